@@ -0,0 +1,126 @@
+"""L1-кэш ответов в памяти контейнера перед ai_question_cache.
+
+Популярные вопросы отдаются из LRU без обращения к БД; попадания (и в L1, и в
+ai_question_cache) не пишутся сразу, а копятся и сбрасываются одним UPDATE из
+фонового потока, у которого соединение уже открыто. Остаток при остановке
+контейнера сбрасывает close() (chat_log.install_shutdown_flush); после SIGKILL
+или падения процесса несброшенные попадания теряются — hit_count приблизителен.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+AI_L1_MAX_ITEMS = int(os.environ.get('AI_L1_MAX_ITEMS', '2000'))
+# Короче, чем 30 дней у ai_question_cache: переписанный в другом контейнере ответ
+# увидим не позже чем через TTL
+AI_L1_TTL_SECONDS = int(os.environ.get('AI_L1_TTL_SECONDS', '600'))
+# Сбрасываем счётчики не чаще раза в интервал или когда накопилось много строк
+AI_L1_FLUSH_SECONDS = int(os.environ.get('AI_L1_FLUSH_SECONDS', '30'))
+AI_L1_FLUSH_MAX_PENDING = 200
+
+
+class AnswerCache:
+    """LRU question_hash -> (истекает, id строки кэша, ответ) и накопитель попаданий"""
+
+    def __init__(self, max_items: int = AI_L1_MAX_ITEMS, ttl: int = AI_L1_TTL_SECONDS, connect=None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._connect = connect  # для close(): на выходе своего соединения нет
+        self._entries = OrderedDict()
+        self._hits = {}  # cache_id -> [число попаданий, time.time() последнего]
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def get(self, key: str):
+        """(cache_id, answer) или None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def put(self, key: str, cache_id: int, answer: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, cache_id, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def record_hit(self, cache_id: int):
+        """Учитывает попадание в памяти; в БД уйдёт при следующем flush"""
+        with self._lock:
+            pending = self._hits.get(cache_id)
+            if pending:
+                pending[0] += 1
+                pending[1] = time.time()
+            else:
+                self._hits[cache_id] = [1, time.time()]
+
+    def flush_due(self) -> bool:
+        with self._lock:
+            return bool(self._hits) and (
+                len(self._hits) >= AI_L1_FLUSH_MAX_PENDING
+                or time.monotonic() - self._last_flush >= AI_L1_FLUSH_SECONDS)
+
+    def flush(self, conn, force: bool = False) -> int:
+        """Пишет накопленные hit_count/last_used_at одним UPDATE. Возвращает число строк"""
+        if not force and not self.flush_due():
+            return 0
+        with self._lock:
+            batch, self._hits = self._hits, {}
+            self._last_flush = time.monotonic()
+        if not batch:
+            return 0
+        now = time.time()
+        ids = list(batch)
+        counts = [batch[i][0] for i in ids]
+        ages = [max(0.0, now - batch[i][1]) for i in ids]
+        cur = conn.cursor()
+        try:
+            # Время передаём как «сколько секунд назад», чтобы не зависеть от TimeZone сессии
+            cur.execute(f'''
+                UPDATE {SCHEMA_NAME}.ai_question_cache c
+                SET hit_count = c.hit_count + v.n,
+                    last_used_at = GREATEST(c.last_used_at, CURRENT_TIMESTAMP - make_interval(secs => v.age))
+                FROM unnest(%s::int[], %s::int[], %s::float8[]) AS v(id, n, age)
+                WHERE c.id = v.id
+            ''', (ids, counts, ages))
+            conn.commit()
+        except Exception as ex:
+            conn.rollback()
+            print(f"[AI] L1 flush err: {ex}", flush=True)
+            with self._lock:
+                for cache_id, (n, ts) in batch.items():
+                    pending = self._hits.setdefault(cache_id, [0, ts])
+                    pending[0] += n
+                    pending[1] = max(pending[1], ts)
+            return 0
+        finally:
+            cur.close()
+        return len(ids)
+
+    def close(self):
+        """Сбрасывает накопленные попадания при остановке на отдельном соединении"""
+        if self._connect is None or not self._hits:
+            return
+        try:
+            conn = self._connect()
+        except Exception as ex:
+            print(f"[AI] L1 flush on exit err: {ex}", flush=True)
+            return
+        try:
+            self.flush(conn, force=True)
+        finally:
+            conn.close()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,178 @@
+"""Очистка ответов ИИ: LaTeX, псевдографика, иероглифы, таблицы, лишние пробелы.
+
+Правила те же, что и раньше, и применяются в том же порядке — порядок важен
+(\\frac{\\sqrt{x}}{2} без отдельного удаления известных команд разворачивается
+иначе). Экономия в другом: шаблоны скомпилированы один раз при импорте, а
+проход пропускается, если в тексте нет его символа-признака. Обычный ответ без
+формул и таблиц проходит только удаление символов, разделители и пробелы.
+Удаление псевдографики и иероглифов объединено в один класс символов — два
+удаления подряд равны удалению объединения.
+
+IncrementalSanitizer — та же очистка для стриминга, по целым строкам.
+Совпадение с прежней реализацией проверяет bench_sanitize.py в корне репозитория.
+"""
+
+import re
+
+_LATEX_BLOCK = re.compile(r'\\\[.*?\\\]', re.DOTALL)
+_LATEX_DISPLAY = re.compile(r'\$\$.*?\$\$', re.DOTALL)
+_LATEX_PAREN = re.compile(r'\\\(.*?\\\)', re.DOTALL)
+_LATEX_INLINE = re.compile(r'(?<!\$)\$(?!\$)([^$]+?)(?<!\$)\$(?!\$)')
+_LATEX_KNOWN_CMD = re.compile(r'\\(frac|sqrt|cdot|times|div|pm|leq|geq|neq|approx|infty|alpha|beta|gamma|delta|theta|lambda|mu|pi|sigma|omega)\b')
+_LATEX_CMD_ARG = re.compile(r'\\[a-zA-Z]+\{([^}]*)\}')
+_LATEX_CMD = re.compile(r'\\[a-zA-Z]+')
+_BRACES = re.compile(r'\{([^}]*)\}')
+_TABLE_SEPARATOR = re.compile(r'^\s*\|[\s\-\|:]+\|\s*$')
+_TABLE_ROW = re.compile(r'^\s*\|.+\|')
+# Псевдографика и иероглифы (CJK) одним классом
+_JUNK_CHARS = re.compile(
+    r'[│├┤┬┴┼╔╗╚╝║═╠╣╦╩╬┌┐└┘─]+'
+    r'|[\u4e00-\u9fff\u3400-\u4dbf\u3000-\u303f\u3040-\u309f\u30a0-\u30ff\uff00-\uffef\u2e80-\u2eff\u31c0-\u31ef]+')
+_RULE_LINE = re.compile(r'^\s*[-_=]{3,}\s*$', re.MULTILINE)
+_TABLE_SEPARATOR_LINE = re.compile(r'^\s*\|[\s\-\|:]+\|\s*$', re.MULTILINE)
+_SPACES = re.compile(r' {2,}')
+_BLANK_LINES = re.compile(r'\n{3,}')
+
+
+def _unwrap_block(m):
+    return m.group(0).replace('\\[', '').replace('\\]', '').strip()
+
+
+def _unwrap_display(m):
+    return m.group(0).replace('$$', '').strip()
+
+
+def _unwrap_paren(m):
+    return m.group(0).replace('\\(', '').replace('\\)', '').strip()
+
+
+def convert_ascii_table(text):
+    """Конвертирует ASCII-таблицы с черточками в читаемый текст"""
+    result = []
+    for line in text.split('\n'):
+        # Строка-разделитель типа |---|---|
+        if _TABLE_SEPARATOR.match(line):
+            continue
+        # Строка таблицы с | ... | ... |
+        if _TABLE_ROW.match(line):
+            cells = [c.strip() for c in line.strip().strip('|').split('|')]
+            if len(cells) > 1:
+                result.append('  '.join(cells))
+                continue
+        result.append(line)
+    return '\n'.join(result)
+
+
+def sanitize_answer(text):
+    """Убирает LaTeX, псевдографику, иероглифы, таблицы и форматирует ответ ИИ"""
+    if not text:
+        return text
+    # Блочный LaTeX: \[...\] и $$...$$, инлайн: \(...\) и $...$
+    if '\\[' in text:
+        text = _LATEX_BLOCK.sub(_unwrap_block, text)
+    if '$$' in text:
+        text = _LATEX_DISPLAY.sub(_unwrap_display, text)
+    if '\\(' in text:
+        text = _LATEX_PAREN.sub(_unwrap_paren, text)
+    if '$' in text:
+        text = _LATEX_INLINE.sub(r'\1', text)
+    # LaTeX-команды: сначала известные (\frac, \sqrt...), затем с аргументом, затем любые
+    if '\\' in text:
+        text = _LATEX_KNOWN_CMD.sub('', text)
+        text = _LATEX_CMD_ARG.sub(r'\1', text)
+        text = _LATEX_CMD.sub('', text)
+    if '{' in text:
+        text = _BRACES.sub(r'\1', text)
+    has_pipes = '|' in text
+    if has_pipes:
+        text = convert_ascii_table(text)
+    text = _JUNK_CHARS.sub('', text)
+    text = _RULE_LINE.sub('', text)
+    # Оставшиеся разделители markdown-таблиц (строки из | - :)
+    if has_pipes:
+        text = _TABLE_SEPARATOR_LINE.sub('', text)
+    if '  ' in text:
+        text = _SPACES.sub(' ', text)
+    if '\n\n\n' in text:
+        text = _BLANK_LINES.sub('\n\n', text)
+    return text.strip()
+
+
+def finish_sentence(text):
+    if text and not text.rstrip().endswith(('.', '!', '?', ')', '»', '`', '*')):
+        return text.rstrip() + '.'
+    return text
+
+
+class IncrementalSanitizer:
+    """sanitize_answer для стриминга: текст отдаётся целыми строками, а строка
+    придерживается, пока не закрыты $..$, $$..$$, \\[..\\], \\(..\\) и {..}. Правила
+    sanitize_answer не выходят за пределы строки или такого блока, поэтому поток
+    совпадает с пакетной обработкой с точностью до пустых строк. Итоговый текст
+    для сохранения — result(), он считается по всему ответу как раньше.
+
+    Кусок модели без перевода строки только дописывается в буфер; баланс
+    разделителей проверяется лишь при появлении новой строки, поэтому длинная
+    строка из сотен токенов не пересматривается на каждом токене."""
+
+    # Если блок так и не закрылся — не держим больше стольких символов
+    MAX_PENDING = 2000
+
+    def __init__(self):
+        self._raw = []
+        self._pending = []
+        self._newlines = 0
+        self._started = False
+
+    @staticmethod
+    def _balanced(text):
+        if text.count('\\[') != text.count('\\]') or text.count('\\(') != text.count('\\)'):
+            return False
+        # {..} снимается через перевод строки (\\cmd{..} и просто скобки)
+        if text.count('{') != text.count('}'):
+            return False
+        if text.count('$$') % 2:
+            return False
+        return text.replace('$$', '').count('$') % 2 == 0
+
+    def feed(self, delta):
+        """Принимает очередной кусок от модели, возвращает готовый к показу текст"""
+        if not delta:
+            return ''
+        self._raw.append(delta)
+        self._pending.append(delta)
+        if '\n' not in delta:
+            return ''
+        pending = ''.join(self._pending)
+        cut = pending.rfind('\n') + 1
+        segment = pending[:cut]
+        if not self._balanced(segment) and len(pending) < self.MAX_PENDING:
+            self._pending = [pending]
+            return ''
+        rest = pending[cut:]
+        self._pending = [rest] if rest else []
+        return self._emit(segment)
+
+    def flush(self):
+        """Отдаёт остаток после окончания генерации"""
+        segment = ''.join(self._pending)
+        self._pending = []
+        return self._emit(segment)
+
+    def result(self):
+        return finish_sentence(sanitize_answer(''.join(self._raw)))
+
+    def _emit(self, segment):
+        text = sanitize_answer(segment)
+        if not text:
+            # Пустые строки копим, а вырезанную целиком строку (разделитель таблицы) — нет
+            if not segment.strip():
+                self._newlines += segment.count('\n')
+            return ''
+        leading = len(segment) - len(segment.lstrip())
+        self._newlines += segment[:leading].count('\n')
+        sep = '\n' * min(2, max(1, self._newlines)) if self._started else ''
+        stripped = segment.rstrip()
+        self._newlines = segment[len(stripped):].count('\n')
+        self._started = True
+        return sep + text
@@ -0,0 +1,121 @@
+"""Постраничная выдача истории чата (action=messages, action=sessions).
+
+Keyset-пагинация: курсор — непрозрачная строка с парой (время, id) крайней
+строки страницы, следующая страница — строки строго «до» или «после» этой пары
+по индексу. В отличие от OFFSET не пересчитывает пройденные строки и не
+сдвигается, когда в чат дописываются сообщения.
+
+Сообщения: без курсора — последние MESSAGES_PAGE_SIZE (экран чата открывается
+снизу), before — более ранние, after — только новые («что появилось с
+прошлого раза»). Сессии упорядочены по updated_at: before листает вниз по
+списку, after отдаёт сессии, изменённые после курсора.
+Внутри страницы порядок всегда хронологический для сообщений и от свежих к
+старым для сессий.
+"""
+
+import base64
+import os
+from datetime import datetime
+
+SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+MESSAGES_PAGE_SIZE = int(os.environ.get('CHAT_MESSAGES_PAGE_SIZE', '30'))
+SESSIONS_PAGE_SIZE = int(os.environ.get('CHAT_SESSIONS_PAGE_SIZE', '20'))
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(ts, row_id) -> str:
+    raw = f"{ts.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """(datetime, id); ValueError при испорченном курсоре"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        ts, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+def page_limit(value, default: int) -> int:
+    try:
+        n = int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        raise ValueError('limit must be a number')
+    return max(1, min(n, MAX_PAGE_SIZE))
+
+
+def _iso(ts):
+    return ts.isoformat() if ts else None
+
+
+def _page(conn, sql_base: str, args: tuple, ts_col: str, before, after, limit: int, newest_first: bool):
+    """Общая часть: строки страницы в порядке выдачи и признак продолжения.
+
+    sql_base — SELECT ... WHERE ... без ORDER BY; ключ — (ts_col, id).
+    Возвращает (rows, has_more).
+    """
+    if before and after:
+        raise ValueError('before and after are mutually exclusive')
+    key = f"({ts_col}, id)"
+    if after:
+        ts, row_id = decode_cursor(after)
+        where, order, args = f" AND {key} > (%s, %s)", 'ASC', args + (ts, row_id)
+    elif before:
+        ts, row_id = decode_cursor(before)
+        where, order, args = f" AND {key} < (%s, %s)", 'DESC', args + (ts, row_id)
+    else:
+        where, order = '', 'DESC'
+    cur = conn.cursor()
+    try:
+        cur.execute(f"{sql_base}{where} ORDER BY {ts_col} {order}, id {order} LIMIT %s",
+                    args + (limit + 1,))
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    # Сообщения показываются по возрастанию, сессии — от свежих
+    if (order == 'DESC') != newest_first:
+        rows.reverse()
+    return rows, has_more
+
+
+def messages_page(conn, user_id: int, session_id, before=None, after=None, limit=None) -> dict:
+    """Страница сообщений сессии по возрастанию времени.
+
+    before_cursor / after_cursor — курсоры первой и последней строки страницы;
+    has_more — есть ли ещё строки в направлении листания (для первой страницы
+    и before — более ранние, для after — более новые).
+    """
+    limit = page_limit(limit, MESSAGES_PAGE_SIZE)
+    rows, has_more = _page(conn, f"""
+        SELECT id, role, content, created_at FROM {SCHEMA_NAME}.chat_messages
+        WHERE session_id = %s AND user_id = %s""", (session_id, user_id),
+        'created_at', before, after, limit, newest_first=False)
+    messages = [{'id': r[0], 'role': r[1], 'content': r[2], 'timestamp': _iso(r[3])} for r in rows]
+    return {
+        'messages': messages,
+        'has_more': has_more,
+        'before_cursor': encode_cursor(rows[0][3], rows[0][0]) if rows else before,
+        'after_cursor': encode_cursor(rows[-1][3], rows[-1][0]) if rows else after,
+    }
+
+
+def sessions_page(conn, user_id: int, before=None, after=None, limit=None) -> dict:
+    """Страница сессий от недавно изменённых к старым; after — изменённые после курсора"""
+    limit = page_limit(limit, SESSIONS_PAGE_SIZE)
+    rows, has_more = _page(conn, f"""
+        SELECT id, title, created_at, updated_at, message_count FROM {SCHEMA_NAME}.chat_sessions
+        WHERE user_id = %s""", (user_id,),
+        'updated_at', before, after, limit, newest_first=True)
+    sessions = [{'id': r[0], 'title': r[1], 'created_at': _iso(r[2]), 'updated_at': _iso(r[3]),
+                 'message_count': r[4]} for r in rows]
+    return {
+        'sessions': sessions,
+        'has_more': has_more,
+        'before_cursor': encode_cursor(rows[-1][3], rows[-1][0]) if rows else before,
+        'after_cursor': encode_cursor(rows[0][3], rows[0][0]) if rows else after,
+    }
@@ -0,0 +1,215 @@
+"""Отложенная пакетная запись истории чата (chat_messages + счётчики chat_sessions).
+
+save_msg() только ставит строку в очередь. Фоновый поток забирает очередь и
+пишет её одним многострочным INSERT и одним UPDATE сессий на сброс, в одной
+транзакции. Сообщение пользователя придерживается, пока к той же сессии не
+придёт ответ ассистента (не дольше CHAT_LOG_HOLD_SECONDS), — так вопрос и ответ
+уходят одним INSERT; заодно в пакет попадают сообщения параллельных запросов
+тёплого контейнера. При завершении процесса (atexit, SIGTERM) очередь
+досбрасывается синхронно.
+
+created_at передаётся как «сколько секунд назад поставлено в очередь», чтобы
+порядок сообщений не зависел от момента сброса и TimeZone сессии.
+
+Если БД недоступна, пакет возвращается в очередь и сброс повторяется. Если же
+БД отвергла пакет (сессию удалили вместе с аккаунтом, недопустимые данные),
+строки пишутся по одной, а отвергнутые отбрасываются и считаются в
+stats['dropped'] — одна плохая строка не задерживает остальные.
+"""
+
+import atexit
+import os
+import signal
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+# Пауза перед сбросом: успевают подъехать сообщения соседних запросов
+CHAT_LOG_LINGER_SECONDS = float(os.environ.get('CHAT_LOG_LINGER_SECONDS', '0.05'))
+# Дольше генерации ответа: вопрос без ответа (ошибка ИИ) всё равно будет записан
+CHAT_LOG_HOLD_SECONDS = float(os.environ.get('CHAT_LOG_HOLD_SECONDS', '60'))
+CHAT_LOG_MAX_PENDING = int(os.environ.get('CHAT_LOG_MAX_PENDING', '5000'))
+NEW_CHAT_TITLE = 'Новый чат'
+RETRY_SECONDS = 2.0
+# Ошибки соединения: пакет не виноват, пишем его позже целиком
+_CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class MessageLog:
+    """Очередь сообщений с фоновым сбросом. connect() — функция, выдающая соединение"""
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._pending = []  # [(monotonic, time.time(), row)]
+        self._held = {}  # session_id -> число сообщений пользователя, ждущих ответа
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.stats = {'messages': 0, 'flushes': 0, 'errors': 0, 'dropped': 0}
+
+    def add(self, sid, uid, role, content, mids=None, tokens=0, cached=False):
+        # NUL в тексте Postgres не принимает
+        if isinstance(content, str) and '\x00' in content:
+            content = content.replace('\x00', '')
+        with self._cond:
+            if len(self._pending) >= CHAT_LOG_MAX_PENDING:
+                self._pending.pop(0)
+                self.stats['dropped'] += 1
+            self._pending.append((time.monotonic(), time.time(), (sid, uid, role, content, mids or [], tokens, cached)))
+            if role == 'user':
+                self._held[sid] = self._held.get(sid, 0) + 1
+            else:
+                self._held.pop(sid, None)
+            self._ensure_thread()
+            self._cond.notify()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='chat-log', daemon=True)
+            self._thread.start()
+
+    def _ready(self, now: float) -> bool:
+        """Есть что писать: ответ ассистента или вопрос, который ждёт слишком долго"""
+        for queued, _, row in self._pending:
+            if row[2] != 'user' or not self._held.get(row[0]) or now - queued >= CHAT_LOG_HOLD_SECONDS:
+                return True
+        return False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._ready(time.monotonic()):
+                    oldest = min((q for q, _, _ in self._pending), default=None)
+                    timeout = None if oldest is None else max(0.01, oldest + CHAT_LOG_HOLD_SECONDS - time.monotonic())
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+            time.sleep(CHAT_LOG_LINGER_SECONDS)
+            if not self.flush():
+                time.sleep(RETRY_SECONDS)
+
+    def flush(self, conn=None) -> bool:
+        """Пишет всю очередь одной транзакцией. False — БД недоступна, строки вернулись в очередь"""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+                self._held.clear()
+            if not batch:
+                return True
+            own = conn is None
+            written = 0
+            try:
+                if own:
+                    conn = self._connect()
+                try:
+                    self._write(conn, batch)
+                    written = len(batch)
+                except _CONNECTION_ERRORS:
+                    raise
+                except Exception as ex:
+                    _rollback(conn)
+                    print(f"[CHAT_LOG] batch rejected ({len(batch)} msgs), writing one by one: {ex}", flush=True)
+                    while batch:
+                        try:
+                            self._write(conn, batch[:1])
+                            written += 1
+                        except _CONNECTION_ERRORS:
+                            raise
+                        except Exception as row_ex:
+                            _rollback(conn)
+                            self.stats['dropped'] += 1
+                            print(f"[CHAT_LOG] dropped message of session {batch[0][2][0]}: {row_ex}", flush=True)
+                        batch = batch[1:]
+            except Exception as ex:
+                # Соединения нет — оставшиеся строки ждут следующего сброса
+                _rollback(conn)
+                print(f"[CHAT_LOG] flush err ({len(batch)} msgs): {ex}", flush=True)
+                with self._cond:
+                    self._pending = (batch + self._pending)[-CHAT_LOG_MAX_PENDING:]
+                    self.stats['errors'] += 1
+                    self.stats['messages'] += written
+                return False
+            finally:
+                if own and conn is not None:
+                    conn.close()
+            self.stats['messages'] += written
+            self.stats['flushes'] += 1
+            return True
+
+    @staticmethod
+    def _write(conn, batch):
+        now = time.time()
+        rows, sessions = [], {}
+        for _, ts, (sid, uid, role, content, mids, tokens, cached) in batch:
+            rows.append((sid, uid, role, content, list(mids), tokens, cached, max(0.0, now - ts)))
+            count, title = sessions.get(sid, (0, None))
+            if role == 'user' and title is None:
+                title = content[:100]
+            sessions[sid] = (count + 1, title)
+        sids = list(sessions)
+        cur = conn.cursor()
+        try:
+            execute_values(cur, f"""
+                INSERT INTO {SCHEMA_NAME}.chat_messages
+                    (session_id, user_id, role, content, material_ids, tokens_used, was_cached, created_at)
+                VALUES %s
+            """, rows, template="(%s, %s, %s, %s, %s::int[], %s, %s, CURRENT_TIMESTAMP - make_interval(secs => %s))",
+                page_size=500)
+            cur.execute(f"""
+                UPDATE {SCHEMA_NAME}.chat_sessions s
+                SET message_count = s.message_count + v.n,
+                    updated_at = CURRENT_TIMESTAMP,
+                    title = CASE WHEN s.title = %s AND v.title IS NOT NULL THEN v.title ELSE s.title END
+                FROM unnest(%s::int[], %s::int[], %s::text[]) AS v(id, n, title)
+                WHERE s.id = v.id
+            """, (NEW_CHAT_TITLE, sids, [sessions[s][0] for s in sids], [sessions[s][1] for s in sids]))
+            conn.commit()
+        finally:
+            cur.close()
+
+    def close(self):
+        """Синхронно досбрасывает очередь (завершение процесса)"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for _ in range(3):
+            if self.flush():
+                break
+
+    def __len__(self):
+        return len(self._pending)
+
+
+def _rollback(conn):
+    try:
+        conn and conn.rollback()
+    except Exception:
+        pass
+
+
+def install_shutdown_flush(log):
+    """Сброс очереди при штатном выходе и по SIGTERM (остановка контейнера).
+    log — MessageLog или другой накопитель с close(); обработчики цепляются
+    друг за друга, так что можно вызывать для нескольких"""
+    atexit.register(log.close)
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def _on_term(signum, frame):
+            log.close()
+            if previous == signal.SIG_IGN:
+                return
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, _on_term)
+    except ValueError:
+        # signal.signal доступен только из главного потока — остаётся atexit
+        pass
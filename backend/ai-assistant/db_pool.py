@@ -0,0 +1,157 @@
+"""Пул подключений к PostgreSQL, переживающий тёплые вызовы функции"""
+
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+# Одна функция обслуживает один запрос + пару фоновых потоков — больше не нужно
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_WAIT_SECONDS = 5
+# Соединение, простоявшее дольше этого, перед выдачей проверяется SELECT 1
+HEALTHCHECK_IDLE_SECONDS = 30
+# Старые соединения пересоздаём, чтобы не упираться в idle-таймауты PgBouncer/LB
+MAX_LIFETIME_SECONDS = 600
+
+_lock = threading.Condition()
+_idle = []  # [(raw_conn, created_at, released_at)]
+_in_use = 0
+
+
+def _open_raw():
+    """Открывает новое соединение; search_path выставляется один раз при подключении"""
+    return psycopg2.connect(DATABASE_URL, options=f'-c search_path={SCHEMA_NAME}')
+
+
+def _is_healthy(raw, released_at: float) -> bool:
+    """Проверяет, что соединение живо и готово к работе"""
+    if raw.closed:
+        return False
+    if time.time() - released_at < HEALTHCHECK_IDLE_SECONDS:
+        return True
+    try:
+        cur = raw.cursor()
+        cur.execute('SELECT 1')
+        cur.fetchone()
+        cur.close()
+        if not raw.autocommit:
+            raw.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def _discard(raw):
+    try:
+        raw.close()
+    except Exception:
+        pass
+
+
+def _release(raw, created_at: float):
+    """Возвращает соединение в пул, откатывая незавершённую транзакцию"""
+    global _in_use
+    keep = not raw.closed and time.time() - created_at < MAX_LIFETIME_SECONDS
+    if keep:
+        try:
+            if raw.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                raw.rollback()
+            raw.autocommit = False
+            raw.cursor_factory = None
+        except Exception:
+            keep = False
+    if not keep:
+        _discard(raw)
+    with _lock:
+        _in_use -= 1
+        if keep:
+            _idle.append((raw, created_at, time.time()))
+        _lock.notify()
+
+
+class PooledConnection:
+    """Обёртка над psycopg2-соединением: close() возвращает его в пул, а не рвёт TCP"""
+
+    def __init__(self, raw, created_at: float):
+        object.__setattr__(self, '_raw', raw)
+        object.__setattr__(self, '_created_at', created_at)
+        object.__setattr__(self, '_released', False)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._raw, name, value)
+
+    def close(self):
+        if self._released:
+            return
+        object.__setattr__(self, '_released', True)
+        _release(self._raw, self._created_at)
+
+    @property
+    def closed(self):
+        return 1 if self._released else self._raw.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        # Обработчик забыл close() — не даём пулу «протечь»
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def get_connection(cursor_factory=None) -> PooledConnection:
+    """Выдаёт соединение из пула (или открывает новое). Потокобезопасно —
+    можно вызывать из фоновых потоков. Вызывающий обязан сделать close()."""
+    global _in_use
+    deadline = time.time() + POOL_WAIT_SECONDS
+    with _lock:
+        while not _idle and _in_use >= POOL_MAX_SIZE:
+            left = deadline - time.time()
+            if left <= 0:
+                raise PoolError('connection pool exhausted')
+            _lock.wait(left)
+        _in_use += 1
+        item = _idle.pop() if _idle else None
+
+    try:
+        while item is not None:
+            raw, created_at, released_at = item
+            if _is_healthy(raw, released_at):
+                break
+            _discard(raw)
+            with _lock:
+                item = _idle.pop() if _idle else None
+        if item is None:
+            raw, created_at = _open_raw(), time.time()
+    except Exception:
+        with _lock:
+            _in_use -= 1
+            _lock.notify()
+        raise
+
+    if cursor_factory is not None:
+        raw.cursor_factory = cursor_factory
+    return PooledConnection(raw, created_at)
+
+
+def close_all():
+    """Закрывает все простаивающие соединения (для тестов и завершения контейнера)"""
+    with _lock:
+        items = list(_idle)
+        _idle.clear()
+    for raw, _, _ in items:
+        _discard(raw)
@@ -0,0 +1,48 @@
+"""Лимиты для анонимных demo/free запросов: ограниченный по размеру LRU со сроком жизни записей"""
+
+import os
+import time
+from collections import OrderedDict
+
+# Сколько ключей (ip / ip+fingerprint) держим в памяти тёплого контейнера
+DEMO_LIMITER_MAX_KEYS = int(os.environ.get('DEMO_LIMITER_MAX_KEYS', '100000'))
+
+
+class DemoLimiter:
+    """Счётчик запросов в фиксированном окне на ключ: (конец окна, число запросов).
+
+    Записи с истёкшим окном выбрасываются при обращении и с хвоста LRU; при
+    переполнении вытесняется самый давно использованный ключ — память ограничена
+    max_keys записями при любом числе уникальных отпечатков."""
+
+    def __init__(self, max_keys: int = DEMO_LIMITER_MAX_KEYS):
+        self.max_keys = max_keys
+        self._entries = OrderedDict()  # key -> (window_ends_at, count)
+
+    def hit(self, key: str, limit: int, window_seconds: int) -> bool:
+        """Учитывает запрос. False — лимит в текущем окне уже исчерпан"""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            self._entries[key] = (now + window_seconds, 1)
+            self._entries.move_to_end(key)
+            self._evict(now)
+            return True
+        ends_at, count = entry
+        self._entries.move_to_end(key)
+        if count >= limit:
+            return False
+        self._entries[key] = (ends_at, count + 1)
+        return True
+
+    def _evict(self, now: float):
+        entries = self._entries
+        # Сначала истёкшие с головы (самые старые), затем — по вместимости
+        while entries:
+            ends_at = next(iter(entries.values()))[0]
+            if ends_at > now and len(entries) <= self.max_keys:
+                break
+            entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,126 @@
+"""Подготовка фото перед отправкой vision-моделям.
+
+Фото с телефона приходит base64-строкой до 14 МБ (4000×3000, EXIF-поворот).
+Декодируем один раз, поворачиваем по EXIF, уменьшаем длинную сторону до
+OCR_MAX_SIDE и пережимаем в JPEG — всем провайдерам уходит один и тот же
+data URL в десятки раз меньше. Заодно считаются перцептивные хэши для
+photo_cache: 64-битный для выбора кандидатов и 256-битный для подтверждения. Если Pillow не смог открыть файл (HEIC и т.п.), отдаём
+исходник как есть.
+"""
+
+import base64
+import io
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Для распознавания текста задачи хватает ~1600px по длинной стороне
+OCR_MAX_SIDE = int(os.environ.get('OCR_MAX_SIDE', '1600'))
+OCR_JPEG_QUALITY = int(os.environ.get('OCR_JPEG_QUALITY', '82'))
+
+PHASH_SIZE = 32
+PHASH_LOW = 8
+# Подтверждающий хэш: 16×16 низких частот с картинки 64×64 — видит строки текста,
+# а не только вёрстку страницы
+FINE_HASH_SIZE = 64
+FINE_HASH_LOW = 16
+
+PreparedImage = namedtuple('PreparedImage', 'data_url bytes_in bytes_out size elapsed phash fine_hash')
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    return np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+_FINE_DCT = _dct_matrix(FINE_HASH_SIZE)
+
+
+def _strip_data_url(image_base64: str) -> str:
+    if image_base64.startswith('data:'):
+        return image_base64.split(',', 1)[-1]
+    return image_base64
+
+
+def _to_rgb(img: Image.Image) -> Image.Image:
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = img.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return img if img.mode in ('RGB', 'L') else img.convert('RGB')
+
+
+def phash(img: Image.Image) -> int:
+    """64-битный перцептивный хэш: знаки низких частот DCT относительно медианы.
+    Яркость/контраст, пережатие и масштаб почти не меняют его, небольшая обрезка
+    или поворот дают несколько бит разницы. Возвращается как signed int64 (BIGINT)"""
+    value = 0
+    for bit in _dct_bits(img, _DCT, PHASH_LOW):
+        value = (value << 1) | int(bit)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def fine_hash(img: Image.Image) -> bytes:
+    """256-битный перцептивный хэш (32 байта) для подтверждения совпадения:
+    у страниц с одной вёрсткой и разным текстом расходится на десятки бит, у
+    пережатой или уменьшенной копии — на единицы"""
+    return np.packbits(_dct_bits(img, _FINE_DCT, FINE_HASH_LOW)).tobytes()
+
+
+def _dct_bits(img: Image.Image, dct: np.ndarray, low: int) -> np.ndarray:
+    """Знаки low×low низких частот DCT относительно медианы (без постоянной составляющей)"""
+    size = dct.shape[0]
+    gray = ImageOps.autocontrast(img.convert('L')).resize((size, size), Image.BOX)
+    coef = dct @ np.asarray(gray, dtype=np.float64) @ dct.T
+    bits = coef[:low, :low].flatten()
+    return bits > np.median(bits[1:])
+
+
+def prepare(image, max_side: int = None) -> PreparedImage:
+    """base64 / data URL или сырые байты (из media_upload) → PreparedImage
+    с компактным data:image/jpeg URL"""
+    started = time.monotonic()
+    max_side = max_side or OCR_MAX_SIDE
+    b64 = None
+    raw = b''
+    try:
+        if isinstance(image, (bytes, bytearray)):
+            raw = bytes(image)
+        else:
+            b64 = _strip_data_url(image.strip())
+            # Испорченный или не-ASCII base64 — тот же запасной путь, что и для неоткрываемого файла
+            raw = base64.b64decode(b64 + '=' * (-len(b64) % 4))
+        img = Image.open(io.BytesIO(raw))
+        untouched = (img.format == 'JPEG' and max(img.size) <= max_side
+                     and img.getexif().get(0x0112, 1) == 1)
+        # JPEG декодируется сразу в уменьшенном масштабе (DCT), не меньше целевого размера
+        ratio = min(1.0, max_side / max(img.size))
+        img.draft('RGB', (int(img.size[0] * ratio), int(img.size[1] * ratio)))
+        img = ImageOps.exif_transpose(img)
+        img = _to_rgb(img)
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=OCR_JPEG_QUALITY, optimize=True, progressive=True)
+        data = out.getvalue()
+        size = img.size
+        image_hash = phash(img)
+        image_fine_hash = fine_hash(img)
+    except Exception as e:
+        print(f"[IMG] preprocess skipped: {type(e).__name__}: {str(e)[:120]}", flush=True)
+        b64 = b64 or base64.b64encode(raw).decode('ascii')
+        size_in = len(raw) or len(b64)
+        return PreparedImage(f'data:image/jpeg;base64,{b64}', size_in, size_in, None, time.monotonic() - started, None, None)
+    if untouched and len(data) >= len(raw):
+        # Уже маленький JPEG без поворота — пережатие ничего не даёт
+        data = raw
+    prepared = PreparedImage('data:image/jpeg;base64,' + base64.b64encode(data).decode('ascii'),
+                             len(raw), len(data), size, time.monotonic() - started, image_hash,
+                             image_fine_hash)
+    print(f"[IMG] {len(raw) // 1024}KB -> {len(data) // 1024}KB {size[0]}x{size[1]} "
+          f"{prepared.elapsed * 1000:.0f}ms", flush=True)
+    return prepared
@@ -1,12 +1,31 @@
 import json
 import os
+import re
 import jwt
-import psycopg2
 import hashlib
-import httpx
 import threading
-from datetime import datetime, timedelta
-from openai import OpenAI
+import time
+import uuid
+import chat_history
+import db_pool
+import entitlements
+import image_prep
+import llm_gateway
+import media_upload
+import ocr_race
+import photo_cache
+import prompt_builder
+import session_memory
+import singleflight
+import semantic_cache
+import text_index
+import transcribe
+from answer_cache import AnswerCache
+from answer_sanitizer import IncrementalSanitizer, finish_sentence, sanitize_answer
+from chat_log import MessageLog, install_shutdown_flush
+from demo_limiter import DemoLimiter
+from keyword_matcher import KeywordMatcher
+from entitlements import SOFT_LANDING_LIMIT, FREE_DAILY_PHOTOS, FREE_DAILY_AUDIO
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
@@ -19,13 +38,6 @@ if _raw_gemini_key and _raw_gemini_key != AITUNNEL_GEMINI_KEY:
     print(f"[INIT] WARN: AITUNNEL_GEMINI_KEY cleaned from non-ASCII chars. raw_len={len(_raw_gemini_key)} clean_len={len(AITUNNEL_GEMINI_KEY)}", flush=True)
 
 LLAMA_MODEL = 'llama-4-maverick'
-OPENROUTER_BASE_URL = 'https://api.aitunnel.ru/v1/'
-
-_http = httpx.Client(timeout=httpx.Timeout(15.0, connect=4.0))
-_http_vision = httpx.Client(timeout=httpx.Timeout(20.0, connect=4.0))
-client = OpenAI(api_key=OPENROUTER_API_KEY, base_url=OPENROUTER_BASE_URL, timeout=15.0, http_client=_http)
-
-_http_whisper = httpx.Client(timeout=httpx.Timeout(30.0, connect=5.0))
 
 CORS_HEADERS = {
     'Content-Type': 'application/json',
@@ -48,193 +60,111 @@ def get_user_id(token: str):
     except Exception:
         return None
 
-PREMIUM_DAILY_LIMIT = 20
-
-FREE_LIMITS_SCHEDULE = {
-    0: 10, 1: 10, 2: 10, 3: 10,
-    4: 7,
-    5: 5,
-    6: 3,
-}
-FREE_DAILY_LIMIT_DEFAULT = 3
-
-SOFT_LANDING_LIMIT = 10  # вопросов/день в переходный период после триала
-SOFT_LANDING_DAYS = 3
-
-
-def check_access(conn, user_id: int) -> dict:
-    """Проверка доступа с учетом подписки/триала/free"""
-    cur = conn.cursor()
-    cur.execute(f'''
-        SELECT subscription_type, subscription_expires_at, subscription_plan,
-               trial_ends_at, is_trial_used,
-               daily_questions_used, daily_questions_reset_at, bonus_questions,
-               daily_premium_questions_used, daily_premium_questions_reset_at,
-               created_at
-        FROM {SCHEMA_NAME}.users WHERE id = %s
-    ''', (user_id,))
-    row = cur.fetchone()
-    cur.close()
-    if not row:
-        return {'has_access': False, 'reason': 'user_not_found'}
-
-    (sub_type, expires_at, sub_plan,
-     trial_ends, trial_used,
-     daily_used, daily_reset, bonus,
-     prem_daily_used, prem_daily_reset,
-     created_at) = row
-
-    now = datetime.now()
-    daily_used = daily_used or 0
-    bonus = bonus or 0
-    prem_daily_used = prem_daily_used or 0
-
-    # --- ТРИАЛ: безлимит (как Premium) ---
-    if trial_ends and not trial_used and trial_ends > now:
-        return {'has_access': True, 'is_trial': True, 'is_premium': True, 'used': 0, 'limit': 999, 'remaining': 999}
-
-    # --- ПЕРЕХОДНЫЙ ПЕРИОД (дни 8-10 после окончания триала): 10 вопросов/день ---
-    if trial_ends and trial_ends <= now:
-        days_since_trial_end = (now - trial_ends).days
-        if 0 <= days_since_trial_end < SOFT_LANDING_DAYS and sub_type != 'premium':
-            if daily_reset and daily_reset < now:
-                cur2 = conn.cursor()
-                cur2.execute(f'UPDATE {SCHEMA_NAME}.users SET daily_questions_used=0, daily_questions_reset_at=%s WHERE id=%s',
-                             (now + timedelta(days=1), user_id))
-                conn.commit()
-                cur2.close()
-                daily_used = 0
-            total_sl = SOFT_LANDING_LIMIT + bonus
-            days_left_sl = SOFT_LANDING_DAYS - days_since_trial_end
-            if daily_used >= total_sl:
-                return {
-                    'has_access': False, 'reason': 'limit', 'is_soft_landing': True,
-                    'used': daily_used, 'limit': SOFT_LANDING_LIMIT,
-                    'soft_landing_days_left': days_left_sl
-                }
-            return {
-                'has_access': True, 'is_soft_landing': True,
-                'used': daily_used, 'limit': SOFT_LANDING_LIMIT,
-                'remaining': total_sl - daily_used,
-                'soft_landing_days_left': days_left_sl
-            }
-
-    # --- ПРЕМИУМ: БЕЗЛИМИТ ---
-    if sub_type == 'premium' and expires_at and expires_at > now:
-        return {
-            'has_access': True, 'is_premium': True,
-            'used': 0, 'limit': 999999, 'remaining': 999999,
-            'source': 'unlimited'
-        }
-
-    # --- БЕСПЛАТНЫЙ ---
-    if daily_reset and daily_reset < now:
-        cur2 = conn.cursor()
-        cur2.execute(f'UPDATE {SCHEMA_NAME}.users SET daily_questions_used=0, daily_questions_reset_at=%s WHERE id=%s',
-                     (now + timedelta(days=1), user_id))
-        conn.commit()
-        cur2.close()
-        daily_used = 0
-
-    days_since_reg = (now - created_at).days if created_at else 999
-    current_free_limit = FREE_LIMITS_SCHEDULE.get(days_since_reg, FREE_DAILY_LIMIT_DEFAULT)
-    is_newcomer = days_since_reg <= 3
-
-    total = current_free_limit + bonus
-    if daily_used >= total:
-        return {'has_access': False, 'reason': 'limit', 'used': daily_used, 'limit': current_free_limit, 'is_free': True, 'is_newcomer': is_newcomer}
-    return {'has_access': True, 'is_free': True, 'used': daily_used, 'limit': current_free_limit, 'remaining': total - daily_used, 'is_newcomer': is_newcomer}
-
-def increment_questions(conn, user_id: int, access_info: dict = None):
-    """Списываем вопрос после успешного ответа ИИ.
-    access_info передаётся из check_access чтобы не делать лишний SELECT."""
-    now = datetime.now()
-    cur = conn.cursor()
-
-    if not access_info:
-        cur.execute(f'''
-            SELECT subscription_type, subscription_expires_at, trial_ends_at, is_trial_used,
-                   daily_questions_used, bonus_questions,
-                   daily_premium_questions_used
-            FROM {SCHEMA_NAME}.users WHERE id=%s
-        ''', (user_id,))
-        u = cur.fetchone()
-        if not u:
-            cur.close()
-            return
-        sub_type, expires, trial_ends, trial_used, daily_used, bonus, prem_daily = u
-        is_premium = sub_type == 'premium' and expires and expires > now
-        is_trial = trial_ends and not trial_used and trial_ends > now
-        source = 'daily' if is_premium else 'free'
-        prem_daily = prem_daily or 0
-        bonus = bonus or 0
-        if is_premium and prem_daily >= PREMIUM_DAILY_LIMIT and bonus > 0:
-            source = 'bonus'
-    else:
-        is_premium = access_info.get('is_premium', False)
-        is_trial = access_info.get('is_trial', False)
-        source = access_info.get('source', 'daily')
-
-    if is_trial:
-        cur.close()
-        return
-
-    if is_premium:
-        cur.close()
-        return
-
+def _questions_limit_error(access: dict) -> dict:
+    """403 для исчерпанного лимита вопросов (текст зависит от тарифа)"""
+    reason = access.get('reason', 'limit')
+    if reason == 'daily_limit':
+        msg = 'Дневной лимит 20 вопросов исчерпан. Купи пакет вопросов или подожди до завтра!'
+    elif access.get('is_soft_landing'):
+        days_left = access.get('soft_landing_days_left', 1)
+        msg = f'Сегодняшний лимит {SOFT_LANDING_LIMIT} вопросов исчерпан. Ещё {days_left} д. расширенного доступа — потом 3 вопроса/день. Оформи подписку!'
+    elif access.get('is_free'):
+        msg = 'Бесплатный лимит (3 вопроса в день) исчерпан. Оформи подписку или купи пакет!'
     else:
-        # Бесплатный: сначала базовые 3, потом бонусные
-        cur.execute(f'''SELECT daily_questions_used, bonus_questions FROM {SCHEMA_NAME}.users WHERE id=%s''', (user_id,))
-        row = cur.fetchone()
-        if row:
-            daily_used, bonus = row[0] or 0, row[1] or 0
-            if daily_used < FREE_DAILY_LIMIT_DEFAULT:
-                cur.execute(f'''UPDATE {SCHEMA_NAME}.users
-                    SET daily_questions_used = COALESCE(daily_questions_used,0) + 1,
-                        daily_questions_reset_at = COALESCE(daily_questions_reset_at, %s),
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id=%s''', (now + timedelta(days=1), user_id))
-            elif bonus > 0:
-                cur.execute(f'''UPDATE {SCHEMA_NAME}.users
-                    SET bonus_questions = GREATEST(0, bonus_questions - 1),
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id=%s AND bonus_questions > 0''', (user_id,))
-
-    conn.commit()
-    cur.close()
+        msg = 'Для доступа к ИИ нужна подписка.'
+    return err(403, {
+        'error': 'limit',
+        'message': msg,
+        'used': access.get('used', 0),
+        'limit': access.get('limit', 0),
+        'is_premium': access.get('is_premium', False),
+        'is_soft_landing': access.get('is_soft_landing', False),
+        'daily_exhausted': access.get('is_premium', False)
+    })
+
+# L1 перед ai_question_cache: попадания из памяти, счётчики — пачкой в фоне
+ANSWER_CACHE = AnswerCache(connect=db_pool.get_connection)
+# Одинаковые вопросы без фото, заданные одновременно, ждут одного ответа модели
+ANSWER_FLIGHTS = singleflight.FlightGroup()
+
+def _cache_key(question, material_ids):
+    return hashlib.md5(f"{question.lower().strip()}:{sorted(material_ids)}".encode()).hexdigest()
 
 def get_cache(conn, question, material_ids):
-    h = hashlib.md5(f"{question.lower().strip()}:{sorted(material_ids)}".encode()).hexdigest()
+    h = _cache_key(question, material_ids)
+    hit = ANSWER_CACHE.get(h)
+    if hit:
+        ANSWER_CACHE.record_hit(hit[0])
+        return hit[1]
     cur = conn.cursor()
     try:
-        cur.execute(f"SELECT answer FROM {SCHEMA_NAME}.ai_question_cache WHERE question_hash=%s AND last_used_at > CURRENT_TIMESTAMP - INTERVAL '30 days'", (h,))
+        cur.execute(f"SELECT id, answer FROM {SCHEMA_NAME}.ai_question_cache WHERE question_hash=%s AND last_used_at > CURRENT_TIMESTAMP - INTERVAL '30 days'", (h,))
         row = cur.fetchone()
+        if not row:
+            # Точного совпадения нет — ищем переформулировку того же вопроса по тем же материалам
+            sig = semantic_cache.signature(semantic_cache.normalize(question))
+            cur.execute(f"""
+                SELECT question_text, minhash, id, answer FROM {SCHEMA_NAME}.ai_question_cache
+                WHERE materials_key=%s AND minhash_bands && %s::int[]
+                  AND last_used_at > CURRENT_TIMESTAMP - INTERVAL '30 days'
+                ORDER BY last_used_at DESC LIMIT 200
+            """, (semantic_cache.materials_key(material_ids), semantic_cache.bands(sig)))
+            rows = cur.fetchall()
+            match = semantic_cache.best_match(question, sig, [(r[0], r[1], (r[2], r[3])) for r in rows])
+            if match:
+                row, score = match
+                print(f"[AI] near-duplicate cache hit id={row[0]} score={score:.2f}", flush=True)
+        conn.rollback()
+        cur.close()
         if row:
-            cur.execute(f"UPDATE {SCHEMA_NAME}.ai_question_cache SET hit_count=hit_count+1, last_used_at=CURRENT_TIMESTAMP WHERE question_hash=%s", (h,))
-            conn.commit()
-            cur.close()
-            return row[0]
+            # hit_count/last_used_at уйдут в БД пачкой из фонового потока
+            ANSWER_CACHE.put(h, row[0], row[1])
+            ANSWER_CACHE.record_hit(row[0])
+            return row[1]
+        return None
     except Exception:
-        pass
+        conn.rollback()
     cur.close()
     return None
 
 def set_cache(conn, question, material_ids, answer, tokens):
-    h = hashlib.md5(f"{question.lower().strip()}:{sorted(material_ids)}".encode()).hexdigest()
+    h = _cache_key(question, material_ids)
+    sig = semantic_cache.signature(semantic_cache.normalize(question[:500]))
     cur = conn.cursor()
     try:
         cur.execute(f'''
-            INSERT INTO {SCHEMA_NAME}.ai_question_cache (question_hash, question_text, answer, material_ids, tokens_used)
-            VALUES (%s,%s,%s,%s,%s)
+            INSERT INTO {SCHEMA_NAME}.ai_question_cache
+                (question_hash, question_text, answer, material_ids, tokens_used, materials_key, minhash, minhash_bands)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
             ON CONFLICT (question_hash) DO UPDATE SET answer=EXCLUDED.answer, tokens_used=EXCLUDED.tokens_used,
+            materials_key=EXCLUDED.materials_key, minhash=EXCLUDED.minhash, minhash_bands=EXCLUDED.minhash_bands,
             hit_count={SCHEMA_NAME}.ai_question_cache.hit_count+1, last_used_at=CURRENT_TIMESTAMP
-        ''', (h, question[:500], answer, material_ids or [], tokens))
+            RETURNING id
+        ''', (h, question[:500], answer, material_ids or [], tokens, semantic_cache.materials_key(material_ids),
+              semantic_cache.to_bytes(sig), semantic_cache.bands(sig)))
+        cache_id = cur.fetchone()[0]
         conn.commit()
+        ANSWER_CACHE.put(h, cache_id, answer)
+        ANSWER_CACHE.flush(conn)
     except Exception:
         pass
     cur.close()
 
+def shared_answer(conn, flight, leader, question, material_ids):
+    """Ответ, уже полученный для того же вопроса, или None — тогда спрашиваем модель.
+    Ведомый ждёт ведущего этого контейнера; ведущий при AI_SINGLEFLIGHT_PG ждёт
+    ведущего другого контейнера и перечитывает кэш"""
+    if not flight:
+        return None
+    if not leader:
+        return ANSWER_FLIGHTS.wait(flight)
+    if not ANSWER_FLIGHTS.lock_remote(flight):
+        return None
+    cached = get_cache(conn, question, material_ids)
+    if cached:
+        ANSWER_FLIGHTS.resolve(flight, cached)
+    return cached
+
 def get_session(conn, user_id):
     cur = conn.cursor()
     try:
@@ -252,22 +182,110 @@ def get_session(conn, user_id):
         cur.close()
         return None
 
-def save_msg(conn, sid, uid, role, content, mids=None, tokens=0, cached=False):
+# История чата пишется пачками из фонового потока (вопрос + ответ одним INSERT)
+CHAT_LOG = MessageLog(db_pool.get_connection)
+install_shutdown_flush(CHAT_LOG)
+install_shutdown_flush(ANSWER_CACHE)
+
+def save_msg(sid, uid, role, content, mids=None, tokens=0, cached=False):
+    """Ставит сообщение в очередь CHAT_LOG — в БД оно уйдёт пакетом из фонового потока"""
     if not sid:
         return
-    cur = conn.cursor()
+    CHAT_LOG.add(sid, uid, role, content, mids, tokens, cached)
+
+def _discard_media(*file_keys):
+    """Удаляет медиа запроса в фоне — только после успешного ответа, чтобы повтор нашёл файл"""
+    if any(file_keys):
+        threading.Thread(target=media_upload.discard, args=file_keys, daemon=True).start()
+
+def _media_key(body, field):
+    """Ключ объекта из media_upload_url: '' — не передан, None — передан не строкой"""
+    value = body.get(field) or ''
+    return value.strip() if isinstance(value, str) else None
+
+def _request_session_id(body):
+    """session_id из тела запроса: клиент продолжает известный ему чат (history — только последний обмен)"""
     try:
-        cur.execute(f"INSERT INTO {SCHEMA_NAME}.chat_messages (session_id,user_id,role,content,material_ids,tokens_used,was_cached) VALUES (%s,%s,%s,%s,%s,%s,%s)",
-                    (sid, uid, role, content, mids or [], tokens, cached))
-        cur.execute(f"UPDATE {SCHEMA_NAME}.chat_sessions SET message_count=message_count+1, updated_at=CURRENT_TIMESTAMP WHERE id=%s", (sid,))
-        if role == 'user':
-            cur.execute(f"UPDATE {SCHEMA_NAME}.chat_sessions SET title=%s WHERE id=%s AND title='Новый чат'", (content[:100], sid))
-        conn.commit()
-    except Exception:
-        pass
-    cur.close()
+        return int(body.get('session_id') or 0) or None
+    except (TypeError, ValueError):
+        return None
+
+def load_memory(conn, user_id, session_id, history=None):
+    """Конспект и последний обмен сессии (session_memory.Memory) или None.
 
-def get_context(conn, user_id, material_ids):
+    chat_messages пишет CHAT_LOG с задержкой, возможно из другого контейнера, и
+    предыдущего обмена в БД может ещё не быть. Если последней реплики из history
+    клиента среди turns нет, берётся последний обмен, присланный клиентом.
+    """
+    if not session_id:
+        return None
+    try:
+        memory = session_memory.load(conn, session_id, user_id)
+    except Exception as ex:
+        print(f"[MEMORY] load err: {ex}", flush=True)
+        conn.rollback()
+        return None
+    client_turns = _client_turns(history)
+    if memory and client_turns:
+        stored = {str(t['content']).strip() for t in memory.turns}
+        if client_turns[-1]['content'] not in stored:
+            print(f"[MEMORY] session {session_id}: chat log behind, using client turns", flush=True)
+            memory = memory._replace(turns=client_turns)
+    return memory
+
+def _client_turns(history):
+    """Последний обмен из history клиента: [{'role', 'content'}] не больше двух реплик"""
+    turns = []
+    for h in (history if isinstance(history, list) else [])[-2:]:
+        if isinstance(h, dict) and h.get('role') in ('user', 'assistant') and str(h.get('content') or '').strip():
+            turns.append({'role': h['role'], 'content': str(h['content']).strip()})
+    return turns
+
+# Сколько символов контекста из материалов уходит в промпт
+CONTEXT_CHAR_BUDGET = int(os.environ.get('CONTEXT_CHAR_BUDGET', '3000'))
+CONTEXT_SUMMARY_CHARS = 300
+# Из длинного чанка берём окно вокруг совпадений, чтобы в бюджет влезло несколько
+CONTEXT_CHUNK_CHARS = 1200
+
+def _rank_chunks(cur, question, materials):
+    """Термины вопроса и чанки материалов по убыванию BM25: [(material_id, chunk_index, text|None)].
+    text=None — текст ещё не прочитан (материал проиндексирован при загрузке)"""
+    terms = text_index.query_terms(question)
+    if not terms:
+        return terms, []
+    lengths, postings, texts = {}, {}, {}
+
+    def add_in_memory(doc, text):
+        tf, length = text_index.chunk_terms(text)
+        lengths[doc] = length
+        texts[doc] = text
+        for term in terms:
+            if tf.get(term):
+                postings.setdefault(term, {})[doc] = tf[term]
+
+    multi = [m[0] for m in materials if m[5] and m[5] > 1]
+    if multi:
+        cur.execute(f"SELECT material_id, chunk_index, token_count FROM {SCHEMA_NAME}.document_chunks WHERE material_id = ANY(%s)", (multi,))
+        legacy = set()
+        for mid, idx, count in cur.fetchall():
+            if count is None:
+                legacy.add(mid)
+            else:
+                lengths[(mid, idx)] = count
+        cur.execute(f"SELECT material_id, chunk_index, term, tf FROM {SCHEMA_NAME}.document_terms WHERE material_id = ANY(%s) AND term = ANY(%s)", (multi, terms))
+        for mid, idx, term, tf in cur.fetchall():
+            postings.setdefault(term, {})[(mid, idx)] = tf
+        if legacy:
+            # Загружены до индекса — ранжируем по тексту в памяти
+            cur.execute(f"SELECT material_id, chunk_index, chunk_text FROM {SCHEMA_NAME}.document_chunks WHERE material_id = ANY(%s)", (list(legacy),))
+            for mid, idx, text in cur.fetchall():
+                add_in_memory((mid, idx), text or '')
+    for mid, _, _, text, _, chunks in materials:
+        if not (chunks and chunks > 1) and text:
+            add_in_memory((mid, 0), text)
+    return terms, [(mid, idx, texts.get((mid, idx))) for score, (mid, idx) in text_index.bm25_rank(terms, lengths, postings)]
+
+def get_context(conn, user_id, material_ids, question=''):
     cur = conn.cursor()
     try:
         if material_ids:
@@ -279,38 +297,81 @@ def get_context(conn, user_id, material_ids):
         if not materials:
             cur.close()
             return ""
-        parts = []
-        for mid, title, subject, text, summary, chunks in materials:
-            parts.append(f"## {title or 'Документ'}" + (f" ({subject})" if subject else ""))
-            if summary:
-                parts.append(summary[:500])
-            if chunks and chunks > 1:
-                try:
-                    cur.execute(f"SELECT chunk_text FROM {SCHEMA_NAME}.document_chunks WHERE material_id=%s ORDER BY chunk_index LIMIT 2", (mid,))
-                    for c in cur.fetchall():
-                        if c[0]:
-                            parts.append(c[0][:1500])
-                except Exception:
-                    if text:
-                        parts.append(text[:1500])
-            elif text:
-                parts.append(text[:1500])
+        try:
+            terms, ranked = _rank_chunks(cur, question, materials)
+        except Exception as ex:
+            print(f"[AI] chunk ranking err: {ex}", flush=True)
+            conn.rollback()
+            ranked = []
+        if not ranked:
+            result = _context_head(cur, materials)
+            cur.close()
+            return result
+
+        # Берём лучшие чанки, пока не кончится бюджет; читаем только их текст
+        picked, size = [], 0
+        for mid, idx, text in ranked:
+            if size >= CONTEXT_CHAR_BUDGET:
+                break
+            picked.append([mid, idx, text])
+            size += min(len(text), CONTEXT_CHUNK_CHARS) if text else CONTEXT_CHUNK_CHARS
+        missing = [(p[0], p[1]) for p in picked if p[2] is None]
+        if missing:
+            cur.execute(f"""
+                SELECT d.material_id, d.chunk_index, d.chunk_text FROM {SCHEMA_NAME}.document_chunks d
+                JOIN unnest(%s::int[], %s::int[]) AS s(m, i) ON d.material_id = s.m AND d.chunk_index = s.i
+            """, ([m for m, _ in missing], [i for _, i in missing]))
+            found = {(m, i): t for m, i, t in cur.fetchall()}
+            for p in picked:
+                if p[2] is None:
+                    p[2] = found.get((p[0], p[1]), '')
         cur.close()
-        result = "\n\n".join(parts)
-        return result[:6000]
+
+        by_id = {m[0]: m for m in materials}
+        sections = {}
+        for mid, _, text in picked:
+            if mid not in sections:
+                _, title, subject, _, summary, _ = by_id[mid]
+                head = f"## {title or 'Документ'}" + (f" ({subject})" if subject else "")
+                sections[mid] = [head] + ([summary[:CONTEXT_SUMMARY_CHARS]] if summary else [])
+            sections[mid].append(text_index.best_window(text, terms, CONTEXT_CHUNK_CHARS))
+        result = "\n\n".join("\n\n".join(parts) for parts in sections.values())
+        return result[:CONTEXT_CHAR_BUDGET]
     except Exception:
         cur.close()
         return ""
 
+def _context_head(cur, materials):
+    """Контекст без вопроса: начало каждого материала (первые чанки по порядку)"""
+    parts = []
+    for mid, title, subject, text, summary, chunks in materials:
+        parts.append(f"## {title or 'Документ'}" + (f" ({subject})" if subject else ""))
+        if summary:
+            parts.append(summary[:500])
+        if chunks and chunks > 1:
+            try:
+                cur.execute(f"SELECT chunk_text FROM {SCHEMA_NAME}.document_chunks WHERE material_id=%s ORDER BY chunk_index LIMIT 2", (mid,))
+                for c in cur.fetchall():
+                    if c[0]:
+                        parts.append(c[0][:1500])
+            except Exception:
+                if text:
+                    parts.append(text[:1500])
+        elif text:
+            parts.append(text[:1500])
+    result = "\n\n".join(parts)
+    return result[:6000]
+
+# Триггеры действий: задачи раньше расписания — при обоих побеждает задача
+ACTION_TRIGGERS = {
+    'создай задачу': 'task', 'добавь задачу': 'task', 'задача:': 'task',
+    'добавь занятие': 'schedule', 'добавь пару': 'schedule', 'в расписание': 'schedule',
+}
+_ACTION_MATCHER = KeywordMatcher(ACTION_TRIGGERS)
+
 def detect_action(question):
-    q = question.lower()
-    task_triggers = ['создай задачу', 'добавь задачу', 'задача:']
-    schedule_triggers = ['добавь занятие', 'добавь пару', 'в расписание']
-    if any(t in q for t in task_triggers):
-        return 'task'
-    if any(t in q for t in schedule_triggers):
-        return 'schedule'
-    return None
+    trigger = _ACTION_MATCHER.first(question.lower())
+    return ACTION_TRIGGERS[trigger] if trigger else None
 
 def parse_schedule(question):
     import re
@@ -346,194 +407,21 @@ def extract_title(question, action):
     m = re.search(r':\s*(.+?)(?:\s+до|\s+к|$)', question)
     if m:
         return m.group(1).strip()[:200]
-    triggers = ['создай задачу','добавь задачу','задача:','добавь занятие','добавь пару','в расписание']
     q = question.lower()
-    for t in triggers:
-        if t in q:
-            idx = q.find(t) + len(t)
-            return question[idx:].strip()[:200]
+    t = _ACTION_MATCHER.first(q)
+    if t:
+        idx = q.find(t) + len(t)
+        return question[idx:].strip()[:200]
     return question[:100]
 
-def _convert_ascii_table(text):
-    """Конвертирует ASCII-таблицы с черточками в читаемый текст"""
-    import re
-    lines = text.split('\n')
-    result = []
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        # Определяем строку-разделитель типа |---|---|
-        if re.match(r'^\s*\|[\s\-\|:]+\|\s*$', line):
-            i += 1
-            continue
-        # Определяем строку таблицы с | ... | ... |
-        if re.match(r'^\s*\|.+\|', line):
-            cells = [c.strip() for c in line.strip().strip('|').split('|')]
-            if len(cells) > 1:
-                result.append('  '.join(cells))
-                i += 1
-                continue
-        result.append(line)
-        i += 1
-    return '\n'.join(result)
-
-
-def sanitize_answer(text):
-    """Убирает LaTeX, псевдографику, иероглифы, таблицы и форматирует ответ ИИ"""
-    import re
-    if not text:
-        return text
-    # Убираем блочный LaTeX: \[...\] и $$...$$
-    text = re.sub(r'\\\[.*?\\\]', lambda m: m.group(0).replace('\\[', '').replace('\\]', '').strip(), text, flags=re.DOTALL)
-    text = re.sub(r'\$\$.*?\$\$', lambda m: m.group(0).replace('$$', '').strip(), text, flags=re.DOTALL)
-    # Убираем инлайн LaTeX: $...$ и \(...\)
-    text = re.sub(r'\\\(.*?\\\)', lambda m: m.group(0).replace('\\(', '').replace('\\)', '').strip(), text, flags=re.DOTALL)
-    text = re.sub(r'(?<!\$)\$(?!\$)([^$]+?)(?<!\$)\$(?!\$)', r'\1', text)
-    # Убираем LaTeX-команды типа \frac, \sqrt, \cdot и т.д.
-    text = re.sub(r'\\(frac|sqrt|cdot|times|div|pm|leq|geq|neq|approx|infty|alpha|beta|gamma|delta|theta|lambda|mu|pi|sigma|omega)\b', '', text)
-    text = re.sub(r'\\[a-zA-Z]+\{([^}]*)\}', r'\1', text)
-    text = re.sub(r'\\[a-zA-Z]+', '', text)
-    # Убираем фигурные скобки LaTeX
-    text = re.sub(r'\{([^}]*)\}', r'\1', text)
-    # Конвертируем ASCII-таблицы в читаемый вид
-    text = _convert_ascii_table(text)
-    # Убираем псевдографику: ^ как степень оставляем, убираем декоративные символы
-    text = re.sub(r'[│├┤┬┴┼╔╗╚╝║═╠╣╦╩╬┌┐└┘─]', '', text)
-    # Убираем иероглифы (CJK символы)
-    text = re.sub(r'[\u4e00-\u9fff\u3400-\u4dbf\u3000-\u303f\u3040-\u309f\u30a0-\u30ff\uff00-\uffef\u2e80-\u2eff\u31c0-\u31ef]+', '', text)
-    # Убираем подчёркивания-разделители типа _____ или ------- стоящие отдельной строкой
-    text = re.sub(r'^\s*[-_=]{3,}\s*$', '', text, flags=re.MULTILINE)
-    # Убираем markdown-таблицы (строки начинающиеся и заканчивающиеся на |)
-    text = re.sub(r'^\s*\|[\s\-\|:]+\|\s*$', '', text, flags=re.MULTILINE)
-    # Чистим лишние пробелы
-    text = re.sub(r' {2,}', ' ', text)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    return text.strip()
-
-
-_http_demo = httpx.Client(timeout=httpx.Timeout(5.0, connect=3.0))
-_http_fallback = httpx.Client(timeout=httpx.Timeout(5.0, connect=2.5))
 
 # ── PHOTO SOLVE ──────────────────────────────────────────────────────────────
-FREE_DAILY_PHOTOS = 1
-PREMIUM_DAILY_PHOTOS = 999999
-
-# ── AUDIO LIMITS ─────────────────────────────────────────────────────────────
-FREE_DAILY_AUDIO = 1
-PREMIUM_DAILY_AUDIO = 999999
-
-def _check_photo_limit(conn, user_id: int) -> dict:
-    from datetime import timedelta as _td
-    now = datetime.now()
-    cur = conn.cursor()
-    cur.execute(f'''
-        SELECT subscription_type, subscription_expires_at,
-               photos_uploaded_today, photos_daily_reset_at, bonus_photos,
-               trial_ends_at, is_trial_used
-        FROM {SCHEMA_NAME}.users WHERE id = %s
-    ''', (user_id,))
-    row = cur.fetchone()
-    cur.close()
-    if not row:
-        return {'has_access': False, 'reason': 'not_found'}
-    sub_type, expires, photos_today, reset_at, bonus, trial_ends, trial_used = row
-    photos_today = photos_today or 0
-    bonus = bonus or 0
-    is_premium = sub_type == 'premium' and expires and (expires.replace(tzinfo=None) if hasattr(expires, 'tzinfo') and expires.tzinfo else expires) > now
-    is_trial = bool(trial_ends and not trial_used and (trial_ends.replace(tzinfo=None) if hasattr(trial_ends, 'tzinfo') and trial_ends.tzinfo else trial_ends) > now)
-    if is_trial:
-        is_premium = True
-    daily_limit = PREMIUM_DAILY_PHOTOS if is_premium else FREE_DAILY_PHOTOS
-    if reset_at:
-        reset_naive = reset_at.replace(tzinfo=None) if hasattr(reset_at, 'tzinfo') and reset_at.tzinfo else reset_at
-        if reset_naive < now:
-            cur2 = conn.cursor()
-            cur2.execute(f'UPDATE {SCHEMA_NAME}.users SET photos_uploaded_today=0, photos_daily_reset_at=%s WHERE id=%s',
-                         (now + _td(days=1), user_id))
-            conn.commit()
-            cur2.close()
-            photos_today = 0
-    if photos_today >= daily_limit:
-        if bonus > 0:
-            return {'has_access': True, 'is_premium': is_premium, 'used': photos_today, 'limit': daily_limit, 'from_bonus': True, 'bonus_remaining': bonus}
-        return {'has_access': False, 'reason': 'limit', 'is_premium': is_premium, 'used': photos_today, 'limit': daily_limit, 'bonus_remaining': 0}
-    return {'has_access': True, 'is_premium': is_premium, 'used': photos_today, 'limit': daily_limit, 'from_bonus': False, 'bonus_remaining': bonus}
-
-def _increment_photo_count(conn, user_id: int, from_bonus: bool):
-    from datetime import timedelta as _td
-    now = datetime.now()
-    cur = conn.cursor()
-    if from_bonus:
-        cur.execute(f'UPDATE {SCHEMA_NAME}.users SET bonus_photos=GREATEST(0,bonus_photos-1),updated_at=CURRENT_TIMESTAMP WHERE id=%s AND bonus_photos>0', (user_id,))
-    else:
-        cur.execute(f'UPDATE {SCHEMA_NAME}.users SET photos_uploaded_today=COALESCE(photos_uploaded_today,0)+1, photos_daily_reset_at=COALESCE(photos_daily_reset_at,%s),updated_at=CURRENT_TIMESTAMP WHERE id=%s',
-                    (now + _td(days=1), user_id))
-    conn.commit()
-    cur.close()
-
-def _check_audio_limit(conn, user_id: int) -> dict:
-    from datetime import timedelta as _td
-    now = datetime.now()
-    cur = conn.cursor()
-    cur.execute(f'''
-        SELECT subscription_type, subscription_expires_at,
-               audio_used_today, audio_daily_reset_at,
-               trial_ends_at, is_trial_used
-        FROM {SCHEMA_NAME}.users WHERE id = %s
-    ''', (user_id,))
-    row = cur.fetchone()
-    cur.close()
-    if not row:
-        return {'has_access': False, 'reason': 'not_found'}
-    sub_type, expires, audio_today, reset_at, trial_ends, trial_used = row
-    audio_today = audio_today or 0
-    is_premium = sub_type == 'premium' and expires and (expires.replace(tzinfo=None) if hasattr(expires, 'tzinfo') and expires.tzinfo else expires) > now
-    is_trial = bool(trial_ends and not trial_used and (trial_ends.replace(tzinfo=None) if hasattr(trial_ends, 'tzinfo') and trial_ends.tzinfo else trial_ends) > now)
-    if is_trial:
-        is_premium = True
-    daily_limit = PREMIUM_DAILY_AUDIO if is_premium else FREE_DAILY_AUDIO
-    if reset_at:
-        reset_naive = reset_at.replace(tzinfo=None) if hasattr(reset_at, 'tzinfo') and reset_at.tzinfo else reset_at
-        if reset_naive < now:
-            cur2 = conn.cursor()
-            cur2.execute(f'UPDATE {SCHEMA_NAME}.users SET audio_used_today=0, audio_daily_reset_at=%s WHERE id=%s',
-                         (now + _td(days=1), user_id))
-            conn.commit()
-            cur2.close()
-            audio_today = 0
-    if audio_today >= daily_limit:
-        return {'has_access': False, 'reason': 'limit', 'is_premium': is_premium, 'used': audio_today, 'limit': daily_limit}
-    return {'has_access': True, 'is_premium': is_premium, 'used': audio_today, 'limit': daily_limit}
-
-
-def _increment_audio_count(conn, user_id: int):
-    from datetime import timedelta as _td
-    now = datetime.now()
-    cur = conn.cursor()
-    cur.execute(f'UPDATE {SCHEMA_NAME}.users SET audio_used_today=COALESCE(audio_used_today,0)+1, audio_daily_reset_at=COALESCE(audio_daily_reset_at,%s),updated_at=CURRENT_TIMESTAMP WHERE id=%s',
-                (now + _td(days=1), user_id))
-    conn.commit()
-    cur.close()
-
-
-def _is_ocr_refusal(text: str) -> bool:
-    refusal_markers = [
-        'не могу просматривать', 'не могу видеть', 'cannot view', 'can\'t view',
-        'cannot see', 'can\'t see', 'не вижу изображен', 'нет изображен',
-        'i cannot', 'i can\'t', 'unable to', 'не удалось', 'sorry',
-        'к сожалению', 'не предоставили', 'не могу распознать',
-        'however, i can help', 'однако, я могу помочь',
-        'извините', 'не могу помочь', 'i\'m sorry', 'i am sorry',
-        'не могу выполнить', 'не могу обработать', 'cannot process',
-        'cannot help', 'can\'t help', 'не в состоянии',
-    ]
-    lower = text.lower()
-    return any(m in lower for m in refusal_markers) or len(text.strip()) < 10
-
-def _ocr_and_solve(image_base64: str, hint: str = '') -> dict:
-    """OCR через Gemini Vision / DeepSeek Vision → решение через Llama-4-Maverick."""
-    recognized_text = None
+# Лимиты фото/аудио считаются в entitlements.Entitlements.photos()/audio(),
+# списываются атомарно через Entitlements.consume()
 
+def _ocr_and_solve(image_url: str, hint: str = '') -> dict:
+    """OCR через vision-модели (ocr_race) → решение через Llama-4-Maverick.
+    image_url — data URL из image_prep.prepare()"""
     ocr_prompt = (
         "Внимательно рассмотри это фото. "
         "Если на фото есть текст (задача, надпись, формула, условие) — перепиши ВЕСЬ текст дословно, по-русски. "
@@ -541,75 +429,7 @@ def _ocr_and_solve(image_base64: str, hint: str = '') -> dict:
         "Отвечай по-русски, без комментариев, без иероглифов, без markdown-заголовков."
     )
 
-    # Шаг 1a: OCR через GPT-4o-mini (приоритет — лучшее качество)
-    if OPENROUTER_API_KEY:
-        try:
-            with httpx.Client(timeout=httpx.Timeout(25.0, connect=5.0)) as h:
-                r_g = h.post("https://api.aitunnel.ru/v1/chat/completions", json={
-                    "model": "gpt-4o-mini",
-                    "messages": [{"role": "user", "content": [
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}},
-                        {"type": "text", "text": ocr_prompt}
-                    ]}],
-                    "temperature": 0.1, "max_tokens": 1500
-                }, headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"})
-                if r_g.status_code == 200:
-                    ocr_text = r_g.json()["choices"][0]["message"]["content"].strip()
-                    if not _is_ocr_refusal(ocr_text):
-                        recognized_text = ocr_text
-                        print(f"[PHOTO] OCR gpt4o-mini ok: {recognized_text[:80]}", flush=True)
-                    else:
-                        print(f"[PHOTO] OCR gpt4o-mini refused: {ocr_text[:80]}", flush=True)
-                else:
-                    print(f"[PHOTO] OCR gpt4o-mini status={r_g.status_code}", flush=True)
-        except Exception as e:
-            print(f"[PHOTO] OCR gpt4o-mini error: {e}", flush=True)
-
-    # Шаг 1b: Фолбек — Gemini Vision
-    if not recognized_text and AITUNNEL_GEMINI_KEY:
-        try:
-            with httpx.Client(timeout=httpx.Timeout(25.0, connect=5.0)) as h:
-                r_gem = h.post("https://api.aitunnel.ru/v1/chat/completions", json={
-                    "model": "gemini-2.5-flash",
-                    "messages": [{"role": "user", "content": [
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}},
-                        {"type": "text", "text": ocr_prompt}
-                    ]}],
-                    "temperature": 0.1, "max_tokens": 1500
-                }, headers={"Authorization": f"Bearer {AITUNNEL_GEMINI_KEY}", "Content-Type": "application/json"})
-                if r_gem.status_code == 200:
-                    ocr_text = r_gem.json()["choices"][0]["message"]["content"].strip()
-                    if not _is_ocr_refusal(ocr_text):
-                        recognized_text = ocr_text
-                        print(f"[PHOTO] OCR gemini ok: {recognized_text[:80]}", flush=True)
-                    else:
-                        print(f"[PHOTO] OCR gemini refused: {ocr_text[:80]}", flush=True)
-                else:
-                    print(f"[PHOTO] OCR gemini status={r_gem.status_code}", flush=True)
-        except Exception as e:
-            print(f"[PHOTO] OCR gemini error: {e}", flush=True)
-
-    # Шаг 1c: Фолбек — Llama Vision
-    if not recognized_text and OPENROUTER_API_KEY:
-        try:
-            with httpx.Client(timeout=httpx.Timeout(20.0, connect=5.0)) as h:
-                r2 = h.post("https://api.aitunnel.ru/v1/chat/completions", json={
-                    "model": "meta-llama/llama-4-maverick",
-                    "messages": [{"role": "user", "content": [
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}},
-                        {"type": "text", "text": ocr_prompt}
-                    ]}],
-                    "temperature": 0.1, "max_tokens": 1000
-                }, headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"})
-                if r2.status_code == 200:
-                    ocr_text = r2.json()["choices"][0]["message"]["content"].strip()
-                    if not _is_ocr_refusal(ocr_text):
-                        recognized_text = ocr_text
-                        print(f"[PHOTO] OCR llama ok: {recognized_text[:80]}", flush=True)
-                    else:
-                        print(f"[PHOTO] OCR llama refused: {ocr_text[:80]}", flush=True)
-        except Exception as e2:
-            print(f"[PHOTO] OCR llama error: {e2}", flush=True)
+    recognized_text = ocr_race.recognize(image_url, ocr_prompt)
 
     if not recognized_text:
         return {'recognized_text': '', 'solution': 'Не удалось распознать фото. Попробуй сфотографировать чётче при хорошем освещении.', 'subject': 'Общее'}
@@ -648,8 +468,7 @@ def _ocr_and_solve(image_base64: str, hint: str = '') -> dict:
     solution = None
     structured = None
     try:
-        resp_s = client.chat.completions.create(
-            model=LLAMA_MODEL,
+        resp_s = llm_gateway.chat(
             messages=[
                 {"role": "system", "content": (
                     "Ты умный ассистент Studyfay. "
@@ -660,10 +479,12 @@ def _ocr_and_solve(image_base64: str, hint: str = '') -> dict:
                 )},
                 {"role": "user", "content": solve_prompt}
             ],
+            route='photo_solve',
+            model=LLAMA_MODEL,
             temperature=0.3,
             max_tokens=1200,
         )
-        raw_answer = resp_s.choices[0].message.content.strip()
+        raw_answer = resp_s.content.strip()
         print(f"[PHOTO] Solve raw: {raw_answer[:120]}", flush=True)
         import re as _re
         json_match = _re.search(r'\{.*\}', raw_answer, _re.DOTALL)
@@ -707,47 +528,58 @@ def _ocr_and_solve(image_base64: str, hint: str = '') -> dict:
     else:
         result['solution'] = solution or ''
     return result
-# ── END PHOTO SOLVE ──────────────────────────────────────────────────────────
 
-def _call_openai_compat(http_client, url: str, api_key: str, question: str, history: list = None, max_tokens: int = 600) -> str | None:
-    """Универсальный вызов OpenAI-совместимого API. Возвращает текст ответа или None."""
+
+def _solve_photo(image_src, hint: str = '') -> dict:
+    """_ocr_and_solve с кэшем по перцептивному хэшу фото (photo_cache).
+    image_src — base64 из тела запроса или байты из media_upload"""
+    image = image_prep.prepare(image_src)
+    if image.phash is None:
+        return _ocr_and_solve(image.data_url, hint)
     try:
-        messages = [{"role": "system", "content": DEMO_SYSTEM}]
-        if history:
-            for h in history[-4:]:
-                role = h.get('role', 'user')
-                content = str(h.get('content', ''))[:300]
-                if role in ('user', 'assistant') and content:
-                    messages.append({"role": role, "content": content})
-        messages.append({"role": "user", "content": question[:800]})
-        payload = {
-            "model": LLAMA_MODEL,
-            "messages": messages,
-            "temperature": 0.5,
-            "max_tokens": max_tokens,
-        }
-        r = http_client.post(
-            url,
-            json=payload,
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-        )
-        if r.status_code == 200:
-            data = r.json()
-            return sanitize_answer(data["choices"][0]["message"]["content"])
-        return None
-    except Exception:
-        return None
+        conn = db_pool.get_connection()
+        try:
+            cached = photo_cache.lookup(conn, image.phash, image.fine_hash, hint)
+        finally:
+            conn.close()
+        if cached:
+            return cached
+    except Exception as e:
+        print(f"[PHOTO] cache unavailable: {e}", flush=True)
+    result = _ocr_and_solve(image.data_url, hint)
+    # Кэшируем только полноценно решённые фото, не запасные ответы
+    if 'structured' in result:
+        try:
+            conn = db_pool.get_connection()
+            try:
+                photo_cache.store(conn, image.phash, image.fine_hash, hint, result)
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"[PHOTO] cache store skipped: {e}", flush=True)
+    return result
+# ── END PHOTO SOLVE ──────────────────────────────────────────────────────────
+
+def _demo_messages(question: str, history: list = None) -> list:
+    messages = [{"role": "system", "content": DEMO_SYSTEM}]
+    if history:
+        for h in history[-4:]:
+            role = h.get('role', 'user')
+            content = str(h.get('content', ''))[:300]
+            if role in ('user', 'assistant') and content:
+                messages.append({"role": role, "content": content})
+    messages.append({"role": "user", "content": question[:800]})
+    return messages
 
 def ask_ai_demo(question: str, history: list = None) -> tuple:
-    """Демо: Artemox → повтор Artemox × 2 → локальный ответ. Всегда возвращает ответ."""
-    for attempt in range(2):
-        answer = _call_openai_compat(
-            _http_demo if attempt == 0 else _http_fallback,
-            f"{OPENROUTER_BASE_URL}/chat/completions",
-            OPENROUTER_API_KEY, question, history, max_tokens=300
-        )
+    """Демо: шлюз LLM (с хеджированием между провайдерами) → локальный ответ. Всегда возвращает ответ."""
+    try:
+        res = llm_gateway.chat(_demo_messages(question, history), route='demo', max_tokens=300, timeout=10.0)
+        answer = sanitize_answer(res.content)
         if answer:
             return answer, 1
+    except llm_gateway.LLMUnavailable:
+        pass
 
     # Локальный ответ — всегда работает
     return _smart_demo_fallback(question), 0
@@ -778,201 +610,167 @@ def _smart_demo_fallback(question: str) -> str:
     )
 
 
-def ask_ai(question, context, image_base64=None, exam_meta=None, history=None):
-    """Запрос к ИИ через Artemox. exam_meta — строка 'тип|предмет_id|предмет|режим'"""
-    has_context = bool(context and len(context) > 50)
-    ctx_trimmed = context[:1200] if has_context else ""
-
-    md_fmt = "Форматирование: используй **жирный** для ключевых терминов, ## заголовки, нумерованные списки для шагов, > цитаты для правил."
-    if exam_meta:
-        parts = exam_meta.split('|')
-        et = parts[0] if len(parts) > 0 else ''
-        sl = parts[2] if len(parts) > 2 else ''
-        mode = parts[3] if len(parts) > 3 else 'explain'
-        el = 'ЕГЭ' if et == 'ege' else 'ОГЭ'
-        if mode == 'practice':
-            system = (
-                f"Ты Studyfay — опытный репетитор-экзаменатор по «{sl}» ({el}). Русский. 1-2 эмодзи. Формулы текстом.\n{md_fmt}\n\n"
-                f"РЕЖИМ ПРАКТИКИ {el.upper()}:\n"
-                f"• Давай РЕАЛЬНЫЕ задания строго в формате {el} (как в КИМ ФИПИ). Указывай номер задания.\n"
-                "• Когда ученик отвечает — НЕМЕДЛЕННО проверяй:\n"
-                "  ✅ Правильно → похвали + объясни ПОЧЕМУ правильно (1-2 предложения) + дай следующее задание.\n"
-                "  ❌ Неверно → покажи правильный ответ + разбор ошибки + подсказку «Запомни:...» + следующее задание.\n"
-                "• Любое сообщение ученика = его ответ. Никогда не пропускай проверку.\n"
-                "• Чередуй темы и типы (тест/расчёт/анализ). Сложность нарастает.\n"
-                "• После 3-4 заданий подряд — короткий итог: «Ты уже разобрал X тем, отлично! 💪»\n"
-                "• В конце задания: «Жду твой ответ 👇»"
-            )
-        elif mode == 'explain':
-            system = (
-                f"Ты Studyfay — лучший репетитор по «{sl}» для {el}. Русский. 1-2 эмодзи. Формулы текстом.\n{md_fmt}\n\n"
-                "КАК ОБЪЯСНЯТЬ:\n"
-                "1) **Суть** — объясни простым языком, используй аналогию из жизни.\n"
-                "2) **Пример** — покажи на конкретной задаче или ситуации (как в экзамене).\n"
-                "3) **Ловушка** — предупреди о типичной ошибке: «Внимание: часто путают X с Y».\n"
-                "4) **Вопрос** — задай один вопрос по теме, чтобы ученик закрепил.\n\n"
-                "• Задачу — реши ПОЛНОСТЬЮ пошагово с пояснением каждого шага.\n"
-                "• Если тема сложная — разбей на части, предложи «Давай разберём по шагам».\n"
-                "• 4-8 предложений. Если просят подробнее — расширяй."
-            )
-        elif mode == 'weak':
-            system = (
-                f"Ты Studyfay — репетитор по «{sl}» ({el}). Специалист по СЛАБЫМ МЕСТАМ. Русский. 1-2 эмодзи. Формулы текстом.\n{md_fmt}\n\n"
-                "МЕТОД РАБОТЫ:\n"
-                "• Определи конкретную проблему ученика и работай ТОЧЕЧНО — не уходи в сторону.\n"
-                "• Дай ПРАВИЛО-ШПАРГАЛКУ: «🔑 Запомни: если X — то всегда Y».\n"
-                "• Покажи ПРИЁМ решения: «Лайфхак: чтобы не ошибиться, делай так...».\n"
-                "• Предупреди об ОШИБКЕ: «⚠️ Типичная ловушка: многие думают X, но на самом деле Y».\n"
-                "• ОБЯЗАТЕЛЬНО дай тренировочное задание того же типа + «Жду ответ 👇».\n"
-                "• При проверке: ✅/❌ + разбор + если неверно — объясни ту же тему ДРУГИМИ словами."
-            )
-        elif mode == 'mock':
-            system = (
-                f"Ты строгий экзаменатор {el} по «{sl}». Имитируешь реальный экзамен. Русский. Формулы текстом.\n{md_fmt}\n\n"
-                "СТРОГИЙ РЕЖИМ:\n"
-                f"• Задания ТОЧНО как в КИМ {el} — официальные формулировки и сложность.\n"
-                "• Нумеруй: «📝 Задание 1», «📝 Задание 2» и т.д.\n"
-                "• Оценка ответа: «✅ Верно» или «❌ Неверно» + объяснение (1-2 предложения) + сразу следующее.\n"
-                "• Засчитывай только ТОЧНЫЕ ответы. Неполный = неверно (объясни что не хватает).\n"
-                "• Без подсказок. После каждых 5 заданий — краткий счёт: «Результат: X/5 ✅».\n"
-                "• В конце задания: «Ваш ответ?»"
-            )
-        else:
-            system = (
-                f"Ты Studyfay — репетитор по «{sl}» для {el}. Русский. 1-2 эмодзи. Формулы текстом.\n{md_fmt}\n"
-                "Структура: суть простыми словами → конкретный пример → совет для экзамена → вопрос ученику."
-            )
-        user_content = question[:1000]
+def ask_ai(question, context, image_base64=None, exam_meta=None, history=None, summary=''):
+    """Запрос к ИИ через Artemox. exam_meta — строка 'тип|предмет_id|предмет|режим',
+    summary — конспект сессии (session_memory)"""
+    prompt = prompt_builder.build(question, context, exam_meta, history, summary=summary)
+
+    if image_base64:
+        answer, tokens = ask_ai_vision(question, prompt.system, image_base64)
+        return answer, tokens
+
+    print(f"[AI] -> LLM {'[exam]' if exam_meta else ''} q_len:{len(question)} prompt:~{prompt.tokens}tok", flush=True)
+    try:
+        res = llm_gateway.chat(prompt.messages, route='ask', model=LLAMA_MODEL, temperature=0.5, max_tokens=800)
+    except llm_gateway.LLMUnavailable:
+        return build_smart_fallback(question, context), 0
+    return finish_sentence(sanitize_answer(res.content)), res.tokens
+
+
+# ── STREAMING ────────────────────────────────────────────────────────────────
+# Функция отвечает одним HTTP-ответом, поэтому стрим устроен как «старт + опрос»:
+# POST со stream=true резервирует лимит, запускает генерацию в фоне и сразу
+# возвращает stream_id; фон дописывает очищенный текст в ai_streams, клиент
+# забирает дельты через GET action=stream&stream_id=..&offset=N (любой инстанс).
+
+# Как часто фон сбрасывает накопленный текст в БД
+STREAM_FLUSH_SECONDS = 0.25
+
+
+def _stream_create(conn, user_id: int) -> str:
+    stream_id = uuid.uuid4().hex
+    cur = conn.cursor()
+    # Заодно убираем старые стримы этого пользователя
+    cur.execute(f"DELETE FROM {SCHEMA_NAME}.ai_streams WHERE user_id=%s AND created_at < NOW() - INTERVAL '1 hour'", (user_id,))
+    cur.execute(f"INSERT INTO {SCHEMA_NAME}.ai_streams (id, user_id) VALUES (%s, %s)", (stream_id, user_id))
+    cur.close()
+    return stream_id
+
+
+def _stream_append(conn, stream_id: str, text: str, result: dict = None):
+    cur = conn.cursor()
+    if result is None:
+        cur.execute(f"UPDATE {SCHEMA_NAME}.ai_streams SET content = content || %s, updated_at = NOW() WHERE id = %s",
+                    (text, stream_id))
     else:
-        system = (
-            "Ты Studyfay — умный и дружелюбный ассистент. Помогаешь школьникам, студентам и всем, кто спрашивает.\n\n"
-            "КАК ТЫ РАБОТАЕШЬ:\n"
-            "• Отвечай на ЛЮБЫЕ вопросы — учебные, бытовые, про предметы, технику, кулинарию, природу и т.д.\n"
-            "• Объясняй ПРОСТЫМИ СЛОВАМИ — как будто рассказываешь другу. Используй аналогии из жизни.\n"
-            "• Если задача — реши ПОЛНОСТЬЮ пошагово. Каждый шаг на отдельной строке с пояснением «почему».\n"
-            "• Если вопрос бытовой или общий — дай полезный, конкретный ответ с примерами.\n"
-            "• Если пользователь прислал фото чего-то (кафель, еда, предмет) — опиши что это и помоги.\n"
-            "• В КОНЦЕ ответа задай ОДИН короткий вопрос по теме.\n\n"
-            "ФОРМАТИРОВАНИЕ (обязательно):\n"
-            "• Используй markdown: **жирный** для ключевых терминов и ответов.\n"
-            "• Используй ## заголовки для разделов.\n"
-            "• Используй нумерованные списки (1. 2. 3.) для пошаговых решений.\n"
-            "• Используй маркированные списки (- ...) для перечислений.\n"
-            "• Используй > цитаты для важных правил/формул.\n\n"
-            "СТИЛЬ:\n"
-            "• Русский. Формулы текстом: x^2, sqrt(x), a/b. Без LaTeX.\n"
-            "• 4-8 предложений. Если просят подробнее — расширяй.\n"
-            "• 1-2 эмодзи. Тон тёплый и поддерживающий, но фактически точный.\n"
-            "• Не переспрашивай — отвечай сразу. Если вопрос неясен — дай лучший ответ + уточни.\n\n"
-            "СТРОГИЕ ЗАПРЕТЫ:\n"
-            "• НИКОГДА не отказывай отвечать. Если тема не учебная — всё равно помоги.\n"
-            "• НИКОГДА не используй иероглифы, китайские/японские/корейские символы.\n"
-            "• НИКОГДА не рисуй таблицы (ни ASCII, ни markdown-таблицы с | и ---). Вместо таблиц используй нумерованный список.\n"
-            "• НИКОГДА не ссылайся на картинки, схемы, графики, диаграммы — ты не можешь их показать.\n"
-            "• НИКОГДА не используй LaTeX, формулы в $...$ или \\frac{}{}. Пиши формулы простым текстом.\n"
-            "• Каждый ответ должен быть УНИКАЛЬНЫМ — не повторяй шаблонные фразы. Адаптируй стиль под контекст вопроса.\n"
-            "• Не начинай каждый ответ одинаково — варьируй вступление."
-        )
-        user_content = question[:1000]
+        cur.execute(f"UPDATE {SCHEMA_NAME}.ai_streams SET content = content || %s, done = TRUE, result = %s, updated_at = NOW() WHERE id = %s",
+                    (text, json.dumps(result, ensure_ascii=False), stream_id))
+    cur.close()
 
-    system += "\n\nСТРОГИЕ ЗАПРЕТЫ (нарушение = ошибка):\n• НЕ показывай картинки/схемы/графики/диаграммы. Не пиши «смотри на рисунок».\n• НЕ используй иероглифы или нелатинские/нерусские символы.\n• НЕ рисуй таблицы (ни ASCII с |---, ни markdown). Используй нумерованный список.\n• НЕ используй LaTeX ($, \\frac, \\sqrt). Формулы ТОЛЬКО текстом: x^2, sqrt(x), a/b.\n• Каждый ответ УНИКАЛЕН — варьируй стиль, вступления и примеры. Не повторяй шаблоны."
 
-    if has_context:
-        system += f"\n\nМатериалы пользователя (используй для ответа):\n{ctx_trimmed}"
+def _stream_read(conn, stream_id: str, user_id: int, offset: int) -> dict | None:
+    cur = conn.cursor()
+    cur.execute(f"SELECT content, done, result FROM {SCHEMA_NAME}.ai_streams WHERE id = %s AND user_id = %s",
+                (stream_id, user_id))
+    row = cur.fetchone()
+    cur.close()
+    if not row:
+        return None
+    content, done, result = row
+    body = {'delta': content[offset:], 'offset': len(content), 'done': bool(done)}
+    if done and result:
+        body.update(result if isinstance(result, dict) else json.loads(result))
+    return body
+
+
+def _run_stream(stream_id: str, model: str, messages: list, temperature: float, max_tokens: int, finish,
+                on_error=None, route: str = 'stream', providers=None):
+    """Фоновая генерация со стримингом через llm_gateway.stream_chat (те же провайдеры,
+    breaker'ы и метрики, что у chat()). finish(conn, answer, tokens) получает итоговый
+    ответ (None — модель не ответила) и возвращает поля финального события.
+    on_error(conn) вызывается, если ответ не дошёл до клиента из-за исключения
+    (в том числе в finish), — возвращает списанный лимит.
+
+    Поток — текст IncrementalSanitizer, в последнем событии к нему дописывается
+    точка finish_sentence; сохраняется sanitize_answer по всему ответу. Они
+    совпадают с точностью до пробелов на краях строк (проверяет bench_sanitize.py),
+    итоговым текстом считается answer финального события."""
+    sanitizer = IncrementalSanitizer()
+    conn = db_pool.get_connection()
+    conn.autocommit = True
+    pending, shown = '', []
+    last_flush = time.time()
+    answer, tokens = None, 0
+
+    def on_delta(delta):
+        nonlocal pending, last_flush
+        pending += sanitizer.feed(delta)
+        if pending and time.time() - last_flush >= STREAM_FLUSH_SECONDS:
+            _stream_append(conn, stream_id, pending)
+            shown.append(pending)
+            pending, last_flush = '', time.time()
 
-    if image_base64:
-        answer, tokens = ask_ai_vision(question, system, image_base64)
-        return answer, tokens
+    try:
+        print(f"[STREAM] {stream_id} -> {model}", flush=True)
+        try:
+            res = llm_gateway.stream_chat(messages, on_delta, route=route, model=model, temperature=temperature,
+                                          max_tokens=max_tokens, providers=providers)
+            tokens = res.tokens
+            pending += sanitizer.flush()
+            answer = sanitizer.result() or None
+        except llm_gateway.LLMUnavailable:
+            answer = None
+        if answer:
+            streamed = ''.join(shown) + pending
+            pending += finish_sentence(streamed)[len(streamed.rstrip()):]
+        result = finish(conn, answer, tokens)
+        _stream_append(conn, stream_id, pending, result)
+    except Exception as e:
+        print(f"[STREAM] FATAL {stream_id}: {type(e).__name__}: {e}", flush=True)
+        _stream_failed(conn, stream_id, pending, answer, on_error)
+    finally:
+        conn.close()
 
-    messages_list = [{"role": "system", "content": system}]
-    if history:
-        for h in history[-6:]:
-            role = h.get('role', 'user')
-            content = h.get('content', '')
-            if role in ('user', 'assistant') and content:
-                messages_list.append({"role": role, "content": content[:400]})
-    messages_list.append({"role": "user", "content": user_content})
 
-    for attempt in range(3):
+def _stream_failed(conn, stream_id: str, pending: str, answer, on_error):
+    """Финальное событие с ошибкой и возврат лимита (ошибки здесь только логируются)"""
+    if on_error:
         try:
-            print(f"[AI] -> OpenRouter/Llama {'[exam]' if exam_meta else ''} attempt:{attempt} q_len:{len(user_content)}", flush=True)
-            resp = client.chat.completions.create(
-                model=LLAMA_MODEL,
-                messages=messages_list,
-                temperature=0.5,
-                max_tokens=800,
-            )
-            answer = resp.choices[0].message.content
-            tokens = resp.usage.total_tokens if resp.usage else 0
-            print(f"[AI] OpenRouter/Llama OK attempt:{attempt} tokens:{tokens}", flush=True)
-            answer = sanitize_answer(answer)
-            if answer and not answer.rstrip().endswith(('.', '!', '?', ')', '»', '`', '*')):
-                answer = answer.rstrip() + '.'
-            return answer, tokens
+            on_error(conn)
         except Exception as e:
-            print(f"[AI] OpenRouter/Llama FAIL attempt:{attempt}: {type(e).__name__}: {str(e)[:200]}", flush=True)
-            if attempt < 2:
-                import time as _t
-                _t.sleep(0.5)
-    return build_smart_fallback(question, context), 0
-
-
-def ocr_image(image_base64):
-    """OCR через DeepSeek Vision API — извлекает текст/условие с фото"""
-    api_key = DEEPSEEK_API_KEY
-    if not api_key:
-        print(f"[AI] no DEEPSEEK_API_KEY", flush=True)
-        return None
-    payload = {
-        "model": "deepseek-vl2",
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}
-                    },
-                    {
-                        "type": "text",
-                        "text": (
-                            "Внимательно рассмотри это фото. "
-                            "Если на фото есть текст — перепиши ВЕСЬ текст дословно. "
-                            "Если текста нет или мало — подробно опиши что изображено на фото. "
-                            "Отвечай по-русски, без пояснений."
-                        )
-                    }
-                ]
-            }
-        ],
-        "temperature": 0.1,
-        "max_tokens": 1000
-    }
+            print(f"[STREAM] {stream_id} refund err: {type(e).__name__}: {e}", flush=True)
     try:
-        print(f"[AI] -> DeepSeek Vision OCR", flush=True)
-        r = _http_vision.post(
-            "https://api.deepseek.com/v1/chat/completions",
-            json=payload,
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-        )
-        print(f"[AI] OCR status:{r.status_code} body:{r.text[:200]}", flush=True)
-        if r.status_code == 200:
-            data = r.json()
-            text = data["choices"][0]["message"]["content"]
-            print(f"[AI] OCR extracted: {text[:100]}", flush=True)
-            return text.strip()
-        return None
-    except Exception as e:
-        print(f"[AI] OCR FAIL: {type(e).__name__}: {str(e)[:200]}", flush=True)
-        return None
+        _stream_append(conn, stream_id, pending, {'answer': answer or '', 'error': True})
+    except Exception:
+        pass
+
+
+def _run_stream_once(stream_id: str, flight, leader: bool, question: str, material_ids: list, messages: list, finish,
+                     on_error=None):
+    """_run_stream для вопроса без фото через ANSWER_FLIGHTS: готовый ответ на тот
+    же вопрос отдаётся в стрим целиком, иначе генерируем сами. Ведущий публикует
+    ответ в finish, здесь рейс закрывается на случай ошибки"""
+    try:
+        conn = db_pool.get_connection()
+        conn.autocommit = True
+        try:
+            answer = shared_answer(conn, flight, leader, question, material_ids)
+            if answer:
+                _stream_append(conn, stream_id, answer, finish(conn, answer, 0, shared=True))
+                return
+        except Exception as e:
+            print(f"[STREAM] FATAL {stream_id}: {type(e).__name__}: {e}", flush=True)
+            _stream_failed(conn, stream_id, '', None, on_error)
+            return
+        finally:
+            conn.close()
+        _run_stream(stream_id, LLAMA_MODEL, messages, 0.5, 800, finish, on_error)
+    finally:
+        if leader:
+            ANSWER_FLIGHTS.resolve(flight, None)
+
+
+OCR_VISION_PROMPT = (
+    "Внимательно рассмотри это фото. "
+    "Если на фото есть текст — перепиши ВЕСЬ текст дословно. "
+    "Если текста нет или мало — подробно опиши что изображено на фото. "
+    "Отвечай по-русски, без пояснений."
+)
 
 
 def ask_ai_vision(question, system, image_base64):
     """OCR фото → передаём распознанный текст в deepseek-chat (та же модель)"""
-    ocr_text = ocr_image(image_base64)
+    ocr_text = ocr_race.recognize(image_prep.prepare(image_base64).data_url, OCR_VISION_PROMPT, log='AI')
 
     if ocr_text:
         user_q = question.strip() if question and question != "Разбери задачу на фото" else ""
@@ -982,17 +780,18 @@ def ask_ai_vision(question, system, image_base64):
             combined = f"Вот что на фото:\n\n{ocr_text}\n\nЕсли это задача — реши пошагово. Если это не задача — опиши что это и дай полезную информацию."
         print(f"[AI] Vision->text, sending to Llama: {combined[:80]}", flush=True)
         try:
-            resp = client.chat.completions.create(
-                model=LLAMA_MODEL,
-                messages=[
+            resp = llm_gateway.chat(
+                [
                     {"role": "system", "content": system},
                     {"role": "user", "content": combined[:1000]}
                 ],
+                route='ocr_solve',
+                model=LLAMA_MODEL,
                 temperature=0.5,
                 max_tokens=900,
             )
-            answer = resp.choices[0].message.content
-            tokens = resp.usage.total_tokens if resp.usage else 0
+            answer = resp.content
+            tokens = resp.tokens
             answer = sanitize_answer(answer)
             if answer and not answer.rstrip().endswith(('.', '!', '?', ')', '»', '`', '*')):
                 answer = answer.rstrip() + '.'
@@ -1029,7 +828,7 @@ DEMO_SYSTEM = (
     "Каждый ответ УНИКАЛЕН — варьируй стиль и вступления."
 )
 
-DEMO_RATE_LIMIT: dict = {}
+DEMO_RATE_LIMIT = DemoLimiter()
 
 # ---------------------------------------------------------------------------
 # Кэш популярных тем — мгновенный ответ без вызова ИИ
@@ -1079,12 +878,15 @@ DEMO_CACHE: dict[str, str] = {
     "реформа": "Коротко: реформа — постепенное преобразование общества или государства без смены власти. 📜\nПример: отмена крепостного права в 1861 году — великая реформа Александра II.\nХочешь глубже — скажи.",
 }
 
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_SPACES_RE = re.compile(r'\s+')
+_SESSION_TOPIC_RE = re.compile(r'тему "([^"]+)"')
+
 def _normalize(text: str) -> str:
     """Нормализует вопрос для поиска в кэше"""
-    import re
     t = text.lower().strip()
-    t = re.sub(r'[^\w\s]', '', t)
-    t = re.sub(r'\s+', ' ', t)
+    t = _PUNCT_RE.sub('', t)
+    t = _SPACES_RE.sub(' ', t)
     return t
 
 SESSION_TOPIC_CACHE: dict[str, str] = {
@@ -1114,24 +916,26 @@ SESSION_TOPIC_CACHE: dict[str, str] = {
     "рыночная экономика": "Рыночная экономика — система, где цены устанавливает рынок через спрос и предложение.\nПример: если яблок мало — цена растёт. Если много — падает. Государство не устанавливает цены.",
 }
 
+# Автоматы строятся один раз при импорте: поиск линеен по длине вопроса, а не по размеру кэшей
+_DEMO_MATCHER = KeywordMatcher(DEMO_CACHE)
+_SESSION_TOPIC_MATCHER = KeywordMatcher(SESSION_TOPIC_CACHE)
+# Follow-up запросы — не кэшируем
+_FOLLOWUP_MATCHER = KeywordMatcher(['"', 'объясни ещё проще', 'объясни еще проще', 'дай одно задание',
+                                    'разбери тему', 'глубже', 'типичные ошибки', 'уровня егэ', 'как для 5-классника'])
+
 def get_demo_cache(question: str) -> str | None:
     """Ищет точное или частичное совпадение в кэше популярных тем.
     Не срабатывает на follow-up запросы (они длинные и содержат кавычки/спецфразы)."""
     q_lower = question.lower()
 
     # Session-промпты (длинные, содержат тему в кавычках) — ищем в SESSION_TOPIC_CACHE
-    import re
-    session_match = re.search(r'тему "([^"]+)"', q_lower)
+    session_match = _SESSION_TOPIC_RE.search(q_lower)
     if session_match:
-        topic_key = session_match.group(1).strip()
-        for key, val in SESSION_TOPIC_CACHE.items():
-            if key in topic_key or topic_key in key:
-                return val
-
-    # Follow-up запросы — не кэшируем
-    followup_markers = ['"', 'объясни ещё проще', 'объясни еще проще', 'дай одно задание',
-                        'разбери тему', 'глубже', 'типичные ошибки', 'уровня егэ', 'как для 5-классника']
-    if any(m in q_lower for m in followup_markers):
+        key = _SESSION_TOPIC_MATCHER.first_related(session_match.group(1).strip())
+        if key:
+            return SESSION_TOPIC_CACHE[key]
+
+    if _FOLLOWUP_MATCHER.any(q_lower):
         return None
     # Слишком длинный вопрос — скорее всего не про одну тему
     if len(question) > 60:
@@ -1141,10 +945,8 @@ def get_demo_cache(question: str) -> str | None:
     if norm in DEMO_CACHE:
         return DEMO_CACHE[norm]
     # 2. Ключ входит в вопрос
-    for key, answer in DEMO_CACHE.items():
-        if key in norm:
-            return answer
-    return None
+    key = _DEMO_MATCHER.first(norm)
+    return DEMO_CACHE[key] if key else None
 
 def handler(event: dict, context) -> dict:
     """ИИ-ассистент Studyfay: отвечает на вопросы студентов"""
@@ -1161,6 +963,19 @@ def handler(event: dict, context) -> dict:
         except Exception:
             body_demo = {}
 
+        # --- PRESIGNED URL для фото/аудио: файл идёт в хранилище, в AI-запрос — только ключ ---
+        if body_demo.get('action') == 'media_upload_url':
+            uid_mu = get_user_id(event.get('headers', {}).get('X-Authorization', '').replace('Bearer ', ''))
+            if not uid_mu:
+                return err(401, {'error': 'Требуется авторизация'})
+            try:
+                return ok(media_upload.presign(uid_mu, body_demo.get('kind', ''), body_demo.get('content_type', '')))
+            except media_upload.MediaError as e:
+                return err(400, {'error': str(e)})
+            except Exception as e:
+                print(f"[MEDIA] presign error: {e}", flush=True)
+                return err(500, {'error': 'Ошибка генерации URL'})
+
         # --- PHOTO SOLVE (требует авторизации, но обрабатывается до demo check) ---
         if body_demo.get('action') == 'photo_solve':
             token_ps = event.get('headers', {}).get('X-Authorization', '').replace('Bearer ', '')
@@ -1168,15 +983,27 @@ def handler(event: dict, context) -> dict:
             if not uid_ps:
                 return err(401, {'error': 'Требуется авторизация'})
             image_b64 = body_demo.get('image_base64', '').strip()
+            image_key_ps = _media_key(body_demo, 'image_key')
+            if image_key_ps is None:
+                return err(400, {'error': 'image_key должен быть строкой'})
             hint_ps = body_demo.get('hint', '').strip()[:300]
-            if not image_b64:
-                return err(400, {'error': 'Нет фото. Передай image_base64'})
+            if not image_b64 and not image_key_ps:
+                return err(400, {'error': 'Нет фото. Передай image_key или image_base64'})
             if len(image_b64) > 14_000_000:
                 return err(400, {'error': 'Фото слишком большое. Максимум 10 МБ'})
-            conn_ps = psycopg2.connect(DATABASE_URL)
+            image_ps = image_b64
+            conn_ps = db_pool.get_connection()
             try:
-                limit_info_ps = _check_photo_limit(conn_ps, uid_ps)
-                if not limit_info_ps['has_access']:
+                ent_ps = entitlements.load(conn_ps, uid_ps)
+                limit_info_ps = ent_ps.photos()
+                # Объект из хранилища читаем после проверки лимита — без лимита не качаем до 10 МБ
+                if image_key_ps and limit_info_ps['has_access']:
+                    try:
+                        image_ps = media_upload.read(image_key_ps, uid_ps, 'photo')
+                    except media_upload.MediaError as e:
+                        return err(400, {'error': str(e)})
+                receipt_ps = ent_ps.consume(conn_ps, 'photos') if limit_info_ps['has_access'] else None
+                if receipt_ps is None:
                     used_ps = limit_info_ps.get('used', 0)
                     lim_ps = limit_info_ps.get('limit', FREE_DAILY_PHOTOS)
                     is_prem_ps = limit_info_ps.get('is_premium', False)
@@ -1190,26 +1017,22 @@ def handler(event: dict, context) -> dict:
                         'is_premium': is_prem_ps,
                         'bonus_remaining': limit_info_ps.get('bonus_remaining', 0)
                     })
-                from_bonus_ps = limit_info_ps.get('from_bonus', False)
-                _increment_photo_count(conn_ps, uid_ps, from_bonus_ps)
-                new_used_ps = limit_info_ps['used'] + (0 if from_bonus_ps else 1)
-                new_bonus_ps = max(0, limit_info_ps['bonus_remaining'] - (1 if from_bonus_ps else 0))
-                daily_left_ps = max(0, limit_info_ps['limit'] - new_used_ps)
             finally:
                 conn_ps.close()
             print(f"[PHOTO] User:{uid_ps} solving photo hint={hint_ps[:30]}", flush=True)
-            result_ps = _ocr_and_solve(image_b64, hint_ps)
+            result_ps = _solve_photo(image_ps, hint_ps)
             resp_body = {
                 'recognized_text': result_ps['recognized_text'],
                 'solution': result_ps['solution'],
                 'subject': result_ps['subject'],
-                'remaining': daily_left_ps + new_bonus_ps,
-                'used': new_used_ps,
-                'limit': limit_info_ps['limit'],
-                'bonus_remaining': new_bonus_ps,
+                'remaining': receipt_ps['remaining'],
+                'used': receipt_ps['used'],
+                'limit': receipt_ps['limit'],
+                'bonus_remaining': receipt_ps['bonus_remaining'],
             }
             if 'structured' in result_ps:
                 resp_body['structured'] = result_ps['structured']
+            _discard_media(image_key_ps)
             return ok(resp_body)
 
         # --- SMART CHAT (multimodal: text + audio + image via Llama + Whisper) ---
@@ -1222,10 +1045,14 @@ def handler(event: dict, context) -> dict:
             message_gc = (body_demo.get('message') or '').strip()
             image_b64_gc = (body_demo.get('image_base64') or '').strip()
             audio_b64_gc = (body_demo.get('audio_base64') or '').strip()
-            audio_format_gc = (body_demo.get('audio_format') or 'webm').strip().lower()
+            image_key_gc = _media_key(body_demo, 'image_key')
+            audio_key_gc = _media_key(body_demo, 'audio_key')
+            if image_key_gc is None or audio_key_gc is None:
+                return err(400, {'error': 'image_key и audio_key должны быть строками'})
+            audio_format_gc = (body_demo.get('audio_format') or media_upload.extension(audio_key_gc) or 'webm').strip().lower()
             history_gc = body_demo.get('history') or []
 
-            if not message_gc and not image_b64_gc and not audio_b64_gc:
+            if not message_gc and not image_b64_gc and not audio_b64_gc and not image_key_gc and not audio_key_gc:
                 return err(400, {'error': 'Нужно отправить текст, фото или аудио'})
 
             if image_b64_gc and len(image_b64_gc) > 14_000_000:
@@ -1233,10 +1060,16 @@ def handler(event: dict, context) -> dict:
             if audio_b64_gc and len(audio_b64_gc) > 20_000_000:
                 return err(400, {'error': 'Аудио слишком большое. Максимум 15 МБ'})
 
-            conn_gc = psycopg2.connect(DATABASE_URL)
+            image_gc = image_b64_gc
+            audio_gc = audio_b64_gc
+            wants_image_gc = bool(image_b64_gc or image_key_gc)
+            wants_audio_gc = bool(audio_b64_gc or audio_key_gc)
+
+            conn_gc = db_pool.get_connection()
             conn_gc.autocommit = True
             try:
-                access_gc = check_access(conn_gc, uid_gc)
+                ent_gc = entitlements.load(conn_gc, uid_gc)
+                access_gc = ent_gc.questions()
                 if not access_gc.get('has_access'):
                     reason_gc = access_gc.get('reason', 'limit')
                     if reason_gc == 'daily_limit':
@@ -1253,8 +1086,8 @@ def handler(event: dict, context) -> dict:
                         'is_premium': access_gc.get('is_premium', False),
                     })
 
-                if audio_b64_gc:
-                    audio_limit = _check_audio_limit(conn_gc, uid_gc)
+                if wants_audio_gc:
+                    audio_limit = ent_gc.audio()
                     if not audio_limit['has_access']:
                         return err(403, {
                             'error': 'limit',
@@ -1264,8 +1097,8 @@ def handler(event: dict, context) -> dict:
                             'limit': audio_limit['limit'],
                         })
 
-                if image_b64_gc:
-                    photo_limit = _check_photo_limit(conn_gc, uid_gc)
+                if wants_image_gc:
+                    photo_limit = ent_gc.photos()
                     if not photo_limit['has_access']:
                         return err(403, {
                             'error': 'limit',
@@ -1275,50 +1108,63 @@ def handler(event: dict, context) -> dict:
                             'limit': photo_limit['limit'],
                         })
 
-                sid_gc = get_session(conn_gc, uid_gc)
+                # Фото/аудио из хранилища (media_upload_url) — байты без base64; иначе строка из тела.
+                # Читаем после проверки лимитов, чтобы без лимита не качать до 15 МБ
+                try:
+                    if image_key_gc:
+                        image_gc = media_upload.read(image_key_gc, uid_gc, 'photo')
+                    if audio_key_gc:
+                        audio_gc = media_upload.read(audio_key_gc, uid_gc, 'audio')
+                except media_upload.MediaError as e:
+                    return err(400, {'error': str(e)})
+
+                # Резервируем лимиты до платных вызовов Whisper/LLM; при неудаче — возвращаем
+                kinds_gc = ['questions'] + (['audio'] if audio_gc else []) + (['photos'] if image_gc else [])
+                receipts_gc = {}
+                for kind_gc in kinds_gc:
+                    receipt_gc = ent_gc.consume(conn_gc, kind_gc)
+                    if receipt_gc is None:
+                        for r in receipts_gc.values():
+                            ent_gc.refund(conn_gc, r)
+                        return err(403, {
+                            'error': 'limit',
+                            'message': 'Лимит на сегодня исчерпан. Оформи подписку или купи пакет!',
+                            'feature': kind_gc,
+                        })
+                    receipts_gc[kind_gc] = receipt_gc
+
+                memory_gc = load_memory(conn_gc, uid_gc, _request_session_id(body_demo), history_gc)
+                sid_gc = memory_gc.session_id if memory_gc else get_session(conn_gc, uid_gc)
+                if memory_gc:
+                    history_gc = memory_gc.turns
 
                 transcript_gc = None
+                transcript_partial_gc = False
                 actual_question = message_gc
-                has_image = bool(image_b64_gc)
+                has_image = bool(image_gc)
 
                 # --- Step 1: Whisper STT for audio ---
-                if audio_b64_gc:
+                if audio_gc:
                     import base64 as _b64
                     try:
-                        ext = 'webm' if audio_format_gc == 'webm' else 'wav'
-                        audio_bytes = _b64.b64decode(audio_b64_gc)
+                        ext = audio_format_gc if audio_format_gc in ('webm', 'mp3', 'm4a', 'ogg') else 'wav'
+                        audio_bytes = audio_gc if isinstance(audio_gc, bytes) else _b64.b64decode(audio_gc)
                         print(f"[WHISPER] User:{uid_gc} format:{ext} size:{len(audio_bytes)}", flush=True)
 
-                        import io as _io
-                        boundary = '----StudyfayAudio'
-                        body_parts = []
-                        body_parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="model"\r\n\r\nwhisper-1')
-                        body_parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="language"\r\n\r\nru')
-                        body_parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="audio.{ext}"\r\nContent-Type: audio/{ext}\r\n\r\n')
-                        pre = '\r\n'.join(body_parts).encode('utf-8')
-                        post = f'\r\n--{boundary}--\r\n'.encode('utf-8')
-                        multipart_body = pre + audio_bytes + post
-
-                        whisper_resp = _http_whisper.post(
-                            'https://api.aitunnel.ru/v1/audio/transcriptions',
-                            content=multipart_body,
-                            headers={
-                                'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-                                'Content-Type': f'multipart/form-data; boundary={boundary}',
-                            },
-                        )
-                        if whisper_resp.status_code == 200:
-                            whisper_data = whisper_resp.json()
-                            transcript_gc = whisper_data.get('text', '').strip()
-                            print(f"[WHISPER] OK: {transcript_gc[:100]}", flush=True)
-                            if transcript_gc:
-                                actual_question = transcript_gc
-                        else:
-                            print(f"[WHISPER] FAIL status:{whisper_resp.status_code} body:{whisper_resp.text[:300]}", flush=True)
+                        transcribed_gc = transcribe.transcribe(conn_gc, audio_bytes, ext)
+                        transcript_gc = transcribed_gc.text
+                        transcript_partial_gc = transcribed_gc.failed > 0
+                        print(f"[WHISPER] OK: {transcript_gc[:100]}"
+                              + (f" ({transcribed_gc.failed}/{transcribed_gc.segments} segments lost)" if transcript_partial_gc else ''),
+                              flush=True)
+                        if transcript_gc:
+                            actual_question = transcript_gc
                     except Exception as e_w:
                         print(f"[WHISPER] ERROR: {type(e_w).__name__}: {str(e_w)[:200]}", flush=True)
 
                 if not actual_question and not has_image:
+                    for r in receipts_gc.values():
+                        ent_gc.refund(conn_gc, r)
                     return ok({
                         'answer': 'Не удалось распознать речь. Попробуй записать ещё раз, говори чётче.',
                         'transcript': '',
@@ -1356,6 +1202,9 @@ def handler(event: dict, context) -> dict:
                     "• Каждый ответ УНИКАЛЕН — варьируй стиль и вступления."
                 )
 
+                if memory_gc and memory_gc.summary:
+                    system_gc += '\n\n' + prompt_builder.summary_block(memory_gc.summary)[0]
+
                 # --- Step 3: Build messages for Llama ---
                 messages_gc = [{"role": "system", "content": system_gc}]
 
@@ -1370,7 +1219,7 @@ def handler(event: dict, context) -> dict:
                     user_content = []
                     user_content.append({
                         "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{image_b64_gc}"}
+                        "image_url": {"url": image_prep.prepare(image_gc).data_url}
                     })
                     text_instruction = actual_question or ''
                     if not text_instruction:
@@ -1382,89 +1231,110 @@ def handler(event: dict, context) -> dict:
                 else:
                     if transcript_gc:
                         q_text = f'Ты спросил: "{transcript_gc}"\n\nОтветь подробно на этот вопрос.'
+                        if transcript_partial_gc:
+                            q_text += (f' Часть записи не распознана (на её месте {transcribe.GAP_MARK}) — '
+                                       'если без неё смысл неясен, попроси повторить.')
                     else:
                         q_text = actual_question
                     messages_gc.append({"role": "user", "content": q_text[:3000]})
 
                 user_text_for_save = actual_question or ('[фото задания]' if has_image else '[аудио]')
-                save_msg(conn_gc, sid_gc, uid_gc, 'user', user_text_for_save[:500])
-
-                # --- Step 4: Call GPT-4o mini (vision + text) ---
-                answer_gc = None
-                tokens_gc = 0
-                chat_model = 'gpt-4o-mini'
-
-                for _attempt_gc in range(2):
-                    try:
-                        print(f"[CHAT] User:{uid_gc} attempt:{_attempt_gc} msg:{actual_question[:60] if actual_question else ''} img:{has_image} model:{chat_model}", flush=True)
-                        resp_gc = client.chat.completions.create(
-                            model=chat_model,
-                            messages=messages_gc,
-                            temperature=0.4,
-                            max_tokens=2000,
-                        )
-                        raw_answer_gc = resp_gc.choices[0].message.content
-                        tokens_gc = resp_gc.usage.total_tokens if resp_gc.usage else 0
-                        answer_gc = sanitize_answer(raw_answer_gc)
-                        if answer_gc and not answer_gc.rstrip().endswith(('.', '!', '?', ')', '»', '`', '*')):
-                            answer_gc = answer_gc.rstrip() + '.'
-                        print(f"[CHAT] OK tokens:{tokens_gc} ans:{answer_gc[:80]}", flush=True)
-                        break
-                    except Exception as e_gc:
-                        print(f"[CHAT] FAIL attempt:{_attempt_gc}: {type(e_gc).__name__}: {str(e_gc)[:200]}", flush=True)
-                        if _attempt_gc == 0:
-                            import time as _tg
-                            _tg.sleep(1)
-                        answer_gc = None
+                save_msg(sid_gc, uid_gc, 'user', user_text_for_save[:500])
 
-                if not answer_gc:
-                    return ok({
+                def _gc_failed():
+                    return {
                         'answer': 'Не удалось получить ответ. Попробуй ещё раз через пару секунд!',
                         'remaining': access_gc.get('remaining', 0),
                         'used': access_gc.get('used', 0),
                         'limit': access_gc.get('limit', 0),
                         'is_premium': access_gc.get('is_premium', False),
                         'error': True
-                    })
+                    }
 
-                increment_questions(conn_gc, uid_gc, access_gc)
-                remaining_gc = max(0, access_gc.get('remaining', 1) - 1)
+                def _gc_result(answer):
+                    result = {
+                        'answer': answer,
+                        'remaining': receipts_gc['questions']['remaining'],
+                        'used': access_gc.get('used', 0) + 1,
+                        'limit': access_gc.get('limit', 0),
+                        'is_premium': access_gc.get('is_premium', False),
+                        'session_id': sid_gc,
+                    }
+                    if transcript_gc:
+                        result['transcript'] = transcript_gc
+                    if transcript_partial_gc:
+                        result['transcript_partial'] = True
+                    if audio_gc and not access_gc.get('is_premium'):
+                        result['audio_used'] = receipts_gc['audio']['used']
+                        result['audio_limit'] = receipts_gc['audio']['limit']
+                    if image_gc and not access_gc.get('is_premium'):
+                        result['photo_used'] = receipts_gc['photos']['used']
+                        result['photo_limit'] = receipts_gc['photos']['limit']
+                    return result
 
-                if audio_b64_gc:
-                    _increment_audio_count(conn_gc, uid_gc)
-                if image_b64_gc:
-                    _increment_photo_count(conn_gc, uid_gc, False)
+                # --- Step 4: Call GPT-4o mini (vision + text) ---
+                answer_gc = None
+                tokens_gc = 0
+                chat_model = 'gpt-4o-mini'
 
-                def _bg_chat_save(uid, ans, tok, session_id):
-                    try:
-                        c2 = psycopg2.connect(DATABASE_URL)
-                        c2.autocommit = True
-                        save_msg(c2, session_id, uid, 'assistant', ans, None, tok, False)
-                        c2.close()
-                    except Exception as ex:
-                        print(f"[CHAT] bg_save err: {ex}", flush=True)
-                threading.Thread(target=_bg_chat_save, args=(uid_gc, answer_gc, tokens_gc, sid_gc), daemon=True).start()
-
-                result_gc = {
-                    'answer': answer_gc,
-                    'remaining': remaining_gc,
-                    'used': access_gc.get('used', 0) + 1,
-                    'limit': access_gc.get('limit', 0),
-                    'is_premium': access_gc.get('is_premium', False),
-                }
-                if transcript_gc:
-                    result_gc['transcript'] = transcript_gc
-
-                if audio_b64_gc and not access_gc.get('is_premium'):
-                    a_info = _check_audio_limit(conn_gc, uid_gc)
-                    result_gc['audio_used'] = a_info.get('used', 0)
-                    result_gc['audio_limit'] = a_info.get('limit', FREE_DAILY_AUDIO)
-                if image_b64_gc and not access_gc.get('is_premium'):
-                    p_info = _check_photo_limit(conn_gc, uid_gc)
-                    result_gc['photo_used'] = p_info.get('used', 0)
-                    result_gc['photo_limit'] = p_info.get('limit', FREE_DAILY_PHOTOS)
-
-                return ok(result_gc)
+                if body_demo.get('stream'):
+                    def _refund_gc(c2):
+                        # Каждая квитанция возвращается один раз, даже если ошибка случилась после возврата
+                        while receipts_gc:
+                            ent_gc.refund(c2, receipts_gc.popitem()[1])
+
+                    def _finish_gc(c2, ans, tok):
+                        if not ans:
+                            _refund_gc(c2)
+                            return _gc_failed()
+                        save_msg(sid_gc, uid_gc, 'assistant', ans, None, tok, False)
+                        session_memory.remember(sid_gc, user_text_for_save, ans)
+                        _discard_media(image_key_gc, audio_key_gc)
+                        return _gc_result(ans)
+
+                    stream_id_gc = _stream_create(conn_gc, uid_gc)
+                    # Поля ответа — до старта фона: при ошибке он опустошит receipts_gc
+                    stream_body = {'stream_id': stream_id_gc, 'remaining': receipts_gc['questions']['remaining'],
+                                   'session_id': sid_gc}
+                    threading.Thread(
+                        target=_run_stream,
+                        args=(stream_id_gc, chat_model, messages_gc, 0.4, 2000, _finish_gc, _refund_gc, 'chat',
+                              ['aitunnel'] if has_image else None),
+                        daemon=True,
+                    ).start()
+                    if transcript_gc:
+                        stream_body['transcript'] = transcript_gc
+                    if transcript_partial_gc:
+                        stream_body['transcript_partial'] = True
+                    return ok(stream_body)
+
+                print(f"[CHAT] User:{uid_gc} msg:{actual_question[:60] if actual_question else ''} img:{has_image} model:{chat_model}", flush=True)
+                try:
+                    # Картинку понимает только модель на aitunnel — остальным провайдерам её не отдаём
+                    resp_gc = llm_gateway.chat(
+                        messages_gc,
+                        route='chat',
+                        model=chat_model,
+                        temperature=0.4,
+                        max_tokens=2000,
+                        providers=['aitunnel'] if has_image else None,
+                    )
+                    tokens_gc = resp_gc.tokens
+                    answer_gc = finish_sentence(sanitize_answer(resp_gc.content))
+                    print(f"[CHAT] OK tokens:{tokens_gc} ans:{answer_gc[:80]}", flush=True)
+                except llm_gateway.LLMUnavailable:
+                    answer_gc = None
+
+                if not answer_gc:
+                    for r in receipts_gc.values():
+                        ent_gc.refund(conn_gc, r)
+                    return ok(_gc_failed())
+
+                save_msg(sid_gc, uid_gc, 'assistant', answer_gc, None, tokens_gc, False)
+                session_memory.remember(sid_gc, user_text_for_save, answer_gc)
+                _discard_media(image_key_gc, audio_key_gc)
+
+                return ok(_gc_result(answer_gc))
             finally:
                 conn_gc.close()
 
@@ -1473,13 +1343,8 @@ def handler(event: dict, context) -> dict:
             if not question:
                 return err(400, {'error': 'Введи вопрос'})
             ip = (event.get('requestContext', {}) or {}).get('identity', {}).get('sourceIp', 'unknown')
-            now_ts = datetime.now()
-            hits = DEMO_RATE_LIMIT.get(ip, [])
-            hits = [t for t in hits if (now_ts - t).total_seconds() < 3600]
-            if len(hits) >= 10:
+            if not DEMO_RATE_LIMIT.hit(ip, 10, 3600):
                 return err(429, {'error': 'Слишком много запросов. Попробуй позже.'})
-            hits.append(now_ts)
-            DEMO_RATE_LIMIT[ip] = hits
             import time as _time
             t0 = _time.time()
             history = body_demo.get('history', [])
@@ -1497,23 +1362,18 @@ def handler(event: dict, context) -> dict:
             ip = (event.get('requestContext', {}) or {}).get('identity', {}).get('sourceIp', 'unknown')
             fp = body_demo.get('fingerprint', '')
             rate_key = f"photo_{ip}_{fp}"
-            now_ts = datetime.now()
-            hits = DEMO_RATE_LIMIT.get(rate_key, [])
-            hits = [t for t in hits if (now_ts - t).total_seconds() < 86400]
-            if len(hits) >= 2:
-                return err(429, {'error': 'Лимит бесплатных решений исчерпан. Зарегистрируйся — это бесплатно!'})
             image_b64 = body_demo.get('image_base64', '').strip()
             hint_fp = body_demo.get('hint', '').strip()[:300]
             if not image_b64:
                 return err(400, {'error': 'Нет фото. Передай image_base64'})
             if len(image_b64) > 14_000_000:
                 return err(400, {'error': 'Фото слишком большое'})
-            hits.append(now_ts)
-            DEMO_RATE_LIMIT[rate_key] = hits
+            if not DEMO_RATE_LIMIT.hit(rate_key, 2, 86400):
+                return err(429, {'error': 'Лимит бесплатных решений исчерпан. Зарегистрируйся — это бесплатно!'})
             import time as _time
             t0 = _time.time()
             print(f"[FREE_PHOTO] ip:{ip} fp:{fp} hint:{hint_fp[:30]}", flush=True)
-            result_fp = _ocr_and_solve(image_b64, hint_fp)
+            result_fp = _solve_photo(image_b64, hint_fp)
             print(f"[FREE_PHOTO] time:{_time.time()-t0:.1f}s", flush=True)
             resp_fp = {
                 'recognized_text': result_fp['recognized_text'],
@@ -1535,13 +1395,8 @@ def handler(event: dict, context) -> dict:
             ip = (event.get('requestContext', {}) or {}).get('identity', {}).get('sourceIp', 'unknown')
             fp = body_demo.get('fingerprint', '')
             rate_key = f"ask_{ip}_{fp}"
-            now_ts = datetime.now()
-            hits = DEMO_RATE_LIMIT.get(rate_key, [])
-            hits = [t for t in hits if (now_ts - t).total_seconds() < 86400]
-            if len(hits) >= 2:
+            if not DEMO_RATE_LIMIT.hit(rate_key, 2, 86400):
                 return err(429, {'error': 'Лимит бесплатных вопросов исчерпан. Зарегистрируйся — это бесплатно!'})
-            hits.append(now_ts)
-            DEMO_RATE_LIMIT[rate_key] = hits
             import time as _time
             t0 = _time.time()
             print(f"[FREE_ASK] ip:{ip} fp:{fp} q:{question[:60]}", flush=True)
@@ -1556,34 +1411,51 @@ def handler(event: dict, context) -> dict:
 
     conn = None
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = db_pool.get_connection()
         conn.autocommit = True
 
         if method == 'GET':
             action = (event.get('queryStringParameters') or {}).get('action', 'sessions')
 
             if action == 'sessions':
-                cur = conn.cursor()
-                cur.execute(f"SELECT id,title,created_at,updated_at,message_count FROM {SCHEMA_NAME}.chat_sessions WHERE user_id=%s ORDER BY updated_at DESC LIMIT 50", (user_id,))
-                sessions = [{'id':r[0],'title':r[1],'created_at':r[2].isoformat() if r[2] else None,'updated_at':r[3].isoformat() if r[3] else None,'message_count':r[4]} for r in cur.fetchall()]
-                cur.close()
-                return ok({'sessions': sessions})
+                qs = event.get('queryStringParameters') or {}
+                try:
+                    return ok(chat_history.sessions_page(conn, user_id, qs.get('before'), qs.get('after'), qs.get('limit')))
+                except ValueError as e:
+                    return err(400, {'error': str(e)})
 
             elif action == 'messages':
-                sid = (event.get('queryStringParameters') or {}).get('session_id')
+                qs = event.get('queryStringParameters') or {}
+                sid = qs.get('session_id')
                 if not sid:
                     return err(400, {'error': 'session_id required'})
-                cur = conn.cursor()
-                cur.execute(f"SELECT role,content,created_at FROM {SCHEMA_NAME}.chat_messages WHERE session_id=%s AND user_id=%s ORDER BY created_at ASC LIMIT 200", (sid, user_id))
-                msgs = [{'role':r[0],'content':r[1],'timestamp':r[2].isoformat() if r[2] else None} for r in cur.fetchall()]
-                cur.close()
-                return ok({'messages': msgs})
+                try:
+                    return ok(chat_history.messages_page(conn, user_id, int(sid), qs.get('before'), qs.get('after'), qs.get('limit')))
+                except ValueError as e:
+                    return err(400, {'error': str(e)})
+
+            elif action == 'stream':
+                qs = event.get('queryStringParameters') or {}
+                stream_id = qs.get('stream_id')
+                if not stream_id:
+                    return err(400, {'error': 'stream_id required'})
+                try:
+                    offset = int(qs.get('offset') or 0)
+                except (TypeError, ValueError):
+                    return err(400, {'error': 'offset must be a number'})
+                if offset < 0:
+                    return err(400, {'error': 'offset must be non-negative'})
+                chunk = _stream_read(conn, stream_id, user_id, offset)
+                if chunk is None:
+                    return err(404, {'error': 'stream not found'})
+                return ok(chunk)
 
             elif action == 'limits':
-                access_info = check_access(conn, user_id)
+                ent = entitlements.load(conn, user_id)
+                access_info = ent.questions()
                 is_prem = access_info.get('is_premium', False) or access_info.get('is_trial', False)
-                photo_info = _check_photo_limit(conn, user_id)
-                audio_info = _check_audio_limit(conn, user_id)
+                photo_info = ent.photos()
+                audio_info = ent.audio()
                 return ok({
                     'is_premium': is_prem,
                     'is_trial': access_info.get('is_trial', False),
@@ -1605,9 +1477,13 @@ def handler(event: dict, context) -> dict:
             image_base64 = body.get('image_base64', None)
             exam_meta = body.get('exam_meta', None)
             history = body.get('history', [])
+            # session_id — сервер сам берёт конспект и последний обмен сессии вместо history
+            req_sid = _request_session_id(body)
             # system_only=true — системный промпт (шаги сессии, первый промпт экзамена)
             # НЕ тратит лимит пользователя
             system_only = body.get('system_only', False)
+            # stream=true — ответ отдаётся по мере генерации (см. STREAMING)
+            stream = bool(body.get('stream')) and not image_base64
 
             if not question and not image_base64:
                 return err(400, {'error': 'Введи вопрос'})
@@ -1616,33 +1492,16 @@ def handler(event: dict, context) -> dict:
 
             # Системные промпты (шаги сессии, стартовый промпт экзамена) не тратят лимит
             if system_only:
-                ctx = get_context(conn, user_id, material_ids)
+                ctx = get_context(conn, user_id, material_ids, question)
                 answer, tokens = ask_ai(question, ctx, image_base64, exam_meta=exam_meta, history=history)
                 sid = get_session(conn, user_id)
-                save_msg(conn, sid, user_id, 'assistant', answer, material_ids, tokens, False)
+                save_msg(sid, user_id, 'assistant', answer, material_ids, tokens, False)
                 return ok({'answer': answer, 'remaining': None, 'system_only': True})
 
-            access = check_access(conn, user_id)
+            ent = entitlements.load(conn, user_id)
+            access = ent.questions()
             if not access.get('has_access'):
-                reason = access.get('reason', 'limit')
-                if reason == 'daily_limit':
-                    msg = 'Дневной лимит 20 вопросов исчерпан. Купи пакет вопросов или подожди до завтра!'
-                elif access.get('is_soft_landing'):
-                    days_left = access.get('soft_landing_days_left', 1)
-                    msg = f'Сегодняшний лимит {SOFT_LANDING_LIMIT} вопросов исчерпан. Ещё {days_left} д. расширенного доступа — потом 3 вопроса/день. Оформи подписку!'
-                elif access.get('is_free'):
-                    msg = 'Бесплатный лимит (3 вопроса в день) исчерпан. Оформи подписку или купи пакет!'
-                else:
-                    msg = 'Для доступа к ИИ нужна подписка.'
-                return err(403, {
-                    'error': 'limit',
-                    'message': msg,
-                    'used': access.get('used', 0),
-                    'limit': access.get('limit', 0),
-                    'is_premium': access.get('is_premium', False),
-                    'is_soft_landing': access.get('is_soft_landing', False),
-                    'daily_exhausted': access.get('is_premium', False)
-                })
+                return _questions_limit_error(access)
 
             action_type = detect_action(question)
 
@@ -1651,15 +1510,20 @@ def handler(event: dict, context) -> dict:
                 cached = get_cache(conn, question, material_ids)
                 if cached:
                     print(f"[AI] cache hit — fast return", flush=True)
-                    increment_questions(conn, user_id, access)
-                    remaining_now = max(0, access.get('remaining', 1) - 1)
+                    receipt = ent.consume(conn, 'questions')
+                    if receipt is None:
+                        return _questions_limit_error({**access, 'used': access.get('limit', 0)})
+                    remaining_now = receipt['remaining']
                     def _bg_cache(uid, q, mids, ans):
                         try:
-                            c2 = psycopg2.connect(DATABASE_URL)
+                            c2 = db_pool.get_connection()
                             c2.autocommit = True
-                            sid2 = get_session(c2, uid)
-                            save_msg(c2, sid2, uid, 'user', q, mids)
-                            save_msg(c2, sid2, uid, 'assistant', ans, mids, 0, True)
+                            mem2 = load_memory(c2, uid, req_sid, history)
+                            sid2 = mem2.session_id if mem2 else get_session(c2, uid)
+                            save_msg(sid2, uid, 'user', q, mids)
+                            save_msg(sid2, uid, 'assistant', ans, mids, 0, True)
+                            session_memory.remember(sid2, q, ans)
+                            ANSWER_CACHE.flush(c2)
                             c2.close()
                         except Exception as ex:
                             print(f"[AI] bg_cache err: {ex}", flush=True)
@@ -1667,8 +1531,13 @@ def handler(event: dict, context) -> dict:
                     return ok({'answer': cached, 'remaining': remaining_now, 'cached': True})
 
             # --- СЕССИЯ И СООБЩЕНИЕ ПОЛЬЗОВАТЕЛЯ ---
-            sid = get_session(conn, user_id)
-            save_msg(conn, sid, user_id, 'user', question, material_ids)
+            # Память читаем до save_msg: последний обмен в БД — ещё предыдущий
+            memory = load_memory(conn, user_id, req_sid, history)
+            sid = memory.session_id if memory else get_session(conn, user_id)
+            summary = ''
+            if memory:
+                history, summary = memory.turns, memory.summary
+            save_msg(sid, user_id, 'user', question, material_ids)
 
             if action_type == 'task':
                 try:
@@ -1681,10 +1550,10 @@ def handler(event: dict, context) -> dict:
                     task = cur.fetchone()
                     conn.commit()
                     cur.close()
-                    increment_questions(conn, user_id, access)
-                    remaining_now = max(0, access.get('remaining', 1) - 1)
+                    receipt = ent.consume(conn, 'questions')
+                    remaining_now = receipt['remaining'] if receipt else 0
                     ans = f"✅ **Задача создана!**\n\n📋 **{task[1]}**" + (f"\n📚 Предмет: {subj}" if subj else "") + "\n\nНайдёшь её в разделе **Планировщик**."
-                    save_msg(conn, sid, user_id, 'assistant', ans)
+                    save_msg(sid, user_id, 'assistant', ans)
                     return ok({'answer': ans, 'remaining': remaining_now, 'action': 'task_created'})
                 except Exception as e:
                     print(f"[AI] task error: {e}", flush=True)
@@ -1702,42 +1571,117 @@ def handler(event: dict, context) -> dict:
                     lesson = cur.fetchone()
                     conn.commit()
                     cur.close()
-                    increment_questions(conn, user_id, access)
-                    remaining_now = max(0, access.get('remaining', 1) - 1)
+                    receipt = ent.consume(conn, 'questions')
+                    remaining_now = receipt['remaining'] if receipt else 0
                     days_names = ['Понедельник','Вторник','Среда','Четверг','Пятница','Суббота','Воскресенье']
                     dn = days_names[lesson[2]] if lesson[2] is not None else 'не указан'
                     ans = f"✅ **Занятие добавлено!**\n\n📚 **{lesson[1]}** — {parsed['type']}\n📅 {dn}"
                     if parsed['start_time']:
                         ans += f" в {parsed['start_time']}"
                     ans += "\n\nСмотри в **Расписании**."
-                    save_msg(conn, sid, user_id, 'assistant', ans)
+                    save_msg(sid, user_id, 'assistant', ans)
                     return ok({'answer': ans, 'remaining': remaining_now, 'action': 'schedule_created'})
                 except Exception as e:
                     print(f"[AI] schedule error: {e}", flush=True)
 
             # --- КОНТЕКСТ + ИИ ---
-            ctx = get_context(conn, user_id, material_ids)
-            answer, tokens = ask_ai(question, ctx, image_base64, exam_meta=exam_meta, history=history)
+            # Лимит резервируем до вызова ИИ, чтобы параллельные запросы не ушли в минус
+            receipt = ent.consume(conn, 'questions')
+            if receipt is None:
+                return _questions_limit_error({**access, 'used': access.get('limit', 0)})
+            refunded = []
+
+            def _refund(c2):
+                # Возврат не больше одного раза: ошибка ИИ и исключение могут совпасть
+                if not refunded:
+                    refunded.append(True)
+                    ent.refund(c2, receipt)
+
+            flight, leader = None, False
+            try:
+                ctx = get_context(conn, user_id, material_ids, question)
+                if stream:
+                    # До рейса: если это упадёт, ведомым некого будет ждать
+                    prompt = prompt_builder.build(question, ctx, exam_meta, history, summary=summary)
+                    stream_id = _stream_create(conn, user_id)
+                # Тот же вопрос уже у модели — ждём её ответа, а не спрашиваем ещё раз (ключ — хэш кэша)
+                if not image_base64:
+                    flight, leader = ANSWER_FLIGHTS.join(_cache_key(question, material_ids))
+
+                if stream:
+                    def _finish_ask(c2, ans, tok, shared=False):
+                        is_err = not ans
+                        if is_err:
+                            ans = build_smart_fallback(question, ctx)
+                            _refund(c2)
+                        elif tok > 0:
+                            set_cache(c2, question, material_ids, ans, tok)
+                        if leader:
+                            ANSWER_FLIGHTS.resolve(flight, None if is_err else ans)
+                        save_msg(sid, user_id, 'assistant', ans, material_ids, 0 if is_err else tok, shared)
+                        if not is_err:
+                            session_memory.remember(sid, question, ans)
+                        result = {'answer': ans, 'remaining': receipt['remaining'] + (1 if is_err else 0), 'ai_error': is_err,
+                                  'session_id': sid}
+                        if shared:
+                            result['cached'] = True
+                        return result
+
+                    if flight:
+                        target = _run_stream_once
+                        args = (stream_id, flight, leader, question, material_ids, prompt.messages, _finish_ask, _refund)
+                    else:
+                        target = _run_stream
+                        args = (stream_id, LLAMA_MODEL, prompt.messages, 0.5, 800, _finish_ask, _refund)
+                    threading.Thread(target=target, args=args, daemon=True).start()
+                    return ok({'stream_id': stream_id, 'remaining': receipt['remaining'], 'session_id': sid})
+
+                shared = shared_answer(conn, flight, leader, question, material_ids)
+                if shared:
+                    answer, tokens = shared, 0
+                else:
+                    answer, tokens = ask_ai(question, ctx, image_base64, exam_meta=exam_meta, history=history, summary=summary)
 
-            ai_error = (answer == build_smart_fallback(question, ctx))
+                ai_error = (answer == build_smart_fallback(question, ctx))
 
-            if not ai_error:
-                increment_questions(conn, user_id, access)
-            remaining_now = max(0, access.get('remaining', 1) - 1) if not ai_error else access.get('remaining', 0)
+                if ai_error:
+                    _refund(conn)
+                remaining_now = receipt['remaining'] + (1 if ai_error else 0)
 
-            def _bg_post(uid, q, mids, ans, tok, session_id, is_err):
+                def _bg_post(uid, q, mids, ans, tok, session_id, is_err):
+                    try:
+                        c2 = db_pool.get_connection()
+                        c2.autocommit = True
+                        if not is_err and tok > 0:
+                            set_cache(c2, q, mids, ans, tok)
+                        # Ждущие того же вопроса получают ответ, когда он уже в кэше
+                        if leader:
+                            ANSWER_FLIGHTS.resolve(flight, None if is_err else ans)
+                        save_msg(session_id, uid, 'assistant', ans, mids, tok, bool(shared))
+                        if not is_err:
+                            session_memory.remember(session_id, q, ans)
+                        c2.close()
+                    except Exception as ex:
+                        print(f"[AI] bg_post err: {ex}", flush=True)
+                    finally:
+                        if leader:
+                            ANSWER_FLIGHTS.resolve(flight, None)
+                threading.Thread(target=_bg_post, args=(user_id, question, material_ids, answer, tokens, sid, ai_error), daemon=True).start()
+
+                result = {'answer': answer, 'remaining': remaining_now, 'ai_error': ai_error, 'session_id': sid}
+                if shared:
+                    result['cached'] = True
+                return ok(result)
+            except Exception:
+                # Ведомые не ждут упавшего ведущего (повторный resolve ничего не делает)
+                if leader:
+                    ANSWER_FLIGHTS.resolve(flight, None)
+                # Лимит уже списан — ошибка сервера не должна стоить ученику вопроса
                 try:
-                    c2 = psycopg2.connect(DATABASE_URL)
-                    c2.autocommit = True
-                    if not is_err and tok > 0:
-                        set_cache(c2, q, mids, ans, tok)
-                    save_msg(c2, session_id, uid, 'assistant', ans, mids, tok, False)
-                    c2.close()
+                    _refund(conn)
                 except Exception as ex:
-                    print(f"[AI] bg_post err: {ex}", flush=True)
-            threading.Thread(target=_bg_post, args=(user_id, question, material_ids, answer, tokens, sid, ai_error), daemon=True).start()
-
-            return ok({'answer': answer, 'remaining': remaining_now, 'ai_error': ai_error})
+                    print(f"[AI] refund err: {type(ex).__name__}: {ex}", flush=True)
+                raise
 
         return err(405, {'error': 'Method not allowed'})
 
@@ -0,0 +1,113 @@
+"""Поиск набора подстрок в тексте за один проход (автомат Ахо–Корасик).
+
+Кэши популярных тем и триггеры действий проверяются на каждом запросе: раньше
+это был цикл `for key in cache: if key in text`, то есть по проходу текста на
+каждый ключ. Автомат строится один раз при импорте и читает текст один раз —
+время зависит от длины вопроса, а не от числа ключей, поэтому демо-кэш можно
+растить до тысяч тем.
+
+Результаты совпадают с прежними циклами: ключи нумеруются в порядке
+добавления, и из всех вхождений побеждает ключ с меньшим номером (как первый
+сработавший `in` в цикле по dict), а не самый левый в тексте.
+"""
+
+from bisect import bisect_right
+from collections import deque
+
+_NONE = 1 << 30
+
+
+class KeywordMatcher:
+    """Неизменяемый набор ключей-подстрок. keys — любая итерируемая коллекция
+    строк (dict — по ключам); пустые и повторные ключи пропускаются."""
+
+    def __init__(self, keys):
+        self.keys = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [_NONE]  # минимальный номер ключа, оканчивающегося в состоянии (с учётом fail-ссылок)
+        seen = set()
+        for key in keys:
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            state = 0
+            for ch in key:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(_NONE)
+                state = nxt
+            self._best[state] = min(self._best[state], len(self.keys))
+            self.keys.append(key)
+        self._link()
+        # Все ключи целиком — для обратной проверки «текст входит в ключ»
+        self._joined = '\0'.join(self.keys)
+        self._starts = []
+        pos = 0
+        for key in self.keys:
+            self._starts.append(pos)
+            pos += len(key) + 1
+
+    def _link(self):
+        """fail-ссылки обходом в ширину; best наследуется от fail-состояния"""
+        goto, fail, best = self._goto, self._fail, self._best
+        queue = deque(goto[0].values())  # у состояний глубины 1 fail = 0
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                if best[fail[nxt]] < best[nxt]:
+                    best[nxt] = best[fail[nxt]]
+                queue.append(nxt)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _scan(self, text: str, stop_at_any: bool) -> int:
+        goto, fail, best = self._goto, self._fail, self._best
+        found = _NONE
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            b = best[state]
+            if b < found:
+                found = b
+                if stop_at_any or not found:
+                    break
+        return found
+
+    def first(self, text: str):
+        """Ключ с наименьшим номером среди входящих в text, или None"""
+        found = self._scan(text, False) if text else _NONE
+        return self.keys[found] if found != _NONE else None
+
+    def any(self, text: str) -> bool:
+        """Входит ли в text хоть один ключ"""
+        return bool(text) and self._scan(text, True) != _NONE
+
+    def first_related(self, text: str):
+        """Ключ с наименьшим номером, для которого `key in text or text in key`, или None.
+
+        Вторая половина — поиск text внутри склейки всех ключей одним str.find:
+        первое вхождение и есть ключ с наименьшим номером. Ключи разделены
+        символом \\0, поэтому вхождение через границу двух ключей невозможно.
+        Этот поиск линеен по суммарной длине ключей, но это один вызов str.find
+        вместо цикла на Python.
+        """
+        inside = self._scan(text, False) if text else _NONE
+        outside = _NONE
+        if self.keys and '\0' not in text:
+            pos = self._joined.find(text)
+            if pos >= 0:
+                outside = bisect_right(self._starts, pos) - 1
+        found = min(inside, outside)
+        return self.keys[found] if found != _NONE else None
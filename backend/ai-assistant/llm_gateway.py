@@ -0,0 +1,380 @@
+"""Шлюз к LLM: несколько OpenAI-совместимых провайдеров, circuit breaker на каждого,
+хеджированные запросы и метрики.
+
+chat() отправляет запрос первому доступному провайдеру. Если ответа нет дольше p90
+его латентности на этом маршруте — параллельно спрашиваем следующего; побеждает
+первый успешный ответ, проигравший прекращает читать поток и закрывает соединение.
+Быстрая ошибка сразу передаёт запрос дальше по списку. После LLM_BREAKER_FAILURES
+ошибок подряд провайдер исключается на LLM_BREAKER_COOLDOWN секунд, затем к нему
+пропускается один пробный запрос.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+AITUNNEL_URL = 'https://api.aitunnel.ru/v1/chat/completions'
+DEEPSEEK_URL = 'https://api.deepseek.com/v1/chat/completions'
+DEFAULT_MODEL = 'llama-4-maverick'
+
+# Порядок опроса; провайдеры без ключа пропускаются
+LLM_PROVIDERS = [p.strip() for p in os.environ.get('LLM_PROVIDERS', 'aitunnel,deepseek,gemini').split(',') if p.strip()]
+LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', '3'))
+LLM_BREAKER_COOLDOWN = float(os.environ.get('LLM_BREAKER_COOLDOWN', '30'))
+# Пока замеров мало, второй запрос уходит через фиксированную задержку
+LLM_HEDGE_DEFAULT_SECONDS = float(os.environ.get('LLM_HEDGE_DEFAULT_SECONDS', '6'))
+LLM_HEDGE_MIN_SECONDS = 1.0
+LLM_HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+MAX_IN_FLIGHT = 2
+CONNECT_TIMEOUT = 4.0
+METRICS_LOG_EVERY = 50
+
+# name -> (url, переменная с ключом, модель по умолчанию, принимает model= от вызывающего)
+_PROVIDER_SPECS = {
+    'aitunnel': (AITUNNEL_URL, 'OPENROUTER_API_KEY', DEFAULT_MODEL, True),
+    'deepseek': (DEEPSEEK_URL, 'DEEPSEEK_API_KEY', 'deepseek-chat', False),
+    'gemini': (AITUNNEL_URL, 'AITUNNEL_GEMINI_KEY', 'gemini-2.5-flash', False),
+}
+
+LLMResult = namedtuple('LLMResult', 'content tokens provider model latency hedged')
+
+
+class LLMUnavailable(Exception):
+    """Ни один провайдер не ответил до дедлайна"""
+
+
+class CircuitBreaker:
+    """closed → (N ошибок подряд) open → (cooldown) half-open: один пробный запрос"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def allow(self, now: float) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if now - self._opened_at < LLM_BREAKER_COOLDOWN or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self, now: float):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is not None or self._failures >= LLM_BREAKER_FAILURES:
+                self._opened_at = now
+
+    def release(self):
+        """Попытка отменена (проиграла гонку) — ни успех, ни ошибка"""
+        with self._lock:
+            self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self._opened_at >= LLM_BREAKER_COOLDOWN else 'open'
+
+
+class Provider:
+    def __init__(self, name: str, url: str, api_key: str, model: str, accepts_model: bool):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.accepts_model = accepts_model
+        self.breaker = CircuitBreaker()
+
+
+def _clean_key(raw: str) -> str:
+    return ''.join(c for c in (raw or '').strip() if ord(c) < 128).strip()
+
+
+_PROVIDERS = {}
+for _name, (_url, _env, _model, _accepts) in _PROVIDER_SPECS.items():
+    _key = _clean_key(os.environ.get(_env, ''))
+    if _key:
+        _PROVIDERS[_name] = Provider(_name, _url, _key, _model, _accepts)
+
+_http = httpx.Client(timeout=httpx.Timeout(20.0, connect=CONNECT_TIMEOUT),
+                     limits=httpx.Limits(max_connections=20, max_keepalive_connections=10))
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='llm')
+
+
+# ── МЕТРИКИ ──────────────────────────────────────────────────────────────────
+
+class _Stats:
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counts = Counter()
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+_calls = 0
+
+
+def _stat(provider: str, route: str) -> _Stats:
+    key = (provider, route)
+    s = _stats.get(key)
+    if s is None:
+        with _stats_lock:
+            s = _stats.setdefault(key, _Stats())
+    return s
+
+
+def _percentile(values, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _hedge_delay(provider: str, route: str, default: float = None) -> float:
+    latencies = list(_stat(provider, route).latencies)
+    if len(latencies) < LLM_HEDGE_MIN_SAMPLES:
+        return LLM_HEDGE_DEFAULT_SECONDS if default is None else default
+    return max(LLM_HEDGE_MIN_SECONDS, _percentile(latencies, 0.9))
+
+
+def snapshot() -> dict:
+    """Счётчики и перцентили латентности по (провайдер, маршрут), состояние breaker'ов"""
+    out = {'breakers': {name: p.breaker.state for name, p in _PROVIDERS.items()}, 'routes': {}}
+    for (provider, route), s in list(_stats.items()):
+        latencies = list(s.latencies)
+        p50, p90 = _percentile(latencies, 0.5), _percentile(latencies, 0.9)
+        out['routes'][f'{provider}/{route}'] = dict(
+            s.counts,
+            p50=round(p50, 2) if p50 is not None else None,
+            p90=round(p90, 2) if p90 is not None else None,
+        )
+    return out
+
+
+# ── ВЫЗОВ ────────────────────────────────────────────────────────────────────
+
+class _Attempt:
+    def __init__(self, provider: Provider):
+        self.provider = provider
+        self.started = time.monotonic()
+        self.cancelled = threading.Event()
+        self.cancel_reason = None
+
+    def cancel(self, reason: str):
+        self.cancel_reason = reason
+        self.cancelled.set()
+
+
+def stream_completion(url: str, api_key: str, body: dict, cancelled: threading.Event = None,
+                      read_timeout: float = 20.0, on_delta=None) -> tuple:
+    """POST chat/completions с stream=true через общий пул соединений. Поток читается
+    по чанкам: выставленный cancelled обрывает чтение и закрывает соединение,
+    on_delta(text) получает каждый непустой кусок ответа.
+    (content, total_tokens или 0); RuntimeError при не-200 и отмене"""
+    body = dict(body, stream=True, stream_options={'include_usage': True})
+    parts, tokens = [], 0
+    with _http.stream('POST', url, json=body,
+                      headers={'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'},
+                      timeout=httpx.Timeout(read_timeout, connect=CONNECT_TIMEOUT)) as r:
+        if r.status_code != 200:
+            r.read()
+            raise RuntimeError(f'HTTP {r.status_code}: {r.text[:200]}')
+        for line in r.iter_lines():
+            if cancelled is not None and cancelled.is_set():
+                raise RuntimeError('cancelled')
+            if not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]':
+                break
+            chunk = json.loads(data)
+            if chunk.get('usage'):
+                tokens = chunk['usage'].get('total_tokens') or tokens
+            for choice in chunk.get('choices') or []:
+                delta = (choice.get('delta') or {}).get('content') or ''
+                parts.append(delta)
+                if delta and on_delta is not None:
+                    on_delta(delta)
+    return ''.join(parts), tokens
+
+
+def _call(attempt: _Attempt, body: dict, route: str, read_timeout: float) -> tuple:
+    """Один запрос к провайдеру (SSE, чтобы проигравшего можно было оборвать между чанками)"""
+    p = attempt.provider
+    stats = _stat(p.name, route)
+    stats.counts['requests'] += 1
+    try:
+        content, tokens = stream_completion(p.url, p.api_key, body, attempt.cancelled, read_timeout)
+        if not content.strip():
+            raise RuntimeError('empty answer')
+    except Exception:
+        if attempt.cancel_reason == 'lost':
+            p.breaker.release()
+            stats.counts['cancelled'] += 1
+        else:
+            p.breaker.failure(time.monotonic())
+            stats.counts['errors'] += 1
+        raise
+    p.breaker.success()
+    stats.latencies.append(time.monotonic() - attempt.started)
+    stats.counts['ok'] += 1
+    return content, tokens or len(content) // 4
+
+
+def chat(messages: list, *, route: str = 'default', model: str = None, max_tokens: int = 800,
+         temperature: float = 0.5, timeout: float = 20.0, providers=None, hedge: bool = True,
+         hedge_after: float = None, extra: dict = None) -> LLMResult:
+    """Ответ первого успешного провайдера. model= применяется к провайдеру, который его принимает
+    (aitunnel), остальные отвечают своей моделью. hedge_after — задержка второго запроса, пока
+    на маршруте мало замеров (для длинных генераций). LLMUnavailable — все упали или истёк timeout"""
+    global _calls
+    deadline = time.monotonic() + timeout
+    queue = deque(_PROVIDERS[n] for n in (providers or LLM_PROVIDERS) if n in _PROVIDERS)
+    running = {}
+    errors = []
+    hedged = False
+
+    def launch() -> bool:
+        while queue:
+            p = queue.popleft()
+            if not p.breaker.allow(time.monotonic()):
+                _stat(p.name, route).counts['skipped_open'] += 1
+                continue
+            body = {
+                'model': model if (model and p.accepts_model) else p.model,
+                'messages': messages,
+                'temperature': temperature,
+                'max_tokens': max_tokens,
+            }
+            if extra:
+                body.update(extra)
+            attempt = _Attempt(p)
+            running[_executor.submit(_call, attempt, body, route, max(1.0, deadline - time.monotonic()))] = attempt
+            return True
+        return False
+
+    if not launch():
+        raise LLMUnavailable('нет доступных провайдеров')
+    try:
+        while running:
+            now = time.monotonic()
+            if now >= deadline:
+                errors.append('timeout')
+                break
+            latest = max(running.values(), key=lambda a: a.started)
+            hedge_at = latest.started + _hedge_delay(latest.provider.name, route, hedge_after)
+            can_hedge = hedge and queue and len(running) < MAX_IN_FLIGHT
+            wait_for = min(deadline, hedge_at) - now if can_hedge else deadline - now
+            done, _ = wait(list(running), timeout=max(0.0, wait_for), return_when=FIRST_COMPLETED)
+            if not done:
+                if can_hedge and time.monotonic() >= hedge_at and launch():
+                    hedged = True
+                    _stat(latest.provider.name, route).counts['hedged'] += 1
+                continue
+            for fut in done:
+                attempt = running.pop(fut)
+                try:
+                    content, tokens = fut.result()
+                except Exception as e:
+                    errors.append(f'{attempt.provider.name}: {type(e).__name__}: {str(e)[:120]}')
+                    if len(running) < MAX_IN_FLIGHT:
+                        launch()
+                    continue
+                latency = time.monotonic() - attempt.started
+                if hedged:
+                    _stat(attempt.provider.name, route).counts['hedge_wins'] += 1
+                used_model = model if (model and attempt.provider.accepts_model) else attempt.provider.model
+                print(f"[LLM] {route} ok provider={attempt.provider.name} {latency:.2f}s tokens={tokens}"
+                      f"{' hedged' if hedged else ''}", flush=True)
+                return LLMResult(content, tokens, attempt.provider.name, used_model, latency, hedged)
+    finally:
+        for attempt in running.values():
+            attempt.cancel('lost' if not errors or errors[-1] != 'timeout' else 'deadline')
+        _calls += 1
+        if _calls % METRICS_LOG_EVERY == 0:
+            print(f"[LLM] metrics {json.dumps(snapshot(), ensure_ascii=False)}", flush=True)
+    print(f"[LLM] {route} FAIL: {'; '.join(errors)}", flush=True)
+    raise LLMUnavailable('; '.join(errors))
+
+
+class _DeliveryError(Exception):
+    """Ошибка в on_delta вызывающего — провайдер тут ни при чём"""
+
+
+def stream_chat(messages: list, on_delta, *, route: str = 'stream', model: str = None, max_tokens: int = 800,
+                temperature: float = 0.5, read_timeout: float = 20.0, providers=None) -> LLMResult:
+    """chat() для стриминга: куски ответа уходят в on_delta(text) по мере генерации.
+    Провайдеры, breaker'ы и метрики те же, но без хеджирования — показанный текст
+    вторым ответом не заменить. Следующий провайдер пробуется, только пока
+    пользователь ничего не увидел; обрыв после первых кусков возвращает то, что
+    успели прислать. LLMUnavailable — ни один провайдер не начал отвечать.
+    Исключение из on_delta пробрасывается как есть и провайдеру в вину не ставится"""
+    global _calls
+    errors = []
+    for p in (_PROVIDERS[n] for n in (providers or LLM_PROVIDERS) if n in _PROVIDERS):
+        stats = _stat(p.name, route)
+        if not p.breaker.allow(time.monotonic()):
+            stats.counts['skipped_open'] += 1
+            continue
+        body = {
+            'model': model if (model and p.accepts_model) else p.model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+        }
+        received = []
+
+        def deliver(text):
+            received.append(text)
+            try:
+                on_delta(text)
+            except Exception as e:
+                raise _DeliveryError() from e
+
+        stats.counts['requests'] += 1
+        started = time.monotonic()
+        try:
+            content, tokens = stream_completion(p.url, p.api_key, body, None, read_timeout, deliver)
+            if not content.strip():
+                raise RuntimeError('empty answer')
+        except _DeliveryError as e:
+            p.breaker.release()
+            stats.counts['cancelled'] += 1
+            raise e.__cause__
+        except Exception as e:
+            p.breaker.failure(time.monotonic())
+            stats.counts['errors'] += 1
+            errors.append(f'{p.name}: {type(e).__name__}: {str(e)[:120]}')
+            if not received:
+                continue
+            content, tokens = ''.join(received), 0
+            print(f"[LLM] {route} broken provider={p.name} after {len(content)} chars", flush=True)
+        else:
+            p.breaker.success()
+            stats.latencies.append(time.monotonic() - started)
+            stats.counts['ok'] += 1
+        latency = time.monotonic() - started
+        used_model = model if (model and p.accepts_model) else p.model
+        print(f"[LLM] {route} stream provider={p.name} {latency:.2f}s tokens={tokens}", flush=True)
+        _calls += 1
+        if _calls % METRICS_LOG_EVERY == 0:
+            print(f"[LLM] metrics {json.dumps(snapshot(), ensure_ascii=False)}", flush=True)
+        return LLMResult(content, tokens or len(content) // 4, p.name, used_model, latency, False)
+    print(f"[LLM] {route} FAIL: {'; '.join(errors) or 'нет доступных провайдеров'}", flush=True)
+    raise LLMUnavailable('; '.join(errors) or 'нет доступных провайдеров')
@@ -0,0 +1,109 @@
+"""Прямая загрузка фото и аудио в хранилище по presigned URL (как в materials).
+
+Клиент получает upload_url и file_key (action=media_upload_url), кладёт файл
+PUT-запросом прямо в бакет и передаёт в photo_solve / gemini_chat только
+image_key / audio_key. Функция читает объект потоком с ограничением размера —
+в теле запроса больше нет мегабайтов base64. Ключ содержит user_id: чужой
+объект прочитать нельзя.
+
+Чтение объект не удаляет: запрос ещё может упереться в лимит или не получить
+ответа модели, и тогда клиент повторит его с тем же ключом. Удаляет discard()
+после успешного ответа, а брошенные ключи снимает правило жизненного цикла
+бакета (MEDIA_RETENTION_DAYS, см. setup_media_lifecycle.py).
+"""
+
+import os
+import uuid
+
+import boto3
+
+MEDIA_BUCKET = 'files'
+MEDIA_PREFIX = 'ai-media'
+UPLOAD_URL_TTL = 600
+READ_CHUNK = 256 * 1024
+# Сколько живут неудалённые медиа (правило жизненного цикла на MEDIA_PREFIX)
+MEDIA_RETENTION_DAYS = 1
+
+# kind -> (макс. размер, допустимые типы -> расширение)
+MEDIA_KINDS = {
+    'photo': (10 * 1024 * 1024, {
+        'image/jpeg': 'jpg', 'image/png': 'png', 'image/webp': 'webp', 'image/heic': 'heic',
+    }),
+    'audio': (15 * 1024 * 1024, {
+        'audio/webm': 'webm', 'audio/wav': 'wav', 'audio/x-wav': 'wav', 'audio/mpeg': 'mp3',
+        'audio/mp4': 'm4a', 'audio/ogg': 'ogg',
+    }),
+}
+
+
+class MediaError(Exception):
+    """Ошибка клиента: неверный тип, ключ или размер файла (текст — для пользователя)"""
+
+
+_s3 = None
+
+
+def get_s3_client():
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client('s3',
+            endpoint_url='https://bucket.poehali.dev',
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'])
+    return _s3
+
+
+def presign(user_id: int, kind: str, content_type: str) -> dict:
+    """Presigned PUT для одного файла пользователя"""
+    if kind not in MEDIA_KINDS:
+        raise MediaError('kind должен быть photo или audio')
+    max_bytes, types = MEDIA_KINDS[kind]
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    ext = types.get(content_type)
+    if not ext:
+        raise MediaError(f'Неподдерживаемый тип файла: {content_type or "не указан"}')
+    key = f"{MEDIA_PREFIX}/{kind}/{user_id}/{uuid.uuid4().hex}.{ext}"
+    url = get_s3_client().generate_presigned_url('put_object',
+        Params={'Bucket': MEDIA_BUCKET, 'Key': key, 'ContentType': content_type},
+        ExpiresIn=UPLOAD_URL_TTL)
+    return {'upload_url': url, 'file_key': key, 'content_type': content_type,
+            'max_bytes': max_bytes, 'expires_in': UPLOAD_URL_TTL}
+
+
+def extension(file_key: str) -> str:
+    return file_key.rsplit('.', 1)[-1].lower() if '.' in file_key else ''
+
+
+def read(file_key: str, user_id: int, kind: str) -> bytes:
+    """Содержимое загруженного файла. Объект остаётся до discard()"""
+    max_bytes = MEDIA_KINDS[kind][0]
+    if not file_key.startswith(f"{MEDIA_PREFIX}/{kind}/{user_id}/") or '..' in file_key:
+        raise MediaError('Неверный ключ файла')
+    s3 = get_s3_client()
+    try:
+        obj = s3.get_object(Bucket=MEDIA_BUCKET, Key=file_key)
+    except s3.exceptions.NoSuchKey:
+        raise MediaError('Файл не найден — загрузи его ещё раз')
+    if obj.get('ContentLength', 0) > max_bytes:
+        obj['Body'].close()
+        raise MediaError(f'Файл слишком большой. Максимум {max_bytes // 1024 // 1024} МБ')
+    data = bytearray()
+    for chunk in obj['Body'].iter_chunks(READ_CHUNK):
+        data += chunk
+        if len(data) > max_bytes:
+            obj['Body'].close()
+            raise MediaError(f'Файл слишком большой. Максимум {max_bytes // 1024 // 1024} МБ')
+    print(f"[MEDIA] read {file_key} {len(data) // 1024}KB", flush=True)
+    return bytes(data)
+
+
+def discard(*file_keys: str):
+    """Удаляет обработанные медиа (пустые ключи пропускаются). Ошибки только логируются —
+    не удалённое снимет правило жизненного цикла"""
+    for file_key in file_keys:
+        if not file_key:
+            continue
+        try:
+            get_s3_client().delete_object(Bucket=MEDIA_BUCKET, Key=file_key)
+        except Exception as e:
+            print(f"[MEDIA] delete {file_key} failed: {e}", flush=True)
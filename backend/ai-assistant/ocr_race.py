@@ -0,0 +1,174 @@
+"""Распознавание фото несколькими vision-моделями наперегонки.
+
+Режим hedge (по умолчанию) спрашивает провайдеров в порядке OCR_PROVIDERS, но
+следующего запускает, не дожидаясь конца предыдущего: сразу после отказа или
+ошибки либо через OCR_HEDGE_SECONDS без ответа. Обычно платим за один вызов,
+а медленный провайдер не держит ученика дольше задержки. В режиме race фото
+одновременно уходит всем провайдерам (в разы дороже); sequential ждёт каждого
+до конца. Побеждает первый ответ, который не отказ (is_refusal), остальные
+перестают читать поток и закрывают соединение. Запросы идут через общий пул
+соединений llm_gateway.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed,
+                                wait)
+
+import llm_gateway
+
+OCR_MODE = os.environ.get('OCR_MODE', 'hedge')
+# Порядок важен для hedge и sequential; провайдеры без ключа пропускаются
+OCR_PROVIDERS = [p.strip() for p in os.environ.get('OCR_PROVIDERS', 'gpt4o-mini,gemini,llama,deepseek-vl').split(',')
+                 if p.strip()]
+OCR_TIMEOUT = float(os.environ.get('OCR_TIMEOUT', '25'))
+# Через сколько секунд без ответа hedge запускает следующего провайдера (≈ p90 обычного OCR)
+OCR_HEDGE_SECONDS = float(os.environ.get('OCR_HEDGE_SECONDS', '8'))
+
+# name -> (url, переменная с ключом, модель, max_tokens)
+_SPECS = {
+    'gpt4o-mini': (llm_gateway.AITUNNEL_URL, 'OPENROUTER_API_KEY', 'gpt-4o-mini', 1500),
+    'gemini': (llm_gateway.AITUNNEL_URL, 'AITUNNEL_GEMINI_KEY', 'gemini-2.5-flash', 1500),
+    'llama': (llm_gateway.AITUNNEL_URL, 'OPENROUTER_API_KEY', 'meta-llama/llama-4-maverick', 1000),
+    'deepseek-vl': (llm_gateway.DEEPSEEK_URL, 'DEEPSEEK_API_KEY', 'deepseek-vl2', 1000),
+}
+
+_REFUSAL_MARKERS = (
+    'не могу просматривать', 'не могу видеть', 'cannot view', 'can\'t view',
+    'cannot see', 'can\'t see', 'не вижу изображен', 'нет изображен',
+    'i cannot', 'i can\'t', 'unable to', 'не удалось', 'sorry',
+    'к сожалению', 'не предоставили', 'не могу распознать',
+    'however, i can help', 'однако, я могу помочь',
+    'извините', 'не могу помочь', 'i\'m sorry', 'i am sorry',
+    'не могу выполнить', 'не могу обработать', 'cannot process',
+    'cannot help', 'can\'t help', 'не в состоянии',
+)
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ocr')
+
+
+def is_refusal(text: str) -> bool:
+    lower = text.lower()
+    return any(m in lower for m in _REFUSAL_MARKERS) or len(text.strip()) < 10
+
+
+def _providers() -> list:
+    out = []
+    for name in OCR_PROVIDERS:
+        spec = _SPECS.get(name)
+        if not spec:
+            continue
+        key = ''.join(c for c in os.environ.get(spec[1], '').strip() if ord(c) < 128).strip()
+        if key:
+            out.append((name, spec[0], key, spec[2], spec[3]))
+    return out
+
+
+def _recognize_one(provider: tuple, image_url: str, prompt: str, cancelled: threading.Event, log: str):
+    name, url, key, model, max_tokens = provider
+    started = time.monotonic()
+    body = {
+        'model': model,
+        'messages': [{'role': 'user', 'content': [
+            {'type': 'image_url', 'image_url': {'url': image_url}},
+            {'type': 'text', 'text': prompt},
+        ]}],
+        'temperature': 0.1,
+        'max_tokens': max_tokens,
+    }
+    text, _ = llm_gateway.stream_completion(url, key, body, cancelled, OCR_TIMEOUT)
+    text = text.strip()
+    if is_refusal(text):
+        print(f"[{log}] OCR {name} refused: {text[:80]}", flush=True)
+        return None
+    print(f"[{log}] OCR {name} ok {time.monotonic() - started:.1f}s: {text[:80]}", flush=True)
+    return text
+
+
+def _sequential(providers: list, image_url: str, prompt: str, log: str):
+    for provider in providers:
+        try:
+            text = _recognize_one(provider, image_url, prompt, None, log)
+        except Exception as e:
+            print(f"[{log}] OCR {provider[0]} error: {type(e).__name__}: {str(e)[:200]}", flush=True)
+            continue
+        if text:
+            return text
+    return None
+
+
+def _race(providers: list, image_url: str, prompt: str, log: str):
+    cancelled = threading.Event()
+    futures = {_executor.submit(_recognize_one, p, image_url, prompt, cancelled, log): p[0] for p in providers}
+    try:
+        for fut in as_completed(futures, timeout=OCR_TIMEOUT):
+            try:
+                text = fut.result()
+            except Exception as e:
+                print(f"[{log}] OCR {futures[fut]} error: {type(e).__name__}: {str(e)[:200]}", flush=True)
+                continue
+            if text:
+                return text
+    except FuturesTimeout:
+        print(f"[{log}] OCR race timeout {OCR_TIMEOUT:.0f}s", flush=True)
+    finally:
+        # Проигравшие бросят чтение на следующем чанке
+        cancelled.set()
+    return None
+
+
+def _hedged(providers: list, image_url: str, prompt: str, log: str):
+    cancelled = threading.Event()
+    queue = list(providers)
+    running = {}
+    deadline = time.monotonic() + OCR_TIMEOUT
+
+    def launch():
+        p = queue.pop(0)
+        running[_executor.submit(_recognize_one, p, image_url, prompt, cancelled, log)] = (p[0], time.monotonic())
+
+    launch()
+    try:
+        while running:
+            now = time.monotonic()
+            if now >= deadline:
+                print(f"[{log}] OCR hedge timeout {OCR_TIMEOUT:.0f}s", flush=True)
+                break
+            hedge_at = max(started for _, started in running.values()) + OCR_HEDGE_SECONDS
+            wait_until = min(deadline, hedge_at) if queue else deadline
+            done, _ = wait(list(running), timeout=max(0.0, wait_until - now), return_when=FIRST_COMPLETED)
+            if not done:
+                if queue and time.monotonic() >= hedge_at:
+                    print(f"[{log}] OCR no answer in {OCR_HEDGE_SECONDS:.0f}s, hedging with {queue[0][0]}", flush=True)
+                    launch()
+                continue
+            for fut in done:
+                name, _ = running.pop(fut)
+                try:
+                    text = fut.result()
+                except Exception as e:
+                    print(f"[{log}] OCR {name} error: {type(e).__name__}: {str(e)[:200]}", flush=True)
+                    text = None
+                if text:
+                    return text
+                # Отказ или ошибка — следующий провайдер без ожидания
+                if queue:
+                    launch()
+    finally:
+        cancelled.set()
+    return None
+
+
+def recognize(image_url: str, prompt: str, log: str = 'PHOTO'):
+    """Текст с фото от первого провайдера, который не отказал, или None.
+    image_url — data URL, подготовленный image_prep.prepare() один раз на все попытки"""
+    providers = _providers()
+    if not providers:
+        print(f"[{log}] OCR: нет ключей ни для одного провайдера", flush=True)
+        return None
+    if OCR_MODE == 'sequential' or len(providers) == 1:
+        return _sequential(providers, image_url, prompt, log)
+    if OCR_MODE == 'race':
+        return _race(providers, image_url, prompt, log)
+    return _hedged(providers, image_url, prompt, log)
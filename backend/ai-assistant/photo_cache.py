@@ -0,0 +1,137 @@
+"""Кэш решений фото-задач по перцептивному хэшу (photo_solve_cache).
+
+Одноклассники фотографируют одну и ту же задачу из учебника: снимки отличаются
+обрезкой и экспозицией, но их pHash (image_prep.phash) расходится лишь на
+несколько бит. Кандидатов выбираем по совпадению хотя бы одного байта хэша
+(phash_bands, GIN): при расстоянии Хэмминга до 7 бит один из 8 байт обязательно
+совпадёт. Точное расстояние считаем в Python.
+
+64-битный хэш различает только вёрстку: у страниц учебника с одинаковой
+разметкой и разным текстом он расходится всего на 4–6 бит. Поэтому он лишь
+выбирает кандидатов, а совпадение подтверждает 256-битный fine_hash
+(image_prep.fine_hash): у разных страниц — десятки бит разницы, у пережатой,
+уменьшенной или осветлённой копии того же снимка — единицы. Заметно
+обрезанный или повёрнутый снимок не подтверждается — это промах, а не чужое
+решение. Задачи, различающиеся лишь парой цифр при той же вёрстке, не
+различит ни один перцептивный хэш. Подсказка пользователя (hint) меняет
+решение, поэтому входит в ключ.
+
+Вытеснение: строки, к которым не обращались PHOTO_CACHE_TTL_DAYS, удаляются
+порциями при записи; сверх PHOTO_CACHE_MAX_ROWS удаляются давно не
+использованные. hit_count — сколько раз решение отдано из кэша.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+# Порог кандидата по 64-битному хэшу; решает подтверждение по fine_hash
+PHOTO_CACHE_MAX_DISTANCE = int(os.environ.get('PHOTO_CACHE_MAX_DISTANCE', '4'))
+# Из 256 бит: копии снимка расходятся на 0–4, разные страницы с одной вёрсткой — на 60+
+PHOTO_CACHE_FINE_MAX_DISTANCE = int(os.environ.get('PHOTO_CACHE_FINE_MAX_DISTANCE', '12'))
+PHOTO_CACHE_TTL_DAYS = int(os.environ.get('PHOTO_CACHE_TTL_DAYS', '60'))
+PHOTO_CACHE_MAX_ROWS = int(os.environ.get('PHOTO_CACHE_MAX_ROWS', '50000'))
+PHOTO_CACHE_CANDIDATES = 50
+EVICT_BATCH = 200
+TRIM_EVERY = 100
+
+_stats = {'hits': 0, 'misses': 0, 'stores': 0}
+_stats_lock = threading.Lock()
+
+
+def bands(phash: int) -> list:
+    """8 байт хэша с номером позиции: (i << 8) | byte"""
+    u = phash & 0xFFFFFFFFFFFFFFFF
+    return [(i << 8) | ((u >> (56 - 8 * i)) & 0xFF) for i in range(8)]
+
+
+def distance(a: int, b: int) -> int:
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count('1')
+
+
+def fine_distance(a: bytes, b: bytes) -> int:
+    return bin(int.from_bytes(bytes(a), 'big') ^ int.from_bytes(bytes(b), 'big')).count('1')
+
+
+def hint_key(hint: str) -> str:
+    return hashlib.md5(' '.join((hint or '').lower().split()).encode()).hexdigest()
+
+
+def _count(kind: str):
+    with _stats_lock:
+        _stats[kind] += 1
+        total = _stats['hits'] + _stats['misses']
+        if kind != 'stores' and total % 20 == 0:
+            print(f"[PHOTO] cache hit rate {_stats['hits'] / total:.1%} "
+                  f"({_stats['hits']}/{total}, stored {_stats['stores']})", flush=True)
+
+
+def lookup(conn, phash: int, fine: bytes, hint: str):
+    """Готовый результат _ocr_and_solve для того же фото или None"""
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT id, phash, fine_hash, result FROM {SCHEMA_NAME}.photo_solve_cache
+            WHERE hint_hash = %s AND phash_bands && %s::int[]
+            ORDER BY last_used_at DESC LIMIT {PHOTO_CACHE_CANDIDATES}
+        """, (hint_key(hint), bands(phash)))
+        best = None
+        for row in cur.fetchall():
+            if distance(phash, row[1]) > PHOTO_CACHE_MAX_DISTANCE:
+                continue
+            d = fine_distance(fine, row[2])
+            if d <= PHOTO_CACHE_FINE_MAX_DISTANCE and (best is None or d < best[0]):
+                best = (d, row[0], row[3])
+        if best is None:
+            conn.rollback()
+            _count('misses')
+            return None
+        cur.execute(f"""
+            UPDATE {SCHEMA_NAME}.photo_solve_cache
+            SET hit_count = hit_count + 1, last_used_at = CURRENT_TIMESTAMP WHERE id = %s
+        """, (best[1],))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"[PHOTO] cache lookup err: {e}", flush=True)
+        return None
+    finally:
+        cur.close()
+    _count('hits')
+    print(f"[PHOTO] cache hit id={best[1]} fine distance={best[0]}", flush=True)
+    result = best[2]
+    return json.loads(result) if isinstance(result, str) else result
+
+
+def store(conn, phash: int, fine: bytes, hint: str, result: dict):
+    """Сохраняет результат и заодно вытесняет устаревшие строки"""
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            INSERT INTO {SCHEMA_NAME}.photo_solve_cache (phash, phash_bands, fine_hash, hint_hash, result)
+            VALUES (%s, %s, %s, %s, %s::jsonb)
+        """, (phash, bands(phash), fine, hint_key(hint), json.dumps(result, ensure_ascii=False)))
+        cur.execute(f"""
+            DELETE FROM {SCHEMA_NAME}.photo_solve_cache WHERE id IN (
+                SELECT id FROM {SCHEMA_NAME}.photo_solve_cache
+                WHERE last_used_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+                LIMIT {EVICT_BATCH})
+        """, (PHOTO_CACHE_TTL_DAYS,))
+        with _stats_lock:
+            _stats['stores'] += 1
+            trim = _stats['stores'] % TRIM_EVERY == 0
+        if trim:
+            cur.execute(f"""
+                DELETE FROM {SCHEMA_NAME}.photo_solve_cache WHERE id IN (
+                    SELECT id FROM {SCHEMA_NAME}.photo_solve_cache
+                    ORDER BY last_used_at DESC OFFSET %s LIMIT {EVICT_BATCH * 5})
+            """, (PHOTO_CACHE_MAX_ROWS,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"[PHOTO] cache store err: {e}", flush=True)
+    finally:
+        cur.close()
@@ -0,0 +1,310 @@
+"""Сборка промпта ask_ai под бюджет входных токенов.
+
+Шаблоны системного промпта по режимам (practice, explain, weak, mock, общий
+экзаменационный и обычный чат) собираются один раз при импорте; готовый текст
+для пары (режим, экзамен, предмет) кэшируется вместе с оценкой токенов. Общие
+правила (без таблиц, LaTeX, картинок, иероглифов) — одним блоком, без прежнего
+дубля «СТРОГИХ ЗАПРЕТОВ» в обычном чате.
+
+Бюджет PROMPT_TOKEN_BUDGET делится так: системный промпт (с конспектом сессии
+из session_memory, не больше SUMMARY_TOKEN_BUDGET) и вопрос — всегда;
+затем история — от последнего сообщения назад, не больше HISTORY_TOKEN_BUDGET
+(последнему сообщению ассистента — больше места: на него ученик и отвечает);
+остаток, но не больше CONTEXT_TOKEN_BUDGET, — материалам. Контекст из
+get_context уже упорядочен по релевантности (BM25), поэтому он режется с конца
+по границам абзацев и предложений, а не посимвольно; обрезка пишется в лог.
+
+Токены оцениваются локально (estimate_tokens) — эвристика по словам для
+токенизатора Llama 3, с запасом в большую сторону.
+"""
+
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', '2200'))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '900'))
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', '450'))
+SUMMARY_TOKEN_BUDGET = int(os.environ.get('SUMMARY_TOKEN_BUDGET', '300'))
+HISTORY_MAX_MESSAGES = 6
+HISTORY_MSG_TOKENS = 80
+HISTORY_LAST_TOKENS = 250
+QUESTION_MAX_CHARS = 1000
+# Служебные токены чат-шаблона на одно сообщение
+MESSAGE_OVERHEAD = 4
+# Меньше этого кусок абзаца не имеет смысла добавлять
+MIN_PIECE_TOKENS = 40
+
+Prompt = namedtuple('Prompt', 'system messages tokens')
+
+_TOKEN_PIECE = re.compile(r'([А-Яа-яЁё]+)|([A-Za-z]+)|(\d+)|(\n)|[^\s\w]|_')
+_SENTENCE_END = re.compile(r'[.!?…](?=\s)|\n')
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов: русское слово — 1 + len//4, латиница — 1 + len//7,
+    цифры — по 3, перевод строки и знак — по одному"""
+    n = 0
+    for cyr, lat, num, nl in _TOKEN_PIECE.findall(text):
+        if cyr:
+            n += 1 + len(cyr) // 4
+        elif lat:
+            n += 1 + len(lat) // 7
+        elif num:
+            n += (len(num) + 2) // 3
+        else:
+            n += 1
+    return n
+
+
+# ── Шаблоны ──────────────────────────────────────────────────────────────────
+# Плейсхолдеры: {sl} — предмет, {el} — ЕГЭ/ОГЭ, {EL} — в верхнем регистре
+
+_MD_FMT = "Форматирование: используй **жирный** для ключевых терминов, ## заголовки, нумерованные списки для шагов, > цитаты для правил."
+
+_EXAM_TEMPLATES = {
+    'practice': (
+        "Ты Studyfay — опытный репетитор-экзаменатор по «{sl}» ({el}). Русский. 1-2 эмодзи. Формулы текстом.\n{md}\n\n"
+        "РЕЖИМ ПРАКТИКИ {EL}:\n"
+        "• Давай РЕАЛЬНЫЕ задания строго в формате {el} (как в КИМ ФИПИ). Указывай номер задания.\n"
+        "• Когда ученик отвечает — НЕМЕДЛЕННО проверяй:\n"
+        "  ✅ Правильно → похвали + объясни ПОЧЕМУ правильно (1-2 предложения) + дай следующее задание.\n"
+        "  ❌ Неверно → покажи правильный ответ + разбор ошибки + подсказку «Запомни:...» + следующее задание.\n"
+        "• Любое сообщение ученика = его ответ. Никогда не пропускай проверку.\n"
+        "• Чередуй темы и типы (тест/расчёт/анализ). Сложность нарастает.\n"
+        "• После 3-4 заданий подряд — короткий итог: «Ты уже разобрал X тем, отлично! 💪»\n"
+        "• В конце задания: «Жду твой ответ 👇»"
+    ),
+    'explain': (
+        "Ты Studyfay — лучший репетитор по «{sl}» для {el}. Русский. 1-2 эмодзи. Формулы текстом.\n{md}\n\n"
+        "КАК ОБЪЯСНЯТЬ:\n"
+        "1) **Суть** — объясни простым языком, используй аналогию из жизни.\n"
+        "2) **Пример** — покажи на конкретной задаче или ситуации (как в экзамене).\n"
+        "3) **Ловушка** — предупреди о типичной ошибке: «Внимание: часто путают X с Y».\n"
+        "4) **Вопрос** — задай один вопрос по теме, чтобы ученик закрепил.\n\n"
+        "• Задачу — реши ПОЛНОСТЬЮ пошагово с пояснением каждого шага.\n"
+        "• Если тема сложная — разбей на части, предложи «Давай разберём по шагам».\n"
+        "• 4-8 предложений. Если просят подробнее — расширяй."
+    ),
+    'weak': (
+        "Ты Studyfay — репетитор по «{sl}» ({el}). Специалист по СЛАБЫМ МЕСТАМ. Русский. 1-2 эмодзи. Формулы текстом.\n{md}\n\n"
+        "МЕТОД РАБОТЫ:\n"
+        "• Определи конкретную проблему ученика и работай ТОЧЕЧНО — не уходи в сторону.\n"
+        "• Дай ПРАВИЛО-ШПАРГАЛКУ: «🔑 Запомни: если X — то всегда Y».\n"
+        "• Покажи ПРИЁМ решения: «Лайфхак: чтобы не ошибиться, делай так...».\n"
+        "• Предупреди об ОШИБКЕ: «⚠️ Типичная ловушка: многие думают X, но на самом деле Y».\n"
+        "• ОБЯЗАТЕЛЬНО дай тренировочное задание того же типа + «Жду ответ 👇».\n"
+        "• При проверке: ✅/❌ + разбор + если неверно — объясни ту же тему ДРУГИМИ словами."
+    ),
+    'mock': (
+        "Ты строгий экзаменатор {el} по «{sl}». Имитируешь реальный экзамен. Русский. Формулы текстом.\n{md}\n\n"
+        "СТРОГИЙ РЕЖИМ:\n"
+        "• Задания ТОЧНО как в КИМ {el} — официальные формулировки и сложность.\n"
+        "• Нумеруй: «📝 Задание 1», «📝 Задание 2» и т.д.\n"
+        "• Оценка ответа: «✅ Верно» или «❌ Неверно» + объяснение (1-2 предложения) + сразу следующее.\n"
+        "• Засчитывай только ТОЧНЫЕ ответы. Неполный = неверно (объясни что не хватает).\n"
+        "• Без подсказок. После каждых 5 заданий — краткий счёт: «Результат: X/5 ✅».\n"
+        "• В конце задания: «Ваш ответ?»"
+    ),
+    'exam': (
+        "Ты Studyfay — репетитор по «{sl}» для {el}. Русский. 1-2 эмодзи. Формулы текстом.\n{md}\n"
+        "Структура: суть простыми словами → конкретный пример → совет для экзамена → вопрос ученику."
+    ),
+}
+
+_CHAT_PROMPT = (
+    "Ты Studyfay — умный и дружелюбный ассистент. Помогаешь школьникам, студентам и всем, кто спрашивает.\n\n"
+    "КАК ТЫ РАБОТАЕШЬ:\n"
+    "• Отвечай на ЛЮБЫЕ вопросы — учебные, бытовые, про предметы, технику, кулинарию, природу и т.д. "
+    "НИКОГДА не отказывай: если тема не учебная — всё равно помоги.\n"
+    "• Объясняй ПРОСТЫМИ СЛОВАМИ — как будто рассказываешь другу. Используй аналогии из жизни.\n"
+    "• Если задача — реши ПОЛНОСТЬЮ пошагово. Каждый шаг на отдельной строке с пояснением «почему».\n"
+    "• Если вопрос бытовой или общий — дай полезный, конкретный ответ с примерами.\n"
+    "• Если пользователь прислал фото чего-то (кафель, еда, предмет) — опиши что это и помоги.\n"
+    "• В КОНЦЕ ответа задай ОДИН короткий вопрос по теме.\n\n"
+    "ФОРМАТИРОВАНИЕ (обязательно):\n"
+    "• Используй markdown: **жирный** для ключевых терминов и ответов.\n"
+    "• Используй ## заголовки для разделов.\n"
+    "• Используй нумерованные списки (1. 2. 3.) для пошаговых решений.\n"
+    "• Используй маркированные списки (- ...) для перечислений.\n"
+    "• Используй > цитаты для важных правил/формул.\n\n"
+    "СТИЛЬ:\n"
+    "• Русский. Формулы текстом: x^2, sqrt(x), a/b. Без LaTeX.\n"
+    "• 4-8 предложений. Если просят подробнее — расширяй.\n"
+    "• 1-2 эмодзи. Тон тёплый и поддерживающий, но фактически точный.\n"
+    "• Не переспрашивай — отвечай сразу. Если вопрос неясен — дай лучший ответ + уточни."
+)
+
+# Общие для всех режимов правила — один раз, в конце системного промпта
+_RULES = (
+    "\n\nСТРОГИЕ ЗАПРЕТЫ (нарушение = ошибка):\n"
+    "• НЕ показывай картинки/схемы/графики/диаграммы. Не пиши «смотри на рисунок».\n"
+    "• НЕ используй иероглифы или нелатинские/нерусские символы.\n"
+    "• НЕ рисуй таблицы (ни ASCII с |---, ни markdown). Используй нумерованный список.\n"
+    "• НЕ используй LaTeX ($, \\frac, \\sqrt). Формулы ТОЛЬКО текстом: x^2, sqrt(x), a/b.\n"
+    "• Каждый ответ УНИКАЛЕН — варьируй стиль, вступления и примеры. Не повторяй шаблоны."
+)
+
+_CONTEXT_HEADER = "\n\nМатериалы пользователя (используй для ответа):\n"
+_SUMMARY_HEADER = "\n\nО чём уже говорили с учеником (конспект, последние реплики — ниже):\n"
+
+
+@lru_cache(maxsize=256)
+def base_system(mode: str = '', el: str = '', sl: str = '') -> tuple:
+    """(текст, токены) системного промпта без материалов. mode='' — обычный чат"""
+    if mode:
+        template = _EXAM_TEMPLATES.get(mode, _EXAM_TEMPLATES['exam'])
+        text = template.format(sl=sl, el=el, EL=el.upper(), md=_MD_FMT) + _RULES
+    else:
+        text = _CHAT_PROMPT + _RULES
+    return text, estimate_tokens(text)
+
+
+def parse_exam_meta(exam_meta) -> tuple:
+    """'тип|предмет_id|предмет|режим' → (режим, ЕГЭ/ОГЭ, предмет); без exam_meta — ('', '', '')"""
+    if not exam_meta:
+        return '', '', ''
+    parts = exam_meta.split('|')
+    et = parts[0] if len(parts) > 0 else ''
+    sl = parts[2] if len(parts) > 2 else ''
+    mode = parts[3] if len(parts) > 3 else 'explain'
+    if mode not in _EXAM_TEMPLATES:
+        mode = 'exam'
+    return mode, 'ЕГЭ' if et == 'ege' else 'ОГЭ', sl
+
+
+def _piece_cost(m) -> int:
+    group = m.lastindex
+    if group == 1:
+        return 1 + (m.end() - m.start()) // 4
+    if group == 2:
+        return 1 + (m.end() - m.start()) // 7
+    if group == 3:
+        return (m.end() - m.start() + 2) // 3
+    return 1
+
+
+def _cut(text: str, max_tokens: int, from_end: bool = False) -> str:
+    """Начало (или конец) text не длиннее max_tokens по оценке, по границе слова"""
+    pieces = _TOKEN_PIECE.finditer(text)
+    if from_end:
+        pieces = reversed(list(pieces))
+    used, pos = 0, None
+    for m in pieces:
+        used += _piece_cost(m)
+        if used > max_tokens:
+            break
+        pos = m.start() if from_end else m.end()
+    else:
+        return text
+    if pos is None:
+        return ''
+    return text[pos:] if from_end else text[:pos]
+
+
+def _shorten(text: str, max_tokens: int) -> tuple:
+    """Сообщение истории в max_tokens: начало и конец (в конце обычно вопрос или
+    задание). Возвращает (текст, токены)"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text, tokens
+    head_tokens = max_tokens // 3
+    head = _cut(text, head_tokens)
+    tail = _cut(text, max_tokens - head_tokens - 1, from_end=True)
+    return f"{head} … {tail}", max_tokens
+
+
+def pack_context(context: str, max_tokens: int) -> tuple:
+    """Начало контекста в max_tokens: абзацы целиком, последний — до конца
+    предложения. Возвращает (текст, токены)"""
+    kept, used = [], 0
+    if max_tokens <= 0:
+        return '', 0
+    for block in context.split('\n\n'):
+        cost = estimate_tokens(block) + 2
+        if used + cost <= max_tokens:
+            kept.append(block)
+            used += cost
+            continue
+        room = max_tokens - used - 2
+        if room >= MIN_PIECE_TOKENS and not block.startswith('## '):
+            piece = _cut(block, room)
+            ends = [m.end() for m in _SENTENCE_END.finditer(piece)]
+            if ends and ends[-1] > len(piece) // 2:
+                piece = piece[:ends[-1]]
+            piece = piece.rstrip()
+            kept.append(piece)
+            used += estimate_tokens(piece) + 2
+        break
+    # Заголовок материала без текста после него не нужен
+    while kept and kept[-1].startswith('## '):
+        used -= estimate_tokens(kept.pop()) + 2
+    return '\n\n'.join(kept), max(0, used)
+
+
+def _pack_history(history, max_tokens: int) -> tuple:
+    """Последние сообщения истории в max_tokens: ([сообщения по порядку], токены)"""
+    picked, used = [], 0
+    last_assistant = True
+    for h in reversed((history or [])[-HISTORY_MAX_MESSAGES:]):
+        role = h.get('role', 'user') if isinstance(h, dict) else None
+        content = h.get('content', '') if isinstance(h, dict) else ''
+        if role not in ('user', 'assistant') or not content or not isinstance(content, str):
+            continue
+        cap = HISTORY_MSG_TOKENS
+        if role == 'assistant' and last_assistant:
+            cap, last_assistant = HISTORY_LAST_TOKENS, False
+        room = max_tokens - used - MESSAGE_OVERHEAD
+        if room < MIN_PIECE_TOKENS // 2:
+            break
+        content, tokens = _shorten(content, min(cap, room))
+        picked.append({"role": role, "content": content})
+        used += tokens + MESSAGE_OVERHEAD
+    picked.reverse()
+    return picked, used
+
+
+_CONTEXT_HEADER_TOKENS = estimate_tokens(_CONTEXT_HEADER)
+
+
+def summary_block(summary: str) -> tuple:
+    """Конспект сессии (session_memory) для конца системного промпта: (текст, токены)"""
+    if not summary:
+        return '', 0
+    summary = _cut(summary.strip(), SUMMARY_TOKEN_BUDGET)
+    text = _SUMMARY_HEADER + summary
+    return text, estimate_tokens(text)
+
+
+def build(question: str, context: str = '', exam_meta=None, history=None, budget: int = None,
+          summary: str = '') -> Prompt:
+    """Промпт ask_ai: системный + конспект сессии + материалы, история, вопрос — в пределах бюджета"""
+    budget = budget or PROMPT_TOKEN_BUDGET
+    system, system_tokens = base_system(*parse_exam_meta(exam_meta))
+    summary_text, summary_tokens = summary_block(summary)
+    system += summary_text
+    system_tokens += summary_tokens
+    user_content = question[:QUESTION_MAX_CHARS]
+    used = system_tokens + estimate_tokens(user_content) + 2 * MESSAGE_OVERHEAD
+
+    # Конспект заменяет раннюю историю, поэтому вместе с ней укладывается в HISTORY_TOKEN_BUDGET
+    history_room = max(HISTORY_LAST_TOKENS, HISTORY_TOKEN_BUDGET - summary_tokens)
+    history_msgs, history_tokens = _pack_history(history, min(history_room, max(0, budget - used)))
+    used += history_tokens
+
+    ctx_tokens = 0
+    if context and len(context) > 50:
+        room = min(CONTEXT_TOKEN_BUDGET, budget - used - _CONTEXT_HEADER_TOKENS)
+        packed, ctx_tokens = pack_context(context, room)
+        if packed:
+            system += _CONTEXT_HEADER + packed
+            ctx_tokens += _CONTEXT_HEADER_TOKENS
+            used += ctx_tokens
+        if len(packed) < len(context):
+            print(f"[PROMPT] context trimmed {len(context)}→{len(packed)} chars to fit ~{room} tok", flush=True)
+
+    messages = [{"role": "system", "content": system}] + history_msgs + [{"role": "user", "content": user_content}]
+    print(f"[PROMPT] ~{used} tok: system {system_tokens} (summary {summary_tokens}), ctx {ctx_tokens}, "
+          f"history {history_tokens} ({len(history_msgs)} msg)", flush=True)
+    return Prompt(system, messages, used)
@@ -0,0 +1,177 @@
+"""Поиск почти-дубликатов вопросов в ai_question_cache.
+
+Вопрос нормализуется (регистр, ё, пунктуация, пробелы; знаки действий
+остаются), режется на символьные 3-граммы, по ним строится MinHash-подпись из MINHASH_PERMUTATIONS чисел. Доля
+совпавших позиций двух подписей — оценка коэффициента Жаккара их n-грамм.
+Подпись разбита на MINHASH_BANDS полос, хэши полос лежат в minhash_bands (GIN):
+кандидатов выбираем по пересечению полос, точный счёт — в NumPy.
+
+Похожесть по n-граммам не различает «2+3» и «2*3», поэтому ответ отдаётся
+только вопросу с той же формулой — той же последовательностью чисел и знаков
+действий (formula). Подписи строк, записанных до того, как знаки стали
+попадать в n-граммы, у вопросов с формулами просто не совпадут — это промах,
+а не чужой ответ.
+
+Не различает она и вопросы, отличающиеся одним словом: «столица Австрии» и
+«…Австралии», «производная lg x» и «ln x». Поэтому сравниваются ещё и основы
+значимых слов (content_words): без служебных слов и окончаний наборы должны
+совпасть. Разницу прощаем только опечатке — одна правка в основе от 6 букв.
+"""
+
+import hashlib
+import os
+import re
+import zlib
+
+import numpy as np
+
+# Минимальная оценка Жаккара, при которой отдаём чужой кэшированный ответ
+AI_CACHE_SIMILARITY = float(os.environ.get('AI_CACHE_SIMILARITY', '0.9'))
+
+SHINGLE = 3
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+_ROWS_PER_BAND = MINHASH_PERMUTATIONS // MINHASH_BANDS
+
+
+def _coefficients(n: int) -> np.ndarray:
+    # Коэффициенты фиксированы навсегда: от них зависят подписи, уже лежащие в БД
+    raw = b''
+    counter = 0
+    while len(raw) < n * 8:
+        raw += hashlib.sha512(f'minhash:{counter}'.encode()).digest()
+        counter += 1
+    return np.frombuffer(raw[:n * 8], dtype='<u8').astype(np.uint64)
+
+
+_COEF = _coefficients(MINHASH_PERMUTATIONS * 2)
+_A = (_COEF[:MINHASH_PERMUTATIONS] | np.uint64(1)).reshape(-1, 1)
+_B = _COEF[MINHASH_PERMUTATIONS:].reshape(-1, 1)
+
+_OPERATORS = '+\\-*/^=<>×÷·√%²³'
+_PUNCT_RE = re.compile(rf'[^\w\s{_OPERATORS}]')
+_SPACE_RE = re.compile(r'\s+')
+# Числа, знаки действий и степени; «:» — деление только между числами
+_FORMULA_RE = re.compile(r'\d+(?:[.,]\d+)?|(?<=\d)\s*:\s*(?=\d)|[+\-*/^=<>×÷·√%²³]')
+_WORD_HYPHEN_RE = re.compile(r'(?<=[а-яё])-(?=[а-яё])')
+_WORD_RE = re.compile(r'[a-zа-я]+')
+# Служебные слова и обращения, от которых смысл вопроса не зависит
+_STOP_WORDS = frozenset('''
+    а в во и или к ко на над о об от по под при про с со у из за до для без же ли бы не ни то это
+    что как какой какая какое какие каков чем чему чего где когда почему зачем сколько ли
+    мне меня мы нам ты тебе вы вам он она оно они его ее их мой моя мое твой свой этот эта эти
+    такое такой такая такие есть был была было быть будет пожалуйста плиз
+    объясни объяснить расскажи рассказать помоги помогите подскажи подскажите скажи напиши
+    хочу надо нужно можно очень просто коротко подробно кратко
+'''.split())
+# Окончания, длинные раньше коротких; основа не короче _MIN_STEM букв
+_ENDINGS = tuple(sorted(set('''
+    иями ями ами ией иях ах ях ого его ому ыми ими ией ием ой ей ий ый ая яя ое ее ые ие ую юю
+    ом ем ам ям ов ев ия ья ие ье ии ьи ию ью ть ти ешь ет ем ете ут ют ит ят ишь им ите ал ала
+    ало али ся сь а я о е ы и у ю ь
+'''.split()), key=lambda e: (-len(e), e)))
+_MIN_STEM = 3
+_TYPO_MIN_LEN = 6
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, ё→е, без пунктуации (кроме знаков действий), одиночные пробелы"""
+    t = (text or '').lower().replace('ё', 'е')
+    t = _PUNCT_RE.sub(' ', t)
+    return _SPACE_RE.sub(' ', t).strip()
+
+
+def formula(text: str) -> list:
+    """Числа и знаки действий вопроса по порядку: «2+3» и «2*3», «x^2-5x+6» и «x^2+5x+6»
+    похожи по n-граммам, но это разные задачи"""
+    t = _WORD_HYPHEN_RE.sub(' ', (text or '').lower()).replace(',', '.')
+    return [m.strip() or ':' for m in _FORMULA_RE.findall(t)]
+
+
+def _stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def content_words(text: str) -> set:
+    """Основы значимых слов: «функции lg x» → {функц, lg, x}"""
+    return {_stem(w) for w in _WORD_RE.findall(normalize(text)) if w not in _STOP_WORDS}
+
+
+def _one_edit(a: str, b: str) -> bool:
+    """Строки отличаются не больше чем одной заменой, вставкой или удалением"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i + (len(a) == len(b)):] == b[i + 1:]
+
+
+def same_words(a: set, b: set) -> bool:
+    """Одинаковые наборы основ; различие допустимо только как опечатка в длинном слове"""
+    only_a, only_b = a - b, b - a
+    if len(only_a) != len(only_b):
+        return False
+    for word in only_a:
+        pair = next((w for w in only_b if min(len(w), len(word)) >= _TYPO_MIN_LEN and _one_edit(w, word)), None)
+        if pair is None:
+            return False
+        only_b.discard(pair)
+    return True
+
+
+def materials_key(material_ids) -> str:
+    """Ключ набора материалов: почти-дубликаты ищем только среди ответов по тем же материалам"""
+    return hashlib.md5(','.join(str(i) for i in sorted(material_ids or [])).encode()).hexdigest()
+
+
+def signature(norm: str) -> np.ndarray:
+    """MinHash-подпись нормализованного текста (uint32[MINHASH_PERMUTATIONS])"""
+    padded = f' {norm} '
+    shingles = {padded[i:i + SHINGLE] for i in range(max(1, len(padded) - SHINGLE + 1))}
+    x = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # multiply-shift хэширование; переполнение uint64 здесь ожидаемо
+    with np.errstate(over='ignore'):
+        h = (_A * x + _B) >> np.uint64(32)
+    return h.min(axis=1).astype(np.uint32)
+
+
+def bands(sig: np.ndarray) -> list:
+    """Хэши полос подписи (int4) для индекса minhash_bands"""
+    rows = sig.reshape(MINHASH_BANDS, _ROWS_PER_BAND)
+    return [zlib.crc32(bytes([b]) + row.tobytes()) - 2**31 for b, row in enumerate(rows)]
+
+
+def to_bytes(sig: np.ndarray) -> bytes:
+    return sig.astype('<u4').tobytes()
+
+
+def from_bytes(raw) -> np.ndarray:
+    return np.frombuffer(bytes(raw), dtype='<u4')
+
+
+def scores(sig: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """Оценка Жаккара подписи с каждой строкой матрицы кандидатов"""
+    return (candidates == sig).mean(axis=1)
+
+
+def best_match(question: str, sig: np.ndarray, rows: list, threshold: float = None):
+    """rows: [(question_text, minhash_bytes, payload)]. Лучший кандидат не ниже порога
+    с той же формулой и теми же значимыми словами — (payload, score) или None"""
+    if not rows:
+        return None
+    threshold = AI_CACHE_SIMILARITY if threshold is None else threshold
+    matrix = np.vstack([from_bytes(r[1]) for r in rows])
+    s = scores(sig, matrix)
+    wanted, words = formula(question), content_words(question)
+    for i in np.argsort(-s, kind='stable'):
+        if s[i] < threshold:
+            break
+        if formula(rows[i][0]) == wanted and same_words(content_words(rows[i][0]), words):
+            return rows[i][2], float(s[i])
+    return None
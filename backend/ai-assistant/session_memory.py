@@ -0,0 +1,156 @@
+"""Память диалога на сервере: краткий конспект сессии + последняя реплика.
+
+Вместо истории, которую клиент присылает в каждом запросе, модель получает
+chat_sessions.summary (конспект всего разговора, до SUMMARY_MAX_CHARS) и
+последний обмен репликами из chat_messages. Конспект обновляется в фоне после
+каждого ответа: дешёвая модель сворачивает новый обмен в старый конспект.
+Обмены, пришедшие, пока идёт обновление сессии, сворачиваются следующим вызовом одной пачкой.
+Конспект покрывает и последний обмен — он же уходит в промпт целиком, так что
+опоздавшее обновление не создаёт дыры в памяти.
+
+Запись защищена версией (summary_turns): два параллельных обновления одной
+сессии не затирают друг друга — проигравшее перечитывает конспект и повторяет.
+Обновление — best effort: при остановке контейнера очередь не досбрасывается.
+"""
+
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import db_pool
+import llm_gateway
+
+SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+SESSION_SUMMARY_MODEL = os.environ.get('SESSION_SUMMARY_MODEL', 'gpt-4o-mini')
+SUMMARY_MAX_CHARS = 1200
+# Сколько текста одной реплики уходит в сворачивание
+EXCHANGE_CHARS = 1500
+UPDATE_ATTEMPTS = 3
+
+Memory = namedtuple('Memory', 'session_id summary turns')
+
+SUMMARY_PROMPT = (
+    "Ты ведёшь краткий конспект диалога ученика с ИИ-репетитором. Обнови конспект с учётом новых реплик.\n"
+    "Сохрани: предмет и тему, что ученик уже понял и где ошибался, последнее выданное задание и его "
+    "правильный ответ, договорённости (уровень, формат ответов, экзамен).\n"
+    "Пиши по-русски, сжато, без вступлений и оценок. Не больше 120 слов."
+)
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='summary')
+_pending = {}  # session_id -> [(вопрос, ответ)], ещё не свёрнутые
+_active = set()  # сессии, по которым уже работает _update
+_lock = threading.Lock()
+
+
+def load(conn, session_id, user_id):
+    """Memory сессии пользователя или None, если сессии нет или она чужая"""
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT s.summary, m.role, m.content
+            FROM {SCHEMA_NAME}.chat_sessions s
+            LEFT JOIN LATERAL (
+                SELECT role, content, created_at, id FROM {SCHEMA_NAME}.chat_messages
+                WHERE session_id = s.id ORDER BY created_at DESC, id DESC LIMIT 2
+            ) m ON TRUE
+            WHERE s.id = %s AND s.user_id = %s
+            ORDER BY m.created_at, m.id
+        """, (session_id, user_id))
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    if not rows:
+        return None
+    turns = [{'role': role, 'content': content} for _, role, content in rows if role and content]
+    return Memory(session_id, rows[0][0] or '', turns)
+
+
+def remember(session_id, question: str, answer: str):
+    """Ставит обмен в очередь на сворачивание в конспект (не блокирует ответ)"""
+    if not session_id or not question or not answer:
+        return
+    with _lock:
+        _pending.setdefault(session_id, []).append((question, answer))
+        if session_id in _active:
+            return
+        _active.add(session_id)
+    _executor.submit(_update, session_id)
+
+
+def _exchanges_text(exchanges) -> str:
+    return '\n\n'.join(f"Ученик: {q[:EXCHANGE_CHARS]}\nРепетитор: {a[:EXCHANGE_CHARS]}" for q, a in exchanges)
+
+
+def summarize(summary: str, exchanges) -> str:
+    """Новый конспект: старый + обмены [(вопрос, ответ)]"""
+    res = llm_gateway.chat([
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": f"Конспект:\n{summary or '(пусто)'}\n\nНовые реплики:\n{_exchanges_text(exchanges)}"},
+    ], route='summary', model=SESSION_SUMMARY_MODEL, temperature=0.2, max_tokens=300, timeout=30.0, hedge=False)
+    return res.content.strip()[:SUMMARY_MAX_CHARS]
+
+
+def _read_summary(session_id):
+    """(конспект, версия) или None, если сессия удалена"""
+    conn = db_pool.get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT summary, summary_turns FROM {SCHEMA_NAME}.chat_sessions WHERE id = %s", (session_id,))
+        row = cur.fetchone()
+        cur.close()
+        return (row[0] or '', row[1] or 0) if row else None
+    finally:
+        conn.close()
+
+
+def _write_summary(session_id, summary: str, turns: int, version: int) -> bool:
+    """False — конспект успели обновить параллельно (версия сменилась)"""
+    conn = db_pool.get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"""
+            UPDATE {SCHEMA_NAME}.chat_sessions
+            SET summary = %s, summary_turns = summary_turns + %s, summary_updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND summary_turns = %s
+        """, (summary, turns, session_id, version))
+        updated = cur.rowcount > 0
+        conn.commit()
+        cur.close()
+        return updated
+    finally:
+        conn.close()
+
+
+def _update(session_id):
+    """Одна сессия — один поток: обмены, пришедшие за время вызова модели, сворачиваются следующим проходом"""
+    while True:
+        with _lock:
+            exchanges = _pending.pop(session_id, [])
+            if not exchanges:
+                _active.discard(session_id)
+                return
+        _fold(session_id, exchanges)
+
+
+def _fold(session_id, exchanges):
+    try:
+        # Соединение не держим, пока отвечает модель
+        for attempt in range(UPDATE_ATTEMPTS):
+            current = _read_summary(session_id)
+            if current is None:
+                return
+            summary, version = current
+            new_summary = summarize(summary, exchanges)
+            if not new_summary:
+                return
+            if _write_summary(session_id, new_summary, len(exchanges), version):
+                print(f"[MEMORY] session {session_id}: +{len(exchanges)} turns, "
+                      f"summary {len(summary)}→{len(new_summary)} chars", flush=True)
+                return
+            print(f"[MEMORY] session {session_id}: concurrent update, retry {attempt + 1}", flush=True)
+    except llm_gateway.LLMUnavailable:
+        print(f"[MEMORY] session {session_id}: summary model unavailable", flush=True)
+    except Exception as e:
+        print(f"[MEMORY] session {session_id} err: {type(e).__name__}: {e}", flush=True)
@@ -0,0 +1,135 @@
+"""Один вызов модели на одинаковые вопросы, заданные одновременно (singleflight).
+
+Когда вопрос из домашки расходится по классу, десятки учеников присылают его
+за секунды. ai_question_cache заполняется только после ответа, поэтому каждый
+промахивается мимо кэша и запускает свой запрос к модели. Здесь первый запрос
+с данным ключом (тем же хэшем, что у кэша ответов) становится ведущим, а
+остальные ждут его ответа и получают его как попадание в кэш.
+
+Ведущий публикует ответ уже после записи в кэш: запрос, пришедший после
+resolve(), находит ответ в ANSWER_CACHE, и окна между рейсом и кэшем нет.
+Неудачный ответ не раздаётся: ведомые, не дождавшиеся ответа, спрашивают
+модель сами. Рейс старше wait_seconds считается зависшим и заменяется новым.
+
+Межконтейнерный вариант (AI_SINGLEFLIGHT_PG=1): ведущий дополнительно берёт
+транзакционный advisory lock Postgres по ключу и держит его до resolve().
+Ведущий из другого контейнера ждёт этот lock (не дольше wait_seconds) и
+перечитывает кэш — ответ туда уже записан. Стоит одного соединения из пула на
+ведущего на время ответа модели, поэтому по умолчанию выключен.
+"""
+
+import os
+import threading
+import time
+
+import db_pool
+
+AI_SINGLEFLIGHT_WAIT_SECONDS = float(os.environ.get('AI_SINGLEFLIGHT_WAIT_SECONDS', '45'))
+AI_SINGLEFLIGHT_PG = os.environ.get('AI_SINGLEFLIGHT_PG', '0') == '1'
+# Первый ключ двухаргументного advisory lock — пространство имён этих блокировок
+ADVISORY_LOCK_NAMESPACE = 2501
+
+
+class Flight:
+    """Один запрос к модели, на ответ которого подписаны ведомые"""
+
+    __slots__ = ('key', 'started', 'followers', 'value', '_done', '_lock_conn')
+
+    def __init__(self, key: str):
+        self.key = key
+        self.started = time.monotonic()
+        self.followers = 0
+        self.value = None
+        self._done = threading.Event()
+        self._lock_conn = None
+
+
+class FlightGroup:
+    """Рейсы по ключу внутри контейнера и счётчики для логов"""
+
+    def __init__(self, wait_seconds: float = AI_SINGLEFLIGHT_WAIT_SECONDS, advisory_locks: bool = AI_SINGLEFLIGHT_PG):
+        self.wait_seconds = wait_seconds
+        self.advisory_locks = advisory_locks
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'followers': 0, 'shared': 0, 'remote_waits': 0}
+
+    def join(self, key: str):
+        """(рейс, ведущий ли). Ведущий обязан вызвать resolve() — и при ошибке тоже"""
+        now = time.monotonic()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and now - flight.started < self.wait_seconds:
+                flight.followers += 1
+                self.stats['followers'] += 1
+                return flight, False
+            flight = self._flights[key] = Flight(key)
+            self.stats['leaders'] += 1
+            return flight, True
+
+    def wait(self, flight: Flight):
+        """Ответ ведущего или None (модель не ответила или не дождались)"""
+        remaining = self.wait_seconds - (time.monotonic() - flight.started)
+        if not flight._done.wait(max(0.0, remaining)):
+            print(f"[FLIGHT] {flight.key[:8]}: leader timed out, asking model", flush=True)
+            return None
+        if flight.value is not None:
+            with self._lock:
+                self.stats['shared'] += 1
+        return flight.value
+
+    def resolve(self, flight: Flight, value=None):
+        """Публикует ответ ведущего (None — неудача) и снимает блокировку.
+        Повторный вызов ничего не делает"""
+        with self._lock:
+            if flight._done.is_set():
+                return
+            flight.value = value
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            lock_conn, flight._lock_conn = flight._lock_conn, None
+            flight._done.set()
+        if lock_conn is not None:
+            # Откат завершает транзакцию — advisory lock снимается вместе с ней
+            lock_conn.close()
+        if flight.followers:
+            print(f"[FLIGHT] {flight.key[:8]}: {flight.followers} waiting requests "
+                  f"{'served' if value is not None else 'released'}", flush=True)
+
+    def lock_remote(self, flight: Flight) -> bool:
+        """Межконтейнерный рейс для ведущего: ждёт, пока ведущий другого
+        контейнера с тем же ключом закончит, и держит блокировку до resolve().
+
+        True — другой контейнер мог уже записать ответ, кэш стоит перечитать.
+        """
+        if not self.advisory_locks:
+            return False
+        conn = db_pool.get_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", (ADVISORY_LOCK_NAMESPACE, _lock_id(flight.key)))
+            if not cur.fetchone()[0]:
+                with self._lock:
+                    self.stats['remote_waits'] += 1
+                cur.execute("SET LOCAL lock_timeout = %s", (f"{int(self.wait_seconds * 1000)}ms",))
+                cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (ADVISORY_LOCK_NAMESPACE, _lock_id(flight.key)))
+            cur.close()
+        except Exception as e:
+            # Не дождались или БД недоступна — отвечаем сами, без блокировки
+            print(f"[FLIGHT] {flight.key[:8]}: advisory lock: {type(e).__name__}", flush=True)
+            conn.close()
+            return True
+        with self._lock:
+            if flight._done.is_set():
+                conn.close()
+            else:
+                flight._lock_conn = conn
+        return True
+
+    def __len__(self):
+        return len(self._flights)
+
+
+def _lock_id(key: str) -> int:
+    """32 бита хэша кэша как int4 для второго ключа advisory lock"""
+    return int(key[:8], 16) - (1 << 31)
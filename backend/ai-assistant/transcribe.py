@@ -0,0 +1,205 @@
+"""Распознавание голосовых сообщений через Whisper: длинные записи по частям.
+
+Запись декодируется в PCM (WAV — модулем wave, остальное — ffmpeg из
+imageio-ffmpeg) и режется на сегменты не длиннее AUDIO_SEGMENT_SECONDS: точка
+разреза — самое тихое место в последней трети окна, чтобы не рвать слово.
+Сегменты уходят в Whisper параллельно, текст склеивается по порядку. Короткие
+записи и файлы, которые не удалось декодировать, отправляются целиком, как
+раньше. Готовые расшифровки кэшируются в audio_transcripts по sha256 файла —
+повторная отправка той же записи не тратит Whisper.
+
+Сегмент, который Whisper не распознал и со второй попытки, заменяется в тексте
+меткой GAP_MARK, а Transcript.failed сообщает вызывающему, сколько таких
+сегментов. Неполная расшифровка не кэшируется: повтор той же записи снова
+пойдёт в Whisper.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import wave
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+
+SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+WHISPER_URL = os.environ.get('WHISPER_URL', 'https://api.aitunnel.ru/v1/audio/transcriptions')
+WHISPER_TIMEOUT = float(os.environ.get('WHISPER_TIMEOUT', '30'))
+AUDIO_SEGMENT_SECONDS = float(os.environ.get('AUDIO_SEGMENT_SECONDS', '30'))
+AUDIO_WHISPER_PARALLEL = int(os.environ.get('AUDIO_WHISPER_PARALLEL', '6'))
+AUDIO_TRANSCRIPT_TTL_DAYS = int(os.environ.get('AUDIO_TRANSCRIPT_TTL_DAYS', '30'))
+DECODE_RATE = 16000
+FRAME_MS = 20
+# Разрез ищем в последней трети окна по энергии, сглаженной на ~300 мс
+SEARCH_FROM = 2 / 3
+SMOOTH_FRAMES = 15
+EVICT_BATCH = 200
+GAP_MARK = '[неразборчиво]'
+
+# failed — сколько из segments сегментов не распознано (в text на их месте GAP_MARK)
+Transcript = namedtuple('Transcript', 'text segments failed')
+
+_http = httpx.Client(timeout=httpx.Timeout(WHISPER_TIMEOUT, connect=5.0),
+                     limits=httpx.Limits(max_connections=AUDIO_WHISPER_PARALLEL * 2))
+_executor = ThreadPoolExecutor(max_workers=AUDIO_WHISPER_PARALLEL, thread_name_prefix='whisper')
+
+_CONTENT_TYPES = {'webm': 'audio/webm', 'wav': 'audio/wav', 'mp3': 'audio/mpeg', 'm4a': 'audio/mp4', 'ogg': 'audio/ogg'}
+
+
+def _ffmpeg():
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which('ffmpeg')
+
+
+def decode(audio: bytes, ext: str):
+    """(int16 моно, частота) или None, если декодировать нечем"""
+    if ext == 'wav':
+        try:
+            with wave.open(io.BytesIO(audio)) as w:
+                if w.getsampwidth() == 2:
+                    samples = np.frombuffer(w.readframes(w.getnframes()), dtype='<i2')
+                    channels = w.getnchannels()
+                    if channels > 1:
+                        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+                    return samples.astype(np.int16), w.getframerate()
+        except Exception:
+            pass
+    exe = _ffmpeg()
+    if not exe:
+        return None
+    # Через файл, а не pipe: у m4a индекс бывает в конце, ffmpeg нужен seek
+    try:
+        with tempfile.NamedTemporaryFile(suffix=f'.{ext}') as f:
+            f.write(audio)
+            f.flush()
+            proc = subprocess.run([exe, '-v', 'error', '-i', f.name, '-f', 's16le', '-ac', '1',
+                                   '-ar', str(DECODE_RATE), 'pipe:1'], capture_output=True, timeout=60)
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"[WHISPER] decode failed: {type(e).__name__}: {e}", flush=True)
+        return None
+    if proc.returncode != 0 or not proc.stdout:
+        print(f"[WHISPER] decode failed: {proc.stderr[:200]!r}", flush=True)
+        return None
+    return np.frombuffer(proc.stdout, dtype='<i2'), DECODE_RATE
+
+
+def split_points(samples: np.ndarray, rate: int, max_seconds: float = None) -> list:
+    """Границы сегментов [(start, end)] в отсчётах; каждый не длиннее max_seconds"""
+    max_len = int(rate * (max_seconds or AUDIO_SEGMENT_SECONDS))
+    total = len(samples)
+    if total <= max_len:
+        return [(0, total)]
+    frame = max(1, rate * FRAME_MS // 1000)
+    n_frames = total // frame
+    energy = np.sqrt((samples[:n_frames * frame].astype(np.float32).reshape(n_frames, frame) ** 2).mean(axis=1))
+    energy = np.convolve(energy, np.ones(SMOOTH_FRAMES) / SMOOTH_FRAMES, mode='same')
+    bounds, start = [], 0
+    while total - start > max_len:
+        lo = (start + int(max_len * SEARCH_FROM)) // frame
+        hi = (start + max_len) // frame
+        cut = (lo + int(np.argmin(energy[lo:hi]))) * frame if hi > lo else start + max_len
+        bounds.append((start, cut))
+        start = cut
+    bounds.append((start, total))
+    return bounds
+
+
+def _wav(samples: np.ndarray, rate: int) -> bytes:
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.astype('<i2').tobytes())
+    return out.getvalue()
+
+
+def whisper(audio: bytes, ext: str) -> str:
+    """Один запрос к Whisper; RuntimeError при не-200"""
+    r = _http.post(WHISPER_URL,
+                   data={'model': 'whisper-1', 'language': 'ru'},
+                   files={'file': (f'audio.{ext}', audio, _CONTENT_TYPES.get(ext, f'audio/{ext}'))},
+                   headers={'Authorization': f"Bearer {os.environ.get('OPENROUTER_API_KEY', '')}"})
+    if r.status_code != 200:
+        raise RuntimeError(f'HTTP {r.status_code}: {r.text[:300]}')
+    return (r.json().get('text') or '').strip()
+
+
+def _segment_text(samples: np.ndarray, rate: int, index: int):
+    """Текст сегмента или None, если Whisper не ответил и со второй попытки"""
+    data = _wav(samples, rate)
+    for attempt in (1, 2):
+        try:
+            return whisper(data, 'wav')
+        except Exception as e:
+            print(f"[WHISPER] segment {index} attempt {attempt}: {type(e).__name__}: {str(e)[:150]}", flush=True)
+    return None
+
+
+def transcribe_audio(audio: bytes, ext: str) -> Transcript:
+    """Текст записи без кэша: целиком, если короткая, иначе сегментами параллельно"""
+    started = time.monotonic()
+    decoded = decode(audio, ext)
+    if decoded is None or len(decoded[0]) <= decoded[1] * AUDIO_SEGMENT_SECONDS:
+        text = whisper(audio, ext)
+        print(f"[WHISPER] whole {len(audio) // 1024}KB {time.monotonic() - started:.1f}s", flush=True)
+        return Transcript(text, 1, 0)
+    samples, rate = decoded
+    bounds = split_points(samples, rate)
+    parts = list(_executor.map(lambda ib: _segment_text(samples[ib[1][0]:ib[1][1]], rate, ib[0]), enumerate(bounds)))
+    failed = sum(1 for p in parts if p is None)
+    print(f"[WHISPER] {len(samples) / rate:.0f}s audio in {len(bounds)} segments, "
+          f"{len(bounds) - failed} ok, {time.monotonic() - started:.1f}s", flush=True)
+    if failed == len(parts):
+        return Transcript('', len(parts), failed)
+    return Transcript(' '.join(GAP_MARK if p is None else p for p in parts if p != ''), len(parts), failed)
+
+
+def transcribe(conn, audio: bytes, ext: str) -> Transcript:
+    """Расшифровка с кэшем в audio_transcripts (conn может быть None — без кэша)"""
+    content_hash = hashlib.sha256(audio).hexdigest()
+    if conn is not None:
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SELECT transcript FROM {SCHEMA_NAME}.audio_transcripts WHERE content_hash = %s",
+                        (content_hash,))
+            row = cur.fetchone()
+            if row:
+                print(f"[WHISPER] cache hit {content_hash[:12]}", flush=True)
+                return Transcript(row[0] if not isinstance(row, dict) else row['transcript'], 1, 0)
+        except Exception as e:
+            conn.rollback()
+            print(f"[WHISPER] cache lookup err: {e}", flush=True)
+        finally:
+            cur.close()
+    result = transcribe_audio(audio, ext)
+    if conn is not None and result.text and not result.failed:
+        cur = conn.cursor()
+        try:
+            cur.execute(f"""
+                INSERT INTO {SCHEMA_NAME}.audio_transcripts (content_hash, transcript, audio_bytes)
+                VALUES (%s, %s, %s) ON CONFLICT (content_hash) DO NOTHING
+            """, (content_hash, result.text, len(audio)))
+            cur.execute(f"""
+                DELETE FROM {SCHEMA_NAME}.audio_transcripts WHERE content_hash IN (
+                    SELECT content_hash FROM {SCHEMA_NAME}.audio_transcripts
+                    WHERE created_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+                    LIMIT {EVICT_BATCH})
+            """, (AUDIO_TRANSCRIPT_TTL_DAYS,))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"[WHISPER] cache store err: {e}", flush=True)
+        finally:
+            cur.close()
+    return result
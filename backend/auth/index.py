@@ -7,9 +7,9 @@ import jwt
 import threading
 import urllib.request
 from datetime import datetime, timedelta
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from rate_limiter import check_rate_limit, check_failed_login, record_failed_login, reset_failed_login, get_client_ip
+import db_pool
 
 
 def _send_welcome_email(email: str, name: str):
@@ -79,10 +79,7 @@ def _send_welcome_email(email: str, name: str):
 
 def get_db_connection():
     """Создаёт подключение к PostgreSQL базе данных"""
-    dsn = os.environ['DATABASE_URL']
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
-    return conn
+    return db_pool.get_connection()
 
 
 def generate_token(user_id: int, email: str) -> str:
@@ -3,8 +3,8 @@
 import json
 import os
 from datetime import datetime
-import psycopg2
 from psycopg2.extras import RealDictCursor
+import db_pool
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
@@ -90,7 +90,7 @@ def handler(event: dict, context) -> dict:
     qs = event.get('queryStringParameters', {}) or {}
     action = qs.get('action', 'status')
 
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = db_pool.get_connection()
     try:
         if action == 'run':
             results = process_renewals(conn)
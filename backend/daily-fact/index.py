@@ -2,16 +2,14 @@
 import json
 import os
 import jwt
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import date
-import httpx
+import db_pool
+import llm_gateway
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 JWT_SECRET = os.environ.get('JWT_SECRET', 'secret')
-OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY', '')
-API_URL = 'https://api.aitunnel.ru/v1/chat/completions'
 MODEL = 'llama-4-maverick'
 
 CORS = {
@@ -93,27 +91,21 @@ def generate_fact(subject_key, recent_facts=None):
 Emoji — один символ, отражающий суть факта."""
 
     try:
-        http = httpx.Client(timeout=httpx.Timeout(15.0, connect=5.0))
-        resp = http.post(
-            API_URL,
-            json={
-                'model': MODEL,
-                'messages': [
-                    {'role': 'system', 'content': 'Ты генератор коротких познавательных фактов. Твои факты простые, правдивые и вызывают удивление — «вроде очевидно, а я не знал». Никакой экзотики и выдумок. Отвечай строго JSON.'},
-                    {'role': 'user', 'content': prompt},
-                ],
-                'temperature': 0.9,
-                'max_tokens': 200,
-            },
-            headers={'Authorization': f'Bearer {OPENROUTER_API_KEY}', 'Content-Type': 'application/json'},
+        resp = llm_gateway.chat(
+            [
+                {'role': 'system', 'content': 'Ты генератор коротких познавательных фактов. Твои факты простые, правдивые и вызывают удивление — «вроде очевидно, а я не знал». Никакой экзотики и выдумок. Отвечай строго JSON.'},
+                {'role': 'user', 'content': prompt},
+            ],
+            route='daily_fact',
+            model=MODEL,
+            temperature=0.9,
+            max_tokens=200,
+            timeout=15.0,
         )
-        http.close()
-
-        if resp.status_code == 200:
-            raw = resp.json()['choices'][0]['message']['content'].strip()
-            raw = raw.replace('```json', '').replace('```', '').strip()
-            data = json.loads(raw)
-            return data.get('text', '')[:300], data.get('emoji', emoji)
+        raw = resp.content.strip()
+        raw = raw.replace('```json', '').replace('```', '').strip()
+        data = json.loads(raw)
+        return data.get('text', '')[:300], data.get('emoji', emoji)
     except Exception as e:
         print(f'[DailyFact] AI error: {e}')
 
@@ -176,7 +168,7 @@ def handler(event: dict, context) -> dict:
     if not user_id:
         return err(401, 'Unauthorized')
 
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = db_pool.get_connection()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute(f'SELECT exam_subject FROM {SCHEMA}.users WHERE id = %s', (user_id,))
@@ -18,9 +18,9 @@ Cron (GET ?cron=...):
 import os
 import json
 import urllib.request
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime, timedelta
+import db_pool
 
 RESEND_API_KEY = os.environ.get('RESEND_API_KEY', '')
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
@@ -63,7 +63,7 @@ def send_email(to: str, subject: str, html: str) -> bool:
 
 
 def get_conn():
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    return db_pool.get_connection(cursor_factory=RealDictCursor)
 
 
 def _base(content: str, preview: str = '') -> str:
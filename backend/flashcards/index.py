@@ -3,20 +3,15 @@
 import json
 import os
 import jwt
-import psycopg2
-import httpx
 from datetime import datetime, date, timedelta
-from openai import OpenAI
+import db_pool
+import llm_gateway
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key')
-OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY', '')
 LLAMA_MODEL = 'llama-4-maverick'
 
-_http = httpx.Client(timeout=httpx.Timeout(22.0, connect=3.0))
-ai_client = OpenAI(api_key=OPENROUTER_API_KEY, base_url='https://api.aitunnel.ru/v1/', timeout=22.0, http_client=_http)
-
 CORS_HEADERS = {
     'Content-Type': 'application/json',
     'Access-Control-Allow-Origin': '*',
@@ -64,7 +59,7 @@ def handler(event, context):
     params = event.get('queryStringParameters') or {}
     action = params.get('action', '')
 
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = db_pool.get_connection()
 
     try:
         if method == 'GET':
@@ -254,13 +249,15 @@ def handle_generate(conn, user_id, body):
 {combined_text}"""
 
     try:
-        response = ai_client.chat.completions.create(
+        response = llm_gateway.chat(
+            [{'role': 'user', 'content': prompt}],
+            route='flashcards',
             model=LLAMA_MODEL,
-            messages=[{'role': 'user', 'content': prompt}],
             max_tokens=1200,
-            temperature=0.6
+            temperature=0.6,
+            timeout=22.0,
         )
-        ai_text = response.choices[0].message.content.strip()
+        ai_text = response.content.strip()
     except Exception as e:
         cur.close()
         return err(500, {'error': f'Ошибка ИИ: {str(e)}'})
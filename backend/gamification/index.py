@@ -5,11 +5,12 @@ import os
 import math
 import random
 from datetime import datetime, date, timedelta
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import jwt
 from rate_limiter import check_rate_limit, get_client_ip
 from pywebpush import webpush, WebPushException
+import db_pool
+import entitlements
 
 VAPID_PRIVATE_KEY = os.environ.get('VAPID_PRIVATE_KEY', '')
 VAPID_PUBLIC_KEY = os.environ.get('VAPID_PUBLIC_KEY', '')
@@ -61,10 +62,7 @@ def get_league(xp_period):
 
 
 def get_db_connection():
-    dsn = os.environ['DATABASE_URL']
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
-    return conn
+    return db_pool.get_connection()
 
 
 def verify_token(token: str) -> dict:
@@ -106,19 +104,8 @@ def send_push(endpoint, p256dh, auth, notification_data):
 
 def check_user_premium(conn, user_id):
     """Проверяет, является ли пользователь Premium"""
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT subscription_type, subscription_expires_at
-        FROM users WHERE id = %s
-    """, (user_id,))
-    row = cur.fetchone()
-    cur.close()
-    if not row:
-        return False, None
-    if row['subscription_type'] == 'premium' and row['subscription_expires_at']:
-        if row['subscription_expires_at'] >= datetime.now():
-            return True, row['subscription_expires_at']
-    return False, row.get('subscription_expires_at')
+    ent = entitlements.load(conn, user_id)
+    return ent.is_premium, ent.row.get('subscription_expires_at')
 
 
 def generate_daily_quests(conn, user_id, is_premium):
@@ -6,8 +6,8 @@ from datetime import datetime, date
 from decimal import Decimal
 
 import jwt
-import psycopg2
 from psycopg2.extras import RealDictCursor
+import db_pool
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
@@ -76,8 +76,7 @@ def _extract_token(event: dict) -> str:
 
 def _get_conn():
     """Создаёт подключение к БД с нужной схемой"""
-    conn = psycopg2.connect(DATABASE_URL, options=f'-c search_path={SCHEMA}')
-    return conn
+    return db_pool.get_connection()
 
 
 def _check_premium(cur, user_id: int) -> bool:
@@ -5,7 +5,6 @@ import os
 import hashlib
 import boto3
 from datetime import datetime
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import jwt
 from openai import OpenAI
@@ -14,6 +13,10 @@ from PyPDF2 import PdfReader
 from docx import Document
 from rate_limiter import check_rate_limit, get_client_ip
 from security_validator import sanitize_filename, check_ownership
+import db_pool
+import entitlements
+import text_index
+from entitlements import FREE_DAILY_FILES
 
 MAX_FILE_SIZE = 50 * 1024 * 1024
 CHUNK_SIZE = 3500
@@ -21,9 +24,7 @@ CHUNK_OVERLAP = 500  # Overlap для сохранения контекста м
 
 
 def get_db_connection():
-    dsn = os.environ['DATABASE_URL']
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    return psycopg2.connect(dsn, options=f'-c search_path={schema}')
+    return db_pool.get_connection()
 
 
 def verify_token(token: str) -> dict:
@@ -34,67 +35,10 @@ def verify_token(token: str) -> dict:
         return None
 
 
-FREE_DAILY_FILES = 1
-PREMIUM_DAILY_FILES = 3
 
 
 def check_subscription_access(conn, user_id: int) -> dict:
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute(f'''
-        SELECT subscription_type, subscription_expires_at, trial_ends_at, is_trial_used,
-               files_uploaded_today, files_daily_reset_at
-        FROM {schema}.users 
-        WHERE id = %s
-    ''', (user_id,))
-    user = cursor.fetchone()
-
-    if not user:
-        cursor.close()
-        return {'has_access': False, 'reason': 'user_not_found'}
-
-    now = datetime.now()
-    from datetime import timedelta
-
-    is_premium = False
-    is_trial = False
-
-    if user.get('subscription_type') == 'premium':
-        if user.get('subscription_expires_at') and user['subscription_expires_at'].replace(tzinfo=None) > now:
-            is_premium = True
-
-    if not is_premium:
-        trial_ends = user.get('trial_ends_at')
-        is_trial_used = user.get('is_trial_used')
-        if trial_ends and not is_trial_used:
-            trial_ends_naive = trial_ends.replace(tzinfo=None) if trial_ends.tzinfo else trial_ends
-            if trial_ends_naive > now:
-                is_trial = True
-
-    # Дневной лимит файлов
-    daily_limit = PREMIUM_DAILY_FILES if (is_premium or is_trial) else FREE_DAILY_FILES
-
-    # Сбрасываем дневной счётчик если прошли сутки
-    files_today = user.get('files_uploaded_today') or 0
-    reset_at = user.get('files_daily_reset_at')
-    if reset_at:
-        reset_naive = reset_at.replace(tzinfo=None) if hasattr(reset_at, 'tzinfo') and reset_at.tzinfo else reset_at
-        if reset_naive < now:
-            cur2 = conn.cursor()
-            cur2.execute(f'UPDATE {schema}.users SET files_uploaded_today=0, files_daily_reset_at=%s WHERE id=%s',
-                         (now + timedelta(days=1), user_id))
-            conn.commit()
-            cur2.close()
-            files_today = 0
-
-    cursor.close()
-    return {
-        'has_access': True,
-        'is_premium': is_premium,
-        'is_trial': is_trial,
-        'files_today': files_today,
-        'daily_limit': daily_limit
-    }
+    return entitlements.load(conn, user_id).files()
 
 
 def get_s3_client():
@@ -262,27 +206,71 @@ def handle_get_shared(code: str, headers: dict) -> dict:
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT id, user_id, title, subject, summary, recognized_text FROM materials ORDER BY id")
-            for row in cur:
-                expected = generate_share_code(row['id'], row['user_id'])
-                if expected == code.upper():
-                    text = row['recognized_text'] or ''
-                    return {
-                        'statusCode': 200,
-                        'headers': headers,
-                        'body': json.dumps({
-                            'title': row['title'],
-                            'subject': row['subject'],
-                            'summary': row['summary'],
-                            'recognized_text': text[:5000]
-                        }, ensure_ascii=False, default=str)
-                    }
+            # Коды — 8 символов MD5, коллизии возможны: как и раньше, берём материал с меньшим id
+            cur.execute("""
+                SELECT title, subject, summary, LEFT(recognized_text, 5000) AS recognized_text
+                FROM materials WHERE share_code = %s ORDER BY id LIMIT 1
+            """, (code.upper(),))
+            row = cur.fetchone()
+            if row:
+                return {
+                    'statusCode': 200,
+                    'headers': headers,
+                    'body': json.dumps({
+                        'title': row['title'],
+                        'subject': row['subject'],
+                        'summary': row['summary'],
+                        'recognized_text': row['recognized_text'] or ''
+                    }, ensure_ascii=False, default=str)
+                }
 
         return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Материал не найден'}, ensure_ascii=False)}
     finally:
         conn.close()
 
 
+SEARCH_MAX_QUERY = 200
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+
+
+def handle_search(user_id: int, params: dict, headers: dict) -> dict:
+    """Полнотекстовый поиск по чанкам материалов пользователя (GIN по chunk_tsv)"""
+    query = (params.get('q') or '').strip()
+    if not query or len(query) > SEARCH_MAX_QUERY:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'Запрос от 1 до {SEARCH_MAX_QUERY} символов'}, ensure_ascii=False)}
+    try:
+        limit = min(max(int(params.get('limit') or SEARCH_DEFAULT_LIMIT), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        limit = SEARCH_DEFAULT_LIMIT
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # ts_headline дорогой — считаем его только для уже отобранных лучших чанков
+            cur.execute("""
+                WITH q AS (SELECT websearch_to_tsquery('russian', %s) AS query),
+                top AS (
+                    SELECT d.material_id, d.chunk_index, d.chunk_text, ts_rank_cd(d.chunk_tsv, q.query) AS rank
+                    FROM q, document_chunks d
+                    JOIN materials m ON m.id = d.material_id
+                    WHERE m.user_id = %s AND d.chunk_tsv @@ q.query
+                    ORDER BY rank DESC, d.material_id, d.chunk_index
+                    LIMIT %s
+                )
+                SELECT top.material_id, m.title, m.subject, top.chunk_index, top.rank,
+                       ts_headline('russian', top.chunk_text, q.query,
+                                   'StartSel="**", StopSel="**", MaxWords=35, MinWords=15, MaxFragments=2') AS snippet
+                FROM top, q, materials m
+                WHERE m.id = top.material_id
+                ORDER BY top.rank DESC, top.material_id, top.chunk_index
+            """, (query, user_id, limit))
+            results = [dict(r, rank=round(float(r['rank']), 4)) for r in cur.fetchall()]
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'query': query, 'results': results}, ensure_ascii=False, default=str)}
+    finally:
+        conn.close()
+
+
 def handler(event: dict, context) -> dict:
     method = event.get('httpMethod', 'GET')
     
@@ -403,18 +391,19 @@ def handler(event: dict, context) -> dict:
                         material_id = material['id']
                         print(f"[MATERIALS] Получен material_id={material_id}")
                         
-                        for idx, chunk in enumerate(chunks):
-                            cur.execute("INSERT INTO document_chunks (material_id, chunk_index, chunk_text) VALUES (%s, %s, %s)", (material_id, idx, chunk))
-                        print(f"[MATERIALS] Вставлено {len(chunks)} чанков")
+                        text_index.store_chunks(cur, material_id, chunks)
+                        print(f"[MATERIALS] Вставлено {len(chunks)} чанков с индексом")
                         
-                        # Увеличиваем дневной счётчик загрузок для всех тарифов
-                        schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-                        cur.execute(f'''
-                            UPDATE {schema}.users 
-                            SET files_uploaded_today = COALESCE(files_uploaded_today, 0) + 1,
-                                files_daily_reset_at = COALESCE(files_daily_reset_at, NOW() + INTERVAL '1 day')
-                            WHERE id = %s
-                        ''', (user_id,))
+                        # Списываем загрузку в той же транзакции: если параллельный запрос
+                        # уже выбрал лимит — откатываем материал целиком
+                        if entitlements.consume(conn, user_id, 'files', daily_limit, commit=False) is None:
+                            conn.rollback()
+                            return {'statusCode': 403, 'headers': headers, 'body': json.dumps({
+                                'error': 'quota_exceeded',
+                                'message': f'Лимит загрузок на сегодня исчерпан ({daily_limit}/{daily_limit}).',
+                                'used': daily_limit,
+                                'max': daily_limit
+                            })}
                         
                         conn.commit()
                         print(f"[MATERIALS] COMMIT OK, материал ID={material_id} создан, квота обновлена")
@@ -513,8 +502,7 @@ def handler(event: dict, context) -> dict:
                         material = cur.fetchone()
                         material_id = material['id']
                         
-                        for idx, chunk in enumerate(chunks):
-                            cur.execute("INSERT INTO document_chunks (material_id, chunk_index, chunk_text) VALUES (%s, %s, %s)", (material_id, idx, chunk))
+                        text_index.store_chunks(cur, material_id, chunks)
                         
                         conn.commit()
                         print(f"[MATERIALS] Создан: ID={material_id}")
@@ -534,12 +522,18 @@ def handler(event: dict, context) -> dict:
             
             conn = get_db_connection()
             try:
+                code = generate_share_code(int(material_id), user_id)
                 with conn.cursor() as cur:
-                    cur.execute("SELECT id FROM materials WHERE id = %s AND user_id = %s", (material_id, user_id))
+                    # Сохраняем код, чтобы публичная ссылка находилась по индексу
+                    cur.execute("""
+                        UPDATE materials SET share_code = %s
+                        WHERE id = %s AND user_id = %s
+                        RETURNING id
+                    """, (code, material_id, user_id))
                     if not cur.fetchone():
                         return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Материал не найден'})}
+                conn.commit()
                 
-                code = generate_share_code(int(material_id), user_id)
                 return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'code': code, 'material_id': material_id}, ensure_ascii=False)}
             finally:
                 conn.close()
@@ -548,6 +542,8 @@ def handler(event: dict, context) -> dict:
     
     # GET - список материалов
     elif method == 'GET':
+        if params.get('action') == 'search':
+            return handle_search(user_id, params, headers)
         conn = get_db_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
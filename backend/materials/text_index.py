@@ -0,0 +1,171 @@
+"""Инвертированный индекс чанков документов и ранжирование BM25.
+
+Токены — слова в нижнем регистре (ё→е) без стоп-слов, русские слова приводятся
+к основе упрощённым стеммером Snowball. При загрузке материала для каждого чанка
+пишется его длина в токенах (document_chunks.token_count) и частоты терминов
+(document_terms); при вопросе читаются только строки с терминами вопроса.
+"""
+
+import math
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+
+from psycopg2.extras import execute_values
+
+SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_TERM_LENGTH = 64
+
+_WORD_RE = re.compile(r'\w+')
+_CYRILLIC_RE = re.compile(r'[а-я]')
+_VOWELS = set('аеиоуыэюя')
+
+STOPWORDS = frozenset('''
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы
+где да даже для до его ее ей ему если есть еще же за здесь и из или им их к как
+какая какие какой когда кто ли либо мне может мы на над надо наш не него нее нет
+ни них но ну о об один он она они оно от очень по под после при про раз с со так
+также такой там те тем то того тоже той только том ты у уже хотя чего чей чем что
+чтобы чье чья эта эти это этого этой этом этот я
+такое такая такие какое каких объясни расскажи найди реши скажи помоги
+'''.split())
+
+# Окончания упрощённого Snowball (русский), от длинных к коротким. Глагольные «-л»/«-н»
+# убраны: иначе «интеграл» и «интегралы» получают разные основы
+_PERFECTIVE_GERUND_1 = ('вшись', 'вши', 'в')  # после а/я
+_PERFECTIVE_GERUND_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+_REFLEXIVE = ('ся', 'сь')
+_ADJECTIVE = ('ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой',
+              'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+_PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')  # после а/я
+_PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+_VERB_1 = ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й')  # после а/я
+_VERB_2 = ('ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют', 'ены',
+           'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю')
+_NOUN = ('иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой', 'ий',
+         'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я')
+_SUPERLATIVE = ('ейше', 'ейш')
+_DERIVATIONAL = ('ость', 'ост')
+
+
+def _strip(rv: str, endings, after_a=False):
+    """Отрезает первое подходящее окончание; для групп «после а/я» — только после них"""
+    for e in endings:
+        if rv.endswith(e):
+            if after_a:
+                head = rv[:-len(e)]
+                if not head or head[-1] not in 'ая':
+                    continue
+            return rv[:-len(e)]
+    return None
+
+
+@lru_cache(maxsize=50000)
+def stem(word: str) -> str:
+    """Основа русского слова (упрощённый Snowball); прочие слова — как есть"""
+    if len(word) < 4 or not _CYRILLIC_RE.search(word):
+        return word
+    pos = next((i for i, ch in enumerate(word) if ch in _VOWELS), None)
+    if pos is None:
+        return word
+    prefix, rv = word[:pos + 1], word[pos + 1:]
+
+    cut = _strip(rv, _PERFECTIVE_GERUND_2) if rv else None
+    if cut is None and rv:
+        cut = _strip(rv, _PERFECTIVE_GERUND_1, after_a=True)
+    if cut is not None:
+        rv = cut
+    else:
+        rv = _strip(rv, _REFLEXIVE) if rv.endswith(_REFLEXIVE) else rv
+        cut = _strip(rv, _ADJECTIVE)
+        if cut is not None:
+            rv = _strip(cut, _PARTICIPLE_2) or _strip(cut, _PARTICIPLE_1, after_a=True) or cut
+        else:
+            cut = _strip(rv, _VERB_2)
+            if cut is None:
+                cut = _strip(rv, _VERB_1, after_a=True)
+            if cut is None:
+                cut = _strip(rv, _NOUN)
+            if cut is not None:
+                rv = cut
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    if len(rv) > 4:
+        rv = _strip(rv, _DERIVATIONAL) or rv
+    rv = _strip(rv, _SUPERLATIVE) or rv
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    elif rv.endswith('ь'):
+        rv = rv[:-1]
+    return prefix + rv
+
+
+def tokenize(text: str) -> list:
+    """Термины текста по порядку (со стеммингом, без стоп-слов)"""
+    words = _WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+    return [stem(w)[:MAX_TERM_LENGTH] for w in words
+            if w not in STOPWORDS and (len(w) > 1 or w.isdigit())]
+
+
+def chunk_terms(text: str) -> tuple:
+    """(Counter термин -> tf, длина в токенах)"""
+    tokens = tokenize(text)
+    return Counter(tokens), len(tokens)
+
+
+def query_terms(question: str) -> list:
+    """Уникальные термины вопроса"""
+    return list(dict.fromkeys(tokenize(question)))
+
+
+def bm25_rank(terms, doc_lengths: dict, postings: dict) -> list:
+    """doc_lengths: {doc: длина}; postings: {термин: {doc: tf}}. [(score, doc)] по убыванию"""
+    n = len(doc_lengths)
+    if not n or not terms:
+        return []
+    avgdl = (sum(doc_lengths.values()) / n) or 1.0
+    scores = {}
+    for term in terms:
+        docs = postings.get(term)
+        if not docs:
+            continue
+        idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+        for doc, tf in docs.items():
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths.get(doc, avgdl) / avgdl)
+            scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+    return sorted(((s, d) for d, s in scores.items()), key=lambda x: -x[0])
+
+
+def best_window(text: str, terms, width: int) -> str:
+    """Фрагмент текста длиной до width с наибольшим числом терминов вопроса"""
+    if len(text) <= width:
+        return text
+    wanted = set(terms)
+    step = max(1, width // 2)
+    best, best_hits = 0, -1
+    for start in range(0, len(text) - step, step):
+        hits = sum(1 for t in tokenize(text[start:start + width]) if t in wanted)
+        if hits > best_hits:
+            best, best_hits = start, hits
+    # Выравниваем начало по границе абзаца или предложения, если она рядом
+    cut = max(text.rfind('\n', max(0, best - 200), best + 1), text.rfind('. ', max(0, best - 200), best + 1))
+    if cut > 0:
+        best = cut + 1
+    return text[best:best + width].strip()
+
+
+def store_chunks(cur, material_id: int, chunks: list):
+    """Вставляет чанки материала вместе с индексом (в текущей транзакции)"""
+    chunk_rows, term_rows = [], []
+    for idx, chunk in enumerate(chunks):
+        tf, length = chunk_terms(chunk)
+        chunk_rows.append((material_id, idx, chunk, length))
+        term_rows.extend((material_id, idx, term, count) for term, count in tf.items())
+    execute_values(cur, f"INSERT INTO {SCHEMA_NAME}.document_chunks (material_id, chunk_index, chunk_text, token_count) VALUES %s",
+                   chunk_rows, page_size=200)
+    execute_values(cur, f"INSERT INTO {SCHEMA_NAME}.document_terms (material_id, chunk_index, term, tf) VALUES %s",
+                   term_rows, page_size=2000)
@@ -3,18 +3,12 @@
 import json
 import os
 import jwt
-from openai import OpenAI
-import httpx
+import llm_gateway
 
-OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY', '')
-OPENROUTER_BASE_URL = 'https://api.aitunnel.ru/v1/'
 MODEL = 'llama-4-maverick'
 
 JWT_SECRET = os.environ.get('JWT_SECRET', '')
 
-_http = httpx.Client(verify=False, timeout=22.0)
-client = OpenAI(api_key=OPENROUTER_API_KEY, base_url=OPENROUTER_BASE_URL, timeout=22.0, http_client=_http)
-
 SUBJECTS = {
     'ege': {
         'ru': {'name': 'Русский язык', 'topics': ['Ударения', 'Паронимы', 'Грамматика', 'Орфография', 'Пунктуация', 'Синтаксис', 'Средства выразительности']},
@@ -64,16 +58,19 @@ JSON массив, каждый элемент: {{"id":N,"topic":"тема","tex
 options только для single.
 ТОЛЬКО JSON массив, без markdown."""
 
-    resp = client.chat.completions.create(
-        model=MODEL,
-        messages=[
+    resp = llm_gateway.chat(
+        [
             {"role": "system", "content": "Генерируй задания ЕГЭ/ОГЭ в формате ФИПИ. Отвечай ТОЛЬКО JSON массивом."},
             {"role": "user", "content": prompt}
         ],
+        route='mock_exam',
+        model=MODEL,
         temperature=0.8,
         max_tokens=6000,
+        timeout=22.0,
+        hedge_after=15.0,
     )
-    text = resp.choices[0].message.content.strip()
+    text = resp.content.strip()
     if text.startswith('```'):
         text = text.split('\n', 1)[1] if '\n' in text else text[3:]
         if text.endswith('```'):
@@ -19,9 +19,9 @@ import json
 import os
 import jwt
 import requests
-import psycopg2
 from datetime import datetime, timedelta, timezone
 from pywebpush import webpush, WebPushException
+import db_pool
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
@@ -63,7 +63,7 @@ def get_user_id(token: str):
 
 
 def get_conn():
-    return psycopg2.connect(DATABASE_URL)
+    return db_pool.get_connection()
 
 
 def days_word(n):
@@ -214,6 +214,8 @@ def handler(event: dict, context) -> dict:
                 return cron_daily_bonus(conn)
             if cron == 'expire_bonus':
                 return cron_expire_bonus(conn)
+            if cron == 'purge_usage':
+                return cron_purge_usage(conn)
             return err(400, 'Unknown cron')
 
         if not user_id:
@@ -447,6 +449,16 @@ def cron_expire_bonus(conn) -> dict:
     return ok({'reset_count': len(reset_ids)})
 
 
+def cron_purge_usage(conn) -> dict:
+    """Чистит дневные счётчики лимитов старше недели — нужны только за текущие сутки"""
+    cur = conn.cursor()
+    cur.execute(f"DELETE FROM {SCHEMA}.usage_counters WHERE day < CURRENT_DATE - 7")
+    deleted = cur.rowcount
+    conn.commit()
+    cur.close()
+    return ok({'deleted': deleted})
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # ТЕСТ
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -11,11 +11,11 @@ import datetime as dt
 from datetime import datetime, timedelta, date
 from decimal import Decimal
 
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import jwt
 import urllib.request
 import urllib.error
+import db_pool
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
@@ -69,8 +69,7 @@ def err(status: int, msg: str) -> dict:
 
 def get_db_connection():
     """Создаёт подключение к PostgreSQL с указанной схемой"""
-    conn = psycopg2.connect(DATABASE_URL, options=f'-c search_path={SCHEMA_NAME}')
-    return conn
+    return db_pool.get_connection()
 
 
 def verify_student_token(token: str) -> dict:
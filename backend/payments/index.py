@@ -7,11 +7,11 @@ import base64
 import threading
 import datetime as dt
 from datetime import datetime, timedelta
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import jwt
 import urllib.request
 import urllib.error
+import db_pool
 
 
 def _send_payment_email(email: str, name: str, plan: str, expires: str):
@@ -511,7 +511,7 @@ def handler(event: dict, context) -> dict:
 
         # YooKassa webhook: has "event" field like "payment.succeeded"
         if action == 'webhook' or body.get('event') or body.get('type') == 'notification':
-            conn = psycopg2.connect(DATABASE_URL)
+            conn = db_pool.get_connection()
             try:
                 result = handle_webhook(conn, body)
                 return {
@@ -523,7 +523,7 @@ def handler(event: dict, context) -> dict:
                 conn.close()
 
         if action == 'notify_pending_users':
-            conn = psycopg2.connect(DATABASE_URL)
+            conn = db_pool.get_connection()
             try:
                 result = notify_pending_payment_users(conn)
                 return {
@@ -548,7 +548,7 @@ def handler(event: dict, context) -> dict:
             duration_days = plan['duration_days']
             expires_at = datetime.now() + timedelta(days=duration_days)
 
-            conn = psycopg2.connect(DATABASE_URL)
+            conn = db_pool.get_connection()
             try:
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
                     cur.execute(f"""
@@ -604,7 +604,7 @@ def handler(event: dict, context) -> dict:
                 return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Invalid token'})}
             claim_user_id = payload_claim['user_id']
 
-            conn = psycopg2.connect(DATABASE_URL)
+            conn = db_pool.get_connection()
             try:
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
                     if guest_payment_id:
@@ -692,7 +692,7 @@ def handler(event: dict, context) -> dict:
         }
 
     user_id = payload['user_id']
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = db_pool.get_connection()
 
     try:
         if method == 'GET':
@@ -11,8 +11,8 @@ import json
 import os
 import jwt
 import requests
-import psycopg2
 from pywebpush import webpush, WebPushException
+import db_pool
 
 DATABASE_URL = os.environ['DATABASE_URL']
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
@@ -45,7 +45,7 @@ def get_user_id(token: str):
 
 
 def get_conn():
-    return psycopg2.connect(DATABASE_URL)
+    return db_pool.get_connection()
 
 
 def send_rustore_push(rustore_token: str, title: str, body: str, url: str = '/') -> bool:
@@ -0,0 +1,336 @@
+"""Единый расчёт прав доступа: подписка, триал, переходный период и дневные лимиты"""
+
+import os
+from datetime import date, datetime, timedelta, timezone
+
+from psycopg2.extras import RealDictCursor
+
+SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+# ── ВОПРОСЫ ИИ ───────────────────────────────────────────────────────────────
+PREMIUM_DAILY_LIMIT = 20
+FREE_LIMITS_SCHEDULE = {
+    0: 10, 1: 10, 2: 10, 3: 10,
+    4: 7,
+    5: 5,
+    6: 3,
+}
+FREE_DAILY_LIMIT_DEFAULT = 3
+
+SOFT_LANDING_LIMIT = 10  # вопросов/день в переходный период после триала
+SOFT_LANDING_DAYS = 3
+
+# ── ФОТО / АУДИО / ФАЙЛЫ ─────────────────────────────────────────────────────
+FREE_DAILY_PHOTOS = 1
+PREMIUM_DAILY_PHOTOS = 999999
+FREE_DAILY_AUDIO = 1
+PREMIUM_DAILY_AUDIO = 999999
+FREE_DAILY_FILES = 1
+PREMIUM_DAILY_FILES = 3
+
+_USER_COLUMNS = (
+    'subscription_type', 'subscription_expires_at', 'subscription_plan',
+    'trial_ends_at', 'is_trial_used', 'created_at',
+    'bonus_questions', 'bonus_photos', 'daily_premium_questions_used',
+    'materials_quota_used', 'materials_quota_reset_at',
+    'ai_questions_used', 'ai_questions_reset_at',
+)
+
+# Дневные счётчики живут в usage_counters (user_id, day, kind): новые сутки — новый
+# ключ, поэтому «сброс» не требует записи в users. Вид -> колонка бонусов или None
+USAGE_KINDS = {
+    'questions': 'bonus_questions',
+    'photos': 'bonus_photos',
+    'audio': None,
+    'files': None,
+    'sessions': None,
+}
+
+# Сутки лимитов считаем по Москве — там почти вся аудитория
+USAGE_TZ = timezone(timedelta(hours=3))
+
+
+def usage_day(now: datetime = None) -> date:
+    """Ключ суток для usage_counters"""
+    return (now or datetime.now(USAGE_TZ)).astimezone(USAGE_TZ).date()
+
+
+def _naive(value):
+    """В БД timestamp без зоны, но драйвер иногда отдаёт aware — сравниваем как naive"""
+    if value is not None and getattr(value, 'tzinfo', None):
+        return value.replace(tzinfo=None)
+    return value
+
+
+class Entitlements:
+    """Снимок строки users на момент запроса. Все ответы «можно ли / сколько осталось»
+    считаются из него без дополнительных запросов к БД."""
+
+    def __init__(self, row: dict | None, now: datetime = None, user_id: int = None, day: date = None):
+        self.row = row or {}
+        self.user_id = user_id
+        self.exists = row is not None
+        self.now = now or datetime.now()
+        self.day = day or usage_day()
+        self.usage = self.row.get('usage') or {}
+
+        # premium без даты окончания — бессрочный (так было в subscription и grade-tracker)
+        expires = _naive(self.row.get('subscription_expires_at'))
+        self.is_premium = bool(
+            self.row.get('subscription_type') == 'premium' and (expires is None or expires > self.now)
+        )
+        trial_ends = _naive(self.row.get('trial_ends_at'))
+        self.trial_ends_at = trial_ends
+        self.is_trial = bool(trial_ends and not self.row.get('is_trial_used') and trial_ends > self.now)
+
+        created_at = _naive(self.row.get('created_at'))
+        self.days_since_registration = (self.now - created_at).days if created_at else 999
+
+        self.soft_landing_days_left = 0
+        if trial_ends and trial_ends <= self.now and not self.is_premium:
+            days_since_trial_end = (self.now - trial_ends).days
+            if 0 <= days_since_trial_end < SOFT_LANDING_DAYS:
+                self.soft_landing_days_left = SOFT_LANDING_DAYS - days_since_trial_end
+
+    @property
+    def has_full_access(self) -> bool:
+        """Premium или активный триал — безлимит ко всему"""
+        return self.is_premium or self.is_trial
+
+    @property
+    def is_soft_landing(self) -> bool:
+        return self.soft_landing_days_left > 0
+
+    @property
+    def resets_at(self) -> datetime:
+        """Когда начнутся следующие сутки лимитов (полночь по МСК)"""
+        return datetime.combine(self.day + timedelta(days=1), datetime.min.time(), USAGE_TZ)
+
+    def used(self, kind: str) -> int:
+        """Сколько израсходовано за текущие сутки"""
+        return self.usage.get(kind) or 0
+
+    def bonus(self, column: str) -> int:
+        return self.row.get(column) or 0
+
+    def questions(self) -> dict:
+        """Доступ к вопросам ИИ с учётом подписки/триала/free"""
+        if not self.exists:
+            return {'has_access': False, 'reason': 'user_not_found'}
+
+        daily_used = self.used('questions')
+        bonus = self.bonus('bonus_questions')
+
+        # --- ТРИАЛ: безлимит (как Premium) ---
+        if self.is_trial:
+            return {'has_access': True, 'is_trial': True, 'is_premium': True, 'used': 0, 'limit': 999, 'remaining': 999}
+
+        # --- ПЕРЕХОДНЫЙ ПЕРИОД после окончания триала ---
+        if self.is_soft_landing:
+            total_sl = SOFT_LANDING_LIMIT + bonus
+            if daily_used >= total_sl:
+                return {
+                    'has_access': False, 'reason': 'limit', 'is_soft_landing': True,
+                    'used': daily_used, 'limit': SOFT_LANDING_LIMIT,
+                    'soft_landing_days_left': self.soft_landing_days_left
+                }
+            return {
+                'has_access': True, 'is_soft_landing': True,
+                'used': daily_used, 'limit': SOFT_LANDING_LIMIT,
+                'remaining': total_sl - daily_used,
+                'soft_landing_days_left': self.soft_landing_days_left
+            }
+
+        # --- ПРЕМИУМ: БЕЗЛИМИТ ---
+        if self.is_premium:
+            return {
+                'has_access': True, 'is_premium': True,
+                'used': 0, 'limit': 999999, 'remaining': 999999,
+                'source': 'unlimited'
+            }
+
+        # --- БЕСПЛАТНЫЙ ---
+        current_free_limit = FREE_LIMITS_SCHEDULE.get(self.days_since_registration, FREE_DAILY_LIMIT_DEFAULT)
+        is_newcomer = self.days_since_registration <= 3
+        total = current_free_limit + bonus
+        if daily_used >= total:
+            return {'has_access': False, 'reason': 'limit', 'used': daily_used, 'limit': current_free_limit, 'is_free': True, 'is_newcomer': is_newcomer}
+        return {'has_access': True, 'is_free': True, 'used': daily_used, 'limit': current_free_limit, 'remaining': total - daily_used, 'is_newcomer': is_newcomer}
+
+    def photos(self) -> dict:
+        """Дневной лимит решений по фото (+ бонусные фото из пакетов)"""
+        if not self.exists:
+            return {'has_access': False, 'reason': 'not_found'}
+        is_premium = self.has_full_access
+        photos_today = self.used('photos')
+        bonus = self.bonus('bonus_photos')
+        daily_limit = PREMIUM_DAILY_PHOTOS if is_premium else FREE_DAILY_PHOTOS
+        if photos_today >= daily_limit:
+            if bonus > 0:
+                return {'has_access': True, 'is_premium': is_premium, 'used': photos_today, 'limit': daily_limit, 'from_bonus': True, 'bonus_remaining': bonus}
+            return {'has_access': False, 'reason': 'limit', 'is_premium': is_premium, 'used': photos_today, 'limit': daily_limit, 'bonus_remaining': 0}
+        return {'has_access': True, 'is_premium': is_premium, 'used': photos_today, 'limit': daily_limit, 'from_bonus': False, 'bonus_remaining': bonus}
+
+    def audio(self) -> dict:
+        """Дневной лимит голосовых сообщений"""
+        if not self.exists:
+            return {'has_access': False, 'reason': 'not_found'}
+        is_premium = self.has_full_access
+        audio_today = self.used('audio')
+        daily_limit = PREMIUM_DAILY_AUDIO if is_premium else FREE_DAILY_AUDIO
+        if audio_today >= daily_limit:
+            return {'has_access': False, 'reason': 'limit', 'is_premium': is_premium, 'used': audio_today, 'limit': daily_limit}
+        return {'has_access': True, 'is_premium': is_premium, 'used': audio_today, 'limit': daily_limit}
+
+    def files(self) -> dict:
+        """Дневной лимит загрузки материалов"""
+        if not self.exists:
+            return {'has_access': False, 'reason': 'user_not_found'}
+        return {
+            'has_access': True,
+            'is_premium': self.is_premium,
+            'is_trial': self.is_trial,
+            'files_today': self.used('files'),
+            'daily_limit': PREMIUM_DAILY_FILES if self.has_full_access else FREE_DAILY_FILES
+        }
+
+    def daily_limit(self, kind: str) -> int | None:
+        """Дневной лимит для consume(); None — списывать нечего (безлимит по вопросам)"""
+        if kind == 'questions':
+            if self.has_full_access:
+                return None
+            if self.is_soft_landing:
+                return SOFT_LANDING_LIMIT
+            return FREE_LIMITS_SCHEDULE.get(self.days_since_registration, FREE_DAILY_LIMIT_DEFAULT)
+        if kind == 'photos':
+            return PREMIUM_DAILY_PHOTOS if self.has_full_access else FREE_DAILY_PHOTOS
+        if kind == 'audio':
+            return PREMIUM_DAILY_AUDIO if self.has_full_access else FREE_DAILY_AUDIO
+        if kind == 'files':
+            return PREMIUM_DAILY_FILES if self.has_full_access else FREE_DAILY_FILES
+        raise ValueError(f'unknown kind: {kind}')
+
+    def consume(self, conn, kind: str, commit: bool = True) -> dict | None:
+        """Списывает единицу лимита с тарифом из снимка. None — лимит исчерпан
+        (в том числе если параллельный запрос успел списать последнюю)."""
+        if not self.exists:
+            return None
+        limit = self.daily_limit(kind)
+        if limit is None:
+            info = self.questions()
+            return {'kind': kind, 'unlimited': True, 'used': 0, 'limit': info['limit'],
+                    'from_bonus': False, 'bonus_remaining': self.bonus('bonus_questions'),
+                    'remaining': max(0, info['remaining'] - 1)}
+        return consume(conn, self.user_id, kind, limit, day=self.day, commit=commit)
+
+    def refund(self, conn, receipt: dict | None, commit: bool = True):
+        refund(conn, self.user_id, receipt, commit=commit)
+
+
+def load(conn, user_id: int, with_counts: bool = False) -> Entitlements:
+    """Загружает снимок прав пользователя одним запросом — только чтение:
+    дневные счётчики берутся по ключу текущих суток из usage_counters.
+    with_counts — заодно посчитать занятия в расписании и незавершённые задачи."""
+    day = usage_day()
+    columns = ', '.join(_USER_COLUMNS)
+    columns += f''',
+            (SELECT json_object_agg(c.kind, c.used) FROM {SCHEMA_NAME}.usage_counters c
+             WHERE c.user_id = u.id AND c.day = %(day)s) AS usage'''
+    if with_counts:
+        columns += f''',
+            (SELECT COUNT(*) FROM {SCHEMA_NAME}.schedule s WHERE s.user_id = u.id) AS schedule_count,
+            (SELECT COUNT(*) FROM {SCHEMA_NAME}.tasks t WHERE t.user_id = u.id AND t.completed = false) AS tasks_count'''
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(f'SELECT {columns} FROM {SCHEMA_NAME}.users u WHERE u.id = %(user_id)s',
+                {'user_id': user_id, 'day': day})
+    row = cur.fetchone()
+    cur.close()
+    return Entitlements(dict(row) if row else None, user_id=user_id, day=day)
+
+
+def consume(conn, user_id: int, kind: str, daily_limit: int, day: date = None,
+            commit: bool = True) -> dict | None:
+    """Атомарно списывает одну единицу: сначала дневной лимит, потом бонусы.
+    Один запрос вместо SELECT + проверки + UPDATE. Дневной счётчик растёт через
+    INSERT ... ON CONFLICT DO UPDATE WHERE used < limit — строка блокируется, поэтому
+    параллельные запросы одного пользователя не уйдут за лимит. users трогаем,
+    только если пришлось потратить бонус.
+    Возвращает квитанцию для ответа клиенту и refund(), либо None, если лимит исчерпан."""
+    bonus_col = USAGE_KINDS[kind]
+    day = day or usage_day()
+    daily_cte = f'''
+        WITH daily AS (
+            INSERT INTO {SCHEMA_NAME}.usage_counters AS c (user_id, day, kind, used)
+            VALUES (%(user_id)s, %(day)s, %(kind)s, 1)
+            ON CONFLICT (user_id, day, kind) DO UPDATE SET used = c.used + 1
+            WHERE c.used < %(limit)s
+            RETURNING c.used
+        )'''
+    if bonus_col:
+        query = daily_cte + f''', bonus AS (
+            UPDATE {SCHEMA_NAME}.users
+            SET {bonus_col} = {bonus_col} - 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %(user_id)s AND {bonus_col} > 0 AND NOT EXISTS (SELECT 1 FROM daily)
+            RETURNING {bonus_col} AS bonus_after
+        )
+        SELECT COALESCE((SELECT used FROM daily), %(limit)s) AS used,
+               COALESCE((SELECT bonus_after FROM bonus),
+                        (SELECT COALESCE({bonus_col}, 0) FROM {SCHEMA_NAME}.users WHERE id = %(user_id)s)) AS bonus_left,
+               EXISTS (SELECT 1 FROM bonus) AS from_bonus,
+               EXISTS (SELECT 1 FROM daily) OR EXISTS (SELECT 1 FROM bonus) AS ok
+        '''
+    else:
+        query = daily_cte + '''
+        SELECT (SELECT used FROM daily) AS used, 0 AS bonus_left,
+               FALSE AS from_bonus, EXISTS (SELECT 1 FROM daily) AS ok
+        '''
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(query, {'user_id': user_id, 'day': day, 'kind': kind, 'limit': daily_limit})
+    row = cur.fetchone()
+    if commit:
+        conn.commit()
+    cur.close()
+    if not row or not row['ok']:
+        return None
+    used, bonus_left = row['used'] or 0, row['bonus_left'] or 0
+    return {
+        'kind': kind, 'day': day, 'unlimited': False,
+        'used': used, 'limit': daily_limit,
+        'from_bonus': bool(row['from_bonus']), 'bonus_remaining': bonus_left,
+        'remaining': max(0, daily_limit - used) + bonus_left,
+    }
+
+
+def record(conn, user_id: int, kind: str, commit: bool = True) -> int:
+    """Учитывает использование без лимита (например, учебные сессии). Возвращает счётчик за сутки"""
+    cur = conn.cursor()
+    cur.execute(f'''
+        INSERT INTO {SCHEMA_NAME}.usage_counters AS c (user_id, day, kind, used)
+        VALUES (%s, %s, %s, 1)
+        ON CONFLICT (user_id, day, kind) DO UPDATE SET used = c.used + 1
+        RETURNING c.used
+    ''', (user_id, usage_day(), kind))
+    row = cur.fetchone()
+    if commit:
+        conn.commit()
+    cur.close()
+    return row[0] if row else 1
+
+
+def refund(conn, user_id: int, receipt: dict | None, commit: bool = True):
+    """Возвращает списанное consume() — например, если ИИ не ответил"""
+    if not receipt or receipt.get('unlimited'):
+        return
+    kind = receipt['kind']
+    bonus_col = USAGE_KINDS[kind]
+    cur = conn.cursor()
+    if receipt.get('from_bonus') and bonus_col:
+        cur.execute(f'UPDATE {SCHEMA_NAME}.users SET {bonus_col} = COALESCE({bonus_col}, 0) + 1, '
+                    f'updated_at = CURRENT_TIMESTAMP WHERE id = %s', (user_id,))
+    else:
+        cur.execute(f'UPDATE {SCHEMA_NAME}.usage_counters SET used = GREATEST(used - 1, 0) '
+                    f'WHERE user_id = %s AND day = %s AND kind = %s',
+                    (user_id, receipt.get('day') or usage_day(), kind))
+    if commit:
+        conn.commit()
+    cur.close()
@@ -3,18 +3,16 @@
 import json
 import os
 from datetime import datetime, timedelta
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import jwt
 from rate_limiter import check_rate_limit, get_client_ip
 from security_validator import check_ownership, validate_string_field, validate_integer_field
+import db_pool
+import entitlements
 
 
 def get_db_connection():
-    dsn = os.environ['DATABASE_URL']
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
-    return conn
+    return db_pool.get_connection()
 
 
 def verify_token(token: str) -> dict:
@@ -26,29 +24,8 @@ def verify_token(token: str) -> dict:
 
 
 def check_premium(conn, user_id):
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("""
-            SELECT subscription_type, subscription_expires_at, trial_ends_at, is_trial_used
-            FROM users WHERE id = %s
-        """, (user_id,))
-        user = cur.fetchone()
-        if not user:
-            return False, False
-
-        is_premium = False
-        if user['subscription_type'] == 'premium':
-            expires = user.get('subscription_expires_at')
-            if expires and expires.replace(tzinfo=None) > datetime.now():
-                is_premium = True
-
-        is_trial = False
-        if not is_premium:
-            trial_ends = user.get('trial_ends_at')
-            if trial_ends and not user.get('is_trial_used'):
-                if trial_ends.replace(tzinfo=None) > datetime.now():
-                    is_trial = True
-
-        return is_premium, is_trial
+    ent = entitlements.load(conn, user_id)
+    return ent.is_premium, ent.is_trial and not ent.is_premium
 
 
 def handler(event: dict, context) -> dict:
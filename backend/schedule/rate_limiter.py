@@ -1,31 +1,203 @@
-"""Rate limiting для schedule"""
+"""Rate limiting middleware для защиты от DDoS и брутфорса.
+
+GCRA (token bucket без таймера): на ключ хранится одно число — теоретическое время
+прихода следующего запроса (TAT). Память O(1) на ключ, проверка O(1).
+Хранилище выбирается переменной RATE_LIMIT_BACKEND:
+  memory   — в памяти контейнера (по умолчанию, как раньше);
+  postgres — общая таблица rate_limit_buckets, лимит держится между инстансами.
+    Ключ хранится как md5 идентификатора (в нём бывает произвольный
+    X-Forwarded-For). Если БД недоступна, запрос пропускается (fail-open):
+    ограничитель не должен ронять вход в 500.
+"""
+
+import hashlib
+import math
+import os
+import random
+import threading
 import time
 from datetime import datetime, timedelta
-import hashlib
 
-_rate_limit_storage = {}
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+# Как часто подчищаем ключи, чей TAT уже в прошлом (они равносильны отсутствию записи)
+SWEEP_INTERVAL_SECONDS = 60
+# Доля запросов к Postgres, после которых удаляем протухшие строки
+PG_PURGE_PROBABILITY = 0.001
+
+
+def _decide(tat: float, now: float, limit: int, window: float, cost: int):
+    """Решение GCRA: (allowed, new_tat, remaining, retry_after, reset_after)"""
+    interval = window / limit
+    base = tat if tat > now else now
+    new_tat = base + cost * interval
+    allowed = new_tat - now <= window + 1e-9
+    effective = new_tat if allowed else base
+    remaining = max(0, int((window - (effective - now)) / interval + 1e-9))
+    retry_after = 0 if allowed else math.ceil(new_tat - window - now)
+    return allowed, new_tat, remaining, retry_after, effective - now
+
+
+class MemoryStore:
+    """TAT по ключу в словаре процесса"""
+
+    def __init__(self):
+        self._tat = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.time() + SWEEP_INTERVAL_SECONDS
+
+    def acquire(self, key: str, limit: int, window: float, cost: int = 1) -> tuple:
+        now = time.time()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            allowed, new_tat, remaining, retry_after, reset_after = _decide(
+                self._tat.get(key, 0.0), now, limit, window, cost)
+            if allowed and cost:
+                self._tat[key] = new_tat
+        return allowed, remaining, retry_after, reset_after
+
+    def reset(self, key: str):
+        with self._lock:
+            self._tat.pop(key, None)
+
+    def _sweep(self, now: float):
+        self._next_sweep = now + SWEEP_INTERVAL_SECONDS
+        expired = [k for k, tat in self._tat.items() if tat <= now]
+        for k in expired:
+            del self._tat[k]
+
+    def __len__(self):
+        return len(self._tat)
+
+
+class PostgresStore:
+    """TAT по ключу в таблице rate_limit_buckets — общий для всех контейнеров.
+    Проверка — один INSERT ... ON CONFLICT DO UPDATE ... WHERE; строка блокируется,
+    так что параллельные запросы с разных инстансов не превысят лимит."""
+
+    def acquire(self, key: str, limit: int, window: float, cost: int = 1) -> tuple:
+        now = time.time()
+        try:
+            tat = self._tat(_bucket_key(key), now, window, cost * window / limit, cost)
+        except Exception as e:
+            print(f"[RATE_LIMIT] postgres unavailable, allowing: {type(e).__name__}: {e}", flush=True)
+            return True, limit, 0, 0.0
+        allowed, _, remaining, retry_after, reset_after = _decide(tat, now, limit, window, cost)
+        return allowed, remaining, retry_after, reset_after
+
+    @staticmethod
+    def _tat(key: str, now: float, window: float, step: float, cost: int) -> float:
+        import db_pool
+        conn = db_pool.get_connection()
+        try:
+            cur = conn.cursor()
+            if cost:
+                cur.execute(f'''
+                    INSERT INTO {SCHEMA_NAME}.rate_limit_buckets AS b (key, tat)
+                    VALUES (%(key)s, %(now)s + %(step)s)
+                    ON CONFLICT (key) DO UPDATE SET tat = GREATEST(b.tat, %(now)s) + %(step)s
+                    WHERE GREATEST(b.tat, %(now)s) + %(step)s - %(now)s <= %(window)s
+                    RETURNING tat
+                ''', {'key': key, 'now': now, 'step': step, 'window': window})
+                row = cur.fetchone()
+                if row:
+                    tat = row[0] - step
+                else:
+                    cur.execute(f'SELECT tat FROM {SCHEMA_NAME}.rate_limit_buckets WHERE key = %s', (key,))
+                    found = cur.fetchone()
+                    tat = found[0] if found else 0.0
+            else:
+                cur.execute(f'SELECT tat FROM {SCHEMA_NAME}.rate_limit_buckets WHERE key = %s', (key,))
+                found = cur.fetchone()
+                tat = found[0] if found else 0.0
+            if random.random() < PG_PURGE_PROBABILITY:
+                cur.execute(f'DELETE FROM {SCHEMA_NAME}.rate_limit_buckets WHERE tat < %s', (now,))
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+        return tat
+
+    def reset(self, key: str):
+        import db_pool
+        try:
+            conn = db_pool.get_connection()
+            try:
+                cur = conn.cursor()
+                cur.execute(f'DELETE FROM {SCHEMA_NAME}.rate_limit_buckets WHERE key = %s', (_bucket_key(key),))
+                conn.commit()
+                cur.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"[RATE_LIMIT] reset failed: {type(e).__name__}: {e}", flush=True)
+
+
+def _bucket_key(identifier: str) -> str:
+    """32 символа для rate_limit_buckets.key при любой длине идентификатора"""
+    return hashlib.md5(identifier.encode()).hexdigest()
+
+
+def _make_store():
+    if RATE_LIMIT_BACKEND == 'postgres':
+        return PostgresStore()
+    return MemoryStore()
+
+
+_store = _make_store()
+
 
 def check_rate_limit(identifier: str, max_requests: int = 100, window_seconds: int = 60) -> tuple:
-    now = time.time()
-    key = hashlib.md5(identifier.encode()).hexdigest()
-    
-    if key not in _rate_limit_storage:
-        _rate_limit_storage[key] = {'requests': []}
-    
-    record = _rate_limit_storage[key]
-    record['requests'] = [r for r in record['requests'] if now - r < window_seconds]
-    
-    if len(record['requests']) >= max_requests:
-        oldest = record['requests'][0]
-        retry_after = int(window_seconds - (now - oldest)) + 1
-        return (False, 0, retry_after)
-    
-    record['requests'].append(now)
-    return (True, max_requests - len(record['requests']), 0)
+    """
+    Проверяет rate limit для идентификатора (IP + endpoint)
+    Возвращает (is_allowed: bool, remaining: int, retry_after: int)
+    """
+    allowed, remaining, retry_after, _ = _store.acquire(identifier, max_requests, window_seconds)
+    return (allowed, remaining, retry_after)
+
+
+def check_failed_login(identifier: str, max_attempts: int = 5, lockout_minutes: int = 15) -> tuple:
+    """
+    Проверяет количество неудачных попыток входа (ничего не списывает)
+    Возвращает (is_allowed: bool, attempts_left: int, locked_until: datetime | None)
+    """
+    _, attempts_left, _, reset_after = _store.acquire(
+        f"login_{identifier}", max_attempts, lockout_minutes * 60, cost=0)
+    if attempts_left <= 0:
+        return (False, 0, datetime.now() + timedelta(seconds=math.ceil(reset_after)))
+    return (True, attempts_left, None)
+
+
+def record_failed_login(identifier: str, max_attempts: int = 5, lockout_minutes: int = 15):
+    """Записывает неудачную попытку входа"""
+    _store.acquire(f"login_{identifier}", max_attempts, lockout_minutes * 60)
+
+
+def reset_failed_login(identifier: str):
+    """Сбрасывает счетчик неудачных попыток (при успешном входе)"""
+    _store.reset(f"login_{identifier}")
+
 
 def get_client_ip(event: dict) -> str:
+    """Извлекает IP клиента из event"""
+    # Сначала проверяем X-Forwarded-For (если за прокси)
     headers = event.get('headers', {})
     forwarded = headers.get('X-Forwarded-For', '')
     if forwarded:
         return forwarded.split(',')[0].strip()
-    return event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'unknown')
+
+    # Затем X-Real-IP
+    real_ip = headers.get('X-Real-IP', '')
+    if real_ip:
+        return real_ip
+
+    # Из requestContext
+    request_context = event.get('requestContext', {})
+    identity = request_context.get('identity', {})
+    source_ip = identity.get('sourceIp', '')
+    if source_ip:
+        return source_ip
+
+    return 'unknown'
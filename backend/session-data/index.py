@@ -4,9 +4,9 @@ import json
 import os
 import hashlib
 from datetime import date, datetime
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import jwt
+import db_pool
 
 
 DAILY_TOPICS = [
@@ -38,10 +38,7 @@ DAILY_TOPICS = [
 
 
 def get_db_connection():
-    dsn = os.environ['DATABASE_URL']
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
-    return conn
+    return db_pool.get_connection()
 
 
 def verify_token(token: str):
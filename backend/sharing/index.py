@@ -1,10 +1,10 @@
 import json
 import os
 import jwt
-import psycopg2
 import random
 import string
 from datetime import datetime
+import db_pool
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
@@ -47,7 +47,7 @@ def handler(event: dict, context) -> dict:
             'body': json.dumps({'error': 'Unauthorized'})
         }
     
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = db_pool.get_connection()
     
     try:
         if method == 'POST':
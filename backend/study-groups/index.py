@@ -5,15 +5,13 @@ import os
 import random
 import string
 from datetime import datetime
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import jwt
+import db_pool
 
 
 def get_db():
-    dsn = os.environ['DATABASE_URL']
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    return psycopg2.connect(dsn, options=f'-c search_path={schema}')
+    return db_pool.get_connection()
 
 
 def verify_token(token: str) -> dict:
@@ -4,24 +4,18 @@ import json
 import os
 import re
 from datetime import datetime, date, timedelta
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import jwt
-from openai import OpenAI
 from rate_limiter import check_rate_limit, get_client_ip
+import db_pool
+import llm_gateway
+import entitlements
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key')
-OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY', '')
 LLAMA_MODEL = 'llama-4-maverick'
 
-ai_client = OpenAI(
-    api_key=OPENROUTER_API_KEY,
-    base_url='https://api.aitunnel.ru/v1/',
-    timeout=22.0
-)
-
 CORS_HEADERS = {
     'Content-Type': 'application/json',
     'Access-Control-Allow-Origin': '*',
@@ -36,10 +30,7 @@ OPTIONS_HEADERS = {
 
 def get_db_connection():
     """Creates a PostgreSQL connection with the configured schema search path."""
-    dsn = os.environ['DATABASE_URL']
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
-    return conn
+    return db_pool.get_connection()
 
 
 def verify_token(token: str) -> dict:
@@ -53,19 +44,7 @@ def verify_token(token: str) -> dict:
 
 def check_premium(conn, user_id: int) -> bool:
     """Returns True if user has an active premium subscription."""
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT subscription_type, subscription_expires_at
-        FROM users WHERE id = %s
-    """, (user_id,))
-    row = cur.fetchone()
-    cur.close()
-    if not row:
-        return False
-    if row['subscription_type'] == 'premium' and row['subscription_expires_at']:
-        if row['subscription_expires_at'] >= datetime.now():
-            return True
-    return False
+    return entitlements.load(conn, user_id).is_premium
 
 
 def ensure_tables(conn):
@@ -160,17 +139,19 @@ def generate_plan_with_ai(subject: str, difficulty: str, days_left: int, context
         "]"
     )
 
-    response = ai_client.chat.completions.create(
-        model=LLAMA_MODEL,
-        messages=[
+    response = llm_gateway.chat(
+        [
             {'role': 'system', 'content': system_prompt},
             {'role': 'user', 'content': f'Создай план подготовки к экзамену по предмету "{subject}" на {capped_days} дней.'},
         ],
+        route='study_plan',
+        model=LLAMA_MODEL,
         temperature=0.6,
         max_tokens=1200,
+        timeout=22.0,
     )
 
-    raw = response.choices[0].message.content.strip()
+    raw = response.content.strip()
 
     # Try to extract JSON from the response (may be wrapped in ```json ... ```)
     json_match = re.search(r'\[.*\]', raw, re.DOTALL)
@@ -3,17 +3,15 @@
 import json
 import os
 from datetime import datetime
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import jwt
+import db_pool
+import entitlements
 
 
 def get_db_connection():
     """Создаёт подключение к PostgreSQL базе данных"""
-    dsn = os.environ['DATABASE_URL']
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
-    return conn
+    return db_pool.get_connection()
 
 
 def verify_token(token: str) -> dict:
@@ -25,169 +23,72 @@ def verify_token(token: str) -> dict:
         return None
 
 
-def check_subscription_status(user_id: int, conn) -> dict:
-    """Проверяет статус подписки пользователя (включая триал период)"""
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("""
-            SELECT subscription_type, subscription_expires_at,
-                   materials_quota_used, materials_quota_reset_at,
-                   trial_ends_at, is_trial_used,
-                   ai_questions_used, ai_questions_reset_at,
-                   daily_questions_used, daily_questions_reset_at,
-                   daily_premium_questions_used, daily_premium_questions_reset_at,
-                   bonus_questions,
-                   files_uploaded_today, files_daily_reset_at
-            FROM users
-            WHERE id = %s
-        """, (user_id,))
-        
-        user = cur.fetchone()
-        
-        if not user:
-            return {'is_premium': False, 'subscription_type': 'free', 'is_trial': False}
-        
-        now = datetime.now()
-        is_premium = False
-        is_trial = False
-        trial_ends_at = None
-        
-        # Проверяем премиум подписку
-        if user['subscription_type'] == 'premium':
-            if user['subscription_expires_at']:
-                if user['subscription_expires_at'] > now:
-                    is_premium = True
-                else:
-                    cur.execute("""
-                        UPDATE users 
-                        SET subscription_type = 'free', subscription_expires_at = NULL
-                        WHERE id = %s
-                    """, (user_id,))
-                    conn.commit()
-            else:
-                is_premium = True
-        
-        if not is_premium and user.get('trial_ends_at') and not user.get('is_trial_used'):
-            trial_ends = user['trial_ends_at'].replace(tzinfo=None) if user['trial_ends_at'].tzinfo else user['trial_ends_at']
-            if trial_ends > now:
-                is_trial = True
-                trial_ends_at = trial_ends
-                is_premium = True
-        
-        # Сброс дневного счётчика файлов
-        if user.get('files_daily_reset_at') and user['files_daily_reset_at'] < datetime.now():
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _subscription_status(ent, conn, user_id: int) -> dict:
+    """Собирает статус подписки из снимка прав (включая триал период)"""
+    user = ent.row
+    if not ent.exists:
+        return {'is_premium': False, 'subscription_type': 'free', 'is_trial': False}
+
+    # Истёкший premium переводим в free — единственная запись, только один раз после истечения
+    expires = user.get('subscription_expires_at')
+    if user.get('subscription_type') == 'premium' and expires and not ent.is_premium:
+        with conn.cursor() as cur:
             cur.execute("""
-                UPDATE users
-                SET files_uploaded_today = 0,
-                    files_daily_reset_at = CURRENT_TIMESTAMP + INTERVAL '1 day'
+                UPDATE users 
+                SET subscription_type = 'free', subscription_expires_at = NULL
                 WHERE id = %s
             """, (user_id,))
-            conn.commit()
-            user['files_uploaded_today'] = 0
-        
-        # Сброс дневных вопросов каждый день
-        if user.get('daily_questions_reset_at'):
-            reset_naive = user['daily_questions_reset_at'].replace(tzinfo=None) if user['daily_questions_reset_at'].tzinfo else user['daily_questions_reset_at']
-            if reset_naive < now:
-                cur.execute("""
-                    UPDATE users 
-                    SET daily_questions_used = 0,
-                        daily_questions_reset_at = CURRENT_TIMESTAMP + INTERVAL '1 day'
-                    WHERE id = %s
-                """, (user_id,))
-                conn.commit()
-                user['daily_questions_used'] = 0
-        
-        return {
-            'is_premium': is_premium,
-            'is_trial': is_trial,
-            'subscription_type': user['subscription_type'],
-            'subscription_expires_at': user['subscription_expires_at'].isoformat() if user['subscription_expires_at'] else None,
-            'trial_ends_at': trial_ends_at.isoformat() if trial_ends_at else None,
-            'materials_quota_used': user['materials_quota_used'] or 0,
-            'materials_quota_reset_at': user['materials_quota_reset_at'].isoformat() if user['materials_quota_reset_at'] else None,
-            'files_uploaded_today': user.get('files_uploaded_today') or 0,
-            'ai_questions_used': user.get('ai_questions_used', 0) or 0,
-            'ai_questions_reset_at': user.get('ai_questions_reset_at').isoformat() if user.get('ai_questions_reset_at') else None,
-            'daily_questions_used': user.get('daily_questions_used', 0) or 0,
-            'daily_questions_reset_at': user.get('daily_questions_reset_at').isoformat() if user.get('daily_questions_reset_at') else None,
-            'daily_premium_questions_used': user.get('daily_premium_questions_used', 0) or 0,
-            'bonus_questions': user.get('bonus_questions', 0) or 0
-        }
+        conn.commit()
 
+    return {
+        'is_premium': ent.has_full_access,
+        'is_trial': ent.is_trial and not ent.is_premium,
+        'subscription_type': user['subscription_type'],
+        'subscription_expires_at': _iso(expires),
+        'trial_ends_at': _iso(ent.trial_ends_at) if ent.is_trial and not ent.is_premium else None,
+        'materials_quota_used': user.get('materials_quota_used') or 0,
+        'materials_quota_reset_at': _iso(user.get('materials_quota_reset_at')),
+        'files_uploaded_today': ent.used('files'),
+        'ai_questions_used': user.get('ai_questions_used') or 0,
+        'ai_questions_reset_at': _iso(user.get('ai_questions_reset_at')),
+        'daily_questions_used': ent.used('questions'),
+        'daily_questions_reset_at': _iso(ent.resets_at),
+        'daily_premium_questions_used': user.get('daily_premium_questions_used') or 0,
+        'bonus_questions': ent.bonus('bonus_questions')
+    }
 
-SOFT_LANDING_DAYS = 3
-SOFT_LANDING_LIMIT = 10
 
-def get_limits(conn, user_id: int) -> dict:
-    """Получает текущие лимиты пользователя"""
-    status = check_subscription_status(user_id, conn)
-    
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT COUNT(*) as count FROM schedule WHERE user_id = %s", (user_id,))
-        schedule_count = cur.fetchone()['count']
-        
-        cur.execute("SELECT COUNT(*) as count FROM tasks WHERE user_id = %s AND completed = false", (user_id,))
-        tasks_count = cur.fetchone()['count']
+def check_subscription_status(user_id: int, conn) -> dict:
+    """Проверяет статус подписки пользователя (включая триал период)"""
+    ent = entitlements.load(conn, user_id)
+    return _subscription_status(ent, conn, user_id)
 
-        # Проверяем soft landing (дни 8-10 после окончания триала)
-        cur.execute("""
-            SELECT trial_ends_at, daily_questions_used, bonus_questions,
-                   daily_sessions_used, daily_sessions_reset_at,
-                   files_uploaded_today, files_daily_reset_at
-            FROM users WHERE id = %s
-        """, (user_id,))
-        u = cur.fetchone()
 
-        # Сброс ежедневного счётчика сессий
-        if u and u.get('daily_sessions_reset_at'):
-            reset_naive = u['daily_sessions_reset_at'].replace(tzinfo=None) if u['daily_sessions_reset_at'].tzinfo else u['daily_sessions_reset_at']
-            if reset_naive < datetime.now():
-                cur.execute("""
-                    UPDATE users
-                    SET daily_sessions_used = 0,
-                        daily_sessions_reset_at = CURRENT_TIMESTAMP + INTERVAL '1 day'
-                    WHERE id = %s
-                """, (user_id,))
-                conn.commit()
-                u['daily_sessions_used'] = 0
-    
-    is_soft_landing = False
-    soft_landing_days_left = 0
-    if not status['is_premium'] and not status['is_trial'] and u and u['trial_ends_at']:
-        now = datetime.now()
-        trial_ends = u['trial_ends_at'].replace(tzinfo=None) if u['trial_ends_at'].tzinfo else u['trial_ends_at']
-        if trial_ends <= now:
-            days_since = (now - trial_ends).days
-            if 0 <= days_since < SOFT_LANDING_DAYS:
-                is_soft_landing = True
-                soft_landing_days_left = SOFT_LANDING_DAYS - days_since
+def get_limits(conn, user_id: int) -> dict:
+    """Получает текущие лимиты пользователя: один SELECT снимка вместе со счётчиками"""
+    ent = entitlements.load(conn, user_id, with_counts=True)
+    status = _subscription_status(ent, conn, user_id)
+    schedule_count = ent.row.get('schedule_count') or 0
+    tasks_count = ent.row.get('tasks_count') or 0
 
-    sessions_used = (u['daily_sessions_used'] or 0) if u else 0
+    is_soft_landing = not status['is_premium'] and ent.is_soft_landing
+    soft_landing_days_left = ent.soft_landing_days_left
+    sessions_used = ent.used('sessions')
 
     # Лимиты по тарифу:
     # Free (после 3 дней): 3 AI вопроса/день, 1 фото/день, 1 аудио/день
     # Premium: БЕЗЛИМИТ ко всему
     # Trial (3 дня при регистрации): БЕЗЛИМИТ ко всему (как Premium)
 
-    files_today = (u.get('files_uploaded_today') or 0) if u else 0
-
-    # Сброс дневного счётчика файлов в get_limits тоже
-    if u and u.get('files_daily_reset_at'):
-        reset_f = u['files_daily_reset_at'].replace(tzinfo=None) if u['files_daily_reset_at'].tzinfo else u['files_daily_reset_at']
-        if reset_f < datetime.now():
-            files_today = 0
-
-    # Calculate days since registration for all tiers
-    created_at = None
-    with conn.cursor(cursor_factory=RealDictCursor) as cur2:
-        cur2.execute("SELECT created_at FROM users WHERE id = %s", (user_id,))
-        row2 = cur2.fetchone()
-        if row2:
-            created_at = row2['created_at']
-    days_since_reg = (datetime.now() - created_at.replace(tzinfo=None)).days if created_at else 999
+    files_today = ent.used('files')
+    days_since_reg = ent.days_since_registration
 
     if status['is_premium']:
-        daily_used = (u['daily_questions_used'] or 0) if u else 0
+        daily_used = ent.used('questions')
         return {
             **status,
             'is_soft_landing': False,
@@ -226,8 +127,8 @@ def get_limits(conn, user_id: int) -> dict:
             }
         }
     elif is_soft_landing:
-        daily_used = u['daily_questions_used'] or 0
-        bonus = u['bonus_questions'] or 0
+        daily_used = ent.used('questions')
+        bonus = ent.bonus('bonus_questions')
         return {
             **status,
             'is_soft_landing': True,
@@ -515,26 +416,11 @@ def handler(event: dict, context) -> dict:
             
             elif action == 'use_session':
                 # Записать использование одной сессии в день
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    cur.execute("""
-                        UPDATE users
-                        SET daily_sessions_used = COALESCE(daily_sessions_used, 0) + 1,
-                            daily_sessions_reset_at = COALESCE(
-                                CASE WHEN daily_sessions_reset_at IS NULL OR daily_sessions_reset_at < CURRENT_TIMESTAMP
-                                     THEN CURRENT_TIMESTAMP + INTERVAL '1 day'
-                                     ELSE daily_sessions_reset_at
-                                END,
-                                CURRENT_TIMESTAMP + INTERVAL '1 day'
-                            )
-                        WHERE id = %s
-                        RETURNING daily_sessions_used, daily_sessions_reset_at
-                    """, (user_id,))
-                    row = cur.fetchone()
-                    conn.commit()
+                sessions_used = entitlements.record(conn, user_id, 'sessions')
                 return {
                     'statusCode': 200,
                     'headers': headers,
-                    'body': json.dumps({'sessions_used': row['daily_sessions_used'] if row else 1})
+                    'body': json.dumps({'sessions_used': sessions_used})
                 }
 
             elif action == 'upgrade_demo':
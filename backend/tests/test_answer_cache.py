@@ -0,0 +1,29 @@
+"""L1-кэш ответов: накопленные попадания сбрасываются и при остановке контейнера.
+
+Запуск: python -m pytest backend/tests
+"""
+
+from test_query_counts import CountingConnection, ai
+
+AnswerCache = type(ai.ANSWER_CACHE)
+
+
+def test_close_flushes_pending_hits():
+    conns = []
+
+    def connect():
+        conns.append(CountingConnection(None))
+        return conns[-1]
+
+    cache = AnswerCache(connect=connect)
+    cache.close()
+    assert conns == []  # нечего сбрасывать — соединение не открываем
+
+    cache.record_hit(1)
+    cache.record_hit(1)
+    cache.record_hit(2)
+    cache.close()
+    assert len(conns) == 1
+    assert [s for s in conns[0].statements if s.startswith('UPDATE')]
+    assert not cache._hits
+
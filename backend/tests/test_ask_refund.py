@@ -0,0 +1,81 @@
+"""POST ask: списанный вопрос возвращается, если ответ сорвала ошибка сервера.
+
+Использует CountingConnection из test_query_counts: возврат виден как UPDATE
+usage_counters с GREATEST(used - 1, 0).
+
+Запуск: python -m pytest backend/tests
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from test_query_counts import ai, conn, user_row  # noqa: F401  (conn — фикстура)
+
+
+def _refunds(c):
+    return [s for s in c.statements if s.startswith('UPDATE') and 'usage_counters' in s]
+
+
+@pytest.fixture
+def ask(conn, monkeypatch):  # noqa: F811
+    monkeypatch.setattr(ai, 'save_msg', lambda *a, **k: None)
+    monkeypatch.setattr(ai.session_memory, 'remember', lambda *a, **k: None)
+    monkeypatch.setattr(ai, 'get_context', lambda *a, **k: '')
+
+    def call(**body):
+        event = {'httpMethod': 'POST', 'headers': {'X-Authorization': 'Bearer t'},
+                 'body': json.dumps({'question': 'Чем митоз отличается от мейоза?', **body})}
+        response = ai.handler(event, None)
+        return response['statusCode'], json.loads(response['body'])
+    return call
+
+
+def _boom(*a, **k):
+    raise RuntimeError('boom')
+
+
+def test_context_error_refunds_question(conn, ask, monkeypatch):  # noqa: F811
+    monkeypatch.setattr(ai, 'get_context', _boom)
+    status, body = ask()
+    assert body.get('error')
+    assert len(_refunds(conn)) == 1
+
+
+def test_model_error_refunds_question_once(conn, ask, monkeypatch):  # noqa: F811
+    monkeypatch.setattr(ai, 'ask_ai', _boom)
+    status, body = ask()
+    assert body.get('error')
+    assert len(_refunds(conn)) == 1
+    # Рейс закрыт — следующий такой же вопрос не ждёт ведущего
+    assert len(ai.ANSWER_FLIGHTS) == 0
+
+
+def test_stream_create_error_refunds_question(conn, ask, monkeypatch):  # noqa: F811
+    monkeypatch.setattr(ai, '_stream_create', _boom)
+    status, body = ask(stream=True)
+    assert body.get('error')
+    assert len(_refunds(conn)) == 1
+    assert len(ai.ANSWER_FLIGHTS) == 0
+
+
+def test_prompt_build_error_releases_flight(conn, ask, monkeypatch):  # noqa: F811
+    monkeypatch.setattr(ai.prompt_builder, 'build', _boom)
+    status, body = ask(stream=True)
+    assert body.get('error')
+    assert len(ai.ANSWER_FLIGHTS) == 0
+    assert len(_refunds(conn)) == 1
+
+
+def test_stream_finish_error_refunds_question(conn, monkeypatch):  # noqa: F811
+    conn.user = user_row()
+    calls = []
+
+    def finish(c, answer, tokens):
+        raise RuntimeError('save failed')
+
+    monkeypatch.setattr(ai, '_stream_append', lambda *a, **k: None)
+    monkeypatch.setattr(ai.llm_gateway, 'stream_chat', lambda *a, **k: SimpleNamespace(content='Ответ.', tokens=3))
+    ai._run_stream('s1', ai.LLAMA_MODEL, [], 0.5, 100, finish, lambda c: calls.append(c))
+    assert calls == [conn]
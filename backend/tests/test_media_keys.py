@@ -0,0 +1,55 @@
+"""Медиа по ключу из media_upload_url: сначала лимиты, потом чтение объекта.
+
+Запуск: python -m pytest backend/tests
+"""
+
+import json
+
+import pytest
+
+from test_query_counts import ai, conn, gemini_chat, user_row  # noqa: F401  (фикстуры)
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    calls = []
+
+    def read(file_key, user_id, kind):
+        calls.append(file_key)
+        return b'data'
+
+    monkeypatch.setattr(ai.media_upload, 'read', read)
+    monkeypatch.setattr(ai, '_discard_media', lambda *keys: None)
+    return calls
+
+
+def _photo_solve(**body):
+    event = {'httpMethod': 'POST', 'headers': {'X-Authorization': 'Bearer t'},
+             'body': json.dumps({'action': 'photo_solve', **body})}
+    response = ai.handler(event, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+@pytest.mark.parametrize('key', [123, ['k'], {'k': 1}])
+def test_non_string_key_is_bad_request(conn, gemini_chat, reads, key):  # noqa: F811
+    assert gemini_chat(message='Реши', image_key=key)[0] == 400
+    assert gemini_chat(message='Реши', audio_key=key)[0] == 400
+    assert _photo_solve(image_key=key)[0] == 400
+    assert reads == [] and conn.statements == []
+
+
+def test_exhausted_limit_does_not_download(conn, gemini_chat, reads):  # noqa: F811
+    conn.user = user_row(usage={'photos': ai.FREE_DAILY_PHOTOS, 'audio': ai.FREE_DAILY_AUDIO})
+    status, body = gemini_chat(message='Реши', image_key='media/photo/42/a.jpg')
+    assert status == 403 and body['feature'] == 'photo'
+    status, body = gemini_chat(message='Реши', audio_key='media/audio/42/a.webm')
+    assert status == 403 and body['feature'] == 'audio'
+    status, body = _photo_solve(image_key='media/photo/42/a.jpg')
+    assert status == 403
+    assert reads == []
+
+
+def test_key_is_read_once_within_limit(conn, gemini_chat, reads):  # noqa: F811
+    status, body = gemini_chat(message='Реши', image_key='media/photo/42/a.jpg')
+    assert status == 200 and body['answer']
+    assert reads == ['media/photo/42/a.jpg']
@@ -0,0 +1,233 @@
+"""Сколько запросов к БД делают проверки лимитов (entitlements).
+
+Соединение подменяется CountingConnection: оно записывает каждый execute и
+отдаёт заготовленные строки по таблице из запроса. Числа — те, что обещаны в
+описании entitlements: снимок users читается одним SELECT на запрос, списание
+лимита — по одному запросу на вид, «сброс» дневных счётчиков ничего не пишет.
+
+Запуск: python -m pytest backend/tests
+"""
+
+import base64
+import importlib.util
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USER_ID = 42
+SESSION_ID = 7
+
+
+def _load(function_dir, name):
+    """index.py функции под уникальным именем: у всех функций модуль называется index"""
+    path = os.path.join(BACKEND, function_dir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(path, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+os.environ.setdefault('JWT_SECRET', 'test')
+ai = _load('ai-assistant', 'ai_assistant_index')
+subscription = _load('subscription', 'subscription_index')
+entitlements = ai.entitlements
+SNAPSHOT_FROM = f'FROM {entitlements.SCHEMA_NAME}.users u'
+
+
+def user_row(**overrides):
+    now = datetime.now()
+    row = {
+        'subscription_type': 'free', 'subscription_expires_at': None, 'subscription_plan': None,
+        'trial_ends_at': now - timedelta(days=30), 'is_trial_used': True, 'created_at': now - timedelta(days=40),
+        'bonus_questions': 0, 'bonus_photos': 0, 'daily_premium_questions_used': 0,
+        'materials_quota_used': 0, 'materials_quota_reset_at': None,
+        'ai_questions_used': 0, 'ai_questions_reset_at': None,
+        'usage': {'questions': 1}, 'schedule_count': 3, 'tasks_count': 2,
+    }
+    row.update(overrides)
+    return row
+
+
+class CountingCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self._row = None
+
+    def execute(self, sql, params=None):
+        sql = ' '.join(sql.split())
+        self.conn.statements.append(sql)
+        self._row = self.conn.answer(sql)
+        self.rowcount = 1 if self._row is not None else 0
+
+    def fetchone(self):
+        return self._row
+
+    def fetchall(self):
+        return [self._row] if self._row is not None else []
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CountingConnection:
+    """Запоминает SQL каждого execute; строки отдаёт по таблице из запроса"""
+
+    def __init__(self, user):
+        self.user = user
+        self.statements = []
+        self.autocommit = False
+
+    def answer(self, sql):
+        if 'usage_counters' in sql and sql.startswith('WITH daily'):
+            return {'used': 2, 'bonus_left': 0, 'from_bonus': False, 'ok': True}
+        if SNAPSHOT_FROM in sql:
+            return self.user
+        if 'chat_sessions' in sql:
+            return (SESSION_ID,)
+        return None
+
+    def cursor(self, cursor_factory=None):
+        return CountingCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def snapshot_reads(self):
+        return [s for s in self.statements if SNAPSHOT_FROM in s]
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    c = CountingConnection(user_row())
+    fake_pool = SimpleNamespace(get_connection=lambda: c)
+    monkeypatch.setattr(ai, 'db_pool', fake_pool)
+    monkeypatch.setattr(subscription, 'db_pool', fake_pool)
+    monkeypatch.setattr(ai, 'get_user_id', lambda token: USER_ID)
+    monkeypatch.setattr(subscription, 'verify_token', lambda token: {'user_id': USER_ID})
+    return c
+
+
+def _get(module, action):
+    event = {'httpMethod': 'GET', 'queryStringParameters': {'action': action},
+             'headers': {'X-Authorization': 'Bearer t'}}
+    response = module.handler(event, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def test_load_is_one_select(conn):
+    ent = entitlements.load(conn, USER_ID)
+    assert ent.questions()['has_access']
+    ent.photos(), ent.audio(), ent.files()
+    assert len(conn.statements) == 1
+
+    conn.statements.clear()
+    entitlements.load(conn, USER_ID, with_counts=True)
+    assert len(conn.statements) == 1
+    assert 'schedule' in conn.statements[0] and 'tasks' in conn.statements[0]
+
+
+def test_load_after_day_rollover_writes_nothing(conn):
+    # Счётчики вчерашних суток в снимок не попадают — и UPDATE для сброса не нужен
+    conn.user = user_row(usage=None, ai_questions_reset_at=datetime.now() - timedelta(days=2))
+    ent = entitlements.load(conn, USER_ID)
+    assert ent.used('questions') == 0
+    assert len(conn.statements) == 1
+
+
+def test_ai_limits_is_one_select(conn):
+    status, body = _get(ai, 'limits')
+    assert status == 200
+    assert body['questions_used'] == 1
+    assert len(conn.statements) == 1
+
+
+@pytest.fixture
+def gemini_chat(conn, monkeypatch):
+    monkeypatch.setattr(ai, 'save_msg', lambda *a, **k: None)
+    monkeypatch.setattr(ai.session_memory, 'remember', lambda *a, **k: None)
+    monkeypatch.setattr(ai.llm_gateway, 'chat', lambda *a, **k: SimpleNamespace(content='Ответ.', tokens=10))
+    monkeypatch.setattr(ai.transcribe, 'transcribe',
+                        lambda c, audio, ext: ai.transcribe.Transcript('вопрос голосом', 1, 0))
+
+    def call(**body):
+        event = {'httpMethod': 'POST', 'headers': {'X-Authorization': 'Bearer t'},
+                 'body': json.dumps({'action': 'gemini_chat', **body})}
+        response = ai.handler(event, None)
+        return response['statusCode'], json.loads(response['body'])
+    return call
+
+
+def _consumes(conn):
+    return [s for s in conn.statements if s.startswith('WITH daily')]
+
+
+def test_gemini_chat_text_reads_snapshot_once(conn, gemini_chat):
+    status, body = gemini_chat(message='Что такое производная?')
+    assert status == 200 and body['answer']
+    # снимок + списание вопроса + поиск сессии
+    assert len(conn.snapshot_reads()) == 1
+    assert len(_consumes(conn)) == 1
+    assert len(conn.statements) == 3
+
+
+def test_gemini_chat_photo_and_audio_read_snapshot_once(conn, gemini_chat):
+    audio = base64.b64encode(b'RIFF').decode()
+    status, body = gemini_chat(message='Реши', image_base64='aGVsbG8=', audio_base64=audio, audio_format='wav')
+    assert status == 200 and body['answer']
+    # Проверки вопросов, аудио и фото — из одного снимка; списание — по запросу на вид
+    assert len(conn.snapshot_reads()) == 1
+    assert len(_consumes(conn)) == 3
+    assert len(conn.statements) == 5
+
+    # У premium вопросы безлимитны — их списание обходится без запроса
+    conn.statements.clear()
+    conn.user = user_row(subscription_type='premium', subscription_expires_at=datetime.now() + timedelta(days=5))
+    status, body = gemini_chat(message='Реши', image_base64='aGVsbG8=', audio_base64=audio, audio_format='wav')
+    assert status == 200 and body['answer']
+    assert len(conn.snapshot_reads()) == 1
+    assert len(_consumes(conn)) == 2
+
+
+def test_subscription_limits_is_one_select(conn):
+    status, body = _get(subscription, 'limits')
+    assert status == 200
+    assert len(conn.statements) == 1
+    assert 'schedule' in conn.statements[0] and 'tasks' in conn.statements[0]
+
+
+def test_subscription_limits_downgrades_expired_premium_once(conn):
+    conn.user = user_row(subscription_type='premium', subscription_expires_at=datetime.now() - timedelta(days=1))
+    status, body = _get(subscription, 'limits')
+    assert status == 200 and not body['is_premium']
+    assert len(conn.statements) == 2
+    assert conn.statements[1].startswith('UPDATE users')
+
+
+def test_premium_without_expiry_stays_premium(conn):
+    # Бессрочный premium (subscription_expires_at IS NULL) не понижается и не упирается в лимиты
+    conn.user = user_row(subscription_type='premium', subscription_expires_at=None)
+    assert entitlements.load(conn, USER_ID).is_premium
+    conn.statements.clear()
+    status, body = _get(subscription, 'limits')
+    assert status == 200 and body['is_premium']
+    assert len(conn.statements) == 1
@@ -0,0 +1,53 @@
+"""Почти-дубликаты ai_question_cache: чужой ответ только той же задаче.
+
+Пары повторяют FORMULA_PAIRS из report_semantic_cache.py. best_match зовётся с
+порогом 0, чтобы решали только проверки формулы и значимых слов.
+
+Запуск: python -m pytest backend/tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ai-assistant'))
+
+import semantic_cache  # noqa: E402
+
+PAIRS = [
+    ("Сколько будет 2*3?", "Сколько будет 2+3?", False),
+    ("Реши уравнение x^2+5x+6=0", "Реши уравнение x^2-5x+6=0", False),
+    ("Вычисли 12-4/1", "Вычисли 12/4-1", False),
+    ("Найди площадь квадрата со стороной 5", "Найди площадь квадрата со стороной 6", False),
+    ("Какой город столица Австралии", "Какой город столица Австрии", False),
+    ("Найди производную функции ln x", "Найди производную функции lg x", False),
+    ("Найди производную функции sin x", "Найди производную функции cos x", False),
+    ("Реши уравнение x^2-5x+6=0", "реши уравнение: x^2 - 5x + 6 = 0", True),
+    ("Объясни теорему Пифагора", "объясни, пожалуйста, теорему пифагора", True),
+    ("Что такое фотосинтез?", "Что такое фотосинтезз?", True),
+]
+
+
+def _sig(text):
+    return semantic_cache.signature(semantic_cache.normalize(text))
+
+
+@pytest.mark.parametrize('cached, question, expected', PAIRS)
+def test_best_match_pairs(cached, question, expected):
+    rows = [(cached, semantic_cache.to_bytes(_sig(cached)), 'answer')]
+    assert (semantic_cache.best_match(question, _sig(question), rows, threshold=0.0) is not None) == expected
+
+
+def test_one_word_neighbours_are_below_default_threshold_or_rejected():
+    # «Австрии» / «Австралии» набирают по n-граммам ≈0.875 — раньше это было выше порога
+    cached, question = "Какой город столица Австралии", "Какой город столица Австрии"
+    rows = [(cached, semantic_cache.to_bytes(_sig(cached)), 'answer')]
+    assert semantic_cache.AI_CACHE_SIMILARITY >= 0.9
+    assert semantic_cache.best_match(question, _sig(question), rows) is None
+
+
+def test_content_words_drop_stop_words_and_endings():
+    assert semantic_cache.content_words("Объясни, пожалуйста, теорему Пифагора") == \
+        semantic_cache.content_words("теорема пифагора")
+    assert semantic_cache.content_words("Найди производную функции lg x") >= {'lg', 'x'}
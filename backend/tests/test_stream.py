@@ -0,0 +1,93 @@
+"""Стриминг ответа: провайдеры и breaker'ы llm_gateway, поток совпадает с итогом.
+
+stream_completion подменяется: провайдер «присылает» заданные куски или падает
+после них. _run_stream пишет в ai_streams через подменённый _stream_append.
+
+Запуск: python -m pytest backend/tests
+"""
+
+import pytest
+
+from test_query_counts import ai, conn, user_row  # noqa: F401  (conn — фикстура)
+
+gateway = ai.llm_gateway
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    """Два провайдера с чистыми breaker'ами; script[name] — куски и, возможно, ошибка"""
+    made = {name: gateway.Provider(name, f'https://{name}', 'key', f'{name}-model', name == 'a')
+            for name in ('a', 'b')}
+    monkeypatch.setattr(gateway, '_PROVIDERS', made)
+    monkeypatch.setattr(gateway, 'LLM_PROVIDERS', ['a', 'b'])
+    script = {}
+
+    def fake_stream(url, api_key, body, cancelled=None, read_timeout=20.0, on_delta=None):
+        parts = script[url[len('https://'):]]
+        for part in parts:
+            if isinstance(part, Exception):
+                raise part
+            on_delta(part)
+        return ''.join(parts), 0
+
+    monkeypatch.setattr(gateway, 'stream_completion', fake_stream)
+    return made, script
+
+
+def test_fails_over_only_before_first_delta(providers):
+    made, script = providers
+    script['a'] = [RuntimeError('HTTP 502')]
+    script['b'] = ['Отв', 'ет.']
+    got = []
+    res = gateway.stream_chat([], got.append)
+    assert res.provider == 'b' and res.content == 'Ответ.'
+    assert got == ['Отв', 'ет.']
+    assert made['a'].breaker._failures == 1
+
+    # Пользователь уже видел начало — второй провайдер не спрашиваем, отдаём что есть
+    script['a'] = ['Нача', RuntimeError('reset')]
+    got.clear()
+    res = gateway.stream_chat([], got.append)
+    assert res.provider == 'a' and res.content == 'Нача'
+    assert got == ['Нача']
+
+
+def test_delivery_error_is_not_provider_failure(providers):
+    made, script = providers
+    script['a'] = ['Ответ']
+
+    def broken(text):
+        raise ValueError('db down')
+
+    with pytest.raises(ValueError):
+        gateway.stream_chat([], broken)
+    assert made['a'].breaker._failures == 0
+    assert made['a'].breaker.state == 'closed'
+
+
+def test_all_providers_down(providers):
+    made, script = providers
+    script['a'] = script['b'] = [RuntimeError('HTTP 500')]
+    with pytest.raises(gateway.LLMUnavailable):
+        gateway.stream_chat([], lambda text: None)
+
+
+def test_run_stream_matches_saved_answer(conn, providers, monkeypatch):  # noqa: F811
+    conn.user = user_row()
+    made, script = providers
+    # {..} через перевод строки: построчная очистка держит строку, пока скобка не закрыта
+    script['a'] = ['Получаем \\frac{a +', '\nb}{2}\n', '| x | y |\n|---|---|\n', '| 1 | 2 |\nИтого']
+    appended, saved = [], []
+    monkeypatch.setattr(ai, 'STREAM_FLUSH_SECONDS', 0)
+    monkeypatch.setattr(ai, '_stream_append', lambda c, sid, text, result=None: appended.append((text, result)))
+
+    def finish(c, answer, tokens):
+        saved.append(answer)
+        return {'answer': answer}
+
+    ai._run_stream('s1', ai.LLAMA_MODEL, [], 0.5, 100, finish)
+    shown = ''.join(text for text, _ in appended)
+    assert saved == [ai.finish_sentence(ai.sanitize_answer(''.join(script['a'])))]
+    assert appended[-1][1] == {'answer': saved[0]}
+    assert shown.endswith('Итого.')
+    assert ''.join(shown.split()) == ''.join(saved[0].split())
@@ -3,16 +3,13 @@
 import json
 import os
 from datetime import datetime, timedelta
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import urllib.request
+import db_pool
 
 
 def get_db_connection():
-    dsn = os.environ['DATABASE_URL']
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
-    return conn
+    return db_pool.get_connection()
 
 
 PUSH_URL = os.environ.get('PUSH_NOTIFICATIONS_URL', '')
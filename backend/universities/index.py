@@ -1,17 +1,13 @@
 """API для поиска университетов и колледжей России"""
 
 import json
-import os
-import psycopg2
 from psycopg2.extras import RealDictCursor
+import db_pool
 
 
 def get_db_connection():
     """Создаёт подключение к PostgreSQL базе данных"""
-    dsn = os.environ['DATABASE_URL']
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
-    return conn
+    return db_pool.get_connection()
 
 
 def handler(event: dict, context) -> dict:
@@ -1,13 +1,13 @@
 import json
 import os
 import jwt
-import psycopg2
 import hashlib
 import base64
 from datetime import datetime, timedelta
 import urllib.request
 import urllib.parse
 import urllib.error
+import db_pool
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
@@ -133,7 +133,7 @@ def handler(event, context):
 
         full_name = f"{first_name} {last_name}".strip()
 
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = db_pool.get_connection()
         cur = conn.cursor()
 
         cur.execute(f'''
@@ -210,7 +210,7 @@ def handler(event, context):
         except Exception:
             return err('Невалидный токен', 401)
 
-        conn = psycopg2.connect(DATABASE_URL)
+        conn = db_pool.get_connection()
         cur = conn.cursor()
 
         cur.execute(f'SELECT id FROM {SCHEMA_NAME}.users WHERE vk_id = %s', (vk_id,))
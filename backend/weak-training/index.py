@@ -2,20 +2,14 @@
 import json
 import os
 import jwt
-import psycopg2
-from openai import OpenAI
-import httpx
+import db_pool
+import llm_gateway
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA_NAME = os.environ.get('MAIN_DB_SCHEMA', 'public')
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key')
-OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY', '')
 
 LLAMA_MODEL = 'llama-4-maverick'
-OPENROUTER_BASE_URL = 'https://api.aitunnel.ru/v1/'
-
-_http = httpx.Client(timeout=httpx.Timeout(25.0, connect=5.0))
-client = OpenAI(api_key=OPENROUTER_API_KEY, base_url=OPENROUTER_BASE_URL, timeout=25.0, http_client=_http)
 
 CORS_HEADERS = {
     'Content-Type': 'application/json',
@@ -46,7 +40,7 @@ def get_user_id(event: dict) -> int | None:
         return None
 
 def get_conn():
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = db_pool.get_connection()
     conn.autocommit = True
     return conn
 
@@ -195,16 +189,19 @@ def generate_training(user_id: int, subject: str):
 Верни ТОЛЬКО JSON, без markdown-обёртки. Максимум 3 слабости."""
 
     try:
-        resp = client.chat.completions.create(
-            model=LLAMA_MODEL,
-            messages=[
+        resp = llm_gateway.chat(
+            [
                 {'role': 'system', 'content': 'Ты опытный репетитор-аналитик. Отвечай строго в формате JSON без markdown-обёртки. Анализируй глубоко, находи корневые причины ошибок.'},
                 {'role': 'user', 'content': prompt}
             ],
+            route='weak_analysis',
+            model=LLAMA_MODEL,
             temperature=0.6,
-            max_tokens=3000
+            max_tokens=3000,
+            timeout=25.0,
+            hedge_after=15.0,
         )
-        raw = resp.choices[0].message.content.strip()
+        raw = resp.content.strip()
         raw = raw.replace('```json', '').replace('```', '').strip()
         data = json.loads(raw)
         data['has_data'] = True
@@ -247,13 +244,8 @@ def chat_about_weakness(user_id: int, subject: str, topic: str, question: str, h
     msgs.append({'role': 'user', 'content': question})
 
     try:
-        resp = client.chat.completions.create(
-            model=LLAMA_MODEL,
-            messages=msgs,
-            temperature=0.7,
-            max_tokens=800
-        )
-        answer = resp.choices[0].message.content.strip()
+        resp = llm_gateway.chat(msgs, route='weak_chat', model=LLAMA_MODEL, temperature=0.7, max_tokens=800, timeout=25.0)
+        answer = resp.content.strip()
         is_correct = _detect_correct(answer)
         return {'answer': answer, 'is_correct': is_correct}
     except Exception as e:
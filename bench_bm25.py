@@ -0,0 +1,84 @@
+"""Бенчмарк выбора контекста по вопросу (BM25) для пользователя с сотнями чанков.
+
+Корпус — 5 материалов по 120 чанков ~3500 символов. Меряется:
+  upload — построение индекса при загрузке (токенизация + стемминг), на чанк;
+  query  — ранжирование по строкам document_terms только с терминами вопроса
+           (то, что ai-assistant читает из БД для проиндексированных материалов);
+  legacy — ранжирование без индекса: токенизация всех чанков на каждый вопрос.
+Запуск: python bench_bm25.py
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import text_index  # noqa: E402
+
+MATERIALS = 5
+CHUNKS = 120
+CHUNK_CHARS = 3500
+QUERIES = 200
+
+WORDS = ('производная функции интеграл предел уравнение неравенство логарифм степень корень '
+         'график точка касательная площадь объём скорость ускорение масса сила энергия закон '
+         'реакция кислота основание соль раствор клетка ядро белок ген организм история война '
+         'реформа государство право конституция экономика рынок спрос предложение цена '
+         'и в на по с для что как это при если то также где который').split()
+
+
+def _chunk(rnd):
+    out, size = [], 0
+    while size < CHUNK_CHARS:
+        w = rnd.choice(WORDS) + rnd.choice(('', 'а', 'ы', 'ов', 'ами', 'ой', 'ем'))
+        out.append(w)
+        size += len(w) + 1
+    return ' '.join(out)
+
+
+def main():
+    rnd = random.Random(7)
+    corpus = {(m, i): _chunk(rnd) for m in range(MATERIALS) for i in range(CHUNKS)}
+    questions = [' '.join(rnd.choice(WORDS[:40]) for _ in range(rnd.randint(2, 6))) + '?' for _ in range(QUERIES)]
+    print(f"чанков: {len(corpus)}, символов: {sum(map(len, corpus.values())):,}")
+
+    t0 = time.perf_counter()
+    index = {doc: text_index.chunk_terms(text) for doc, text in corpus.items()}
+    upload = (time.perf_counter() - t0) / len(corpus)
+    lengths = {doc: n for doc, (_, n) in index.items()}
+    inverted = {}
+    for doc, (tf, _) in index.items():
+        for term, count in tf.items():
+            inverted.setdefault(term, {})[doc] = count
+
+    t0 = time.perf_counter()
+    for q in questions:
+        terms = text_index.query_terms(q)
+        postings = {t: inverted.get(t, {}) for t in terms}
+        ranked = text_index.bm25_rank(terms, lengths, postings)
+        for _, doc in ranked[:3]:
+            text_index.best_window(corpus[doc], terms, 1200)
+    query = (time.perf_counter() - t0) / QUERIES
+
+    t0 = time.perf_counter()
+    for q in questions[:10]:
+        terms = text_index.query_terms(q)
+        postings, lens = {}, {}
+        for doc, text in corpus.items():
+            tf, n = text_index.chunk_terms(text)
+            lens[doc] = n
+            for t in terms:
+                if tf.get(t):
+                    postings.setdefault(t, {})[doc] = tf[t]
+        text_index.bm25_rank(terms, lens, postings)
+    legacy = (time.perf_counter() - t0) / 10
+
+    print(f"upload  {upload * 1e3:8.2f} ms/чанк")
+    print(f"query   {query * 1e3:8.2f} ms/вопрос (по индексу, с выбором окна)")
+    print(f"legacy  {legacy * 1e3:8.2f} ms/вопрос (токенизация всех чанков)")
+
+
+if __name__ == '__main__':
+    main()
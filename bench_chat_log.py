@@ -0,0 +1,175 @@
+"""Бенчмарк записи истории чата: по сообщению (как было) против очереди chat_log.
+
+Нагрузка — REQUESTS запросов в THREADS потоков, каждый пишет вопрос и ответ в
+одну из SESSIONS сессий. «Было»: на сообщение INSERT + UPDATE счётчика (+ UPDATE
+заголовка для вопроса) и commit. «Стало»: MessageLog — многострочный INSERT и
+один UPDATE сессий на сброс. Печатается время до записи всех сообщений,
+сообщений в секунду, число запросов к БД и commit'ов.
+
+Без DATABASE_URL соединение имитируется: RTT_MS на запрос и COMMIT_MS на
+commit (порядок сетевой задержки до управляемого Postgres). С DATABASE_URL
+пишется в TEMP-таблицы реальной БД.
+Запуск: [DATABASE_URL=...] python bench_chat_log.py
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REAL_DB = bool(os.environ.get('DATABASE_URL'))
+if REAL_DB:
+    os.environ['MAIN_DB_SCHEMA'] = 'pg_temp'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+import chat_log  # noqa: E402
+
+REQUESTS = 2000
+THREADS = 8
+SESSIONS = 200
+RTT_MS = 1.0
+COMMIT_MS = 2.0
+
+
+class SimConn:
+    """Соединение-заглушка: считает запросы и ждёт RTT; одно на всех, как реальное"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.statements = 0
+        self.commits = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, args=None):
+        with self.lock:
+            self.statements += 1
+            time.sleep(RTT_MS / 1000)
+
+    def mogrify(self, template, args):
+        return b'(' + b','.join(str(a).encode() for a in args) + b')'
+
+    @property
+    def connection(self):
+        return self
+
+    def fetchall(self):
+        return []
+
+    def commit(self):
+        with self.lock:
+            self.commits += 1
+            time.sleep(COMMIT_MS / 1000)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RealConn:
+    """Одно реальное соединение с TEMP-таблицами; close() ничего не закрывает"""
+
+    def __init__(self):
+        import psycopg2
+        self.raw = psycopg2.connect(os.environ['DATABASE_URL'])
+        self.lock = threading.Lock()
+        self.statements = 0
+        self.commits = 0
+        cur = self.raw.cursor()
+        cur.execute("""
+            CREATE TEMP TABLE chat_sessions (id SERIAL PRIMARY KEY, title VARCHAR(255) DEFAULT 'Новый чат',
+                updated_at TIMESTAMP, message_count INTEGER DEFAULT 0);
+            CREATE TEMP TABLE chat_messages (id SERIAL PRIMARY KEY, session_id INTEGER, user_id INTEGER,
+                role VARCHAR(20), content TEXT, material_ids INTEGER[], tokens_used INTEGER DEFAULT 0,
+                was_cached BOOLEAN DEFAULT FALSE, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        """)
+        cur.execute(f"INSERT INTO chat_sessions (id) SELECT generate_series(1, {SESSIONS})")
+        self.raw.commit()
+
+    def cursor(self):
+        conn = self
+
+        class _Cur:
+            def __init__(self):
+                self.c = conn.raw.cursor()
+                self.connection = conn.raw
+
+            def execute(self, sql, args=None):
+                conn.statements += 1
+                self.c.execute(sql, args)
+
+            def mogrify(self, *a):
+                return self.c.mogrify(*a)
+
+            def close(self):
+                self.c.close()
+        return _Cur()
+
+    def commit(self):
+        self.commits += 1
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        pass
+
+    def reset(self):
+        cur = self.raw.cursor()
+        cur.execute("TRUNCATE chat_messages; UPDATE chat_sessions SET message_count = 0, title = 'Новый чат'")
+        self.raw.commit()
+        self.statements = self.commits = 0
+
+
+def old_save_msg(conn, sid, uid, role, content):
+    with conn.lock:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO chat_messages (session_id,user_id,role,content,material_ids,tokens_used,was_cached) "
+                    "VALUES (%s,%s,%s,%s,%s,%s,%s)", (sid, uid, role, content, [], 0, False))
+        cur.execute("UPDATE chat_sessions SET message_count=message_count+1, updated_at=CURRENT_TIMESTAMP WHERE id=%s",
+                    (sid,))
+        if role == 'user':
+            cur.execute("UPDATE chat_sessions SET title=%s WHERE id=%s AND title='Новый чат'", (content[:100], sid))
+        conn.commit()
+
+
+def run(name, conn, save, finish):
+    def request(i):
+        sid = i % SESSIONS + 1
+        save(sid, sid, 'user', f'вопрос {i}')
+        save(sid, sid, 'assistant', f'ответ {i} ' * 20)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(request, range(REQUESTS)))
+    finish()
+    elapsed = time.monotonic() - started
+    messages = REQUESTS * 2
+    print(f"{name:<8}{elapsed:>9.2f}s{messages / elapsed:>12.0f}{conn.statements:>10}{conn.commits:>10}")
+
+
+def main():
+    conn_cls = RealConn if REAL_DB else SimConn
+    print(f"{'БД' if REAL_DB else f'имитация RTT {RTT_MS} мс, commit {COMMIT_MS} мс'}; "
+          f"{REQUESTS} запросов × 2 сообщения, {THREADS} потоков\n")
+    print(f"{'':<8}{'время':>10}{'сообщ/с':>12}{'запросов':>10}{'commit':>10}")
+
+    conn = conn_cls()
+    run('было', conn, lambda *a: old_save_msg(conn, *a), lambda: None)
+
+    if REAL_DB:
+        conn.reset()
+    else:
+        conn = conn_cls()
+    log = chat_log.MessageLog(lambda: conn)
+    run('стало', conn, log.add, log.close)
+    print(f"\nсбросов очереди: {log.stats['flushes']}, ошибок: {log.stats['errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Бенчмарк лимитера анонимных demo/free запросов ai-assistant под миллионом отпечатков.
+
+Сравнивает прежний словарь {key: [datetime, ...]} без вытеснения с DemoLimiter
+(ограниченный LRU со сроком жизни). Запуск: python bench_demo_limiter.py
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+from demo_limiter import DemoLimiter  # noqa: E402
+
+FINGERPRINTS = 1_000_000
+
+
+def legacy_hit(storage: dict, key: str, limit: int, window: int) -> bool:
+    now_ts = datetime.now()
+    hits = storage.get(key, [])
+    hits = [t for t in hits if (now_ts - t).total_seconds() < window]
+    if len(hits) >= limit:
+        return False
+    hits.append(now_ts)
+    storage[key] = hits
+    return True
+
+
+def _keys():
+    rnd = random.Random(7)
+    for i in range(FINGERPRINTS):
+        ip = f"{rnd.randrange(1, 255)}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}"
+        yield f"ask_{ip}_{i:016x}"
+
+
+def _run(name, make):
+    keys = list(_keys())
+
+    hit, size = make()
+    t0 = time.perf_counter()
+    for key in keys:
+        hit(key, 2, 86400)
+        hit(key, 2, 86400)
+    elapsed = time.perf_counter() - t0
+    held = size()
+    del hit, size
+
+    hit, _ = make()
+    tracemalloc.start()
+    for key in keys:
+        hit(key, 2, 86400)
+        hit(key, 2, 86400)
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{name:8s} {len(keys) * 2 / elapsed:>12,.0f} hits/s  keys held {held:>9,}  "
+          f"memory {current / 2**20:7.1f} MiB")
+
+
+def _legacy():
+    storage = {}
+    return (lambda k, l, w: legacy_hit(storage, k, l, w)), (lambda: len(storage))
+
+
+def _lru():
+    limiter = DemoLimiter()
+    return limiter.hit, (lambda: len(limiter))
+
+
+def main():
+    _run('legacy', _legacy)
+    _run('lru', _lru)
+
+
+if __name__ == '__main__':
+    main()
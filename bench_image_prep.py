@@ -0,0 +1,100 @@
+"""Бенчмарк подготовки фото перед OCR (ai-assistant/image_prep.py).
+
+Для каждого фото меряется размер тела запроса к vision-провайдеру (JSON с
+data URL) до и после подготовки и время самой подготовки. Если заданы ключи
+провайдеров (OPENROUTER_API_KEY / AITUNNEL_GEMINI_KEY / DEEPSEEK_API_KEY),
+дополнительно меряется время ocr_race.recognize() на исходнике и на
+подготовленном фото — латентность распознавания от начала до конца.
+
+Без аргументов генерируются снимки «как с телефона»: 4032×3024, JPEG q95,
+EXIF-поворот 6, текст задачи на неравномерном фоне с шумом.
+Запуск: python bench_image_prep.py [фото.jpg ...]
+"""
+
+import base64
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+import image_prep  # noqa: E402
+
+SAMPLES = 6
+PROMPT = "Перепиши весь текст с фото дословно, по-русски."
+
+
+def _synthetic(seed: int) -> bytes:
+    rnd = random.Random(seed)
+    w, h = 4032, 3024
+    img = Image.linear_gradient('L').resize((w, h)).convert('RGB')
+    img = Image.blend(img, Image.new('RGB', (w, h), (235, 228, 210)), 0.7)
+    noise = Image.effect_noise((w // 4, h // 4), 40).resize((w, h)).convert('RGB')
+    img = Image.blend(img, noise, 0.15)
+    draw = ImageDraw.Draw(img)
+    y = 200
+    while y < h - 200:
+        line = ' '.join(rnd.choice(('Решите', 'уравнение', 'x^2', '-', '5x', '+', '6', '=', '0', 'Найдите',
+                                    'производную', 'функции', 'f(x)', 'sin', 'на', 'отрезке', '[0;', 'pi]'))
+                        for _ in range(rnd.randint(6, 12)))
+        draw.text((250, y), line, fill=(30, 30, 40), font_size=90)
+        y += 140
+    img = img.filter(ImageFilter.GaussianBlur(1.2))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=95, exif=exif)
+    return out.getvalue()
+
+
+def _body_size(data_url: str) -> int:
+    return len(json.dumps({'model': 'gpt-4o-mini', 'messages': [{'role': 'user', 'content': [
+        {'type': 'image_url', 'image_url': {'url': data_url}}, {'type': 'text', 'text': PROMPT}]}]}))
+
+
+def _load() -> list:
+    if len(sys.argv) > 1:
+        return [(os.path.basename(p), open(p, 'rb').read()) for p in sys.argv[1:]]
+    return [(f'synthetic-{i}', _synthetic(i)) for i in range(SAMPLES)]
+
+
+def main():
+    photos = _load()
+    has_keys = any(os.environ.get(k) for k in ('OPENROUTER_API_KEY', 'AITUNNEL_GEMINI_KEY', 'DEEPSEEK_API_KEY'))
+    if has_keys:
+        import ocr_race
+    before, after, prep_ms, e2e = [], [], [], []
+    print(f"{'фото':<22}{'тело до':>12}{'тело после':>12}{'сжатие':>8}{'prep, мс':>10}")
+    for name, raw in photos:
+        b64 = base64.b64encode(raw).decode('ascii')
+        original_url = f'data:image/jpeg;base64,{b64}'
+        prepared = image_prep.prepare(b64)
+        before.append(_body_size(original_url))
+        after.append(_body_size(prepared.data_url))
+        prep_ms.append(prepared.elapsed * 1000)
+        print(f"{name[:21]:<22}{before[-1] / 1e6:>10.2f}MB{after[-1] / 1e6:>10.2f}MB"
+              f"{before[-1] / after[-1]:>7.1f}x{prep_ms[-1]:>10.0f}")
+        if has_keys:
+            t = time.monotonic()
+            ocr_race.recognize(original_url, PROMPT, log='BENCH')
+            t_orig = time.monotonic() - t
+            t = time.monotonic()
+            ocr_race.recognize(image_prep.prepare(b64).data_url, PROMPT, log='BENCH')
+            e2e.append((t_orig, time.monotonic() - t))
+    print(f"\nитого тело запроса: {sum(before) / 1e6:.1f}MB -> {sum(after) / 1e6:.1f}MB "
+          f"({sum(before) / sum(after):.1f}x), prep медиана {statistics.median(prep_ms):.0f} мс")
+    if e2e:
+        print(f"распознавание (медиана): исходник {statistics.median(t for t, _ in e2e):.2f}s, "
+              f"с подготовкой {statistics.median(t for _, t in e2e):.2f}s")
+    else:
+        print("ключи провайдеров не заданы — латентность распознавания не мерялась")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""Бенчмарк сборки промпта ask_ai (ai-assistant/prompt_builder.py).
+
+Сравнивает прежние _ask_system_prompt + _ask_messages (ниже, без изменений) с
+prompt_builder.build на типичных запросах: обычный чат без контекста, чат с
+материалами и длинной историей, режимы practice/mock с заданием в конце
+последнего ответа. Печатает оценку входных токенов (одна и та же
+estimate_tokens для обоих), время сборки и что уцелело: первый (самый
+релевантный) абзац материалов и текст задания, на которое отвечает ученик.
+Запуск: python bench_prompt.py
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+import prompt_builder  # noqa: E402
+
+CONTEXT_CHAR_BUDGET = 3000
+REPEAT = 2000
+
+
+# ── Прежняя сборка из ai-assistant/index.py ──────────────────────────────────
+
+def _ask_system_prompt(question, context, exam_meta=None) -> tuple:
+    """Системный промпт ask_ai и текст вопроса. exam_meta — строка 'тип|предмет_id|предмет|режим'"""
+    has_context = bool(context and len(context) > 50)
+    ctx_trimmed = context[:CONTEXT_CHAR_BUDGET] if has_context else ""
+
+    md_fmt = "Форматирование: используй **жирный** для ключевых терминов, ## заголовки, нумерованные списки для шагов, > цитаты для правил."
+    if exam_meta:
+        parts = exam_meta.split('|')
+        et = parts[0] if len(parts) > 0 else ''
+        sl = parts[2] if len(parts) > 2 else ''
+        mode = parts[3] if len(parts) > 3 else 'explain'
+        el = 'ЕГЭ' if et == 'ege' else 'ОГЭ'
+        if mode == 'practice':
+            system = (
+                f"Ты Studyfay — опытный репетитор-экзаменатор по «{sl}» ({el}). Русский. 1-2 эмодзи. Формулы текстом.\n{md_fmt}\n\n"
+                f"РЕЖИМ ПРАКТИКИ {el.upper()}:\n"
+                f"• Давай РЕАЛЬНЫЕ задания строго в формате {el} (как в КИМ ФИПИ). Указывай номер задания.\n"
+                "• Когда ученик отвечает — НЕМЕДЛЕННО проверяй:\n"
+                "  ✅ Правильно → похвали + объясни ПОЧЕМУ правильно (1-2 предложения) + дай следующее задание.\n"
+                "  ❌ Неверно → покажи правильный ответ + разбор ошибки + подсказку «Запомни:...» + следующее задание.\n"
+                "• Любое сообщение ученика = его ответ. Никогда не пропускай проверку.\n"
+                "• Чередуй темы и типы (тест/расчёт/анализ). Сложность нарастает.\n"
+                "• После 3-4 заданий подряд — короткий итог: «Ты уже разобрал X тем, отлично! 💪»\n"
+                "• В конце задания: «Жду твой ответ 👇»"
+            )
+        elif mode == 'explain':
+            system = (
+                f"Ты Studyfay — лучший репетитор по «{sl}» для {el}. Русский. 1-2 эмодзи. Формулы текстом.\n{md_fmt}\n\n"
+                "КАК ОБЪЯСНЯТЬ:\n"
+                "1) **Суть** — объясни простым языком, используй аналогию из жизни.\n"
+                "2) **Пример** — покажи на конкретной задаче или ситуации (как в экзамене).\n"
+                "3) **Ловушка** — предупреди о типичной ошибке: «Внимание: часто путают X с Y».\n"
+                "4) **Вопрос** — задай один вопрос по теме, чтобы ученик закрепил.\n\n"
+                "• Задачу — реши ПОЛНОСТЬЮ пошагово с пояснением каждого шага.\n"
+                "• Если тема сложная — разбей на части, предложи «Давай разберём по шагам».\n"
+                "• 4-8 предложений. Если просят подробнее — расширяй."
+            )
+        elif mode == 'weak':
+            system = (
+                f"Ты Studyfay — репетитор по «{sl}» ({el}). Специалист по СЛАБЫМ МЕСТАМ. Русский. 1-2 эмодзи. Формулы текстом.\n{md_fmt}\n\n"
+                "МЕТОД РАБОТЫ:\n"
+                "• Определи конкретную проблему ученика и работай ТОЧЕЧНО — не уходи в сторону.\n"
+                "• Дай ПРАВИЛО-ШПАРГАЛКУ: «🔑 Запомни: если X — то всегда Y».\n"
+                "• Покажи ПРИЁМ решения: «Лайфхак: чтобы не ошибиться, делай так...».\n"
+                "• Предупреди об ОШИБКЕ: «⚠️ Типичная ловушка: многие думают X, но на самом деле Y».\n"
+                "• ОБЯЗАТЕЛЬНО дай тренировочное задание того же типа + «Жду ответ 👇».\n"
+                "• При проверке: ✅/❌ + разбор + если неверно — объясни ту же тему ДРУГИМИ словами."
+            )
+        elif mode == 'mock':
+            system = (
+                f"Ты строгий экзаменатор {el} по «{sl}». Имитируешь реальный экзамен. Русский. Формулы текстом.\n{md_fmt}\n\n"
+                "СТРОГИЙ РЕЖИМ:\n"
+                f"• Задания ТОЧНО как в КИМ {el} — официальные формулировки и сложность.\n"
+                "• Нумеруй: «📝 Задание 1», «📝 Задание 2» и т.д.\n"
+                "• Оценка ответа: «✅ Верно» или «❌ Неверно» + объяснение (1-2 предложения) + сразу следующее.\n"
+                "• Засчитывай только ТОЧНЫЕ ответы. Неполный = неверно (объясни что не хватает).\n"
+                "• Без подсказок. После каждых 5 заданий — краткий счёт: «Результат: X/5 ✅».\n"
+                "• В конце задания: «Ваш ответ?»"
+            )
+        else:
+            system = (
+                f"Ты Studyfay — репетитор по «{sl}» для {el}. Русский. 1-2 эмодзи. Формулы текстом.\n{md_fmt}\n"
+                "Структура: суть простыми словами → конкретный пример → совет для экзамена → вопрос ученику."
+            )
+        user_content = question[:1000]
+    else:
+        system = (
+            "Ты Studyfay — умный и дружелюбный ассистент. Помогаешь школьникам, студентам и всем, кто спрашивает.\n\n"
+            "КАК ТЫ РАБОТАЕШЬ:\n"
+            "• Отвечай на ЛЮБЫЕ вопросы — учебные, бытовые, про предметы, технику, кулинарию, природу и т.д.\n"
+            "• Объясняй ПРОСТЫМИ СЛОВАМИ — как будто рассказываешь другу. Используй аналогии из жизни.\n"
+            "• Если задача — реши ПОЛНОСТЬЮ пошагово. Каждый шаг на отдельной строке с пояснением «почему».\n"
+            "• Если вопрос бытовой или общий — дай полезный, конкретный ответ с примерами.\n"
+            "• Если пользователь прислал фото чего-то (кафель, еда, предмет) — опиши что это и помоги.\n"
+            "• В КОНЦЕ ответа задай ОДИН короткий вопрос по теме.\n\n"
+            "ФОРМАТИРОВАНИЕ (обязательно):\n"
+            "• Используй markdown: **жирный** для ключевых терминов и ответов.\n"
+            "• Используй ## заголовки для разделов.\n"
+            "• Используй нумерованные списки (1. 2. 3.) для пошаговых решений.\n"
+            "• Используй маркированные списки (- ...) для перечислений.\n"
+            "• Используй > цитаты для важных правил/формул.\n\n"
+            "СТИЛЬ:\n"
+            "• Русский. Формулы текстом: x^2, sqrt(x), a/b. Без LaTeX.\n"
+            "• 4-8 предложений. Если просят подробнее — расширяй.\n"
+            "• 1-2 эмодзи. Тон тёплый и поддерживающий, но фактически точный.\n"
+            "• Не переспрашивай — отвечай сразу. Если вопрос неясен — дай лучший ответ + уточни.\n\n"
+            "СТРОГИЕ ЗАПРЕТЫ:\n"
+            "• НИКОГДА не отказывай отвечать. Если тема не учебная — всё равно помоги.\n"
+            "• НИКОГДА не используй иероглифы, китайские/японские/корейские символы.\n"
+            "• НИКОГДА не рисуй таблицы (ни ASCII, ни markdown-таблицы с | и ---). Вместо таблиц используй нумерованный список.\n"
+            "• НИКОГДА не ссылайся на картинки, схемы, графики, диаграммы — ты не можешь их показать.\n"
+            "• НИКОГДА не используй LaTeX, формулы в $...$ или \\frac{}{}. Пиши формулы простым текстом.\n"
+            "• Каждый ответ должен быть УНИКАЛЬНЫМ — не повторяй шаблонные фразы. Адаптируй стиль под контекст вопроса.\n"
+            "• Не начинай каждый ответ одинаково — варьируй вступление."
+        )
+        user_content = question[:1000]
+
+    system += "\n\nСТРОГИЕ ЗАПРЕТЫ (нарушение = ошибка):\n• НЕ показывай картинки/схемы/графики/диаграммы. Не пиши «смотри на рисунок».\n• НЕ используй иероглифы или нелатинские/нерусские символы.\n• НЕ рисуй таблицы (ни ASCII с |---, ни markdown). Используй нумерованный список.\n• НЕ используй LaTeX ($, \\frac, \\sqrt). Формулы ТОЛЬКО текстом: x^2, sqrt(x), a/b.\n• Каждый ответ УНИКАЛЕН — варьируй стиль, вступления и примеры. Не повторяй шаблоны."
+
+    if has_context:
+        system += f"\n\nМатериалы пользователя (используй для ответа):\n{ctx_trimmed}"
+    return system, user_content
+
+
+def _ask_messages(system, user_content, history=None) -> list:
+    messages_list = [{"role": "system", "content": system}]
+    if history:
+        for h in history[-6:]:
+            role = h.get('role', 'user')
+            content = h.get('content', '')
+            if role in ('user', 'assistant') and content:
+                messages_list.append({"role": role, "content": content[:400]})
+    messages_list.append({"role": "user", "content": user_content})
+    return messages_list
+
+
+# ── Сценарии ─────────────────────────────────────────────────────────────────
+
+PARAGRAPH = ("Производная функции в точке равна пределу отношения приращения функции к приращению "
+             "аргумента, когда приращение аргумента стремится к нулю. Геометрически это угловой "
+             "коэффициент касательной к графику функции в данной точке. ")
+CONTEXT = "\n\n".join(
+    ["## Конспект: производная (алгебра)", "КЛЮЧЕВОЙ_АБЗАЦ: " + PARAGRAPH * 2]
+    + [PARAGRAPH * 2 for _ in range(3)]
+    + ["## Учебник: глава 5 (алгебра)"] + [PARAGRAPH * 2 for _ in range(3)]
+)[:CONTEXT_CHAR_BUDGET]
+TASK = "📝 Задание 7. Найдите производную функции f(x) = 3x^2 - 4x + 1 в точке x0 = 2. Жду твой ответ 👇"
+ANSWER = ("✅ Верно! Ты правильно применил правило дифференцирования степенной функции. "
+          "Производная суммы равна сумме производных, а производная константы равна нулю. ") * 4
+HISTORY = []
+for i in range(4):
+    HISTORY += [{"role": "user", "content": f"Мой ответ: {i + 3}. " + "Я считал так: сначала нашёл производную, потом подставил точку. " * 3},
+                {"role": "assistant", "content": ANSWER + "\n\n" + TASK}]
+
+SCENARIOS = [
+    ('чат, без контекста', "Что такое фотосинтез?", "", None, []),
+    ('чат, материалы + история', "Объясни, как найти производную сложной функции?", CONTEXT, None, HISTORY),
+    ('practice, история', "Мой ответ: 8", "", "ege|2|Математика профиль|practice", HISTORY),
+    ('mock, материалы + история', "Ответ: 8", CONTEXT, "oge|2|Математика|mock", HISTORY),
+    ('explain, материалы', "Объясни теорему Виета", CONTEXT, "ege|2|Математика профиль|explain", []),
+]
+
+
+def tokens(messages):
+    return sum(prompt_builder.estimate_tokens(m["content"]) + prompt_builder.MESSAGE_OVERHEAD for m in messages)
+
+
+def old_build(q, ctx, meta, history):
+    system, user_content = _ask_system_prompt(q, ctx, meta)
+    return _ask_messages(system, user_content, history)
+
+
+def timed(fn, *args):
+    t = time.perf_counter()
+    for _ in range(REPEAT):
+        fn(*args)
+    return (time.perf_counter() - t) / REPEAT * 1e6
+
+
+def main():
+    print(f"бюджет {prompt_builder.PROMPT_TOKEN_BUDGET} ток. (контекст ≤ {prompt_builder.CONTEXT_TOKEN_BUDGET}, "
+          f"история ≤ {prompt_builder.HISTORY_TOKEN_BUDGET})\n")
+    print(f"{'сценарий':<28}{'токены было→стало':>20}{'сборка, мкс':>16}  ключевой абзац / задание")
+    total_old = total_new = 0
+    for name, q, ctx, meta, history in SCENARIOS:
+        # build() пишет в лог строку [PROMPT] на каждый вызов
+        with contextlib.redirect_stdout(io.StringIO()):
+            old = old_build(q, ctx, meta, history)
+            new = prompt_builder.build(q, ctx, meta, history).messages
+            us_old = timed(old_build, q, ctx, meta, history)
+            us_new = timed(prompt_builder.build, q, ctx, meta, history)
+        t_old, t_new = tokens(old), tokens(new)
+        total_old += t_old
+        total_new += t_new
+        kept = []
+        if ctx:
+            kept.append('абзац ' + ('да/да' if 'КЛЮЧЕВОЙ_АБЗАЦ' in old[0]["content"] and 'КЛЮЧЕВОЙ_АБЗАЦ' in new[0]["content"] else 'НЕТ'))
+        if history:
+            has_task = lambda msgs: any('Задание 7' in m["content"] for m in msgs[1:-1])
+            kept.append(f"задание {'да' if has_task(old) else 'нет'}→{'да' if has_task(new) else 'нет'}")
+        print(f"{name:<28}{t_old:>9} → {t_new:<8}{us_old:>8.0f} → {us_new:<6.0f}  {', '.join(kept)}")
+    print(f"\nитого входных токенов: {total_old} → {total_new} ({(1 - total_new / total_old) * 100:.0f}% меньше)")
+
+
+if __name__ == '__main__':
+    main()
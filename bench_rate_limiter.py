@@ -0,0 +1,93 @@
+"""Микро-бенчмарк rate limiter: стоимость одной проверки при 100k активных ключей.
+
+Сравнивает старую реализацию (список меток времени на ключ + md5) с GCRA из
+backend/rate_limiter.py (одно число на ключ). Запуск: python bench_rate_limiter.py
+"""
+
+import hashlib
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import rate_limiter  # noqa: E402
+
+KEYS = 100_000
+CHECKS = 500_000
+MAX_REQUESTS = 120
+WINDOW = 60
+
+
+class LegacyLimiter:
+    """Прежний алгоритм: sliding log со списком всех запросов в окне"""
+
+    def __init__(self):
+        self.storage = {}
+
+    def check(self, identifier, max_requests, window_seconds):
+        now = time.time()
+        key = hashlib.md5(identifier.encode()).hexdigest()
+        if key not in self.storage:
+            self.storage[key] = {'requests': []}
+        record = self.storage[key]
+        record['requests'] = [r for r in record['requests'] if now - r < window_seconds]
+        if len(record['requests']) >= max_requests:
+            return False
+        record['requests'].append(now)
+        return True
+
+
+def _keys():
+    return [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}_schedule" for i in range(KEYS)]
+
+
+def _run(name, check):
+    keys = _keys()
+    rnd = random.Random(42)
+    # Прогрев: каждый ключ активен, у «горячих» 1% ключей почти полное окно
+    for k in keys:
+        check(k)
+    hot = keys[:KEYS // 100]
+    for _ in range(MAX_REQUESTS - 10):
+        for k in hot:
+            check(k)
+
+    sample = [hot[rnd.randrange(len(hot))] if rnd.random() < 0.5 else keys[rnd.randrange(KEYS)]
+              for _ in range(CHECKS)]
+    t0 = time.perf_counter()
+    for k in sample:
+        check(k)
+    elapsed = time.perf_counter() - t0
+    print(f"{name:8s} {elapsed / CHECKS * 1e6:8.2f} µs/check  {CHECKS / elapsed:>12,.0f} checks/s")
+
+
+def main():
+    legacy = LegacyLimiter()
+    _run('legacy', lambda k: legacy.check(k, MAX_REQUESTS, WINDOW))
+
+    store = rate_limiter.MemoryStore()
+    _run('gcra', lambda k: store.acquire(k, MAX_REQUESTS, WINDOW))
+
+    tracemalloc.start()
+    s = rate_limiter.MemoryStore()
+    for k in _keys():
+        s.acquire(k, MAX_REQUESTS, WINDOW)
+    gcra_mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    l = LegacyLimiter()
+    for k in _keys():
+        for _ in range(10):
+            l.check(k, MAX_REQUESTS, WINDOW)
+    legacy_mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"memory at {KEYS:,} keys: gcra {gcra_mem / 2**20:.1f} MiB, "
+          f"legacy (10 req/key) {legacy_mem / 2**20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
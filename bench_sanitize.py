@@ -0,0 +1,320 @@
+"""Проверка и бенчмарк очистки ответов ИИ (ai-assistant/answer_sanitizer.py).
+
+Золотой корпус — ручные примеры на каждое правило (LaTeX всех видов, вложенные
+команды, таблицы markdown и псевдографикой, иероглифы, разделители, пробелы)
+плюс CORPUS_SIZE ответов, собранных из тех же фрагментов и обычного текста.
+Эталон — прежняя реализация из index.py (ниже, без изменений): вывод
+sanitize_answer должен совпасть на всём корпусе. Потоковый режим проверяется
+нарезкой каждого ответа на случайные куски по 1–12 символов: result() нового
+IncrementalSanitizer совпадает с прежним, а поток с точкой finish_sentence — с
+result() с точностью до пробелов (так его дописывает _run_stream). Поток нового
+и прежнего расходится только там, где {..} занимает несколько строк.
+Время — на ответ: обычный (без формул и таблиц), с формулами, и стриминг
+ответа токенами по ~4 символа.
+Запуск: python bench_sanitize.py
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+import answer_sanitizer  # noqa: E402
+
+CORPUS_SIZE = 3000
+SEED = 21
+
+
+# ── Эталон: прежняя реализация из ai-assistant/index.py ──────────────────────
+
+def _convert_ascii_table(text):
+    """Конвертирует ASCII-таблицы с черточками в читаемый текст"""
+    import re
+    lines = text.split('\n')
+    result = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        # Определяем строку-разделитель типа |---|---|
+        if re.match(r'^\s*\|[\s\-\|:]+\|\s*$', line):
+            i += 1
+            continue
+        # Определяем строку таблицы с | ... | ... |
+        if re.match(r'^\s*\|.+\|', line):
+            cells = [c.strip() for c in line.strip().strip('|').split('|')]
+            if len(cells) > 1:
+                result.append('  '.join(cells))
+                i += 1
+                continue
+        result.append(line)
+        i += 1
+    return '\n'.join(result)
+
+
+def sanitize_answer(text):
+    """Убирает LaTeX, псевдографику, иероглифы, таблицы и форматирует ответ ИИ"""
+    import re
+    if not text:
+        return text
+    # Убираем блочный LaTeX: \[...\] и $$...$$
+    text = re.sub(r'\\\[.*?\\\]', lambda m: m.group(0).replace('\\[', '').replace('\\]', '').strip(), text, flags=re.DOTALL)
+    text = re.sub(r'\$\$.*?\$\$', lambda m: m.group(0).replace('$$', '').strip(), text, flags=re.DOTALL)
+    # Убираем инлайн LaTeX: $...$ и \(...\)
+    text = re.sub(r'\\\(.*?\\\)', lambda m: m.group(0).replace('\\(', '').replace('\\)', '').strip(), text, flags=re.DOTALL)
+    text = re.sub(r'(?<!\$)\$(?!\$)([^$]+?)(?<!\$)\$(?!\$)', r'\1', text)
+    # Убираем LaTeX-команды типа \frac, \sqrt, \cdot и т.д.
+    text = re.sub(r'\\(frac|sqrt|cdot|times|div|pm|leq|geq|neq|approx|infty|alpha|beta|gamma|delta|theta|lambda|mu|pi|sigma|omega)\b', '', text)
+    text = re.sub(r'\\[a-zA-Z]+\{([^}]*)\}', r'\1', text)
+    text = re.sub(r'\\[a-zA-Z]+', '', text)
+    # Убираем фигурные скобки LaTeX
+    text = re.sub(r'\{([^}]*)\}', r'\1', text)
+    # Конвертируем ASCII-таблицы в читаемый вид
+    text = _convert_ascii_table(text)
+    # Убираем псевдографику: ^ как степень оставляем, убираем декоративные символы
+    text = re.sub(r'[│├┤┬┴┼╔╗╚╝║═╠╣╦╩╬┌┐└┘─]', '', text)
+    # Убираем иероглифы (CJK символы)
+    text = re.sub(r'[\u4e00-\u9fff\u3400-\u4dbf\u3000-\u303f\u3040-\u309f\u30a0-\u30ff\uff00-\uffef\u2e80-\u2eff\u31c0-\u31ef]+', '', text)
+    # Убираем подчёркивания-разделители типа _____ или ------- стоящие отдельной строкой
+    text = re.sub(r'^\s*[-_=]{3,}\s*$', '', text, flags=re.MULTILINE)
+    # Убираем markdown-таблицы (строки начинающиеся и заканчивающиеся на |)
+    text = re.sub(r'^\s*\|[\s\-\|:]+\|\s*$', '', text, flags=re.MULTILINE)
+    # Чистим лишние пробелы
+    text = re.sub(r' {2,}', ' ', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+
+
+def _finish_sentence(text):
+    if text and not text.rstrip().endswith(('.', '!', '?', ')', '»', '`', '*')):
+        return text.rstrip() + '.'
+    return text
+
+
+class IncrementalSanitizer:
+    """sanitize_answer для стриминга: текст отдаётся целыми строками, а строка
+    придерживается, пока не закрыты $..$, $$..$$, \\[..\\], \\(..\\). Правила
+    sanitize_answer не выходят за пределы строки или такого блока, поэтому поток
+    совпадает с пакетной обработкой с точностью до пустых строк. Итоговый текст
+    для сохранения — result(), он считается по всему ответу как раньше."""
+
+    # Если блок так и не закрылся — не держим больше стольких символов
+    MAX_PENDING = 2000
+
+    def __init__(self):
+        self._raw = []
+        self._pending = ''
+        self._newlines = 0
+        self._started = False
+
+    @staticmethod
+    def _balanced(text):
+        if text.count('\\[') != text.count('\\]') or text.count('\\(') != text.count('\\)'):
+            return False
+        if text.count('$$') % 2:
+            return False
+        return text.replace('$$', '').count('$') % 2 == 0
+
+    def feed(self, delta):
+        """Принимает очередной кусок от модели, возвращает готовый к показу текст"""
+        if not delta:
+            return ''
+        self._raw.append(delta)
+        self._pending += delta
+        cut = self._pending.rfind('\n') + 1
+        if cut <= 0:
+            return ''
+        segment = self._pending[:cut]
+        if not self._balanced(segment) and len(self._pending) < self.MAX_PENDING:
+            return ''
+        self._pending = self._pending[cut:]
+        return self._emit(segment)
+
+    def flush(self):
+        """Отдаёт остаток после окончания генерации"""
+        segment, self._pending = self._pending, ''
+        return self._emit(segment)
+
+    def result(self):
+        return _finish_sentence(sanitize_answer(''.join(self._raw)))
+
+    def _emit(self, segment):
+        text = sanitize_answer(segment)
+        if not text:
+            # Пустые строки копим, а вырезанную целиком строку (разделитель таблицы) — нет
+            if not segment.strip():
+                self._newlines += segment.count('\n')
+            return ''
+        leading = len(segment) - len(segment.lstrip())
+        self._newlines += segment[:leading].count('\n')
+        sep = '\n' * min(2, max(1, self._newlines)) if self._started else ''
+        stripped = segment.rstrip()
+        self._newlines = segment[len(stripped):].count('\n')
+        self._started = True
+        return sep + text
+
+
+# ── Корпус ───────────────────────────────────────────────────────────────────
+
+HANDCRAFTED = [
+    'Привет! Чем могу помочь?',
+    'Ответ: 42',
+    '',
+    '   \n\n  ',
+    'Решим уравнение $2x^2 - 5x + 3 = 0$. Дискриминант $D = b^2 - 4ac = 25 - 24 = 1$.',
+    'Формула: \\[ x = \\frac{-b \\pm \\sqrt{D}}{2a} \\] и всё.',
+    '$$\nS = \\pi r^2\n$$\nгде r — радиус.',
+    'Инлайн \\(a^2 + b^2 = c^2\\) — теорема Пифагора.',
+    '\\frac{\\sqrt{x}}{2} и \\sqrt{\\frac{a}{b}}',
+    '\\textbf{Важно}: \\alpha + \\beta = \\gamma, \\cdot \\times \\div',
+    '\\pi2 и \\frac2 и \\unknown{арг} и \\mathbb{R}',
+    'Цена $5 и $10 долларов, а $$ не закрыт',
+    'Одиночный $ без пары',
+    '{вложенные {скобки}} и {простые}',
+    '| Формула | Значение |\n|---|---|\n| a | 1 |\n| b | 2 |\nКонец таблицы.',
+    '  | x | y |  \n | :-- | --: |\n| 1 | 2 |',
+    '|одна ячейка|',
+    '┌───┬───┐\n│ a │ b │\n├───┼───┤\n│ 1 │ 2 │\n└───┴───┘',
+    '╔══╗\n║ok║\n╚══╝',
+    'Текст с иероглифами 你好世界 и японскими カタカナ ひらがな и ＡＢＣ',
+    'Первая часть\n\n-----\n\nВторая часть\n____\n===\n-_=\nТретья',
+    'Много    пробелов   здесь\n\n\n\n\nи пустых строк',
+    '1. Первый пункт\n2. Второй пункт\n   - вложенный\n\n**Итог**: готово',
+    '```python\nprint({"a": 1})\n```',
+    'x^2 + y^2 = r^2, a_1 + a_2',
+    '\\[\na + b\n\\] и $$c$$ и \\(d\\) и $e$',
+    '$$ a \\[ b $$ c \\]',
+    '\\( \\[ x \\) \\]',
+    'Обратный слеш в пути C:\\Users\\name и \\n',
+    'Таблица без разделителя\n| a | b |\n| c | d |',
+    '|---|\n|:-:|',
+    'Строка | с | вертикальными | чертами в середине',
+    '\t\tТабы\t\tи пробелы  \n',
+    'Получаем \\frac{a +\nb}{2} и {многострочные\nскобки} конец',
+    '\\textbf{Важно\n}: проверь знак',
+]
+
+FRAGMENTS = [
+    'Производная функции показывает скорость её изменения.',
+    'Рассмотрим пример подробно.',
+    'Шаг 1. Найдём область определения.',
+    'Подставим значения: $x = 2$, $y = 3$.',
+    'Получаем \\frac{a}{b} = \\frac{3}{4}.',
+    '\\[ \\int_0^1 x^2 dx = \\frac{1}{3} \\]',
+    '$$E = mc^2$$',
+    '\\(\\sin^2 x + \\cos^2 x = 1\\)',
+    '| Величина | Обозначение |\n|----------|-------------|\n| Масса | m |\n| Сила | F |',
+    '┌──────┐\n│ итог │\n└──────┘',
+    '---',
+    '__________',
+    'Ответ:   x = 5.',
+    '你好',
+    '{скобки}',
+    '**Важно:** не забудь единицы измерения.',
+    '- пункт списка\n- ещё пункт',
+    '',
+    'Стоимость $15 за штуку.',
+    'Итак, \\sqrt{16} = 4 и \\pi \\approx 3.14.',
+]
+
+PLAIN = [
+    'Фотосинтез — процесс образования органических веществ из углекислого газа и воды на свету.',
+    'Реформы Петра I изменили систему управления государством.',
+    'Сила тока прямо пропорциональна напряжению и обратно пропорциональна сопротивлению.',
+    '**Пример:** если скорость 10 м/с, то за 5 секунд тело пройдёт 50 метров.',
+    '1. Запиши условие.\n2. Найди неизвестное.\n3. Проверь ответ.',
+    'Кислоты реагируют с основаниями с образованием соли и воды.',
+]
+
+
+def build_corpus(rnd):
+    corpus = list(HANDCRAFTED)
+    for _ in range(CORPUS_SIZE):
+        parts = [rnd.choice(FRAGMENTS if rnd.random() < 0.5 else PLAIN) for _ in range(rnd.randint(1, 25))]
+        seps = ['\n', '\n\n', ' ', '\n\n\n', '  ']
+        corpus.append(''.join(p + rnd.choice(seps) for p in parts))
+    return corpus
+
+
+def plain_answers(rnd, n):
+    return ['\n\n'.join(rnd.choice(PLAIN) for _ in range(rnd.randint(8, 20))) for _ in range(n)]
+
+
+def chunks(text, rnd, lo=1, hi=12):
+    out, i = [], 0
+    while i < len(text):
+        n = rnd.randint(lo, hi)
+        out.append(text[i:i + n])
+        i += n
+    return out
+
+
+def stream(sanitizer, parts):
+    out = ''.join(sanitizer.feed(p) for p in parts) + sanitizer.flush()
+    return out, sanitizer.result()
+
+
+def _words(text):
+    return ''.join((text or '').split())
+
+
+def per_answer(fn, texts, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for text in texts:
+            fn(text)
+        best = min(best, time.perf_counter() - t)
+    return best / len(texts) * 1e6
+
+
+def main():
+    rnd = random.Random(SEED)
+    corpus = build_corpus(rnd)
+
+    mismatches = [t for t in corpus if answer_sanitizer.sanitize_answer(t) != sanitize_answer(t)]
+    print(f"золотой корпус: {len(corpus)} ответов, расхождений sanitize_answer: {len(mismatches)}")
+    for t in mismatches[:3]:
+        print(f"  {t[:80]!r}")
+
+    stream_diff = result_diff = 0
+    shown_diff = {'прежний': 0, 'новый': 0}
+    for t in corpus:
+        parts = chunks(t, rnd)
+        new_out, new_result = stream(answer_sanitizer.IncrementalSanitizer(), parts)
+        old_out, old_result = stream(IncrementalSanitizer(), parts)
+        stream_diff += new_out != old_out
+        result_diff += new_result != old_result
+        shown_diff['прежний'] += _words(_finish_sentence(old_out)) != _words(old_result)
+        shown_diff['новый'] += _words(answer_sanitizer.finish_sentence(new_out)) != _words(new_result)
+    print(f"стриминг кусками 1–12 символов: расхождений потока {stream_diff}, итогового текста {result_diff}")
+    print(f"поток ≠ итог (без учёта пробелов): прежний {shown_diff['прежний']}, новый {shown_diff['новый']}\n")
+
+    plain = plain_answers(rnd, 300)
+    latex = [t for t in corpus if '$' in t or '\\' in t][:300]
+    long_stream = ['\n'.join(rnd.choice(FRAGMENTS + PLAIN) for _ in range(60)) for _ in range(30)]
+    token_parts = [chunks(t, random.Random(i), 2, 6) for i, t in enumerate(long_stream)]
+
+    print(f"{'':<36}{'было, мкс':>12}{'стало, мкс':>12}{'ускорение':>11}")
+    rows = [
+        (f'обычный ответ (~{sum(map(len, plain)) // len(plain)} симв.)', sanitize_answer,
+         answer_sanitizer.sanitize_answer, plain),
+        (f'с формулами/таблицами (~{sum(map(len, latex)) // len(latex)} симв.)', sanitize_answer,
+         answer_sanitizer.sanitize_answer, latex),
+        (f'стриминг токенами (~{sum(map(len, long_stream)) // len(long_stream)} симв.)',
+         lambda i: stream(IncrementalSanitizer(), token_parts[i]),
+         lambda i: stream(answer_sanitizer.IncrementalSanitizer(), token_parts[i]), range(len(long_stream))),
+    ]
+    for name, old, new, data in rows:
+        data = list(data)
+        t_old, t_new = per_answer(old, data), per_answer(new, data)
+        print(f"{name:<36}{t_old:>12.1f}{t_new:>12.1f}{t_old / t_new:>10.1f}x")
+
+    if mismatches or result_diff:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Бенчмарк памяти диалога (ai-assistant/session_memory.py).
+
+Сравнивает прежнюю схему, где клиент в каждом запросе присылает последние 10
+сообщений, с серверной: конспект сессии + последний обмен репликами. Для
+диалогов разной длины печатает размер тела запроса, входные токены промпта
+ask_ai (prompt_builder.build), токены памяти в промпте gemini_chat (одна и та
+же estimate_tokens) и сколько реплик модель видит дословно — с конспектом
+модель помнит весь диалог. Конспект здесь — текст типичной длины, модель не вызывается.
+Запуск: python bench_session_memory.py
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+import prompt_builder  # noqa: E402
+
+CLIENT_HISTORY = 10
+
+QUESTION = "А почему у производной сложной функции множители перемножаются, а не складываются?"
+SUMMARY = (
+    "Ученик готовится к ЕГЭ по профильной математике, задание 12 и 8. Тема — производные: "
+    "таблицу производных знает, путает производную частного (забывает квадрат знаменателя). "
+    "Разобрали правило цепочки на sin(3x) и (2x+1)^5, на e^(x^2) ошибся — не домножил на 2x. "
+    "Последнее задание: найти точку максимума y = x^3 - 12x + 7, правильный ответ -2. "
+    "Просит короткие объяснения с одним примером."
+)
+
+
+def _dialog(turns):
+    msgs = []
+    for i in range(turns):
+        msgs.append({'role': 'user', 'content': f"Вопрос {i + 1}: как найти производную функции y = (2x+1)^{i + 2} * sin(x)?"})
+        msgs.append({'role': 'assistant', 'content': (
+            f"Ответ {i + 1}. Используем правило произведения и правило цепочки. "
+            "Производная (2x+1)^n равна n(2x+1)^(n-1) * 2, производная sin(x) — cos(x). "
+            "Складываем: (uv)' = u'v + uv'. Проверь себя: подставь x = 0. " * 3)})
+    return msgs
+
+
+def _build(history, summary=''):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return prompt_builder.build(QUESTION, '', None, history, summary=summary)
+
+
+def _chat_memory_tokens(history, summary=''):
+    """Память в промпте gemini_chat: до 10 сообщений по 500 символов (+ конспект)"""
+    tokens = sum(prompt_builder.estimate_tokens(h['content'][:500]) + prompt_builder.MESSAGE_OVERHEAD
+                 for h in history[-10:])
+    return tokens + prompt_builder.summary_block(summary)[1]
+
+
+def main():
+    print(f"{'обменов':>8} | {'тело, байт':>17} | {'ask_ai, токены':>17} | {'чат: память':>17} | {'помнит реплик':>15}")
+    print(f"{'':>8} | {'было':>8} {'стало':>8} | {'было':>8} {'стало':>8} | {'было':>8} {'стало':>8} | "
+          f"{'было':>7} {'стало':>7}")
+    for turns in (1, 3, 5, 10, 20):
+        dialog = _dialog(turns)
+        client = dialog[-CLIENT_HISTORY:]
+        old_body = json.dumps({'question': QUESTION, 'history': client}, ensure_ascii=False).encode()
+        new_body = json.dumps({'question': QUESTION, 'session_id': 123456}, ensure_ascii=False).encode()
+        old_prompt = _build(client)
+        new_prompt = _build(dialog[-2:], SUMMARY if turns > 1 else '')
+        # Реплики, дошедшие до модели дословно; конспект покрывает весь диалог
+        old_seen = len(old_prompt.messages) - 2
+        new_seen = 'все' if turns > 1 else len(new_prompt.messages) - 2
+        old_chat = _chat_memory_tokens(client)
+        new_chat = _chat_memory_tokens(dialog[-2:], SUMMARY if turns > 1 else '')
+        print(f"{turns:>8} | {len(old_body):>8} {len(new_body):>8} | {old_prompt.tokens:>8} {new_prompt.tokens:>8} | "
+              f"{old_chat:>8} {new_chat:>8} | {old_seen:>3}/{len(dialog):<3} {new_seen:>7}")
+
+
+if __name__ == '__main__':
+    main()
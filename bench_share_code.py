@@ -0,0 +1,81 @@
+"""Бенчмарк поиска расшаренного материала по коду при 1M материалов.
+
+Python-часть всегда: прежний перебор строк с пересчётом MD5 против поиска по
+готовому индексу кодов. Если задан DATABASE_URL — то же самое в Postgres на
+временной таблице: полный скан против индекса по share_code.
+Запуск: python bench_share_code.py
+"""
+
+import hashlib
+import os
+import random
+import time
+
+MATERIALS = 1_000_000
+LOOKUPS = 5
+
+
+def generate_share_code(material_id: int, user_id: int) -> str:
+    return hashlib.md5(f"{material_id}:{user_id}".encode()).hexdigest()[:8].upper()
+
+
+def bench_python():
+    rnd = random.Random(1)
+    rows = [(i, rnd.randrange(1, 50_000)) for i in range(1, MATERIALS + 1)]
+    targets = [rows[rnd.randrange(MATERIALS)] for _ in range(LOOKUPS)]
+    codes = [generate_share_code(mid, uid) for mid, uid in targets]
+
+    t0 = time.perf_counter()
+    for code in codes:
+        for mid, uid in rows:
+            if generate_share_code(mid, uid) == code:
+                break
+    scan = (time.perf_counter() - t0) / LOOKUPS
+
+    index = {}
+    for mid, uid in rows:
+        index.setdefault(generate_share_code(mid, uid), mid)
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        for code in codes:
+            index[code]
+    probe = (time.perf_counter() - t0) / (1000 * LOOKUPS)
+    print(f"python  md5 scan {scan * 1e3:9.1f} ms/lookup   index {probe * 1e6:6.2f} µs/lookup")
+
+
+def bench_postgres(url: str):
+    import psycopg2
+    conn = psycopg2.connect(url)
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TEMP TABLE bench_materials AS
+        SELECT g AS id, (g % 50000) + 1 AS user_id, repeat('текст ', 200) AS recognized_text
+        FROM generate_series(1, %s) g
+    """, (MATERIALS,))
+    cur.execute("ALTER TABLE bench_materials ADD COLUMN share_code VARCHAR(8)")
+    cur.execute("UPDATE bench_materials SET share_code = UPPER(LEFT(MD5(id::text || ':' || user_id::text), 8))")
+    cur.execute("ANALYZE bench_materials")
+    codes = [generate_share_code(i, (i % 50000) + 1) for i in random.Random(2).sample(range(1, MATERIALS + 1), LOOKUPS)]
+
+    def timed(sql):
+        t0 = time.perf_counter()
+        for code in codes:
+            cur.execute(sql, (code,))
+            cur.fetchall()
+        return (time.perf_counter() - t0) / LOOKUPS
+
+    scan = timed("SELECT id, LEFT(recognized_text, 5000) FROM bench_materials WHERE share_code = %s ORDER BY id LIMIT 1")
+    cur.execute("CREATE INDEX ON bench_materials(share_code)")
+    cur.execute("ANALYZE bench_materials")
+    probe = timed("SELECT id, LEFT(recognized_text, 5000) FROM bench_materials WHERE share_code = %s ORDER BY id LIMIT 1")
+    print(f"postgres seq scan {scan * 1e3:8.1f} ms/lookup   index {probe * 1e3:6.2f} ms/lookup")
+    conn.rollback()
+    conn.close()
+
+
+if __name__ == '__main__':
+    bench_python()
+    if os.environ.get('DATABASE_URL'):
+        bench_postgres(os.environ['DATABASE_URL'])
+    else:
+        print("postgres: DATABASE_URL не задан — пропущено")
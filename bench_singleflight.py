@@ -0,0 +1,129 @@
+"""Нагрузочный тест singleflight (ai-assistant/singleflight.py): «вопрос разошёлся по классу».
+
+REQUESTS запросов с QUESTIONS одинаковыми вопросами приходят за BURST_SECONDS
+в CONTAINERS контейнеров (у каждого своя FlightGroup, кэш ответов общий, как
+ai_question_cache). Путь запроса повторяет POST ask в index.py: кэш → рейс →
+модель → запись в кэш → resolve(). Модель имитируется задержкой
+LLM_SECONDS. Печатается число вызовов модели, сколько запросов получили
+чужой ответ и задержка ответа ученику (p50/p95).
+
+Режимы: «было» — без рейсов; «в контейнере» — FlightGroup без advisory lock;
+с DATABASE_URL ещё «+ advisory lock» — межконтейнерный вариант на реальном
+Postgres (блокировки транзакционные, таблицы не нужны).
+Запуск: [DATABASE_URL=...] python bench_singleflight.py
+"""
+
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+
+REAL_DB = bool(os.environ.get('DATABASE_URL'))
+os.environ.setdefault('DB_POOL_MAX_SIZE', '32')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+import singleflight  # noqa: E402
+
+SEED = 25
+REQUESTS = 300
+QUESTIONS = 5
+CONTAINERS = 3
+BURST_SECONDS = 3.0
+LLM_SECONDS = (2.0, 4.0)
+# Все времена сжаты в TIME_SCALE раз, чтобы тест шёл секунды
+TIME_SCALE = 0.1
+
+
+class Upstream:
+    """Имитация модели: считает вызовы, отвечает через LLM_SECONDS"""
+
+    def __init__(self, rnd):
+        self.rnd = rnd
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def ask(self, question):
+        with self.lock:
+            self.calls += 1
+            delay = self.rnd.uniform(*LLM_SECONDS) * TIME_SCALE
+        time.sleep(delay)
+        return f"ответ на «{question}»"
+
+
+def _key(question):
+    return hashlib.md5(f"{question.lower().strip()}:{sorted([])}".encode()).hexdigest()
+
+
+def run(mode):
+    rnd = random.Random(SEED)
+    upstream = Upstream(random.Random(SEED + 1))
+    cache = {}
+    cache_lock = threading.Lock()
+    groups = [singleflight.FlightGroup(wait_seconds=60 * TIME_SCALE * 10, advisory_locks=(mode == 'pg'))
+              for _ in range(CONTAINERS)]
+    latencies, shared = [], [0]
+    out_lock = threading.Lock()
+
+    def request(container, question):
+        start = time.perf_counter()
+        key = _key(question)
+        with cache_lock:
+            answer = cache.get(key)
+        flight = leader = None
+        if answer is None and mode != 'off':
+            group = groups[container]
+            flight, leader = group.join(key)
+            if not leader:
+                answer = group.wait(flight)
+            elif group.lock_remote(flight):
+                with cache_lock:
+                    answer = cache.get(key)
+                if answer:
+                    group.resolve(flight, answer)
+            if answer:
+                with out_lock:
+                    shared[0] += 1
+        if answer is None:
+            answer = upstream.ask(question)
+            with cache_lock:
+                cache[key] = answer
+            if leader:
+                groups[container].resolve(flight, answer)
+        with out_lock:
+            latencies.append(time.perf_counter() - start)
+
+    plan = sorted((rnd.uniform(0, BURST_SECONDS * TIME_SCALE), rnd.randrange(CONTAINERS),
+                   f"Реши задачу №{rnd.randrange(QUESTIONS) + 1} из домашки") for _ in range(REQUESTS))
+    threads = []
+    t0 = time.perf_counter()
+    for at, container, question in plan:
+        delay = at - (time.perf_counter() - t0)
+        if delay > 0:
+            time.sleep(delay)
+        th = threading.Thread(target=request, args=(container, question))
+        th.start()
+        threads.append(th)
+    for th in threads:
+        th.join()
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] / TIME_SCALE
+    p95 = latencies[int(len(latencies) * 0.95)] / TIME_SCALE
+    return upstream.calls, shared[0], p50, p95
+
+
+def main():
+    modes = [('off', 'было'), ('local', 'в контейнере')]
+    if REAL_DB:
+        modes.append(('pg', '+ advisory lock'))
+    print(f"{REQUESTS} запросов, {QUESTIONS} вопросов, {CONTAINERS} контейнера, всплеск {BURST_SECONDS:.0f} с, "
+          f"модель {LLM_SECONDS[0]:.0f}–{LLM_SECONDS[1]:.0f} с")
+    print(f"{'режим':>16} | {'вызовов модели':>14} | {'чужой ответ':>11} | {'p50, с':>6} | {'p95, с':>6}")
+    for mode, title in modes:
+        calls, shared, p50, p95 = run(mode)
+        print(f"{title:>16} | {calls:>14} | {shared:>11} | {p50:>6.2f} | {p95:>6.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Бенчмарк поиска по кэшам тем (ai-assistant/keyword_matcher.py).
+
+Сравнивает прежние циклы из get_demo_cache (`for key in DEMO_CACHE: if key in
+norm` и двусторонний `in` по SESSION_TOPIC_CACHE) с KeywordMatcher на кэшах
+разного размера: как сейчас (~30 тем) и выросших до тысяч. Ключи — реальные
+темы плюс сгенерированные словосочетания из школьных терминов. Сначала
+проверяется совпадение результатов на всём корпусе вопросов, затем печатается
+время на вопрос и время построения автомата (один раз при импорте).
+Запуск: python bench_topic_cache.py
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+from keyword_matcher import KeywordMatcher  # noqa: E402
+
+SEED = 24
+QUESTIONS = 2000
+SIZES = (33, 300, 3000, 10000)
+
+REAL_TOPICS = [
+    'производная', 'интеграл', 'логарифм', 'теорема пифагора', 'пифагор', 'синус косинус', 'тригонометрия',
+    'уравнение', 'дробь', 'степень', 'прогрессия', 'закон ома', 'закон ньютона', 'ньютон',
+    'кинетическая энергия', 'потенциальная энергия', 'скорость', 'ускорение', 'электрический ток',
+    'молярная масса', 'валентность', 'оксид', 'кислота', 'электролиз', 'фотосинтез', 'митоз', 'мейоз',
+    'днк', 'рнк', 'клетка', 'белок', 'конституция', 'реформа',
+]
+ADJECTIVES = ['квадратные', 'линейные', 'органические', 'неорганические', 'электрические', 'магнитные',
+              'тепловые', 'клеточные', 'социальные', 'экономические', 'правовые', 'исторические',
+              'иррациональные', 'показательные', 'дробные', 'векторные', 'химические', 'ядерные']
+NOUNS = ['уравнения', 'реакции', 'системы', 'процессы', 'явления', 'функции', 'неравенства', 'поля',
+         'колебания', 'волны', 'реформы', 'институты', 'соединения', 'структуры', 'модели', 'законы',
+         'величины', 'преобразования', 'отношения', 'нормы']
+EXTRA = ['доказательство', 'свойства', 'примеры', 'определение', 'график', 'задачи', 'формулы', 'теория']
+FILLERS = ['что такое', 'объясни', 'как решать', 'помоги понять', 'расскажи про', 'зачем нужна', '']
+
+
+def _topics(n, rnd):
+    keys = list(REAL_TOPICS)
+    seen = set(keys)
+    while len(keys) < n:
+        key = f"{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)}"
+        if rnd.random() < 0.7:
+            key += f" {rnd.choice(EXTRA)} {rnd.randint(1, 400)}"
+        if key not in seen:
+            seen.add(key)
+            keys.append(key)
+    return keys[:n]
+
+
+def _questions(keys, rnd):
+    out = []
+    for _ in range(QUESTIONS):
+        r = rnd.random()
+        if r < 0.4:
+            q = f"{rnd.choice(FILLERS)} {rnd.choice(keys)}".strip()
+        elif r < 0.6:
+            q = f"{rnd.choice(FILLERS)} {rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)}".strip()
+        elif r < 0.8:
+            k = rnd.choice(keys)
+            q = k[rnd.randint(0, len(k) // 2):][:rnd.randint(3, 20)]  # обрывок темы
+        else:
+            q = f"{rnd.choice(FILLERS)} как поступить в вуз без экзаменов".strip()
+        out.append(q[:60])
+    return out
+
+
+# ── Прежние циклы из ai-assistant/index.py ───────────────────────────────────
+
+def old_demo(cache, norm):
+    for key in cache:
+        if key in norm:
+            return key
+    return None
+
+
+def old_session(cache, topic_key):
+    for key in cache:
+        if key in topic_key or topic_key in key:
+            return key
+    return None
+
+
+def _per_call(fn, items, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for q in items:
+            fn(q)
+    return (time.perf_counter() - start) / (repeat * len(items)) * 1e6
+
+
+def main():
+    rnd = random.Random(SEED)
+    print(f"{'тем':>6} | {'построение':>10} | {'demo: было':>10} {'стало':>7} | {'session: было':>13} {'стало':>7}")
+    for size in SIZES:
+        keys = _topics(size, rnd)
+        cache = dict.fromkeys(keys, '')
+        start = time.perf_counter()
+        matcher = KeywordMatcher(cache)
+        build_ms = (time.perf_counter() - start) * 1000
+        questions = _questions(keys, rnd)
+
+        mismatches = 0
+        for q in questions:
+            mismatches += old_demo(cache, q) != matcher.first(q)
+            mismatches += old_session(cache, q) != matcher.first_related(q)
+        if mismatches:
+            print(f"{size:>6} | РАСХОЖДЕНИЙ: {mismatches}")
+            sys.exit(1)
+
+        repeat = max(1, 3000 // size)
+        print(f"{size:>6} | {build_ms:>7.1f} мс | "
+              f"{_per_call(lambda q: old_demo(cache, q), questions, repeat):>7.1f} мкс "
+              f"{_per_call(matcher.first, questions, repeat):>7.1f} | "
+              f"{_per_call(lambda q: old_session(cache, q), questions, repeat):>10.1f} мкс "
+              f"{_per_call(matcher.first_related, questions, repeat):>7.1f}")
+    print(f"Результаты совпадают на {QUESTIONS} вопросах для каждого размера кэша.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Бенчмарк распознавания длинных голосовых (ai-assistant/transcribe.py).
+
+Поднимает локальную заглушку /audio/transcriptions: она читает длительность
+присланного WAV и отвечает через STUB_BASE + STUB_PER_SECOND × длительность
+секунд (порядок задержек Whisper API). Записи 30 с / 2 мин / 5 мин — синтетическая
+«речь»: слова из модулированного шума с паузами. Сравниваются отправка файла
+целиком одним запросом (как раньше, таймаут WHISPER_TIMEOUT) и нарезка по
+паузам с параллельными запросами; печатается число сегментов и их длины.
+
+Запуск: python bench_transcribe.py
+"""
+
+import io
+import os
+import sys
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+os.environ.setdefault('OPENROUTER_API_KEY', 'stub')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+import transcribe  # noqa: E402
+
+STUB_BASE = 0.5
+STUB_PER_SECOND = 0.12
+RATE = 16000
+DURATIONS = (30, 120, 300)
+
+
+class StubWhisper(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        riff = body.find(b'RIFF')
+        with wave.open(io.BytesIO(body[riff:])) as w:
+            seconds = w.getnframes() / w.getframerate()
+        time.sleep(STUB_BASE + STUB_PER_SECOND * seconds)
+        payload = f'{{"text": "[{seconds:.1f}s]"}}'.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except BrokenPipeError:
+            pass  # клиент уже ушёл по таймауту
+
+    def log_message(self, *args):
+        pass
+
+
+def speech_like(seconds: int, seed: int = 0) -> bytes:
+    rnd = np.random.default_rng(seed)
+    out, total = [], 0
+    while total < seconds * RATE:
+        word = int(RATE * rnd.uniform(0.2, 0.6))
+        t = np.arange(word) / RATE
+        envelope = np.sin(np.pi * t / t[-1]) * (0.5 + 0.5 * np.sin(2 * np.pi * rnd.uniform(3, 6) * t))
+        out.append((rnd.normal(0, 6000, word) * envelope).astype(np.int16))
+        pause = rnd.uniform(0.6, 1.0) if rnd.random() < 0.12 else rnd.uniform(0.08, 0.25)
+        out.append((rnd.normal(0, 60, int(RATE * pause))).astype(np.int16))
+        total += word + int(RATE * pause)
+    samples = np.concatenate(out)[:seconds * RATE]
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(RATE)
+        w.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubWhisper)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    transcribe.WHISPER_URL = f'http://127.0.0.1:{server.server_port}/v1/audio/transcriptions'
+    print(f"заглушка: {STUB_BASE}s + {STUB_PER_SECOND}s × длительность, таймаут {transcribe.WHISPER_TIMEOUT:.0f}s, "
+          f"сегмент ≤ {transcribe.AUDIO_SEGMENT_SECONDS:.0f}s, параллельно {transcribe.AUDIO_WHISPER_PARALLEL}\n")
+    print(f"{'запись':>8}{'целиком':>14}{'по частям':>12}{'сегментов':>11}  длины сегментов, с")
+    for seconds in DURATIONS:
+        audio = speech_like(seconds, seconds)
+        t = time.monotonic()
+        try:
+            transcribe.whisper(audio, 'wav')
+            whole = f'{time.monotonic() - t:.1f}s'
+        except Exception as e:
+            whole = f'fail {time.monotonic() - t:.0f}s' if 'Timeout' in type(e).__name__ else 'fail'
+        samples, rate = transcribe.decode(audio, 'wav')
+        bounds = transcribe.split_points(samples, rate)
+        t = time.monotonic()
+        text = transcribe.transcribe_audio(audio, 'wav').text
+        chunked = time.monotonic() - t
+        lengths = ' '.join(f'{(b - a) / rate:.1f}' for a, b in bounds)
+        print(f"{seconds:>7}s{whole:>14}{chunked:>11.1f}s{len(bounds):>11}  {lengths}")
+        assert text.count('[') == len(bounds)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+-- Дневные счётчики лимитов: ключ (user_id, day, kind), сутки по Москве.
+-- Новые сутки — новая строка, поэтому «сброс» больше не переписывает users.
+CREATE TABLE IF NOT EXISTS usage_counters (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    kind VARCHAR(20) NOT NULL,
+    used INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day, kind)
+);
+
+CREATE INDEX IF NOT EXISTS idx_usage_counters_day ON usage_counters(day);
+
+-- Переносим ещё не истёкшие значения из колонок users на текущие сутки.
+-- Сами колонки пока оставляем, чтобы можно было откатиться на старые функции.
+INSERT INTO usage_counters (user_id, day, kind, used)
+SELECT id, (CURRENT_TIMESTAMP AT TIME ZONE 'Europe/Moscow')::date, 'questions', daily_questions_used
+FROM users
+WHERE daily_questions_used > 0 AND (daily_questions_reset_at IS NULL OR daily_questions_reset_at > CURRENT_TIMESTAMP)
+ON CONFLICT (user_id, day, kind) DO NOTHING;
+
+INSERT INTO usage_counters (user_id, day, kind, used)
+SELECT id, (CURRENT_TIMESTAMP AT TIME ZONE 'Europe/Moscow')::date, 'photos', photos_uploaded_today
+FROM users
+WHERE photos_uploaded_today > 0 AND (photos_daily_reset_at IS NULL OR photos_daily_reset_at > CURRENT_TIMESTAMP)
+ON CONFLICT (user_id, day, kind) DO NOTHING;
+
+INSERT INTO usage_counters (user_id, day, kind, used)
+SELECT id, (CURRENT_TIMESTAMP AT TIME ZONE 'Europe/Moscow')::date, 'audio', audio_used_today
+FROM users
+WHERE audio_used_today > 0 AND (audio_daily_reset_at IS NULL OR audio_daily_reset_at > CURRENT_TIMESTAMP)
+ON CONFLICT (user_id, day, kind) DO NOTHING;
+
+INSERT INTO usage_counters (user_id, day, kind, used)
+SELECT id, (CURRENT_TIMESTAMP AT TIME ZONE 'Europe/Moscow')::date, 'files', files_uploaded_today
+FROM users
+WHERE files_uploaded_today > 0 AND (files_daily_reset_at IS NULL OR files_daily_reset_at > CURRENT_TIMESTAMP)
+ON CONFLICT (user_id, day, kind) DO NOTHING;
+
+INSERT INTO usage_counters (user_id, day, kind, used)
+SELECT id, (CURRENT_TIMESTAMP AT TIME ZONE 'Europe/Moscow')::date, 'sessions', daily_sessions_used
+FROM users
+WHERE daily_sessions_used > 0 AND (daily_sessions_reset_at IS NULL OR daily_sessions_reset_at > CURRENT_TIMESTAMP)
+ON CONFLICT (user_id, day, kind) DO NOTHING;
@@ -0,0 +1,8 @@
+-- Общее хранилище rate limiter (RATE_LIMIT_BACKEND=postgres): одна строка на ключ,
+-- tat — теоретическое время следующего запроса по GCRA (unix epoch, секунды)
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    key VARCHAR(255) PRIMARY KEY,
+    tat DOUBLE PRECISION NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_tat ON rate_limit_buckets(tat);
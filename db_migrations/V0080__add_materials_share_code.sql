@@ -0,0 +1,10 @@
+-- Код публичной ссылки на материал храним в колонке с индексом, вместо перебора
+-- всей таблицы с пересчётом MD5. Формат прежний: первые 8 символов md5("id:user_id")
+ALTER TABLE materials ADD COLUMN IF NOT EXISTS share_code VARCHAR(8);
+
+UPDATE materials
+SET share_code = UPPER(LEFT(MD5(id::text || ':' || user_id::text), 8))
+WHERE share_code IS NULL;
+
+-- Не UNIQUE: у 8 символов MD5 бывают коллизии
+CREATE INDEX IF NOT EXISTS idx_materials_share_code ON materials(share_code);
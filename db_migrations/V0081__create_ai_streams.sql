@@ -0,0 +1,13 @@
+-- Стриминг ответов ai-assistant: фоновая генерация дописывает очищенный текст,
+-- клиент забирает его по смещению. Строки старше часа удаляются при следующем стриме
+CREATE TABLE IF NOT EXISTS ai_streams (
+    id VARCHAR(32) PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    content TEXT NOT NULL DEFAULT '',
+    done BOOLEAN NOT NULL DEFAULT FALSE,
+    result JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_ai_streams_user_created ON ai_streams(user_id, created_at);
@@ -0,0 +1,9 @@
+-- Поиск почти-дубликатов в кэше ответов: MinHash-подпись вопроса (64 × uint32),
+-- хэши её 16 полос для выбора кандидатов через GIN и ключ набора материалов.
+-- Старые строки без подписи заполняет report_semantic_cache.py --backfill
+ALTER TABLE ai_question_cache ADD COLUMN IF NOT EXISTS materials_key VARCHAR(32);
+ALTER TABLE ai_question_cache ADD COLUMN IF NOT EXISTS minhash BYTEA;
+ALTER TABLE ai_question_cache ADD COLUMN IF NOT EXISTS minhash_bands INTEGER[];
+
+CREATE INDEX IF NOT EXISTS idx_ai_cache_minhash_bands ON ai_question_cache USING GIN (minhash_bands);
+CREATE INDEX IF NOT EXISTS idx_ai_cache_materials_key ON ai_question_cache(materials_key, last_used_at DESC);
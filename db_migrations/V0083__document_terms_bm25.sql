@@ -0,0 +1,12 @@
+-- Инвертированный индекс чанков для выбора контекста ИИ по вопросу (BM25).
+-- token_count NULL — чанк загружен до индекса; такие материалы ai-assistant
+-- ранжирует в памяти по тексту чанков
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS token_count INTEGER;
+
+CREATE TABLE IF NOT EXISTS document_terms (
+    material_id INTEGER NOT NULL REFERENCES materials(id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    term VARCHAR(64) NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (material_id, term, chunk_index)
+);
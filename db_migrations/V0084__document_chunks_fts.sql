@@ -0,0 +1,6 @@
+-- Полнотекстовый поиск по материалам: tsvector чанка (конфигурация russian)
+-- вычисляется самой БД при вставке, существующие строки заполняются при ALTER
+ALTER TABLE document_chunks
+    ADD COLUMN IF NOT EXISTS chunk_tsv tsvector GENERATED ALWAYS AS (to_tsvector('russian', chunk_text)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_document_chunks_tsv ON document_chunks USING GIN (chunk_tsv);
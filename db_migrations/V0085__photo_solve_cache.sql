@@ -0,0 +1,18 @@
+-- Кэш решений фото-задач: перцептивный хэш снимка (64 бита), его байты с номером
+-- позиции для выбора кандидатов через GIN и хэш подсказки пользователя.
+-- result — ответ photo_solve целиком (recognized_text, solution, subject, structured)
+CREATE TABLE IF NOT EXISTS photo_solve_cache (
+    id SERIAL PRIMARY KEY,
+    phash BIGINT NOT NULL,
+    phash_bands INTEGER[] NOT NULL,
+    hint_hash VARCHAR(32) NOT NULL,
+    result JSONB NOT NULL,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_photo_cache_bands ON photo_solve_cache USING GIN (phash_bands);
+CREATE INDEX IF NOT EXISTS idx_photo_cache_last_used ON photo_solve_cache(last_used_at);
+
+COMMENT ON TABLE photo_solve_cache IS 'Кэш OCR и решений фото-задач по перцептивному хэшу снимка';
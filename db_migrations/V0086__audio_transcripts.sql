@@ -0,0 +1,11 @@
+-- Кэш расшифровок голосовых сообщений по sha256 содержимого файла
+CREATE TABLE IF NOT EXISTS audio_transcripts (
+    content_hash CHAR(64) PRIMARY KEY,
+    transcript TEXT NOT NULL,
+    audio_bytes INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_audio_transcripts_created ON audio_transcripts(created_at);
+
+COMMENT ON TABLE audio_transcripts IS 'Кэш расшифровок Whisper по хэшу аудиофайла';
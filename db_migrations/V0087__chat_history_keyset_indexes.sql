@@ -0,0 +1,9 @@
+-- Keyset-пагинация истории чата: ключ (время, id) целиком в индексе
+UPDATE chat_sessions SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_keyset ON chat_messages(session_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_keyset ON chat_sessions(user_id, updated_at DESC, id DESC);
+
+-- Новые индексы покрывают старые по префиксу
+DROP INDEX IF EXISTS idx_chat_messages_session;
+DROP INDEX IF EXISTS idx_chat_sessions_user;
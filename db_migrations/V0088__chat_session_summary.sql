@@ -0,0 +1,7 @@
+-- Серверная память диалога: краткий конспект сессии, обновляется в фоне после каждого ответа.
+-- summary_turns — сколько обменов свёрнуто в конспект (и версия для защиты от гонки обновлений)
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summary TEXT;
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summary_turns INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summary_updated_at TIMESTAMP;
+
+COMMENT ON COLUMN chat_sessions.summary IS 'Краткий конспект разговора для промпта вместо полной истории';
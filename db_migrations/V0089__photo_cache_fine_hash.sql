@@ -0,0 +1,8 @@
+-- Подтверждающий 256-битный перцептивный хэш снимка (image_prep.fine_hash, 32 байта):
+-- 64-битный phash только выбирает кандидатов. Строки без него подтвердить нечем —
+-- кэш пересобирается заново.
+DELETE FROM photo_solve_cache;
+
+ALTER TABLE photo_solve_cache ADD COLUMN IF NOT EXISTS fine_hash BYTEA NOT NULL;
+
+COMMENT ON COLUMN photo_solve_cache.fine_hash IS '256-битный перцептивный хэш для подтверждения совпадения фото';
@@ -0,0 +1,73 @@
+"""Отчёт по кэшу решений фото-задач (photo_solve_cache).
+
+Каждая строка — один промах (фото решено и сохранено), hit_count — сколько раз
+её решение отдано из кэша, поэтому доля попаданий ≈ Σhit_count / (Σhit_count +
+строк). Промахи без сохранения (фото не распознано) сюда не попадают. Дополнительно
+печатается распределение расстояний fine_hash до ближайшего кандидата по 64-битному
+хэшу: пары чуть дальше PHOTO_CACHE_FINE_MAX_DISTANCE — копии того же снимка, которые
+не подтвердились, либо разные задачи с одной вёрсткой; их стоит проверить глазами,
+прежде чем менять порог.
+
+Запуск: DATABASE_URL=... python report_photo_cache.py
+"""
+
+import os
+import sys
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+import photo_cache  # noqa: E402
+
+MAX_SHOWN_DISTANCE = 40
+DISTANCE_STEP = 4
+
+
+def report(rows):
+    total_rows = len(rows)
+    hits = sum(r[3] for r in rows)
+    print(f"строк: {total_rows}, попаданий: {hits}")
+    if not total_rows:
+        return
+    print(f"доля попаданий: {hits / (hits + total_rows):.1%} (пороги {photo_cache.PHOTO_CACHE_MAX_DISTANCE} бит из 64, "
+          f"{photo_cache.PHOTO_CACHE_FINE_MAX_DISTANCE} из 256)")
+    reused = sum(1 for r in rows if r[3])
+    print(f"строк с попаданиями: {reused} ({reused / total_rows:.1%}), "
+          f"макс. попаданий у строки: {max(r[3] for r in rows)}")
+
+    buckets = defaultdict(list)
+    for i, (_, phash, hint_hash, _, _) in enumerate(rows):
+        for b in photo_cache.bands(phash):
+            buckets[(hint_hash, b)].append(i)
+    nearest = Counter()
+    for i, (_, phash, hint_hash, _, fine) in enumerate(rows):
+        candidates = [j for j in {j for b in photo_cache.bands(phash) for j in buckets[(hint_hash, b)] if j != i}
+                      if photo_cache.distance(phash, rows[j][1]) <= photo_cache.PHOTO_CACHE_MAX_DISTANCE]
+        if candidates:
+            d = min(photo_cache.fine_distance(fine, rows[j][4]) for j in candidates)
+            if d <= MAX_SHOWN_DISTANCE:
+                nearest[d // DISTANCE_STEP] += 1
+    print("\nближайший кандидат с той же подсказкой (строк с расстоянием fine_hash d):")
+    for k in range(MAX_SHOWN_DISTANCE // DISTANCE_STEP + 1):
+        lo = k * DISTANCE_STEP
+        mark = '  <- порог' if lo <= photo_cache.PHOTO_CACHE_FINE_MAX_DISTANCE < lo + DISTANCE_STEP else ''
+        print(f"  d={lo:2d}–{lo + DISTANCE_STEP - 1:2d}: {nearest[k]}{mark}")
+
+
+def main():
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        print("DATABASE_URL не задан — отчёт строится по содержимому photo_solve_cache")
+        return
+    import psycopg2
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+    conn = psycopg2.connect(url)
+    cur = conn.cursor()
+    cur.execute(f"SELECT id, phash, hint_hash, hit_count, fine_hash FROM {schema}.photo_solve_cache ORDER BY id")
+    report(cur.fetchall())
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Отчёт: сколько промахов ai_question_cache закрыл бы поиск почти-дубликатов.
+
+Проходит по кэшу в порядке created_at и для каждого вопроса ищет более ранний
+вопрос по тому же набору материалов с оценкой Жаккара не ниже порога (и той же
+формулой и значимыми словами) — такой вопрос получил бы готовый ответ вместо вызова LLM. Печатает
+долю таких попаданий для нескольких порогов и примеры пар у порога из
+AI_CACHE_SIMILARITY, чтобы подобрать его вручную.
+
+Перед отчётом (и без DATABASE_URL) проверяются пары FORMULA_PAIRS: вопросы,
+отличающиеся только знаками действий, числами или одним словом, не должны
+получать ответ друг друга, а переформулировки той же задачи — должны.
+
+Запуск: DATABASE_URL=... python report_semantic_cache.py [--backfill]
+  --backfill — заполнить materials_key/minhash/minhash_bands у старых строк
+"""
+
+import os
+import sys
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+import semantic_cache  # noqa: E402
+
+THRESHOLDS = (0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95)
+SAMPLES = 15
+
+# (кэшированный вопрос, новый вопрос, должен ли новый получить ответ первого)
+FORMULA_PAIRS = [
+    ("Сколько будет 2*3?", "Сколько будет 2+3?", False),
+    ("Реши уравнение x^2+5x+6=0", "Реши уравнение x^2-5x+6=0", False),
+    ("Вычисли 12-4/1", "Вычисли 12/4-1", False),
+    ("Реши уравнение x^2-5x+6=0", "Реши уравнение x^2-5x+7=0", False),
+    ("Найди площадь квадрата со стороной 5", "Найди площадь квадрата со стороной 6", False),
+    ("Какой город столица Австралии", "Какой город столица Австрии", False),
+    ("Найди производную функции ln x", "Найди производную функции lg x", False),
+    ("Найди производную функции sin x", "Найди производную функции cos x", False),
+    ("Реши уравнение x^2-5x+6=0", "реши уравнение: x^2 - 5x + 6 = 0", True),
+    ("Что такое фотосинтез?", "что такое фотосинтез", True),
+    ("Объясни теорему Пифагора", "объясни, пожалуйста, теорему пифагора", True),
+    ("Что такое фотосинтез?", "Что такое фотосинтезз?", True),
+]
+
+
+def load_rows(cur, schema):
+    cur.execute(f"SELECT id, question_text, material_ids FROM {schema}.ai_question_cache ORDER BY created_at, id")
+    rows = []
+    for cache_id, text, mids in cur.fetchall():
+        sig = semantic_cache.signature(semantic_cache.normalize(text))
+        rows.append({
+            'id': cache_id,
+            'text': text,
+            'key': semantic_cache.materials_key(mids),
+            'sig': sig,
+            'bands': semantic_cache.bands(sig),
+            'formula': semantic_cache.formula(text),
+            'words': semantic_cache.content_words(text),
+        })
+    return rows
+
+
+def best_earlier(rows):
+    """Для каждой строки — лучшая более ранняя (score, index) из кандидатов по полосам"""
+    buckets = defaultdict(list)
+    best = []
+    for i, row in enumerate(rows):
+        candidates = set()
+        for b in row['bands']:
+            candidates.update(buckets[(row['key'], b)])
+        top = (0.0, None)
+        for j in candidates:
+            if rows[j]['formula'] != row['formula'] or not semantic_cache.same_words(rows[j]['words'], row['words']):
+                continue
+            score = float((rows[j]['sig'] == row['sig']).mean())
+            if score > top[0]:
+                top = (score, j)
+        best.append(top)
+        for b in row['bands']:
+            buckets[(row['key'], b)].append(i)
+    return best
+
+
+def report(rows):
+    total = len(rows)
+    print(f"строк в кэше: {total}, наборов материалов: {len({r['key'] for r in rows})}")
+    if not total:
+        return
+    best = best_earlier(rows)
+    for t in THRESHOLDS:
+        hits = sum(1 for score, _ in best if score >= t)
+        mark = '  <- AI_CACHE_SIMILARITY' if abs(t - semantic_cache.AI_CACHE_SIMILARITY) < 1e-9 else ''
+        print(f"порог {t:.2f}: {hits:7d} попаданий ({hits / total:6.1%}){mark}")
+
+    t = semantic_cache.AI_CACHE_SIMILARITY
+    near = sorted(((s, i, j) for i, (s, j) in enumerate(best) if j is not None and t - 0.1 <= s < t + 0.1),
+                  key=lambda x: x[0])
+    print(f"\nпримеры пар с оценкой {t - 0.1:.2f}–{t + 0.1:.2f}:")
+    step = max(1, len(near) // SAMPLES)
+    for s, i, j in near[::step][:SAMPLES]:
+        print(f"  {s:.2f}  {rows[i]['text'][:70]!r}\n        {rows[j]['text'][:70]!r}")
+
+
+def backfill(conn, cur, schema, rows):
+    updated = 0
+    for row in rows:
+        cur.execute(f"""
+            UPDATE {schema}.ai_question_cache SET materials_key=%s, minhash=%s, minhash_bands=%s
+            WHERE id=%s AND minhash IS NULL
+        """, (row['key'], semantic_cache.to_bytes(row['sig']), row['bands'], row['id']))
+        updated += cur.rowcount
+    conn.commit()
+    print(f"backfill: обновлено строк {updated}")
+
+
+def check_formula_pairs() -> bool:
+    """best_match на FORMULA_PAIRS при пороге 0 — решают только сравнение формул и слов"""
+    failed = 0
+    for cached, question, expected in FORMULA_PAIRS:
+        sig = semantic_cache.signature(semantic_cache.normalize(cached))
+        got = semantic_cache.best_match(
+            question, semantic_cache.signature(semantic_cache.normalize(question)),
+            [(cached, semantic_cache.to_bytes(sig), cached)], threshold=0.0) is not None
+        if got != expected:
+            failed += 1
+            print(f"ОШИБКА: {question!r} {'получил' if got else 'не получил'} ответ на {cached!r}")
+    print(f"пары FORMULA_PAIRS: {len(FORMULA_PAIRS) - failed}/{len(FORMULA_PAIRS)} верно")
+    return not failed
+
+
+def main():
+    if not check_formula_pairs():
+        sys.exit(1)
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        print("DATABASE_URL не задан — отчёт строится по содержимому ai_question_cache")
+        return
+    import psycopg2
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+    conn = psycopg2.connect(url)
+    cur = conn.cursor()
+    rows = load_rows(cur, schema)
+    report(rows)
+    if '--backfill' in sys.argv:
+        backfill(conn, cur, schema, rows)
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Правило жизненного цикла для медиа ИИ-ассистента (ai-assistant/media_upload.py).
+
+Фото и аудио, загруженные по presigned URL, удаляются после успешного ответа.
+Брошенные ключи (лимит, ошибка модели, клиент не повторил запрос) снимает это
+правило: объекты под MEDIA_PREFIX истекают через MEDIA_RETENTION_DAYS. Бакет
+общий с материалами, поэтому существующие правила сохраняются, а заменяется
+только правило с тем же ID. Запуск идемпотентен.
+
+Запуск: AWS_ACCESS_KEY_ID=... AWS_SECRET_ACCESS_KEY=... python setup_media_lifecycle.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'ai-assistant'))
+
+import media_upload  # noqa: E402
+
+RULE_ID = 'expire-ai-media'
+
+
+def main():
+    if not os.environ.get('AWS_ACCESS_KEY_ID') or not os.environ.get('AWS_SECRET_ACCESS_KEY'):
+        print("Нужны AWS_ACCESS_KEY_ID и AWS_SECRET_ACCESS_KEY от хранилища функции")
+        sys.exit(1)
+    s3 = media_upload.get_s3_client()
+    try:
+        rules = s3.get_bucket_lifecycle_configuration(Bucket=media_upload.MEDIA_BUCKET).get('Rules', [])
+    except s3.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'NoSuchLifecycleConfiguration':
+            raise
+        rules = []
+    rules = [r for r in rules if r.get('ID') != RULE_ID]
+    rules.append({
+        'ID': RULE_ID,
+        'Filter': {'Prefix': f"{media_upload.MEDIA_PREFIX}/"},
+        'Status': 'Enabled',
+        'Expiration': {'Days': media_upload.MEDIA_RETENTION_DAYS},
+    })
+    s3.put_bucket_lifecycle_configuration(Bucket=media_upload.MEDIA_BUCKET,
+                                          LifecycleConfiguration={'Rules': rules})
+    print(f"{media_upload.MEDIA_BUCKET}: {media_upload.MEDIA_PREFIX}/ истекает через "
+          f"{media_upload.MEDIA_RETENTION_DAYS} д., правил в бакете: {len(rules)}")
+
+
+if __name__ == '__main__':
+    main()
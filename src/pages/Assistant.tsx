@@ -216,6 +216,7 @@ const Assistant = () => {
   const inputRef = useRef<HTMLTextAreaElement>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
   const cameraInputRef = useRef<HTMLInputElement>(null);
+  const keepScrollRef = useRef(false);
 
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [input, setInput] = useState('');
@@ -228,6 +229,8 @@ const Assistant = () => {
   const [showMenu, setShowMenu] = useState(false);
   const [sessions, setSessions] = useState<Session[]>([]);
   const [currentSessionId, setCurrentSessionId] = useState<number | null>(null);
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
+  const [sessionsCursor, setSessionsCursor] = useState<string | null>(null);
   const [abortController, setAbortController] = useState<AbortController | null>(null);
   const [showLimitScreen, setShowLimitScreen] = useState(false);
   const [loadingHint, setLoadingHint] = useState('');
@@ -270,23 +273,35 @@ const Assistant = () => {
   }, []);
 
   useEffect(() => {
+    // Подгрузка ранних сообщений сверху не должна уводить экран вниз
+    if (keepScrollRef.current) { keepScrollRef.current = false; return; }
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [messages, isLoading]);
 
   const getToken = () => authService.getToken() || '';
 
-  const loadSessions = async () => {
+  const loadSessions = async (before?: string) => {
     try {
-      const resp = await fetch(`${API.AI_ASSISTANT}?action=sessions`, {
+      const cursor = before ? `&before=${encodeURIComponent(before)}` : '';
+      const resp = await fetch(`${API.AI_ASSISTANT}?action=sessions${cursor}`, {
         headers: { Authorization: `Bearer ${getToken()}` },
       });
       if (resp.ok) {
         const data = await resp.json();
-        setSessions(data.sessions || []);
+        setSessions(s => before ? [...s, ...(data.sessions || [])] : (data.sessions || []));
+        setSessionsCursor(data.has_more ? data.before_cursor : null);
       }
     } catch (e) { console.error('loadSessions', e); }
   };
 
+  const toChatMessages = (list: { id: number; role: 'user' | 'assistant'; content: string; timestamp: string }[]): ChatMessage[] =>
+    list.map(m => ({
+      id: `loaded-${m.id}`,
+      role: m.role,
+      content: m.content,
+      timestamp: new Date(m.timestamp),
+    }));
+
   const loadSessionMessages = async (sessionId: number) => {
     try {
       const resp = await fetch(`${API.AI_ASSISTANT}?action=messages&session_id=${sessionId}`, {
@@ -294,20 +309,30 @@ const Assistant = () => {
       });
       if (resp.ok) {
         const data = await resp.json();
-        setMessages(
-          (data.messages || []).map((m: { role: 'user' | 'assistant'; content: string; timestamp: string }, i: number) => ({
-            id: `loaded-${i}`,
-            role: m.role,
-            content: m.content,
-            timestamp: new Date(m.timestamp),
-          }))
-        );
+        setMessages(toChatMessages(data.messages || []));
+        setOlderCursor(data.has_more ? data.before_cursor : null);
         setCurrentSessionId(sessionId);
         setShowMenu(false);
       }
     } catch (e) { console.error('loadMessages', e); }
   };
 
+  const loadOlderMessages = async () => {
+    if (!currentSessionId || !olderCursor) return;
+    try {
+      const resp = await fetch(
+        `${API.AI_ASSISTANT}?action=messages&session_id=${currentSessionId}&before=${encodeURIComponent(olderCursor)}`,
+        { headers: { Authorization: `Bearer ${getToken()}` } },
+      );
+      if (resp.ok) {
+        const data = await resp.json();
+        keepScrollRef.current = true;
+        setMessages(prev => [...toChatMessages(data.messages || []), ...prev]);
+        setOlderCursor(data.has_more ? data.before_cursor : null);
+      }
+    } catch (e) { console.error('loadOlderMessages', e); }
+  };
+
   const deleteSession = async (sessionId: number) => {
     try {
       await fetch(`${API.AI_ASSISTANT}?action=delete_session&session_id=${sessionId}`, {
@@ -317,6 +342,7 @@ const Assistant = () => {
       setSessions(s => s.filter(x => x.id !== sessionId));
       if (currentSessionId === sessionId) {
         setMessages([]);
+        setOlderCursor(null);
         setCurrentSessionId(null);
       }
     } catch (e) { console.error('deleteSession', e); }
@@ -324,6 +350,7 @@ const Assistant = () => {
 
   const newChat = () => {
     setMessages([]);
+    setOlderCursor(null);
     setCurrentSessionId(null);
     setShowMenu(false);
   };
@@ -427,14 +454,16 @@ const Assistant = () => {
       const body: Record<string, unknown> = {
         action: 'gemini_chat',
         message: messageText || undefined,
-        history: messages.slice(-10).map(m => ({ role: m.role, content: m.content })),
       };
+      // Для известной сессии память (конспект + последний обмен) хранит сервер;
+      // последний обмен шлём и так — история в БД пишется с задержкой
+      if (currentSessionId) body.session_id = currentSessionId;
+      body.history = messages.slice(currentSessionId ? -2 : -10).map(m => ({ role: m.role, content: m.content }));
       if (img) body.image_base64 = img;
       if (audio) {
         body.audio_base64 = audio;
         body.audio_format = audioFmt || 'wav';
       }
-      if (currentSessionId) body.session_id = currentSessionId;
 
       const resp = await fetch(API.AI_ASSISTANT, {
         method: 'POST',
@@ -489,6 +518,7 @@ const Assistant = () => {
         timestamp: new Date(),
       };
       setMessages(prev => [...prev, assistantMsg]);
+      if (data.session_id) setCurrentSessionId(data.session_id);
 
       const prem = data.is_premium || false;
       if (prem) {
@@ -640,6 +670,11 @@ const Assistant = () => {
                   </div>
                 ))
               )}
+              {sessionsCursor && (
+                <button onClick={() => loadSessions(sessionsCursor)} className="w-full text-xs text-blue-600 py-2 hover:bg-gray-50 rounded-xl">
+                  Показать ещё
+                </button>
+              )}
             </div>
             <div className="p-3 border-t border-gray-100 space-y-1">
               <button onClick={() => { setShowMenu(false); navigate('/achievements'); }} className="w-full flex items-center gap-2.5 px-3 py-2.5 text-sm text-gray-600 hover:bg-gray-50 rounded-xl">
@@ -701,6 +736,13 @@ const Assistant = () => {
         )}
 
         {/* Chat messages */}
+        {olderCursor && (
+          <div className="flex justify-center">
+            <button onClick={loadOlderMessages} className="text-xs text-blue-600 px-3 py-1.5 rounded-full bg-blue-50 hover:bg-blue-100">
+              Показать более ранние сообщения
+            </button>
+          </div>
+        )}
         {messages.map(msg => (
           <div key={msg.id} className={`flex gap-2.5 ${msg.role === 'user' ? 'justify-end' : 'justify-start'}`}>
             {msg.role === 'assistant' && <MascotAvatar />}